@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+from typing import Dict, Any, Iterable, List, Tuple
+import math
+
+import numpy as np
+
+import metrics
+
+# Raw accelerometer processing: derives the race_data fields generate_report
+# reads (hpc_race_summary_estimates and significant_events) from the car's
+# 3-axis accelerometer instead of waiting for the HPC estimates.
+#
+# Samples arrive in chunks of (n, 3) G values, axes (longitudinal, lateral,
+# vertical), vertical including gravity. Every window is a trailing moving
+# average computed from a cumulative sum over the chunk with the previous
+# chunk's last window-1 samples prepended, so memory is bounded by the chunk
+# size whatever the race length, and results do not depend on how the race
+# is chunked (up to cumulative-sum rounding). Detected regions that may still
+# continue into the next chunk are carried until they close.
+#
+# Derived quantities (first-order models; constants below):
+#   peak G per axis       first largest |G| after a SMOOTH_MS moving average
+#   SustainedHighG        runs where the SUSTAIN_MS mean horizontal G is at
+#                         least SUSTAINED_G; duration_ms is the run length
+#   spinal compression    runs where smoothed vertical G exceeds SPINE_SPIKE_G,
+#                         runs closer than SPINE_REFRACTORY_MS counted once
+#   peak neck load        HEAD_HELMET_KG x peak NECK_MS-mean |lateral G|
+#   fluid loss            (base + per-degree above SWEAT_FROM_C + per mean
+#                         horizontal G) litres per hour x race hours
+
+AXES = ("longitudinal", "lateral", "vertical")
+
+SAMPLE_RATE_HZ = 1000
+CHUNK_SAMPLES = 1 << 18
+
+SMOOTH_MS = 10
+SUSTAIN_MS = 500
+SUSTAINED_G = 3.5
+SPINE_SPIKE_G = 3.0
+SPINE_REFRACTORY_MS = 100
+NECK_MS = 200
+HEAD_HELMET_KG = 6.5
+SWEAT_BASE_L_PER_H = 0.6
+SWEAT_FROM_C = 30.0
+SWEAT_PER_C_L_PER_H = 0.04
+SWEAT_PER_G_L_PER_H = 0.3
+
+class _Trailing:
+    """Trailing mean over `w` samples across chunks (shorter at the race start)."""
+
+    def __init__(self, w: int):
+        self.w = max(1, w)
+        self.tail = np.zeros(0)
+        self.seen = 0
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        ext = np.concatenate((self.tail, x))
+        cs = np.empty(len(ext) + 1)
+        cs[0] = 0.0
+        np.cumsum(ext, out=cs[1:])
+        n, t, w = len(x), len(self.tail), self.w
+        if t == w - 1:                        # past the race start: every window is full
+            out = cs[t + 1:] - cs[:n]
+            out /= w
+        else:
+            hi = np.arange(t + 1, t + n + 1)
+            out = (cs[hi] - cs[np.maximum(hi - w, 0)]) / np.minimum(self.seen + np.arange(1, n + 1), w)
+        self.tail = ext[len(ext) - (w - 1):]
+        self.seen += n
+        return out
+
+def _first_peak(values: np.ndarray, current: float) -> float:
+    """The generate_report fold: keep `current` unless a value has strictly larger |G| (first such wins)."""
+    if not len(values):
+        return current
+    i = int(np.argmax(np.abs(values)))
+    return float(values[i]) if abs(values[i]) > abs(current) else current
+
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(start, end) chunk indices of the True runs, end exclusive."""
+    d = np.diff(mask.astype(np.int8), prepend=0, append=0)
+    return np.flatnonzero(d == 1), np.flatnonzero(d == -1)
+
+def _run_peaks(values: np.ndarray, mask: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Per run of `mask`, the first value of largest |value| (the runs are contiguous once masked)."""
+    if not len(lengths):
+        return np.zeros(0)
+    v = values[mask]
+    a = np.abs(v)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    m = np.maximum.reduceat(a, starts)
+    first = np.minimum.reduceat(np.where(a == np.repeat(m, lengths), np.arange(len(v)), len(v)), starts)
+    return v[first]
+
+class _RegionTracker:
+    """
+    Runs of a per-sample condition across chunks. Runs separated by fewer
+    than `merge_gap` samples are one region (1: only touching runs, i.e. a
+    run cut by a chunk boundary); a region is emitted once it can no longer
+    grow. Regions are (start, end, lateral peak, vertical peak).
+    """
+
+    def __init__(self, merge_gap: int = 1):
+        self.merge_gap = merge_gap
+        self.pending: List[Any] | None = None
+
+    def feed(self, mask: np.ndarray, lateral: np.ndarray, vertical: np.ndarray, offset: int) -> List[Tuple[int, int, float, float]]:
+        s, e = _runs(mask)
+        runs = list(zip((s + offset).tolist(), (e + offset).tolist(),
+                        _run_peaks(lateral, mask, e - s).tolist(), _run_peaks(vertical, mask, e - s).tolist()))
+        done = []
+        for start, end, lat, vert in runs:
+            p = self.pending
+            if p is not None and start - p[1] < self.merge_gap:
+                p[1] = end
+                if abs(lat) > abs(p[2]):
+                    p[2] = lat
+                if abs(vert) > abs(p[3]):
+                    p[3] = vert
+                continue
+            if p is not None:
+                done.append(tuple(p))
+            self.pending = [start, end, lat, vert]
+        chunk_end = offset + len(mask)
+        if self.pending is not None and chunk_end - self.pending[1] >= self.merge_gap:
+            done.append(tuple(self.pending))
+            self.pending = None
+        return done
+
+    def finish(self) -> List[Tuple[int, int, float, float]]:
+        done = [tuple(self.pending)] if self.pending is not None else []
+        self.pending = None
+        return done
+
+class AccelProcessor:
+    """
+    Feed (n, 3) chunks of G samples with feed(); race_data() at any point is a
+    generate_report-compatible doc for the samples seen so far.
+    """
+
+    def __init__(self, race_data: Dict[str, Any] | None = None, sample_rate_hz: float = SAMPLE_RATE_HZ):
+        self.fields = {k: v for k, v in (race_data or {}).items()
+                       if k not in ("significant_events", "hpc_race_summary_estimates")}
+        self.fs = float(sample_rate_hz)
+        ms = lambda t: max(1, int(round(t * self.fs / 1000)))
+        self._smooth = [_Trailing(ms(SMOOTH_MS)) for _ in AXES]
+        self._sustain = _Trailing(ms(SUSTAIN_MS))
+        self._neck = _Trailing(ms(NECK_MS))
+        self._sustained = _RegionTracker(1)
+        self._spikes = _RegionTracker(ms(SPINE_REFRACTORY_MS))
+        self.samples = 0
+        self.peaks = [0, 0, 0]
+        self.peak_neck_g = 0.0
+        self._horizontal_sum = 0.0
+        self.events: List[Dict[str, Any]] = []
+        self.sustained_ms = 0.0
+        self.spine_events = 0
+
+    def feed(self, chunk: np.ndarray) -> "AccelProcessor":
+        axes = np.asarray(chunk).reshape(-1, 3).T.astype(float)      # one contiguous row per axis
+        if not axes.shape[1]:
+            return self
+        with metrics.stage("accel", "chunk"):
+            sm = [f(axes[k]) for k, f in enumerate(self._smooth)]
+            for k in range(3):
+                self.peaks[k] = _first_peak(sm[k], self.peaks[k])
+            _, lat, vert = sm
+            horizontal = np.sqrt(axes[0] * axes[0] + axes[1] * axes[1])
+            self._horizontal_sum += float(horizontal.sum())
+            self.peak_neck_g = max(self.peak_neck_g, float(self._neck(np.abs(axes[1])).max()))
+            sustained = self._sustain(horizontal) >= SUSTAINED_G
+            self._emit(self._sustained.feed(sustained, lat, vert, self.samples), "SustainedHighG")
+            self._emit(self._spikes.feed(vert > SPINE_SPIKE_G, lat, vert, self.samples), "VerticalCompression")
+            self.samples += axes.shape[1]
+        return self
+
+    def feed_chunks(self, chunks: Iterable[np.ndarray]) -> "AccelProcessor":
+        for chunk in chunks:
+            self.feed(chunk)
+        return self
+
+    def _emit(self, regions, kind: str) -> None:
+        to_ms = 1000.0 / self.fs
+        for start, end, lat, vert in regions:
+            event = {
+                "timestamp_ms": round(start * to_ms, 3),
+                "event_type": kind,
+                "g_forces": {"lateral_peak_g": round(lat, 3), "vertical_peak_g": round(vert, 3)},
+                "duration_ms": round((end - start) * to_ms, 3),
+            }
+            if kind == "SustainedHighG":
+                self.sustained_ms += event["duration_ms"]
+            else:
+                self.spine_events += 1
+            self.events.append(event)
+
+    def finish(self) -> "AccelProcessor":
+        """Close regions still open at the end of the race."""
+        self._emit(self._sustained.finish(), "SustainedHighG")
+        self._emit(self._spikes.finish(), "VerticalCompression")
+        return self
+
+    def estimates(self) -> Dict[str, Any]:
+        hours = self.samples / self.fs / 3600
+        mean_horizontal = self._horizontal_sum / self.samples if self.samples else 0.0
+        temp = self.fields.get("cockpit_temp_c")
+        heat = max(0.0, float(temp) - SWEAT_FROM_C) if isinstance(temp, (int, float)) and not isinstance(temp, bool) else 0.0
+        rate = SWEAT_BASE_L_PER_H + SWEAT_PER_C_L_PER_H * heat + SWEAT_PER_G_L_PER_H * mean_horizontal
+        return {
+            "estimated_total_fluid_loss_l": round(rate * hours, 2),
+            "peak_neck_load_equivalent_kg": round(HEAD_HELMET_KG * self.peak_neck_g, 1),
+            "cumulative_spinal_compression_events": self.spine_events,
+        }
+
+    def race_data(self) -> Dict[str, Any]:
+        """The race_data doc so far; regions still open are not listed until finish()."""
+        events = [dict(event_id=i, **e) for i, e in enumerate(sorted(self.events, key=lambda e: e["timestamp_ms"]))]
+        return dict(
+            self.fields,
+            hpc_race_summary_estimates=self.estimates(),
+            significant_events=events,
+            accelerometer_summary={
+                "samples": self.samples,
+                "duration_s": round(self.samples / self.fs, 3),
+                "sample_rate_hz": self.fs,
+                "peak_g": {axis: round(p, 3) for axis, p in zip(AXES, self.peaks)},
+                "sustained_high_g_ms": round(self.sustained_ms, 3),
+            },
+        )
+
+def iter_chunks(samples: np.ndarray, chunk: int = CHUNK_SAMPLES) -> Iterable[np.ndarray]:
+    """Row chunks of an (n, 3) array, e.g. an np.memmap of a recorded race."""
+    for i in range(0, len(samples), chunk):
+        yield samples[i:i + chunk]
+
+def iter_binary(stream, dtype: str = "<f4", chunk: int = CHUNK_SAMPLES) -> Iterable[np.ndarray]:
+    """(n, 3) chunks from a file-like of interleaved x, y, z samples (a partial trailing sample is an error)."""
+    dt = np.dtype(dtype)
+    frame = 3 * dt.itemsize
+    buf = bytearray()
+    while True:
+        data = stream.read(chunk * frame - len(buf))
+        if not data:
+            break
+        buf += data
+        if len(buf) >= chunk * frame:
+            yield np.frombuffer(bytes(buf), dtype=dt).reshape(-1, 3)
+            buf = bytearray()
+    if len(buf) % frame:
+        raise ValueError(f"body is not a whole number of {dtype} x,y,z samples")
+    if buf:
+        yield np.frombuffer(bytes(buf), dtype=dt).reshape(-1, 3)
+
+def process(chunks: Iterable[np.ndarray], race_data: Dict[str, Any] | None = None,
+            sample_rate_hz: float = SAMPLE_RATE_HZ) -> Dict[str, Any]:
+    """race_data derived from a whole race of accelerometer chunks."""
+    if not math.isfinite(sample_rate_hz) or sample_rate_hz <= 0:
+        raise ValueError("sample_rate_hz must be positive")
+    with metrics.stage("accel", "process"):
+        return AccelProcessor(race_data, sample_rate_hz).feed_chunks(chunks).finish().race_data()
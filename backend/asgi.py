@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Tuple
+from urllib.parse import parse_qsl
+import asyncio
+import io
+import json
+import os
+import signal
+import sys
+
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+
+from backend import app as flask_app, docs, feed, jobs, open_race_stream
+
+# ASGI entry point for production serving (see serve.py).
+#
+# The event loop never blocks: each Flask request (Firestore reads through the
+# DocCache, setup computation, JSON encoding) runs on a bounded thread pool,
+# and streaming bodies are pulled from it chunk by chunk. /feedback/live is
+# served natively from HealthFeed.astream, so SSE subscribers cost a coroutine
+# each rather than a pool thread. /raceSim/stream is native too: each event
+# is computed on the pool, and paced playback waits on the event loop between
+# events instead of in a thread. Shutdown ends the live and race streams
+# first, then drains the pool, the job queue, the batch process pool and the
+# Firestore listeners.
+#
+# Request bodies are not buffered: wsgi.input pulls http.request messages
+# from the event loop as Flask reads, so the routes that consume
+# request.stream in chunks (/feedback/accel, /feedback/events) stay bounded
+# in memory however long the upload. Every other route is capped at
+# MAX_BODY_BYTES: a larger Content-Length gets 413 before anything is read,
+# and a body that grows past it mid-read gets 413 from Flask.
+
+THREADS = int(os.environ.get("ASGI_THREADS", 32))
+MAX_BODY_BYTES = int(os.environ.get("ASGI_MAX_BODY_BYTES", 64 * 1024 * 1024))
+STREAMED_ROUTES = frozenset(("/feedback/accel", "/feedback/events"))      # no body cap: read in chunks
+
+_executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="asgi")
+
+# ---------- WSGI bridge ----------
+
+def _environ(scope: Dict[str, Any], body: "_BodyStream") -> Dict[str, Any]:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BufferedReader(body, 64 * 1024),
+        "wsgi.input_terminated": True,      # the stream ends with the body, Content-Length or not
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope["headers"]:
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def _call_wsgi(environ: Dict[str, Any]) -> Tuple[int, List[Tuple[bytes, bytes]], bytes | None, Any, Any]:
+    started: Dict[str, Any] = {}
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info=None) -> Callable:
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+        return lambda data: None
+
+    result = flask_app(environ, start_response)
+    it = iter(result)
+    first = next(it, None)      # Flask calls start_response before the first chunk
+    return started["status"], started["headers"], first, it, result
+
+def _next_chunk(it: Any) -> bytes | None:
+    return next(it, None)
+
+def _declared_length(scope: Dict[str, Any]) -> int | None:
+    for name, value in scope["headers"]:
+        if name.lower() == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+class _BodyStream(io.RawIOBase):
+    """
+    The request body for a pool thread, pulled one http.request message at a
+    time from the event loop. Past `limit` bytes a read raises
+    RequestEntityTooLarge (Flask answers 413); a client that goes away
+    raises ClientDisconnected and sets `disconnected`.
+    """
+
+    def __init__(self, receive: Callable, loop: asyncio.AbstractEventLoop, limit: int | None):
+        self._receive, self._loop, self._limit = receive, loop, limit
+        self._chunk = memoryview(b"")
+        self._more = True
+        self.size = 0
+        self.disconnected = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _pull(self) -> None:
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message["type"] == "http.disconnect":
+            self._more, self.disconnected = False, True
+            raise ClientDisconnected()
+        body = message.get("body", b"")
+        self.size += len(body)
+        if self._limit is not None and self.size > self._limit:
+            self._more = False
+            raise RequestEntityTooLarge()
+        self._chunk = memoryview(body)
+        self._more = bool(message.get("more_body"))
+
+    def readinto(self, b: Any) -> int:
+        while not len(self._chunk) and self._more:
+            self._pull()
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+async def _send_simple(send: Callable, status: int, body: bytes) -> None:
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"text/plain"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+async def _wsgi(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    limit = None if scope["path"] in STREAMED_ROUTES else MAX_BODY_BYTES
+    declared = _declared_length(scope)
+    if limit is not None and declared is not None and declared > limit:
+        return await _send_simple(send, 413, b"request body too large")      # refuse before reading any of it
+    loop = asyncio.get_running_loop()
+    body = _BodyStream(receive, loop, limit)
+    status, headers, chunk, it, result = await loop.run_in_executor(_executor, _call_wsgi, _environ(scope, body))
+    try:
+        if body.disconnected:
+            return                           # nobody to answer
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        while chunk is not None:
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            chunk = await loop.run_in_executor(_executor, _next_chunk, it)
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        close = getattr(result, "close", None)
+        if close is not None:
+            await loop.run_in_executor(_executor, close)
+
+async def _send_json(send: Callable, status: int, obj: Any, headers: List[Tuple[bytes, bytes]] = ()) -> None:
+    body = json.dumps(obj).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers]})
+    await send({"type": "http.response.body", "body": body})
+
+# ---------- Native routes ----------
+
+async def _until_disconnect(receive: Callable, pump: Callable) -> None:
+    """Run pump() until it finishes or the client goes away, whichever is first."""
+    async def _watch_disconnect() -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    tasks = {asyncio.create_task(pump()), asyncio.create_task(_watch_disconnect())}
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for t in pending:
+        t.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+async def _live_feedback(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    last = dict(scope["headers"]).get(b"last-event-id", b"").decode()
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream"),
+        (b"cache-control", b"no-cache"),
+        (b"x-accel-buffering", b"no"),
+        (b"access-control-allow-origin", b"*"),
+    ]})
+
+    async def _pump() -> None:
+        async for message in feed.astream(int(last) if last.isdigit() else -1):
+            await send({"type": "http.response.body", "body": message, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})       # feed closed (shutdown)
+
+    await _until_disconnect(receive, _pump)
+
+async def _race_sim(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    args: Dict[str, str] = {}
+    for k, v in parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True):
+        args.setdefault(k, v)           # first value wins, as request.args.to_dict()
+    loop = asyncio.get_running_loop()
+    status, stream = await loop.run_in_executor(_executor, open_race_stream, args)
+    if status != 200:
+        return await _send_json(send, status, stream, [(b"retry-after", b"5")] if status == 503 else [])
+    try:
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ]})
+
+        async def _pump() -> None:
+            while True:
+                chunk = await loop.run_in_executor(_executor, stream.next_chunk)
+                if chunk is None:
+                    break
+                await asyncio.sleep(stream.delay())       # paced playback: no thread held while waiting
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+        await _until_disconnect(receive, _pump)
+    finally:
+        await loop.run_in_executor(_executor, stream.close)      # waits out an event still computing
+
+# ---------- Lifespan ----------
+
+def _end_streams() -> None:
+    feed.close()
+    if "race_sim" in sys.modules:      # only if a race was ever streamed
+        sys.modules["race_sim"].close_streams()
+
+def _end_streams_on_signal() -> None:
+    """Chain SIGTERM/SIGINT so open SSE streams end before the server drains connections."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        previous = signal.getsignal(sig)
+
+        def _handler(signum, frame, previous=previous):
+            loop.call_soon_threadsafe(_end_streams)
+            if callable(previous):
+                previous(signum, frame)
+
+        try:
+            signal.signal(sig, _handler)
+        except ValueError:        # not the main thread (e.g. embedded in a test harness)
+            return
+
+def shutdown() -> None:
+    _end_streams()
+    _executor.shutdown(wait=True, cancel_futures=False)
+    jobs.close()
+    if "batch" in sys.modules:         # only if a batch request ever loaded it
+        sys.modules["batch"].shutdown_pool()
+    docs.close()
+
+async def _lifespan(receive: Callable, send: Callable) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            _end_streams_on_signal()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await asyncio.get_running_loop().run_in_executor(None, shutdown)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+# ---------- App ----------
+
+async def app(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    if scope["path"] == "/feedback/live" and scope["method"] == "GET":
+        return await _live_feedback(scope, receive, send)
+    if scope["path"] == "/raceSim/stream" and scope["method"] == "GET":
+        return await _race_sim(scope, receive, send)
+    return await _wsgi(scope, receive, send)
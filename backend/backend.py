@@ -1,73 +1,547 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context
+from contextlib import nullcontext
 
 app = Flask(__name__)
 
-import firebase_admin
-from firebase_admin import firestore
-from firebase_admin import credentials
-
 import os
+import sys
+import threading
 
-from poc import compute_setup_from_doc
+# numpy-backed engine modules (poc, batch, sweep) and firebase are loaded on
+# first use, so importing this module and answering /healthz stay cheap
 from health import generate_report
+from schema import SchemaError
+from health_feed import HealthFeed
+from doc_cache import DocCache
+from result_cache import ResultCache, doc_version, setup_cache_key
+from jobs import JobQueue, QueueFull, content_key
+from metrics import REGISTRY, stage, trace
+from firestore_client import LazyClient, is_ready, on_ready, where_eq
 from flask_cors import CORS
 
 CORS(app)
 # CORS(app, resources={r"/": {"origins": "*"}})
 
-basedir = os.path.dirname((os.path.dirname(os.path.abspath(__file__))))
+db = LazyClient()      # firestore client is created on the first collection() call
+
+docs = DocCache.from_env(db)      # cached test_drive / race_data reads
+on_ready(lambda client: (docs.watch("test_drive"), docs.watch("race_data")))
+
+results = ResultCache.from_env()     # memoized /dataForConfig bodies, keyed by doc + preferences hash
+
+feed = HealthFeed.from_env()      # live health report over events pushed during the race
+
+jobs = JobQueue.from_env()      # background /dataForConfig and /feedback computations, identical in-flight jobs collapsed
+
+
+def schema_error_body(exc, stored=None):
+  # SchemaError -> {"error", "path"}; `stored` names the collection when a firestore doc (not the request) is malformed
+  return {"error": str(exc) if stored is None else f"stored {stored} doc is malformed: {exc}", "path": exc.path}
+
 
-cred = credentials.Certificate(os.path.join(basedir, "serviceAccountKey.json"))
-firebase_admin.initialize_app(cred)
+def schema_error(exc, status=400, stored=None):
+  return jsonify(schema_error_body(exc, stored)), status
 
-db = firestore.client()
 
 
 @app.route('/dataForConfig', methods = ['POST'])
 def get_ideal_config():
 
+  from poc import build_preferences_from_doc
+  from batch import apply_questionnaire
+  from setup_plan import PLANS
+
   questionnaire = request.get_json()       # questionnaire response only (metadata present in firestore)
 
-  query = db.collection("test_drive").limit(1)
-  results = list(query.stream())
+  timings = bool(request.args.get("timings"))      # ?timings=1: stage timings + counters in diagnostics, result cache bypassed
+
+  n_shortlist = 0
+  if request.args.get("shortlist") is not None:      # ?shortlist=N: the N fastest candidate setups by predicted lap time
+    from laptime import shortlist_size
+    try:
+      n_shortlist = shortlist_size(request.args["shortlist"])
+    except ValueError as exc:
+      return jsonify({"error": str(exc)}), 400
+
+  with (trace() if timings else nullcontext()) as tr:
+    calc_doc = docs.first_doc("test_drive")      # private copy, safe to mutate
+
+    try:
+      calc_doc = apply_questionnaire(calc_doc, questionnaire)     # changing preferences in metadoc
+    except SchemaError as exc:
+      return schema_error(exc)
+    prefs = build_preferences_from_doc(calc_doc)
+
+    with stage("route", "cache_key"):
+      version = doc_version(calc_doc)      # everything but the answers
+      etag = setup_cache_key(calc_doc, prefs, version)      # same doc + answers => same setup
+      if n_shortlist:
+        etag = f"{etag}-s{n_shortlist}"      # a different body: shortlist + predicted_performance
+    if not timings and request.if_none_match.contains(etag):
+      resp = Response(status=304)
+      resp.set_etag(etag)
+      return resp
+
+    body = None if timings else results.get(etag)
+    if body is None:
+      try:
+        result = PLANS.compute(calc_doc, prefs, version)     # compute_setup_from_doc, with the answer-independent part precomputed per doc version
+      except SchemaError as exc:
+        return schema_error(exc, 500, "test_drive")      # the stored doc is malformed, not the request
+      if n_shortlist:
+        from laptime import shortlist
+        try:
+          with stage("route", "shortlist"):
+            ranked = shortlist(calc_doc, prefs, n_shortlist, heuristic=result["diagnostics"]["aggregated_move"])
+        except SchemaError as exc:
+          return schema_error(exc, 500, "test_drive")
+        result["predicted_performance"] = ranked.pop("heuristic")      # the returned setup, scored
+        result["shortlist"] = ranked.pop("setups")
+        result["diagnostics"]["laptime"] = ranked
+      if timings:
+        result["diagnostics"].update(tr.as_dict())
+        return jsonify(result)
+      with stage("route", "serialize"):
+        body = app.json.dumps(result).encode()
+      results.put(etag, body)
+
+  resp = Response(body, mimetype="application/json")       # return result
+  resp.set_etag(etag)
+  return resp
+
+
+
+@app.route('/dataForConfig/batch', methods = ['POST'])
+def get_ideal_config_batch():
+  from batch import parse_batch, run_batch, to_ndjson
+
+  try:
+    items = parse_batch(request.get_json(silent=True))      # [{questionnaire, doc?}, ...]
+  except ValueError as exc:
+    return jsonify({"error": str(exc)}), 400
+
+  default_doc = None
+  if any(it["doc"] is None for it in items):      # one firestore read for the whole batch
+    default_doc = docs.first_doc("test_drive")
+
+  # stream one ndjson line per item as it finishes, then a summary line
+  return Response(stream_with_context(to_ndjson(run_batch(items, default_doc))), mimetype="application/x-ndjson")
+
+
+
+@app.route('/dataForConfig/sweep', methods = ['POST'])
+def get_config_sweep():
+  from sweep import sweep_preferences
+
+  axes = request.get_json(silent=True)     # {"stability_bias": {"start", "stop", "num"} | [..], ...}
+  if not isinstance(axes, dict):
+    return jsonify({"error": "expected an object of sweep axes"}), 400
+
+  calc_doc = docs.first_doc("test_drive")
+
+  try:
+    result = sweep_preferences(calc_doc, axes)     # every grid point in one pass
+  except SchemaError as exc:
+    return schema_error(exc, 500, "test_drive")
+  except ValueError as exc:
+    return jsonify({"error": str(exc)}), 400
+
+  return jsonify(result)
+
+
 
-  metadoc = results[0]
+@app.route('/dataForConfig/sessions', methods = ['POST'])
+def get_multi_session_config():
+  from batch import apply_questionnaire
+  from multi_session import SessionWeighting, iter_session_pages, optimise_sessions
 
-  calc_doc = metadoc.to_dict()
+  body = request.get_json(silent=True)     # questionnaire answers + optional track / tyre_compound / half_life_days / page_size
+  if not isinstance(body, dict):
+    return jsonify({"error": "expected a questionnaire object"}), 400
 
-  stability = questionnaire.get('rookie_stability_priority')     # get the preferences
-  steering = questionnaire.get('steering_weight_preference')
-  throttle = questionnaire.get('throttle_pedal_linearity')
-  brake = questionnaire.get('brake_pedal_linearity')
+  try:
+    half_life = body.get("half_life_days", 30.0)
+    weighting = SessionWeighting(half_life_days=float(half_life) if half_life is not None else None)
+    if weighting.half_life_days is not None and not weighting.half_life_days > 0:
+      raise ValueError("half_life_days must be > 0 or null")
+    page_size = int(body.get("page_size", 100))
+    if page_size < 1:
+      raise ValueError("page_size must be >= 1")
+  except (TypeError, ValueError) as exc:
+    return jsonify({"error": str(exc)}), 400
 
-  if 'controls' not in calc_doc['initial_setup']:
-    calc_doc['initial_setup']['controls'] = {}
+  try:
+    base_doc = apply_questionnaire(docs.first_doc("test_drive"), body)     # targets, constraints and initial setup come from here
+  except SchemaError as exc:
+    return schema_error(exc)
+  meta = base_doc.get("metadata") or {}
 
-  # changing preferences in metadoc
-  calc_doc['metadata']['rookie_stability_priority'] = float(stability)
-  calc_doc['initial_setup']['controls']['steering_weight_preference'] = steering
-  calc_doc['initial_setup']['controls']['throttle_pedal_linearity'] = float(throttle)
-  calc_doc['initial_setup']['controls']['brake_pedal_linearity'] = float(brake)
+  try:
+    pages = iter_session_pages(db, body.get("track", meta.get("track")), body.get("tyre_compound", meta.get("tyre_compound")), page_size)
+    result = optimise_sessions(base_doc, pages, weighting=weighting)     # pages are read while earlier ones compute
+  except SchemaError as exc:
+    return schema_error(exc, 500, "test_drive")      # the stored doc is malformed, not the request
+  except LookupError as exc:
+    return jsonify({"error": str(exc)}), 404
 
-  result = compute_setup_from_doc(calc_doc)     # function from poc
+  return jsonify(result)
 
-  print(result)
-  return jsonify(result)       # return result
+
+
+@app.route('/dataForConfig/traces', methods = ['POST'])
+def get_config_from_traces():
+  from poc import build_preferences_from_doc, compute_setup_from_doc, validate_schema
+  from batch import apply_questionnaire
+  from lap_traces import LapTraces, build_test_drive_doc
+
+  # questionnaire answers + lap traces ({"distance_m", "channels"} or per-lap "laps") + optional track "turns"
+  body = request.get_json(silent=True)
+  if not isinstance(body, dict):
+    return jsonify({"error": "expected a questionnaire object with lap traces"}), 400
+
+  try:
+    base_doc = apply_questionnaire(docs.first_doc("test_drive"), body)     # targets, constraints and initial setup come from here
+  except SchemaError as exc:
+    return schema_error(exc)
+  try:
+    validate_schema(base_doc)
+  except SchemaError as exc:
+    return schema_error(exc, 500, "test_drive")      # the stored doc is malformed, not the request
+
+  try:
+    step_m = float(body.get("step_m", 2.0))
+  except (TypeError, ValueError):
+    step_m = 0.0
+  if not step_m > 0:
+    return jsonify({"error": "step_m must be a positive number", "path": "step_m"}), 400
+
+  try:
+    if "laps" in body:
+      traces = LapTraces.from_laps(body["laps"], step_m)
+    else:
+      traces = LapTraces(body.get("distance_m"), body.get("channels") or {})
+    calc_doc = build_test_drive_doc(base_doc, traces, body.get("turns"))
+  except SchemaError as exc:
+    if exc.path.startswith("track_turns"):
+      return schema_error(exc, 500, "test_drive")      # the stored turn definitions
+    return schema_error(exc)
+  result = compute_setup_from_doc(calc_doc, build_preferences_from_doc(calc_doc))
+
+  result["turns"] = calc_doc["turns"]
+  return jsonify(result)
+
+
+
+@app.route('/dataForConfig/robustness', methods = ['POST'])
+def get_config_robustness():
+  from poc import build_preferences_from_doc
+  from batch import apply_questionnaire
+  from robustness import RobustnessOptions, robustness
+
+  # questionnaire answers + optional samples / seed / noise_model / noise / quantiles / stable_probability / lap_stats
+  body = request.get_json(silent=True)
+  if not isinstance(body, dict):
+    return jsonify({"error": "expected a questionnaire object"}), 400
+
+  try:
+    calc_doc = apply_questionnaire(docs.first_doc("test_drive"), body)
+    options = RobustnessOptions.from_payload(body)
+  except SchemaError as exc:
+    return schema_error(exc)
+  except ValueError as exc:
+    return jsonify({"error": str(exc)}), 400
+
+  try:
+    result = robustness(calc_doc, build_preferences_from_doc(calc_doc), options)     # every sample in batched array passes
+  except SchemaError as exc:
+    return schema_error(exc, 500, "test_drive")
+  except ValueError as exc:
+    return jsonify({"error": str(exc)}), 400
+
+  return jsonify(result)
+
+
+
+@app.route('/dataForConfig/solve', methods = ['POST'])
+def get_solved_config():
+  from poc import build_preferences_from_doc
+  from batch import apply_questionnaire
+  from solver import SolverOptions, solve_setup
+
+  # questionnaire answers + optional max_iterations / ftol / xtol / start + "sensitivity" model overrides
+  body = request.get_json(silent=True)
+  if not isinstance(body, dict):
+    return jsonify({"error": "expected a questionnaire object"}), 400
+
+  try:
+    calc_doc = apply_questionnaire(docs.first_doc("test_drive"), body)
+    options = SolverOptions.from_payload(body)
+  except SchemaError as exc:
+    return schema_error(exc)
+  except ValueError as exc:
+    return jsonify({"error": str(exc)}), 400
+
+  try:
+    result = solve_setup(calc_doc, build_preferences_from_doc(calc_doc), options, body.get("sensitivity"))     # closed loop against the turn-response model
+  except SchemaError as exc:
+    return schema_error(exc, 500, "test_drive")
+  except ValueError as exc:
+    return jsonify({"error": str(exc)}), 400
+
+  return jsonify(result)
 
 
 
 @app.route('/feedback')
 def give_feedback():
 
-  query = db.collection("race_data").limit(1)      # retrieve race_data
-  results = list(query.stream())
+  converted_data = docs.first_doc("race_data")      # retrieve race_data
+  try:
+    result = generate_report(converted_data)      # return health result
+  except SchemaError as exc:
+    return schema_error(exc, 500, "race_data")
+
+  return jsonify(result)
+
+
+
+@app.route('/feedback/fleet')
+def fleet_feedback():
+  from fleet_health import FleetTable, fleet_report
+  from multi_session import iter_query_pages
+
+  # every race_data doc (optionally one driver's): per-race reports + rolling per-driver trends
+  try:
+    window = int(request.args.get("window", 5))
+    page_size = int(request.args.get("page_size", 200))
+    if page_size < 1:
+      raise ValueError("page_size must be >= 1")
+    if request.args.get("source") == "store":      # local columnar copy (event_store.py ingest)
+      from event_store import open_cached
+      if not os.environ.get("EVENT_STORE_DIR"):
+        return jsonify({"error": "EVENT_STORE_DIR is not set"}), 404
+      try:
+        store = open_cached(os.environ["EVENT_STORE_DIR"])
+      except FileNotFoundError:
+        return jsonify({"error": "no event store in EVENT_STORE_DIR (run event_store.py ingest)"}), 404
+      table = FleetTable().extend_store(store, driver=request.args.get("driver"))
+    else:
+      query = db.collection("race_data")
+      if request.args.get("driver"):
+        query = where_eq(query, "driver_id", request.args["driver"])
+      table = FleetTable().extend_pages(iter_query_pages(query, page_size, pipeline="fleet_health"))
+    result = fleet_report(table, window=window, reports=request.args.get("reports", "1") != "0")
+  except ValueError as exc:
+    return jsonify({"error": str(exc)}), 400
+
+  return jsonify(result)
+
+
+
+@app.route('/feedback/accel', methods = ['POST'])
+def accel_feedback():
+  from accel import iter_binary, process
+
+  # raw race accelerometer (interleaved x, y, z G as little-endian float32, or ?dtype=f8), read in chunks
+  dtype = {"f4": "<f4", "f8": "<f8"}.get(request.args.get("dtype", "f4"))
+  if dtype is None:
+    return jsonify({"error": "dtype must be f4 or f8"}), 400
+  fields = {k: request.args[k] for k in ("driver_id", "track_name") if k in request.args}
+  try:
+    if "cockpit_temp_c" in request.args:
+      fields["cockpit_temp_c"] = float(request.args["cockpit_temp_c"])
+    race_data = process(iter_binary(request.stream, dtype), fields, float(request.args.get("sample_rate_hz", 1000)))
+    result = generate_report(race_data)
+  except SchemaError as exc:
+    return schema_error(exc)
+  except ValueError as exc:
+    return jsonify({"error": str(exc)}), 400
+
+  return jsonify({"race_data": race_data, "report": result})
+
+
+
+@app.route('/feedback/events', methods = ['POST'])
+def push_race_events():
+
+  if request.args.get("reset"):      # new race
+    feed.reset()
+
+  try:
+    version = feed.publish_ndjson(request.stream)      # ndjson events, or {"race_data": {...}} lines
+  except SchemaError as exc:
+    return schema_error(exc)
+  except ValueError as exc:
+    return jsonify({"error": str(exc)}), 400
+
+  return jsonify({"version": version, "subscribers": feed.subscribers})
+
+
+
+@app.route('/feedback/live')
+def live_feedback():
+
+  # server-sent events; a reconnecting client resumes from Last-Event-ID
+  last = request.headers.get("Last-Event-ID", "")
+  stream = feed.stream(int(last) if last.isdigit() else -1)
+
+  return Response(stream_with_context(stream), mimetype="text/event-stream",
+                  headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+
+def open_race_stream(args):
+  # (status, body) for GET /raceSim/stream: a RaceStream on 200, else the error object; asgi.py serves the stream natively
+  from race_sim import RaceOptions, RaceStream, TooManyStreams, build_track
+
+  # query: laps / cars / seed / dt_s / frame_s / speedup, or ids=a,b,c (one car each)
+  args = dict(args)
+  ids = [i for i in args.pop("ids", "").split(",") if i] or None
+  if ids:
+    args["cars"] = len(ids)
+  try:
+    options = RaceOptions.from_payload(args)
+  except ValueError as exc:
+    return 400, {"error": str(exc)}
+
+  try:
+    track = build_track(docs.first_doc("test_drive"))      # turn kinematics of the stored session
+  except SchemaError as exc:
+    return 500, schema_error_body(exc, "test_drive")
+
+  try:
+    return 200, RaceStream(track, options, ids)
+  except TooManyStreams as exc:
+    return 503, {"error": str(exc)}
+
+
+
+@app.route('/raceSim/stream')
+def race_sim_stream():
+
+  # server-sent events: track layout, downsampled frames, final classification
+  status, body = open_race_stream(request.args.to_dict())
+  if status != 200:
+    return jsonify(body), status, ({"Retry-After": "5"} if status == 503 else {})
+
+  # Response closes the stream (freeing its slot) when the server is done with it
+  return Response(body, mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+
+def submit_job(kind, key, fn):
+  # 202 + Location for a new or joined job; 503 + Retry-After when the queue is full
+  try:
+    job, joined = jobs.submit(kind, key, fn)
+  except QueueFull as exc:
+    return jsonify({"error": f"job queue is full: {exc}"}), 503, {"Retry-After": "1"}
+  return jsonify(dict(job.to_dict(), deduplicated=joined)), 202, {"Location": f"/jobs/{job.id}"}
+
+
+
+def _setup_job(calc_doc, prefs, version, etag):
+  # runs on a job worker: (status, body, etag), shared with /dataForConfig through the result cache
+  from setup_plan import PLANS
+  body = results.get(etag)
+  if body is None:
+    try:
+      result = PLANS.compute(calc_doc, prefs, version)
+    except SchemaError as exc:
+      return 500, app.json.dumps(schema_error_body(exc, "test_drive")).encode(), None
+    body = app.json.dumps(result).encode()
+    results.put(etag, body)
+  return 200, body, etag
+
+
+
+def _report_job(race_data):
+  try:
+    return 200, app.json.dumps(generate_report(race_data)).encode(), None
+  except SchemaError as exc:
+    return 500, app.json.dumps(schema_error_body(exc, "race_data")).encode(), None
+
+
+
+@app.route('/jobs/dataForConfig', methods = ['POST'])
+def submit_config_job():
+  from poc import build_preferences_from_doc
+  from batch import apply_questionnaire
+
+  # same answers against the same doc version => the same job while it is in flight
+  try:
+    calc_doc = apply_questionnaire(docs.first_doc("test_drive"), request.get_json())
+  except SchemaError as exc:
+    return schema_error(exc)
+  prefs = build_preferences_from_doc(calc_doc)
+  version = doc_version(calc_doc)
+  etag = setup_cache_key(calc_doc, prefs, version)
+
+  return submit_job("dataForConfig", etag, lambda: _setup_job(calc_doc, prefs, version, etag))
+
+
+
+@app.route('/jobs/feedback', methods = ['POST'])
+def submit_feedback_job():
+  race_data = docs.first_doc("race_data")
+  return submit_job("feedback", content_key("feedback", race_data), lambda: _report_job(race_data))
+
+
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+
+  # ?wait=S long-polls up to JOB_MAX_WAIT_S; a finished job answers with the route's own status and body
+  try:
+    wait = min(float(request.args.get("wait", 0)), float(os.environ.get("JOB_MAX_WAIT_S", 30)))
+  except ValueError:
+    return jsonify({"error": "wait must be a number of seconds"}), 400
+  job = jobs.wait(job_id, wait)
+  if job is None:
+    return jsonify({"error": f"unknown or expired job {job_id!r}"}), 404
+  if job.state == "failed":
+    return jsonify(job.to_dict()), 500
+  if job.state != "done":
+    return jsonify(job.to_dict()), 202, {"Retry-After": "1"}
+
+  status, body, etag = job.result
+  resp = Response(body, status=status, mimetype="application/json", headers={"X-Job-Id": job.id})
+  if etag:
+    resp.set_etag(etag)
+  return resp
+
+
+
+@app.route('/healthz')
+def healthz():
+  # liveness: answers before firestore and the engine have loaded
+  return jsonify({"status": "ok", "firestore_ready": is_ready(), "engine_loaded": "poc" in sys.modules})
+
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+  # per process: with several server workers, each one exports its own series
+  return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+
+@app.route('/cacheStats')
+def cache_stats():
+  stats = {"docs": docs.stats(), "results": results.stats(), "jobs": jobs.stats()}
+  if "setup_plan" in sys.modules:      # loaded with the first /dataForConfig
+    stats["plans"] = sys.modules["setup_plan"].PLANS.stats()
+  return jsonify(stats)
+
+
 
-  data = results[0]
-  
-  converted_data = data.to_dict()
-  result = generate_report(converted_data)      # return health result
+def warm_up():
+  """Load the engine and connect to firestore ahead of the first request."""
+  import batch, sweep      # noqa: F401  (pulls in poc, rules, turn_matrix, numpy)
+  from setup_plan import PLANS
+  PLANS.get(docs.first_doc("test_drive"))      # also loads the default rule table
 
-  return jsonify(result, 200)
+if os.environ.get("BACKEND_WARMUP") == "1":      # warm in the background; /healthz answers meanwhile
+  threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
 
 
 
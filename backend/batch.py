@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Iterator, List
+import json
+import multiprocessing
+import os
+import time
+
+from schema import SchemaError, decode_questionnaire
+from turn_matrix import compute_setup_from_doc_vectorized
+
+# Batch setup computation for /dataForConfig/batch.
+#
+# Items are fanned out over a process pool (spawned, so workers never import
+# backend.py / firebase) and results are yielded as NDJSON lines in completion
+# order, followed by one summary line with throughput. An item that fails,
+# including one whose worker died, comes back as an ok=false line; a broken
+# pool is dropped so the next batch starts a fresh one.
+
+MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 1000))
+
+# ---------- Questionnaire -> doc ----------
+
+def apply_questionnaire(doc: Dict[str, Any], questionnaire: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Write the four questionnaire answers into the doc, as /dataForConfig does.
+    Raises SchemaError for a missing or non-numeric answer.
+    """
+    q = decode_questionnaire(questionnaire)
+
+    if 'controls' not in doc['initial_setup']:
+        doc['initial_setup']['controls'] = {}
+
+    doc['metadata']['rookie_stability_priority'] = q.rookie_stability_priority
+    doc['initial_setup']['controls']['steering_weight_preference'] = q.steering_weight_preference
+    doc['initial_setup']['controls']['throttle_pedal_linearity'] = q.throttle_pedal_linearity
+    doc['initial_setup']['controls']['brake_pedal_linearity'] = q.brake_pedal_linearity
+    return doc
+
+# ---------- Worker ----------
+
+def compute_item(index: int, doc: Dict[str, Any], questionnaire: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs in a pool worker. Never raises: failures come back as ok=False lines."""
+    t0 = time.perf_counter()
+    try:
+        calc_doc = apply_questionnaire(doc, questionnaire)
+        result = compute_setup_from_doc_vectorized(calc_doc)
+        out = {"index": index, "ok": True, "result": result}
+    except Exception as exc:
+        out = _failed(index, exc)
+    out["compute_ms"] = (time.perf_counter() - t0) * 1e3
+    return out
+
+def _failed(index: int, exc: BaseException) -> Dict[str, Any]:
+    out = {"index": index, "ok": False, "error": f"{type(exc).__name__}: {exc}"}
+    if isinstance(exc, SchemaError):
+        out["path"] = exc.path
+    return out
+
+# ---------- Pool ----------
+
+_POOL: ProcessPoolExecutor | None = None
+
+def pool_size() -> int:
+    return int(os.environ.get("SETUP_POOL_WORKERS", 0)) or (os.cpu_count() or 1)
+
+def get_pool() -> ProcessPoolExecutor:
+    global _POOL
+    if _POOL is None:
+        _POOL = ProcessPoolExecutor(
+            max_workers=pool_size(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _POOL
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Forget a broken pool so the next get_pool() starts a new one."""
+    global _POOL
+    if _POOL is pool:
+        _POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_pool() -> None:
+    global _POOL
+    if _POOL is not None:
+        _POOL.shutdown(wait=True, cancel_futures=True)
+        _POOL = None
+
+# ---------- Batch API ----------
+
+def parse_batch(payload: Any) -> List[Dict[str, Any]]:
+    """
+    Accepts {"items": [{"questionnaire": {...}, "doc": {...}?}, ...]} or a bare
+    list of questionnaires. Raises ValueError with a client-facing message.
+    """
+    items = payload.get("items") if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        raise ValueError("expected a non-empty 'items' list")
+    if len(items) > MAX_ITEMS:
+        raise ValueError(f"at most {MAX_ITEMS} items per batch, got {len(items)}")
+    out = []
+    for i, it in enumerate(items):
+        if isinstance(it, dict) and "questionnaire" in it:
+            q, doc = it["questionnaire"], it.get("doc")
+        else:
+            q, doc = it, None
+        if not isinstance(q, dict):
+            raise ValueError(f"items[{i}]: questionnaire must be an object")
+        if doc is not None and not isinstance(doc, dict):
+            raise ValueError(f"items[{i}]: doc must be an object")
+        out.append({"questionnaire": q, "doc": doc})
+    return out
+
+def run_batch(
+    items: List[Dict[str, Any]],
+    default_doc: Dict[str, Any] | None,
+    pool: ProcessPoolExecutor | None = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield one record per item as soon as it finishes, then a summary record.
+    Items without their own doc use `default_doc` (fetched once by the caller).
+    """
+    pool = pool or get_pool()
+    t0 = time.perf_counter()
+    futures = {}
+    for i, it in enumerate(items):
+        doc = it["doc"] if it["doc"] is not None else default_doc
+        if doc is None:
+            raise ValueError(f"items[{i}]: no doc given and no default doc available")
+        # The doc is pickled to the worker, so mutation there never reaches default_doc
+        fut = pool.submit(compute_item, i, doc, it["questionnaire"])
+        futures[fut] = (i, time.perf_counter())
+
+    failed = 0
+    latencies = []
+    broken = False
+    for fut in as_completed(futures):
+        i, submitted = futures[fut]
+        try:
+            rec = fut.result()
+        except Exception as exc:          # the worker died (e.g. out of memory) or the result did not unpickle
+            rec = _failed(i, exc)
+            if isinstance(exc, BrokenProcessPool) and not broken:
+                broken = True
+                _discard_pool(pool)
+        rec["latency_ms"] = (time.perf_counter() - submitted) * 1e3
+        latencies.append(rec["latency_ms"])
+        failed += 0 if rec["ok"] else 1
+        yield rec
+
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    yield {"summary": {
+        "count": len(items),
+        "failed": failed,
+        "wall_ms": wall * 1e3,
+        "throughput_per_s": len(items) / wall if wall > 0 else None,
+        "latency_ms_p50": latencies[len(latencies) // 2],
+        "latency_ms_max": latencies[-1],
+    }}
+
+def to_ndjson(records: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    for rec in records:
+        yield json.dumps(rec) + "\n"
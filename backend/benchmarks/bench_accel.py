@@ -0,0 +1,163 @@
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import accel
+from accel import AccelProcessor, iter_binary, iter_chunks, process
+from health import generate_report
+
+# Raw accelerometer processing: chunked results match a whole-array,
+# sample-by-sample reference and do not depend on the chunk size, the
+# derived race_data goes through generate_report, and a full race at 1 kHz
+# processes in well under a second with memory bounded by the chunk.
+#   python backend/benchmarks/bench_accel.py
+#   python backend/benchmarks/bench_accel.py --minutes 120 --chunk 65536
+
+
+def make_race(minutes, fs=1000, seed=0, chunk=1 << 20):
+    """(n, 3) float32 G samples: corners (lateral), braking (longitudinal), kerbs and bumps (vertical)."""
+    n = int(minutes * 60 * fs)
+    out = np.empty((n, 3), dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    lap_s = 85.0
+    for i in range(0, n, chunk):
+        t = np.arange(i, min(i + chunk, n)) / fs
+        phase = 2 * np.pi * t / lap_s
+        corners = np.sin(7 * phase) * (2.5 + 2.0 * np.sin(3 * phase) ** 2)
+        braking = -4.5 * np.clip(np.sin(5 * phase + 0.4), 0.8, 1.0) + 4.5 * 0.8
+        kerbs = (np.sin(11 * phase + 1.1) > 0.995) * 3.2 * np.abs(np.sin(400 * t))
+        m = len(t)
+        out[i:i + m, 0] = braking + 0.6 * np.sin(0.9 * phase) + rng.normal(0, 0.15, m)
+        out[i:i + m, 1] = corners + rng.normal(0, 0.15, m)
+        out[i:i + m, 2] = 1.0 + kerbs + rng.normal(0, 0.35, m)
+    return out
+
+
+def reference(samples, fs=1000):
+    """Whole race at once, regions walked sample by sample."""
+    x = samples.astype(float)
+    ms = lambda t: max(1, int(round(t * fs / 1000)))
+
+    def trailing(v, w):
+        cs = np.concatenate(([0.0], np.cumsum(v)))
+        i = np.arange(1, len(v) + 1)
+        return (cs[i] - cs[np.maximum(i - w, 0)]) / np.minimum(i, w)
+
+    def regions(mask, lat, vert, gap):
+        out, cur = [], None
+        for i in np.flatnonzero(mask).tolist():
+            if cur is not None and i - cur[1] < gap:
+                cur[1] = i + 1
+            else:
+                if cur is not None:
+                    out.append(cur)
+                cur = [i, i + 1]
+        if cur is not None:
+            out.append(cur)
+        peak = lambda v: v[int(np.argmax(np.abs(v)))]
+        return [(s, e, peak(lat[s:e][mask[s:e]]), peak(vert[s:e][mask[s:e]])) for s, e in out]
+
+    sm = [trailing(x[:, k], ms(accel.SMOOTH_MS)) for k in range(3)]
+    horizontal = np.sqrt(x[:, 0] * x[:, 0] + x[:, 1] * x[:, 1])
+    sustained = regions(trailing(horizontal, ms(accel.SUSTAIN_MS)) >= accel.SUSTAINED_G, sm[1], sm[2], 1)
+    spikes = regions(sm[2] > accel.SPINE_SPIKE_G, sm[1], sm[2], ms(accel.SPINE_REFRACTORY_MS))
+    return {
+        "peaks": [float(v[int(np.argmax(np.abs(v)))]) for v in sm],
+        "neck_g": float(trailing(np.abs(x[:, 1]), ms(accel.NECK_MS)).max()),
+        "sustained": [(s, e) for s, e, _, _ in sustained],
+        "spikes": [(s, e) for s, e, _, _ in spikes],
+        "spike_peaks": [(round(a, 3), round(b, 3)) for _, _, a, b in spikes],
+    }
+
+
+def check_reference(samples, fs=1000):
+    ref = reference(samples, fs)
+    proc = AccelProcessor(sample_rate_hz=fs).feed_chunks(iter_chunks(samples, 4999)).finish()
+    events = proc.race_data()["significant_events"]
+    to_ms = 1000.0 / fs
+    got_sustained = [(round(e["timestamp_ms"] / to_ms), round((e["timestamp_ms"] + e["duration_ms"]) / to_ms))
+                     for e in events if e["event_type"] == "SustainedHighG"]
+    spikes = [e for e in events if e["event_type"] == "VerticalCompression"]
+    got_spikes = [(round(e["timestamp_ms"] / to_ms), round((e["timestamp_ms"] + e["duration_ms"]) / to_ms)) for e in spikes]
+    assert got_sustained == ref["sustained"], (len(got_sustained), len(ref["sustained"]))
+    assert got_spikes == ref["spikes"], (len(got_spikes), len(ref["spikes"]))
+    assert [(e["g_forces"]["lateral_peak_g"], e["g_forces"]["vertical_peak_g"]) for e in spikes] == ref["spike_peaks"]
+    assert np.allclose(proc.peaks, ref["peaks"], rtol=0, atol=1e-9)
+    assert abs(proc.peak_neck_g - ref["neck_g"]) < 1e-9
+    print(f"reference OK: {len(samples)} samples, {len(got_sustained)} sustained-G windows, {len(got_spikes)} compression spikes")
+
+
+def check_chunking(samples, meta):
+    docs = [process(iter_chunks(samples, c), meta) for c in (1000, 65536, 1 << 18, len(samples))]
+    with io.BytesIO(samples.tobytes()) as f:
+        docs.append(process(iter_binary(f, chunk=12345), meta))
+    first = json.dumps(docs[0], sort_keys=True)
+    assert all(json.dumps(d, sort_keys=True) == first for d in docs[1:])
+    report = generate_report(docs[0])
+    print(f"chunking OK: identical race_data for 5 chunkings; report severities "
+          f"{[p['severity'] for p in report['priority_recovery_plan']]}")
+    return docs[0]
+
+
+def bench(path, n, meta, chunk):
+    samples = np.memmap(path, dtype=np.float32, mode="r", shape=(n, 3))
+    best = float("inf")
+    for _ in range(3):
+        t0 = time.perf_counter()
+        doc = process(iter_chunks(samples, chunk), meta)
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    process(iter_chunks(samples, chunk), meta)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    est = doc["hpc_race_summary_estimates"]
+    print(f"{n / 60000:.0f} min race ({n} samples x 3, {n * 12 / 2**20:.0f} MiB on disk): {best:.3f}s "
+          f"({n / best / 1e6:.1f} M samples/s), chunk {chunk}, peak traced memory {peak / 2**20:.1f} MiB")
+    print(f"  {len(doc['significant_events'])} events, estimates {est}")
+
+
+def bench_route(samples, meta):
+    import backend
+    client = backend.app.test_client()
+    q = "&".join(f"{k}={v}" for k, v in meta.items())
+    resp = client.post(f"/feedback/accel?{q}", data=samples.tobytes())
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    assert resp.get_json()["race_data"] == json.loads(json.dumps(process(iter_chunks(samples), meta)))
+    assert client.post("/feedback/accel", data=b"\x00" * 13).status_code == 400
+    print("route OK: POST /feedback/accel")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--minutes", type=float, default=95)
+    ap.add_argument("--chunk", type=int, default=accel.CHUNK_SAMPLES)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    meta = {"driver_id": "driver_0", "track_name": "monza", "cockpit_temp_c": 48.0}
+    short = make_race(2, seed=args.seed)
+    check_reference(short)
+    check_chunking(short, meta)
+    bench_route(short[:60000], meta)
+
+    race = make_race(args.minutes, seed=args.seed)
+    path = os.path.join(tempfile.mkdtemp(), "race.f32")
+    race.tofile(path)
+    n = len(race)
+    del race
+    bench(path, n, meta, args.chunk)
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import copy
+import os
+import signal
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch
+from batch import apply_questionnaire, get_pool, parse_batch, pool_size, run_batch, shutdown_pool
+from poc import compute_setup_from_doc
+from synth import make_test_drive_doc
+
+# /dataForConfig/batch backend vs N sequential /dataForConfig-equivalent calls.
+# Each sequential call pays one (simulated) Firestore read; the batch pays one in total.
+# First: a worker killed mid-batch turns its items into ok=false lines, the
+# summary still arrives and the next batch gets a fresh pool.
+#   python backend/benchmarks/bench_batch.py --items 48 --turns 600 --firestore-ms 40
+
+
+def _questionnaire(i):
+    return {
+        "rookie_stability_priority": 0.5 + 0.4 * ((i * 7) % 10) / 10,
+        "steering_weight_preference": ("light", "medium", "heavy")[i % 3],
+        "throttle_pedal_linearity": 0.8,
+        "brake_pedal_linearity": 0.9,
+    }
+
+
+def sequential(doc, questionnaires, firestore_s):
+    t0 = time.perf_counter()
+    for q in questionnaires:
+        time.sleep(firestore_s)
+        compute_setup_from_doc(apply_questionnaire(copy.deepcopy(doc), q))
+    return time.perf_counter() - t0
+
+
+def batched(doc, questionnaires, firestore_s):
+    t0 = time.perf_counter()
+    time.sleep(firestore_s)
+    items = [{"questionnaire": q, "doc": None} for q in questionnaires]
+    recs = list(run_batch(items, doc))
+    summary = recs[-1]["summary"]
+    if summary["failed"]:
+        raise AssertionError(f"{summary['failed']} batch items failed")
+    return time.perf_counter() - t0, summary
+
+
+def check_broken_pool(n_items=24, n_turns=2000):
+    doc = make_test_drive_doc(n_turns, seed=1)
+    items = [{"questionnaire": _questionnaire(i), "doc": None} for i in range(n_items)]
+    pool = get_pool()
+    list(run_batch(items[:1], doc))                     # workers up
+    records = run_batch(items, doc)
+    first = next(records)
+    for pid in list(pool._processes):
+        os.kill(pid, signal.SIGKILL)
+    recs = [first] + list(records)
+    summary = recs[-1]["summary"]
+    assert len(recs) == n_items + 1 and sorted(r["index"] for r in recs[:-1]) == list(range(n_items))
+    assert summary["failed"] > 0 and all("BrokenProcessPool" in r["error"] for r in recs[:-1] if not r["ok"])
+    assert batch._POOL is None
+    again = list(run_batch(items[:4], doc))
+    assert again[-1]["summary"]["failed"] == 0 and batch._POOL is not pool
+    try:
+        parse_batch([{}] * (batch.MAX_ITEMS + 1))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("an oversized batch was accepted")
+    shutdown_pool()
+    print(f"broken pool OK: {summary['failed']}/{n_items} items failed after a worker was killed, "
+          f"summary sent, next batch on a fresh pool; batches over {batch.MAX_ITEMS} items rejected")
+
+
+def run(n_items=48, n_turns=600, firestore_ms=40.0):
+    doc = make_test_drive_doc(n_turns, seed=1)
+    qs = [_questionnaire(i) for i in range(n_items)]
+    fs = firestore_ms / 1e3
+
+    # warm the pool so worker spawn is not billed to the batch
+    list(run_batch([{"questionnaire": qs[0], "doc": None}], doc))
+
+    t_seq = sequential(doc, qs, fs)
+    t_batch, summary = batched(doc, qs, fs)
+    print(f"{n_items} questionnaires x {n_turns} turns, firestore {firestore_ms:.0f} ms, {pool_size()} workers")
+    print(f"  sequential route calls: {t_seq * 1e3:9.1f} ms  ({n_items / t_seq:7.1f} req/s)")
+    print(f"  batch endpoint        : {t_batch * 1e3:9.1f} ms  ({n_items / t_batch:7.1f} req/s)  x{t_seq / t_batch:.1f}")
+    print(f"  per-item latency p50 {summary['latency_ms_p50']:.1f} ms, max {summary['latency_ms_max']:.1f} ms")
+    shutdown_pool()
+    return {"sequential_s": t_seq, "batch_s": t_batch, "summary": summary}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=48)
+    ap.add_argument("--turns", type=int, default=600)
+    ap.add_argument("--firestore-ms", type=float, default=40.0)
+    a = ap.parse_args()
+    check_broken_pool()
+    run(a.items, a.turns, a.firestore_ms)
@@ -0,0 +1,134 @@
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doc_cache import DocCache
+from fake_firestore import FakeFirestore
+from poc import DEMO_DOC
+from schema import SchemaError
+
+# DocCache against the in-process fake Firestore: behaviour checks
+# (TTL, LRU, snapshot invalidation, copy isolation), single-flight misses
+# (shared reads, per-joiner exceptions, the join timeout) and read latency.
+#   python backend/benchmarks/bench_doc_cache.py
+
+
+class _Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def check_behaviour():
+    db = FakeFirestore()
+    db.collection("test_drive").document("a").set(DEMO_DOC)
+    clock = _Clock()
+    cache = DocCache(db, ttl_s=10.0, max_entries=2, clock=clock)
+    cache.watch("test_drive")
+
+    d1 = cache.first_doc("test_drive")
+    d1["metadata"]["track"] = "mutated"
+    d2 = cache.first_doc("test_drive")
+    assert d2["metadata"]["track"] == DEMO_DOC["metadata"]["track"], "cache handed out a shared copy"
+    assert (cache.hits, cache.misses, db.reads) == (1, 1, 1)
+
+    clock.t = 11.0                                   # TTL expiry
+    cache.first_doc("test_drive")
+    assert (cache.misses, db.reads) == (2, 2)
+
+    changed = dict(DEMO_DOC, metadata=dict(DEMO_DOC["metadata"], track="cota_v2"))
+    db.collection("test_drive").document("a").set(changed)   # snapshot listener fires
+    assert cache.first_doc("test_drive")["metadata"]["track"] == "cota_v2"
+    assert cache.invalidations == 1
+
+    cache.get("x", 1, lambda: 1)
+    cache.get("y", 1, lambda: 2)                     # evicts test_drive (LRU)
+    assert cache.evictions == 1 and cache.stats()["entries"] == 2
+    cache.close()
+    print("doc cache behaviour OK")
+
+
+def _joiners(cache, n, loader):
+    """n concurrent gets of one key: (results, exceptions) by thread."""
+    out, errors = [None] * n, [None] * n
+
+    def run(i):
+        try:
+            out[i] = cache.get("test_drive", "k", loader)
+        except Exception as exc:
+            errors[i] = exc
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return out, errors
+
+
+def check_single_flight(n=8):
+    calls = []
+
+    def slow(value, error=None, seconds=0.2):
+        def load():
+            calls.append(1)
+            time.sleep(seconds)
+            if error is not None:
+                raise error
+            return value
+        return load
+
+    cache = DocCache(FakeFirestore())
+    out, _ = _joiners(cache, n, slow({"a": [1]}))
+    assert len(calls) == 1 and all(o == {"a": [1]} for o in out) and len({id(o) for o in out}) == n
+    assert cache.joined == n - 1
+
+    calls.clear()
+    cache.invalidate()
+    _, errors = _joiners(cache, n, slow(None, SchemaError("turns[2].balance", "missing")))
+    assert len(calls) == 1 and len({id(e) for e in errors}) == n, "joiners share one exception instance"
+    leader = next(e for e in errors if e.__cause__ is None)
+    for e in errors:
+        assert type(e) is SchemaError and (e.path, str(e)) == (leader.path, str(leader))
+        assert e is leader or e.__cause__ is leader
+
+    calls.clear()
+    cache = DocCache(FakeFirestore(), join_timeout_s=0.05)
+    t0 = time.perf_counter()
+    out, _ = _joiners(cache, 3, slow({"b": 2}, seconds=1.0))
+    assert len(calls) == 3 and cache.join_timeouts == 2 and all(o == {"b": 2} for o in out)
+    assert time.perf_counter() - t0 < 1.9, "joiners waited for the stuck load"
+    print(f"single flight OK: {n} concurrent misses, one read; each joiner raises its own chained copy; "
+          "a joiner past join_timeout_s reads for itself")
+
+
+def measure(latency_ms=40.0, n=50):
+    db = FakeFirestore(latency_s=latency_ms / 1e3)
+    db.collection("test_drive").document("a").set(DEMO_DOC)
+
+    def direct():
+        return list(db.collection("test_drive").limit(1).stream())[0].to_dict()
+
+    cache = DocCache(db)
+    rows = {}
+    for name, fn in (("uncached", direct), ("cached", lambda: cache.first_doc("test_drive"))):
+        samples = []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - t0) * 1e3)
+        rows[name] = statistics.median(samples)
+        print(f"  {name:9s} p50 {rows[name]:8.3f} ms")
+    print(f"  {cache.stats()}")
+    return rows
+
+
+if __name__ == "__main__":
+    check_behaviour()
+    check_single_flight()
+    measure()
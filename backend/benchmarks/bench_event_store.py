@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_fleet_health import make_season
+from event_store import EVENT_COLUMNS, EventStore, EventStoreWriter, ingest
+from fleet_health import FleetTable, fleet_report
+from health import generate_report
+
+# Columnar event store: ingest a season, reopen it memory-mapped, and check
+# that stored races report exactly like generate_report on the source docs,
+# that fleet scoring from the store equals scoring the docs, that slices are
+# views of the mapped files, and that re-ingest / an interrupted ingest /
+# concurrent ingests are safe. Then time each path.
+#   python backend/benchmarks/bench_event_store.py
+#   python backend/benchmarks/bench_event_store.py --drivers 20 --races 100 --events 500
+
+
+def check_store(docs, root):
+    with EventStoreWriter(root) as w:
+        w.extend(docs[: len(docs) // 2])
+    with EventStoreWriter(root) as w:                   # re-ingest: known ids are skipped
+        w.extend(docs)
+    store = EventStore.open(root)
+    assert store.race_ids == [rid for rid, _ in docs]
+    assert store.n_events == sum(len(r["significant_events"]) for _, r in docs)
+
+    for rid, race in docs:
+        assert json.dumps(store.report(rid)) == json.dumps(generate_report(race)), rid
+        ev = store.race(rid)
+        assert [e["event_type"] for e in race["significant_events"]] == ev.event_types
+        assert ev.timestamp_ms.tolist() == [e["timestamp_ms"] for e in race["significant_events"]]
+        assert isinstance(ev.lateral_peak_g.base, np.memmap) or not len(ev), rid   # a view, not a copy
+
+    want = fleet_report(FleetTable().extend(docs))
+    got = fleet_report(FleetTable().extend_store(store))
+    for w_row, g_row in zip(want["races"], got["races"]):
+        assert json.dumps(w_row) == json.dumps(g_row), w_row["id"]
+    assert json.dumps(want["trends"]) == json.dumps(got["trends"])
+    print(f"store parity OK: {len(docs)} races, {store.n_events} events; reports and fleet trends identical")
+
+
+def check_interrupted(docs, root):
+    with EventStoreWriter(root) as w:
+        w.extend(docs[:3])
+    committed = EventStore.open(root)
+    w = EventStoreWriter(root)
+    w.extend(docs[3:6])
+    for f in w._files.values():                       # bytes on disk, manifest never replaced
+        f.flush()
+    w.close()
+    assert EventStore.open(root).race_ids == committed.race_ids
+    with EventStoreWriter(root) as w:                   # the next ingest cuts the orphan bytes back
+        w.extend(docs[3:6])
+    store = EventStore.open(root)
+    assert store.race_ids == [rid for rid, _ in docs[:6]]
+    for name in EVENT_COLUMNS:
+        assert os.path.getsize(os.path.join(root, f"{name}.bin")) == store.n_events * np.dtype(EVENT_COLUMNS[name]).itemsize
+    for rid, race in docs[:6]:
+        assert store.report(rid) == generate_report(race)
+    print("interrupted ingest OK: uncommitted races are invisible and cut back on the next ingest")
+
+
+def check_concurrent(docs, root, writers=4):
+    parts = [docs[i::writers] for i in range(writers)]
+    start = threading.Barrier(writers)
+
+    def run(part):
+        start.wait()
+        ingest(root, iter([part[: len(part) // 2], part[len(part) // 2:]]))
+    threads = [threading.Thread(target=run, args=(p,)) for p in parts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    store = EventStore.open(root)
+    assert sorted(store.race_ids) == sorted(rid for rid, _ in docs)
+    for rid, race in docs:
+        assert store.report(rid) == generate_report(race), rid
+    print(f"concurrent ingest OK: {writers} writers into one store serialised on the lock, every race intact")
+
+
+def _best(fn, rounds=3):
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench(docs, root):
+    t0 = time.perf_counter()
+    with EventStoreWriter(root) as w:
+        w.extend(docs)
+    t_ingest = time.perf_counter() - t0
+    store = EventStore.open(root)
+    t_open = _best(lambda: EventStore.open(root))
+    ids = store.race_ids
+    t_reports_store = _best(lambda: [store.report(r) for r in ids])
+    t_reports_docs = _best(lambda: [generate_report(race) for _, race in docs])
+    t_fleet_store = _best(lambda: fleet_report(FleetTable().extend_store(EventStore.open(root)), reports=False))
+    t_fleet_docs = _best(lambda: fleet_report(FleetTable().extend(docs), reports=False))
+    size = sum(os.path.getsize(os.path.join(root, n)) for n in os.listdir(root))
+    print(f"{len(docs)} races, {store.n_events} events, {size / 2**20:.1f} MiB on disk")
+    print(f"  ingest {t_ingest:.3f}s, open {t_open * 1e3:.1f} ms")
+    print(f"  every report:  store {t_reports_store:.3f}s   event dicts {t_reports_docs:.3f}s")
+    print(f"  fleet scoring: store {t_fleet_store:.3f}s   event dicts {t_fleet_docs:.3f}s")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--drivers", type=int, default=20)
+    ap.add_argument("--races", type=int, default=100)
+    ap.add_argument("--events", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    small = make_season(5, 8, 30, args.seed)
+    small[3][1]["significant_events"] = []                          # a race with no events
+    small[4][1]["significant_events"][2]["g_forces"] = {}           # missing peaks default to 0
+    check_store(small, os.path.join(tmp, "parity"))
+    check_interrupted(small, os.path.join(tmp, "interrupted"))
+    check_concurrent(small, os.path.join(tmp, "concurrent"))
+    bench(make_season(args.drivers, args.races, args.events, args.seed), os.path.join(tmp, "bench"))
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fleet_health import TOP_SEVERITY, FleetTable, fleet_report
+from health import generate_report
+from synth import make_race_data
+
+# Fleet-wide health scoring: every per-race report equals generate_report on
+# the same doc, the rolling per-driver trends equal a plain Python window over
+# each driver's races, and the whole season scores in seconds.
+#   python backend/benchmarks/bench_fleet_health.py
+#   python backend/benchmarks/bench_fleet_health.py --drivers 20 --races 100 --events 200
+
+
+def make_season(n_drivers, n_races, n_events, seed=0):
+    """(race_id, race_data) for every driver's races, interleaved and out of time order."""
+    docs = []
+    for r in range(n_races):
+        for d in range(n_drivers):
+            race = make_race_data(n_events, seed + 7919 * d + r)
+            race["driver_id"] = f"driver_{d:03d}"
+            race["race_date"] = f"2026-{1 + (r * 37) % 12:02d}-{1 + (r * 11) % 28:02d}T{r % 24:02d}:00:00Z"
+            docs.append((f"race_{d:03d}_{r:04d}", race))
+    return docs
+
+
+def naive_trends(docs, window):
+    """Reference: group by driver, sort by race time, sum()/max() over each trailing slice."""
+    from multi_session import epoch
+    rows = {}
+    for i, (race_id, race) in enumerate(docs):
+        rep = generate_report(race)
+        est = race["hpc_race_summary_estimates"]
+        events = race["significant_events"]
+        lat = max((abs(e["g_forces"]["lateral_peak_g"]) for e in events), default=0)
+        vert = max((abs(e["g_forces"]["vertical_peak_g"]) for e in events), default=0)
+        rows.setdefault(race["driver_id"], []).append((epoch(race["race_date"]), i, race_id, {
+            "neck_load_kg_sum": est["peak_neck_load_equivalent_kg"],
+            "fluid_loss_l_mean": est["estimated_total_fluid_loss_l"],
+            "spinal_compression_events_sum": est["cumulative_spinal_compression_events"],
+            "high_g_duration_ms_sum": sum(e.get("duration_ms", 0) for e in events if e.get("event_type") == "SustainedHighG"),
+            "peak_lateral_g_max": lat,
+            "peak_vertical_g_max": vert,
+            "high_severity_count": sum(p["severity"] == "High" for p in rep["priority_recovery_plan"]),
+        }))
+    out = {}
+    for driver, races in rows.items():
+        races.sort(key=lambda r: (r[0], r[1]))
+        series = {}
+        for name in races[0][3]:
+            vals = [r[3][name] for r in races]
+            win = [vals[max(0, k - window + 1):k + 1] for k in range(len(vals))]
+            if name.endswith("_max"):
+                series[name] = [float(max(w)) for w in win]
+            elif name.endswith("_mean"):
+                series[name] = [sum(w, 0.0) / len(w) for w in win]
+            else:
+                series[name] = [float(sum(w, 0.0)) for w in win]
+        out[driver] = ([r[2] for r in races], series)
+    return out
+
+
+def check_parity(docs, window):
+    result = fleet_report(FleetTable().extend(docs), window=window)
+    for (race_id, race), row in zip(docs, result["races"]):
+        assert row["id"] == race_id
+        assert json.dumps(row["report"]) == json.dumps(generate_report(race)), race_id
+    for area, top in result["summary"]["top_severity"].items():
+        assert top["level"] == TOP_SEVERITY[area]
+        assert top["races"] == sum(row["severity"][area] == top["level"] for row in result["races"]), area
+    want = naive_trends(docs, window)
+    assert set(want) == set(result["trends"])
+    for driver, (races, series) in want.items():
+        got = result["trends"][driver]
+        assert got["races"] == races, driver
+        for name, values in series.items():
+            assert got["series"][name] == values, (driver, name)
+    print(f"fleet parity OK: {len(docs)} reports identical to generate_report, "
+          f"{len(want)} drivers' trends identical to a plain window (window={window})")
+
+
+def check_skips(docs):
+    bad = [("bad_events", dict(docs[0][1], significant_events={})), ("bad_meta", {"hpc_race_summary_estimates": []})]
+    result = fleet_report(FleetTable().extend(docs[:5] + bad))
+    assert result["summary"]["races"] == 5 and [s["id"] for s in result["summary"]["skipped"]] == ["bad_events", "bad_meta"]
+    print("skips OK: malformed docs are reported, not fatal")
+
+
+def bench(docs, window):
+    t0 = time.perf_counter()
+    table = FleetTable().extend(docs)
+    t1 = time.perf_counter()
+    fleet_report(table, window=window, reports=False)
+    t2 = time.perf_counter()
+    fleet_report(table, window=window)
+    t3 = time.perf_counter()
+    for _, race in docs:
+        generate_report(race)
+    t4 = time.perf_counter()
+    n_events = int(table.column("events").sum())
+    print(f"{len(docs)} races, {n_events} events: decode+fold {t1 - t0:.3f}s, "
+          f"score+trends {t2 - t1:.3f}s, with reports {t3 - t1:.3f}s "
+          f"(generate_report per doc: {t4 - t3:.3f}s, no trends)")
+
+
+def bench_route(docs, window):
+    docs = docs[:400]         # the stand-in deep-copies every doc it streams; that, not scoring, dominates here
+    tmp = tempfile.mkdtemp()
+    seed_path = os.path.join(tmp, "seed.json")
+    with open(seed_path, "w") as f:
+        json.dump({"race_data": dict(docs)}, f)
+    os.environ["FIRESTORE_STANDIN"] = seed_path
+    import backend
+    client = backend.app.test_client()
+    t0 = time.perf_counter()
+    resp = client.get(f"/feedback/fleet?window={window}&reports=0")
+    t1 = time.perf_counter()
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    body = resp.get_json()
+    assert body["summary"]["races"] == len(docs)
+    one = client.get("/feedback/fleet?driver=driver_000").get_json()
+    assert set(one["trends"]) == {"driver_000"}
+    assert client.get("/feedback/fleet?window=0").status_code == 400
+    os.environ["EVENT_STORE_DIR"] = tmp                             # nothing ingested there
+    assert client.get("/feedback/fleet?source=store").status_code == 404
+    print(f"route OK: GET /feedback/fleet over {len(docs)} docs in {t1 - t0:.3f}s (stand-in reads included)")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--drivers", type=int, default=20)
+    ap.add_argument("--races", type=int, default=100)
+    ap.add_argument("--events", type=int, default=200)
+    ap.add_argument("--window", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--skip-route", action="store_true")
+    args = ap.parse_args()
+
+    check_parity(make_season(6, 12, 40, args.seed), args.window)
+    check_parity(make_season(3, 4, 0, args.seed), 1)
+    docs = make_season(args.drivers, args.races, args.events, args.seed)
+    check_skips(docs)
+    bench(docs, args.window)
+    if not args.skip_route:
+        bench_route(docs, args.window)
+
+
+if __name__ == "__main__":
+    main()
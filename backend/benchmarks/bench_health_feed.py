@@ -0,0 +1,121 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from health import generate_report
+from health_feed import HealthFeed
+from synth import make_race_data
+
+# Fan-out load test for the live health feed. A local generator thread
+# publishes race events in bursts; hundreds of async subscribers (one event
+# loop, one thread) plus a few deliberately slow ones consume the feed.
+# Latency is receive time minus publish time of the version delivered.
+#   python backend/benchmarks/bench_health_feed.py --subscribers 500 --slow 20
+
+
+def generate(feed, race, bursts, burst_size, gap_s):
+    events = race["significant_events"]
+    for b in range(bursts):
+        for ev in events[b * burst_size:(b + 1) * burst_size]:
+            feed.publish(ev)
+        time.sleep(gap_s)
+
+
+async def subscriber(feed, lat, got, slow_s):
+    async for version, published_at, state in feed.updates():
+        lat.append(time.monotonic() - published_at)
+        got.append(state)
+        if slow_s:
+            await asyncio.sleep(slow_s)
+
+
+async def run_async(args, feed, race):
+    lats = [[] for _ in range(args.subscribers + args.slow)]
+    gots = [[] for _ in lats]
+    tasks = [
+        asyncio.create_task(subscriber(feed, lats[i], gots[i], args.slow_s if i >= args.subscribers else 0.0))
+        for i in range(len(lats))
+    ]
+    await asyncio.sleep(0.05)
+    t0 = time.perf_counter()
+    gen = asyncio.create_task(asyncio.to_thread(generate, feed, race, args.bursts, args.burst_size, args.gap_s))
+    await asyncio.sleep(0.1)
+    threads_during = threading.active_count()     # main + the generator, regardless of subscriber count
+    await gen
+    wall = time.perf_counter() - t0
+    await asyncio.sleep(args.slow_s + 2 * feed.min_interval_s + 0.1)   # let everyone catch up
+    feed.close()
+    await asyncio.gather(*tasks)
+    return lats, gots, threads_during, wall
+
+
+def sync_check(feed_interval, race, n_threads=20):
+    """The WSGI generator: blocking subscribers must converge on the final state too."""
+    feed = HealthFeed(min_interval_s=feed_interval)
+    last = [None] * n_threads
+
+    def consume(i):
+        for msg in feed.stream():
+            last[i] = msg
+
+    threads = [threading.Thread(target=consume, args=(i,)) for i in range(n_threads)]
+    for t in threads:
+        t.start()
+    feed.reset({k: v for k, v in race.items() if k != "significant_events"})
+    feed.publish_many(race["significant_events"])
+    time.sleep(3 * feed_interval + 0.1)
+    feed.close()
+    for t in threads:
+        t.join()
+    expected = generate_report(race)
+    for m in last:
+        assert m is not None and json.loads(m.split(b"\ndata: ")[1])["report"] == expected, "sync subscriber is stale"
+    print(f"sync stream OK: {n_threads} blocking subscribers converged on version {feed.state()[0]}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--subscribers", type=int, default=500)
+    ap.add_argument("--slow", type=int, default=20, help="extra subscribers that take --slow-s per message")
+    ap.add_argument("--slow-s", type=float, default=0.5)
+    ap.add_argument("--bursts", type=int, default=40)
+    ap.add_argument("--burst-size", type=int, default=250)
+    ap.add_argument("--gap-s", type=float, default=0.05)
+    ap.add_argument("--interval", type=float, default=0.05, help="HealthFeed.min_interval_s")
+    args = ap.parse_args()
+
+    race = make_race_data(args.bursts * args.burst_size, seed=7)
+    meta = {k: v for k, v in race.items() if k != "significant_events"}
+    feed = HealthFeed(meta, min_interval_s=args.interval)
+    threads_before = threading.active_count()
+    lats, gots, threads_during, wall = asyncio.run(run_async(args, feed, race))
+
+    expected = generate_report(race)
+    final_version = feed.state()[0] - 1          # close() bumps once more
+    assert all(g and g[-1]["report"] == expected for g in gots), "a subscriber missed the final state"
+    fast = np.concatenate([l for l in lats[:args.subscribers]]) * 1e3
+    slow_msgs = [len(g) for g in gots[args.subscribers:]]
+    fast_msgs = [len(g) for g in gots[:args.subscribers]]
+
+    n_events = len(race["significant_events"])
+    print(f"{n_events} events in {args.bursts} bursts over {wall:.2f}s -> {final_version} versions")
+    print(f"subscribers: {args.subscribers} + {args.slow} slow, threads {threads_before} -> {threads_during} while streaming")
+    print(f"fan-out latency ms: p50 {np.percentile(fast, 50):.2f}  p99 {np.percentile(fast, 99):.2f}  max {fast.max():.2f}")
+    print(f"messages per subscriber: fast median {int(np.median(fast_msgs))}, slow median {int(np.median(slow_msgs or [0]))} "
+          f"(coalesced from {final_version} versions)")
+    print("final state: every subscriber matches generate_report")
+
+    sync_check(args.interval, make_race_data(2000, seed=8))
+
+
+if __name__ == "__main__":
+    main()
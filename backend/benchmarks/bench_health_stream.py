@@ -0,0 +1,52 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from health import HealthAccumulator, generate_report
+from synth import iter_race_events, make_race_data
+
+# Streaming health report: the final snapshot must equal the batch report,
+# every prefix snapshot must equal the batch report of that prefix, and
+# memory must stay flat as the event count grows.
+#   python backend/benchmarks/bench_health_stream.py
+
+
+def check_parity(seeds=range(10), n_events=400):
+    for seed in seeds:
+        race = make_race_data(n_events, seed)
+        events = race["significant_events"]
+        acc = HealthAccumulator(race)
+        for i, ev in enumerate(events):
+            acc.add(ev)
+            if i % 37 == 0:
+                prefix = dict(race, significant_events=events[:i + 1])
+                assert acc.snapshot() == generate_report(prefix), f"prefix {i} (seed {seed})"
+        assert acc.snapshot() == generate_report(race), f"final snapshot (seed {seed})"
+
+        meta = {k: v for k, v in race.items() if k != "significant_events"}
+        lines = [json.dumps({"race_data": meta})] + [json.dumps(e) for e in events]
+        assert HealthAccumulator().feed_ndjson(lines).snapshot() == generate_report(race), "ndjson"
+    print(f"health stream parity OK: {len(seeds)} races x {n_events} events")
+
+
+def measure(counts=(10_000, 100_000, 1_000_000)):
+    for n in counts:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        acc = HealthAccumulator(make_race_data(0)).extend(iter_race_events(n, seed=3))
+        report = acc.snapshot()
+        dt = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert acc.events_seen == n and report["key_metrics"]
+        print(f"{n:>9} events: {n / dt:>10.0f} events/s  peak traced memory {peak / 1024:7.1f} KiB")
+
+
+if __name__ == "__main__":
+    check_parity()
+    measure()
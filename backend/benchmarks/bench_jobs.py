@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from jobs import DONE, FAILED, RUNNING, JobQueue, QueueFull
+from poc import DEMO_DOC
+from synth import make_race_data, make_test_drive_doc
+
+# Job queue: identical submits while a job is in flight collapse into it;
+# a full queue rejects instead of growing; wait() long-polls; failures and
+# expiry behave. Then the /jobs routes against the Firestore stand-in, and
+# bursts of identical /dataForConfig requests served synchronously vs
+# through the queue, a new session per burst (Firestore reads, computations
+# run, wall time, latency). Each computation is held until every request of
+# its burst has arrived (sync: reached the computation; jobs: been accepted),
+# so every burst lands within one computation and the counts are exact:
+# sync runs clients x bursts computations, the queue runs one per burst.
+# The queue saves computations, not latency: a joined request still waits
+# for the whole job plus the long-poll round trip.
+#   python backend/benchmarks/bench_jobs.py
+#   python backend/benchmarks/bench_jobs.py --turns 3000 --bursts 5 --clients 16
+
+
+def _concurrently(n, fn):
+    out = [None] * n
+    start = threading.Barrier(n)
+
+    def run(i):
+        start.wait()
+        out[i] = fn(i)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return out
+
+
+def check_single_flight(n=40):
+    q = JobQueue(workers=2)
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.05)
+        return "result"
+    submitted = _concurrently(n, lambda i: q.submit("test", "same-key", work))
+    ids = {job.id for job, _ in submitted}
+    assert len(ids) == 1 and sum(joined for _, joined in submitted) == n - 1, (ids, submitted)
+    job = q.wait(ids.pop(), 5)
+    assert job.state == DONE and job.result == "result" and len(calls) == 1 and job.joined == n - 1
+    again, joined = q.submit("test", "same-key", work)                 # finished: a new job, not a stale join
+    assert not joined and again.id != job.id
+    q.close()
+    print(f"single flight OK: {n} concurrent identical submits ran once")
+
+
+def check_backpressure():
+    q = JobQueue(workers=1, max_pending=2)
+    gate = threading.Event()
+    first, _ = q.submit("test", "a", gate.wait)
+    while q.get(first.id).state != RUNNING:
+        time.sleep(0.001)
+    q.submit("test", "b", lambda: "b")
+    q.submit("test", "c", lambda: "c")
+    try:
+        q.submit("test", "d", lambda: "d")
+    except QueueFull:
+        pass
+    else:
+        raise AssertionError("a full queue accepted a job")
+    joined, dup = q.submit("test", "b", lambda: "b")                    # joining an in-flight job is always allowed
+    assert dup
+    gate.set()
+    assert q.wait(joined.id, 5).state == DONE
+    d, _ = q.submit("test", "d", lambda: "d")
+    assert q.wait(d.id, 5).result == "d"
+    assert q.stats()["rejected"] == 1
+    q.close()
+    print("backpressure OK: the queue rejects past max_pending and accepts again once drained")
+
+
+def check_long_poll_and_expiry():
+    now = [0.0]
+    q = JobQueue(workers=1, keep_s=10.0, clock=lambda: now[0])
+    gate = threading.Event()
+    job, _ = q.submit("test", "slow", gate.wait)
+    t0 = time.perf_counter()
+    assert q.wait(job.id, 0.05).state in ("queued", RUNNING)
+    assert 0.04 <= time.perf_counter() - t0 < 1.0
+    threading.Timer(0.05, gate.set).start()
+    t0 = time.perf_counter()
+    assert q.wait(job.id, 10).state == DONE
+    assert time.perf_counter() - t0 < 1.0                               # woken, not timed out
+
+    bad, _ = q.submit("test", "boom", lambda: 1 / 0)
+    bad = q.wait(bad.id, 5)
+    assert bad.state == FAILED and bad.error.startswith("ZeroDivisionError")
+    retry, joined = q.submit("test", "boom", lambda: "ok")
+    assert not joined and q.wait(retry.id, 5).result == "ok"
+
+    now[0] = 11.0
+    assert q.get(job.id) is None and q.wait(job.id, 1) is None
+    q.close()
+    print("long poll OK: wait() wakes on completion and times out when asked; failed jobs free their key; finished jobs expire")
+
+
+def _backend(seed_docs):
+    tmp = tempfile.mkdtemp()
+    seed_path = os.path.join(tmp, "seed.json")
+    with open(seed_path, "w") as f:
+        json.dump(seed_docs, f)
+    os.environ["FIRESTORE_STANDIN"] = seed_path
+    import backend
+    return backend
+
+
+def check_route(backend, race):
+    client = backend.app.test_client()
+    q = {"rookie_stability_priority": 0.7, "steering_weight_preference": "light",
+         "throttle_pedal_linearity": 0.6, "brake_pedal_linearity": 0.5}
+    resp = client.post("/jobs/dataForConfig", json=q)
+    assert resp.status_code == 202 and resp.headers["Location"].startswith("/jobs/"), resp.get_json()
+    got = client.get(resp.headers["Location"] + "?wait=10")
+    assert got.status_code == 200 and got.headers["X-Job-Id"] == resp.get_json()["job_id"]
+    sync = client.post("/dataForConfig", json=q)
+    assert got.get_json() == sync.get_json() and got.headers["ETag"] == sync.headers["ETag"]
+
+    resp = client.post("/jobs/feedback")
+    got = client.get(resp.headers["Location"] + "?wait=10")
+    from health import generate_report
+    assert got.status_code == 200 and got.get_json() == json.loads(json.dumps(generate_report(race)))
+    assert got.get_json() == client.get("/feedback").get_json()       # same bare report body as the sync route
+
+    assert client.get("/jobs/nope").status_code == 404
+    assert client.get(resp.headers["Location"] + "?wait=x").status_code == 400
+    assert client.post("/jobs/dataForConfig", json={"rookie_stability_priority": "high"}).status_code == 400
+    assert "jobs" in client.get("/cacheStats").get_json()
+    print("route OK: POST /jobs/dataForConfig, POST /jobs/feedback, GET /jobs/<id>?wait=S")
+
+
+def bench(backend, n_turns, bursts, clients, latency_ms=20, seed=0):
+    """Each burst: a new session lands in Firestore, then `clients` identical requests arrive together."""
+    from firestore_client import get_client
+    import setup_plan
+    db = get_client()
+    db.latency_s = latency_ms / 1000
+    sessions = [make_test_drive_doc(n_turns, seed=seed + b) for b in range(bursts)]
+    answers = {"rookie_stability_priority": 0.6, "steering_weight_preference": "medium",
+               "throttle_pedal_linearity": 0.6, "brake_pedal_linearity": 0.5}
+    computed = []
+    compute = setup_plan.PLANS.compute
+    burst = threading.Condition()
+    arrived = [0]
+
+    def arrive():
+        with burst:
+            arrived[0] += 1
+            burst.notify_all()
+
+    def counting(*a, **kw):
+        computed.append(1)
+        if mode == "sync":
+            arrive()
+        with burst:
+            assert burst.wait_for(lambda: arrived[0] >= clients, 60), "the burst never arrived"
+        return compute(*a, **kw)
+
+    def sync_request(_):
+        t0 = time.perf_counter()
+        resp = backend.app.test_client().post("/dataForConfig", json=answers)
+        assert resp.status_code == 200
+        return time.perf_counter() - t0
+
+    def job_request(_):
+        t0 = time.perf_counter()
+        c = backend.app.test_client()
+        resp = c.post("/jobs/dataForConfig", json=answers)
+        assert resp.status_code == 202, resp.get_json()
+        arrive()
+        resp = c.get(resp.headers["Location"] + "?wait=60")
+        assert resp.status_code == 200
+        return time.perf_counter() - t0
+
+    print(f"{'mode':>5} {'requests':>9} {'reads':>6} {'computed':>9} {'wall s':>7} {'p50 ms':>8} {'p95 ms':>8}")
+    setup_plan.PLANS.compute = counting
+    try:
+        for mode, request in (("sync", sync_request), ("jobs", job_request)):
+            computed.clear()
+            reads = db.reads
+            latencies = []
+            t0 = time.perf_counter()
+            for doc in sessions:
+                db.collection("test_drive").document("td").set(doc)
+                backend.docs.invalidate("test_drive")
+                backend.results._mem.clear()
+                setup_plan.PLANS.clear()
+                arrived[0] = 0
+                latencies += _concurrently(clients, request)
+            wall = time.perf_counter() - t0
+            lat = np.array(latencies) * 1e3
+            print(f"{mode:>5} {len(lat):>9} {db.reads - reads:>6} {len(computed):>9} {wall:>7.2f} "
+                  f"{np.percentile(lat, 50):>8.1f} {np.percentile(lat, 95):>8.1f}")
+            assert len(computed) == (clients if mode == "sync" else 1) * bursts, (mode, len(computed))
+    finally:
+        setup_plan.PLANS.compute = compute
+    stats = backend.jobs.stats()
+    print(f"jobs: {stats['submitted']} submitted, {stats['deduplicated']} joined an in-flight job, {stats['rejected']} rejected")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=2000)
+    ap.add_argument("--bursts", type=int, default=5)
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--latency-ms", type=float, default=20)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    check_single_flight()
+    check_backpressure()
+    check_long_poll_and_expiry()
+    race = make_race_data(300, seed=1)
+    backend = _backend({"test_drive": {"td": DEMO_DOC}, "race_data": {"rd": race}})
+    check_route(backend, race)
+    bench(backend, args.turns, args.bursts, args.clients, args.latency_ms, args.seed)
+
+
+if __name__ == "__main__":
+    main()
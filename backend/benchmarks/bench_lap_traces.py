@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lap_traces import LapTraces, build_test_drive_doc, extract_turns
+from poc import DEMO_DOC, build_preferences_from_doc, compute_setup_from_doc
+from synth import make_lap_traces, make_track_turns
+
+# Turn metrics from lap traces: synthetic laps carry a known oversteer index
+# per turn phase and known locking / traction-loss levels; the extracted
+# turns must recover them, resampling per-lap distances must agree with the
+# common-grid path, and the built doc must run through compute_setup_from_doc.
+#   python backend/benchmarks/bench_lap_traces.py
+#   python backend/benchmarks/bench_lap_traces.py --laps 50 200 1000 --turns 20
+
+
+PHASES = ("entry_oversteer_index", "mid_oversteer_index", "exit_oversteer_index")
+
+
+def check_recovery(n_turns=16, n_laps=40, seed=0):
+    turns = make_track_turns(n_turns, seed=seed)
+    s, ch, truth = make_lap_traces(turns, n_laps, seed=seed)
+    out = extract_turns(LapTraces(s, ch), turns)
+    got = {
+        "oversteer": np.array([[t["balance"][k] for k in PHASES] for t in out]),
+        "lock_front": np.array([t["braking"]["brake_locking_risk_front"] for t in out]),
+        "lock_rear": np.array([t["braking"]["brake_locking_risk_rear"] for t in out]),
+        "traction": np.array([t["traction"]["traction_loss_index"] for t in out]),
+        "surface": np.array([[t["tyre"]["surface_temp_c"][c] for c in ("fl", "fr", "rl", "rr")] for t in out]),
+        "v_apex": np.array([t["kinematics"]["v_apex_kmh"] for t in out]),
+        "porpoising": np.array([t["aero_ride"]["porpoising_amplitude_mm"] for t in out]),
+    }
+    tolerance = {"oversteer": 0.03, "lock_front": 0.02, "lock_rear": 0.02, "traction": 0.02,
+                 "surface": 0.5, "v_apex": 2.0, "porpoising": 0.1}
+    for key, tol in tolerance.items():
+        err = float(np.abs(got[key] - truth[key]).max())
+        assert err <= tol, (key, err)
+    spread = np.array([t["lap_stats"]["std"]["balance.mid_oversteer_index"] for t in out])
+    assert np.all((spread > 0.01) & (spread < 0.03)), spread           # the 0.02 lap-to-lap jitter put in
+    print(f"recovery OK: {n_turns} turns x {n_laps} laps; balance, locking, traction, temps, apex speed, porpoising within tolerance")
+
+
+def check_resampled(n_turns=8, n_laps=6, seed=1):
+    """Per-lap distance samples (offset, jittered) resample onto the grid and give the same turns."""
+    turns = make_track_turns(n_turns, seed=seed)
+    s, ch, _ = make_lap_traces(turns, n_laps, step_m=0.5, seed=seed)
+    rng = np.random.default_rng(seed)
+    laps = []
+    for i in range(n_laps):
+        keep = np.sort(rng.choice(len(s), len(s) // 2, replace=False))
+        keep = np.union1d(keep, [0, len(s) - 1])
+        laps.append({"distance_m": s[keep].tolist(), **{k: v[i, keep].tolist() for k, v in ch.items()}})
+    fine = extract_turns(LapTraces(s, ch), turns)
+    resampled = extract_turns(LapTraces.from_laps(laps, step_m=0.5), turns)
+    for a, b in zip(fine, resampled):
+        for k in PHASES:
+            assert abs(a["balance"][k] - b["balance"][k]) < 0.02, (a["turn_id"], k)
+    print(f"resampling OK: {n_laps} laps with their own distance samples match the common-grid extraction")
+
+
+def check_doc(seed=0):
+    turns = make_track_turns(12, seed=seed)
+    s, ch, _ = make_lap_traces(turns, 10, seed=seed)
+    doc = build_test_drive_doc(DEMO_DOC, LapTraces(s, ch), turns)
+    result = compute_setup_from_doc(doc, build_preferences_from_doc(doc))
+    assert len(result["diagnostics"]["per_turn_weights"]) == len(turns)
+    assert result["diagnostics"]["aggregated_move"]
+    print(f"doc OK: compute_setup_from_doc accepts the extracted doc ({len(result['diagnostics']['aggregated_move'])} settings moved)")
+
+
+def bench(lap_counts, n_turns, seed=0):
+    turns = make_track_turns(n_turns, seed=seed)
+    print(f"{'laps':>6} {'points/lap':>11} {'extract ms':>11} {'per lap ms':>11}")
+    for n_laps in lap_counts:
+        s, ch, _ = make_lap_traces(turns, n_laps, seed=seed)
+        traces = LapTraces(s, ch)
+        best = float("inf")
+        for _ in range(3):
+            t0 = time.perf_counter()
+            extract_turns(traces, turns)
+            best = min(best, time.perf_counter() - t0)
+        print(f"{n_laps:>6} {len(s):>11} {best * 1e3:>11.1f} {best * 1e3 / n_laps:>11.3f}")
+
+
+def check_route(seed=0):
+    tmp = tempfile.mkdtemp()
+    seed_path = os.path.join(tmp, "seed.json")
+    with open(seed_path, "w") as f:
+        json.dump({"test_drive": {"td": DEMO_DOC}}, f)
+    os.environ["FIRESTORE_STANDIN"] = seed_path
+    import backend
+    client = backend.app.test_client()
+    turns = make_track_turns(6, seed=seed)
+    s, ch, _ = make_lap_traces(turns, 3, step_m=5.0, seed=seed)
+    q = {"rookie_stability_priority": 0.7, "steering_weight_preference": "light",
+         "throttle_pedal_linearity": 0.6, "brake_pedal_linearity": 0.5}
+    body = dict(q, distance_m=s.tolist(), channels={k: v.tolist() for k, v in ch.items()}, turns=turns)
+    resp = client.post("/dataForConfig/traces", json=body)
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    assert [t["turn_id"] for t in resp.get_json()["turns"]] == [t["turn_id"] for t in turns]
+    bad = dict(body, turns=[dict(turns[0], end_m=turns[0]["start_m"] + 1)])
+    resp = client.post("/dataForConfig/traces", json=bad)
+    assert resp.status_code == 400 and resp.get_json()["path"] == "turns[0]", resp.get_json()
+    for bad, path in ((dict(body, channels=dict(body["channels"], brake="x")), "brake"),
+                      (dict(body, laps=7), "laps"), (dict(body, step_m="fine"), "step_m")):
+        resp = client.post("/dataForConfig/traces", json=bad)
+        assert resp.status_code == 400 and resp.get_json()["path"] == path, resp.get_json()
+
+    stored = dict(DEMO_DOC, track_turns=[{"start_m": 10.0}])                # the default definitions are broken
+    backend.db.collection("test_drive").document("td").set(stored)
+    backend.docs.invalidate()
+    resp = client.post("/dataForConfig/traces", json={k: v for k, v in body.items() if k != "turns"})
+    assert resp.status_code == 500 and resp.get_json()["path"] == "track_turns[0].end_m", resp.get_json()
+    backend.db.collection("test_drive").document("td").set(dict(DEMO_DOC, targets=None))
+    backend.docs.invalidate()
+    resp = client.post("/dataForConfig/traces", json=body)
+    assert resp.status_code == 500 and resp.get_json()["path"] == "targets", resp.get_json()
+    print("route OK: POST /dataForConfig/traces; 400 for bad traces or turns, 500 for a malformed stored doc")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--laps", type=int, nargs="+", default=[10, 50, 200])
+    ap.add_argument("--turns", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    check_recovery(seed=args.seed)
+    check_resampled(seed=args.seed + 1)
+    check_doc(args.seed)
+    check_route(args.seed)
+    bench(args.laps, args.turns, args.seed)
+
+
+if __name__ == "__main__":
+    main()
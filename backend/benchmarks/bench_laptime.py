@@ -0,0 +1,231 @@
+import argparse
+import copy
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import laptime
+from laptime import LapTimeModel, shortlist
+from poc import DEMO_DOC
+from schema import INPUT_FIELDS, SchemaError
+from setup_array import APPLY_ORDER
+from synth import make_test_drive_doc
+from turn_matrix import compile_rules_for_doc, compile_turns
+
+# Lap-time surrogate: a zero move predicts the session as driven; batched
+# scoring matches a turn-by-turn reference and scoring one candidate at a
+# time; more downforce is quicker and more drag is slower. Then check the
+# ?shortlist route and time candidates per second.
+#   python backend/benchmarks/bench_laptime.py
+#   python backend/benchmarks/bench_laptime.py --turns 6 1000 --candidates 2000 20000
+
+
+def _move(**kw):
+    m = np.zeros(len(APPLY_ORDER))
+    for k, v in kw.items():
+        m[APPLY_ORDER.index(k)] = v
+    return m
+
+
+def reference_lap_time(doc, lm, move):
+    """One candidate, turn by turn, from the doc's raw fields."""
+    tm = compile_turns(doc, compile_rules_for_doc(doc).turn_fields)
+    model = lm.model
+    col = {f: i for i, f in enumerate(INPUT_FIELDS)}
+    aero_gain = sum(move[s] * model.aero_grip[s] for s in range(len(move)))
+
+    def grip(t, shift, gain):
+        r = {f: (0.0 if math.isnan(tm.errors[t, c]) else tm.errors[t, c]) / model.scales[c] + shift[c] / model.scales[c]
+             for f, c in col.items()}
+        ex = {f: max(v, 0.0) for f, v in r.items()}
+        tyre = laptime.TYRE_GRIP_LOSS * sum(r[f"tyre.surface_temp_c.{c}"] ** 2 for c in ("fl", "fr", "rl", "rr")) / 4
+        losses = [
+            laptime.BALANCE_GRIP_LOSS * r["balance.entry_oversteer_index"] ** 2 + tyre
+            + laptime.LOCKING_GRIP_LOSS * (ex["braking.brake_locking_risk_front"] ** 2 + ex["braking.brake_locking_risk_rear"] ** 2),
+            laptime.BALANCE_GRIP_LOSS * r["balance.mid_oversteer_index"] ** 2 + tyre,
+            laptime.BALANCE_GRIP_LOSS * r["balance.exit_oversteer_index"] ** 2 + tyre
+            + laptime.TRACTION_GRIP_LOSS * ex["traction.traction_loss_index"] ** 2,
+        ]
+        k = doc["turns"][t]["kinematics"]
+        share = min(max(1.0 - laptime.MECH_GRIP_G / k["lat_g_apex"], 0.0), 1.0)
+        porpoise = min(laptime.PORPOISING_AERO_LOSS * ex["aero_ride.porpoising_amplitude_mm"] ** 2, laptime.MAX_GRIP_LOSS)
+        aero = 1.0 + share * (gain - porpoise)
+        return [aero * (1.0 - min(l, laptime.MAX_GRIP_LOSS)) for l in losses]
+
+    shift = [sum(move[s] * model.jacobian[s, c] for s in range(len(move))) for c in range(len(INPUT_FIELDS))]
+    turns = doc["turns"]
+    lap_length = doc["metadata"].get("lap_length_m")
+    straight = (lap_length - sum(t["length_m"] for t in turns)) / len(turns) if lap_length else 0.0
+    total = 0.0
+    for t, turn in enumerate(turns):
+        k = turn["kinematics"]
+        nxt = turns[(t + 1) % len(turns)]["kinematics"]
+        base = grip(t, [0.0] * len(shift), 0.0)
+        cand = grip(t, shift, aero_gain)
+        entry, mid, exit_ = (c / b for c, b in zip(cand, base))
+        ve, va, vx, vn = k["v_entry_kmh"] / 3.6, k["v_apex_kmh"] / 3.6, k["v_exit_kmh"] / 3.6, nxt["v_entry_kmh"] / 3.6
+        L = turn["length_m"]
+        va2 = va * math.sqrt(mid)
+        vx2 = va2 + (vx - va) * exit_
+        tt = L / (ve + va2) / math.sqrt(entry) + L / (va2 + vx2)
+        if straight:
+            tt += 2 * straight / (vx2 + vn)
+        total += tt * turn.get("occurrence_rate", 1.0)
+    return total + sum(move[s] * model.lap_time[s] for s in range(len(move)))
+
+
+def check_baseline():
+    lm = LapTimeModel(DEMO_DOC)
+    out = lm.score(np.zeros((3, len(APPLY_ORDER))))
+    assert np.all(out["delta_s"] == 0.0) and np.all(out["lap_time_s"] == lm.baseline_s), out
+    assert lm.turns_only
+
+    doc = copy.deepcopy(DEMO_DOC)
+    doc["metadata"]["reference_lap_time_s"] = 81.342
+    doc["metadata"]["lap_length_m"] = 5793.0
+    lm = LapTimeModel(doc)
+    out = lm.score(np.zeros((1, len(APPLY_ORDER))))
+    assert out["lap_time_s"][0] == 81.342 and not lm.turns_only
+    assert lm.baseline_s > LapTimeModel(DEMO_DOC).baseline_s        # straights add time
+
+    bad = copy.deepcopy(DEMO_DOC)
+    bad["turns"][2]["kinematics"]["v_apex_kmh"] = 0
+    try:
+        LapTimeModel(bad)
+    except SchemaError as exc:
+        assert exc.path == "turns[2].kinematics.v_apex_kmh", exc.path
+    else:
+        raise AssertionError("a zero apex speed was accepted")
+    print("baseline OK: a zero move predicts the session as driven (reference lap time honoured); bad kinematics name their path")
+
+
+def check_reference(seed=0):
+    for lap_length in (None, 30000.0):
+        doc = make_test_drive_doc(40, seed=seed)
+        if lap_length:
+            doc["metadata"]["lap_length_m"] = lap_length
+        lm = LapTimeModel(doc)
+        rng = np.random.default_rng(seed)
+        moves = rng.normal(0, 1.0, (laptime.BATCH_CANDIDATES + 37, len(APPLY_ORDER))) * lm.unit     # spans two batches
+        batched = lm.score(moves)
+        for i in range(0, len(moves), 50):
+            one = lm.score(moves[i])
+            assert abs(one["lap_time_s"][0] - batched["lap_time_s"][i]) <= 1e-9, i
+            assert abs(one["confidence"][0] - batched["confidence"][i]) <= 1e-12, i
+            want = reference_lap_time(doc, lm, batched["moves"][i])
+            assert abs(want - lm.baseline_s - batched["delta_s"][i]) <= 1e-9, (i, want, batched["delta_s"][i])
+    print("reference OK: batched scoring equals one-at-a-time scoring and a turn-by-turn reference (with and without straights)")
+
+
+def check_monotone():
+    # aero only: no turn-response, no drag -> more wing is quicker in every aero-loaded turn
+    doc = copy.deepcopy(DEMO_DOC)
+    doc["sensitivity_model"] = {"settings": {k: {f: 0.0 for f in INPUT_FIELDS} for k in APPLY_ORDER},
+                                "lap_time_s": {k: 0.0 for k in APPLY_ORDER}}
+    lm = LapTimeModel(doc)
+    steps = lm.caps[APPLY_ORDER.index("rear_wing_main_deg")] * np.array([0.0, 1 / 3, 2 / 3, 1.0])     # up to the cap
+    wing = np.stack([_move(rear_wing_main_deg=x) for x in steps])
+    laps = lm.score(wing)["lap_time_s"]
+    assert np.all(np.diff(laps) < 0), laps
+
+    # drag only: aero grip and turn response off -> lap time grows by exactly lap_time_s per unit
+    doc["sensitivity_model"]["aero_grip"] = {k: 0.0 for k in APPLY_ORDER}
+    doc["sensitivity_model"]["lap_time_s"] = {"rear_wing_main_deg": 0.04}
+    lm = LapTimeModel(doc)
+    delta = lm.score(wing)["delta_s"]
+    assert np.allclose(delta, 0.04 * steps, atol=1e-12), delta
+
+    # a turn below MECH_GRIP_G gets nothing from downforce
+    assert lm.aero_share[0] == 0.0 and lm.aero_share[1] > 0.5
+    print(f"monotone OK: more downforce is quicker ({laps[0]:.3f} -> {laps[-1]:.3f} s), drag costs exactly lap_time_s per unit")
+
+
+def check_shortlist(seed=0):
+    res = shortlist(DEMO_DOC, n=5, candidates=3000, seed=seed)
+    deltas = [s["predicted_performance"]["delta_vs_baseline_s"] for s in res["setups"]]
+    assert len(deltas) == 5 and deltas == sorted(deltas), deltas
+    assert deltas[0] <= res["heuristic"]["delta_vs_baseline_s"] and deltas[0] < 0
+    assert [s["rank"] for s in res["setups"]] == [1, 2, 3, 4, 5]
+    again = shortlist(DEMO_DOC, n=5, candidates=3000, seed=seed)
+    assert again == res                                                 # seeded
+    lm = LapTimeModel(DEMO_DOC)
+    for s in res["setups"]:
+        move = lm.move_vector(s["aggregated_move"])
+        over = np.flatnonzero(np.abs(move) > lm.caps * (1 + 1e-9))
+        assert not len(over), f"{s['source']}: {[APPLY_ORDER[i] for i in over]} past their step caps"
+    small = shortlist(DEMO_DOC, n=2, candidates=3, seed=seed)
+    heuristic = res["heuristic"]
+    assert small["candidates"] == 3 and small["heuristic"] == heuristic, small     # the anchor is always scored
+    print(f"shortlist OK: ranked, distinct, seeded, within the step caps; best {deltas[0]:+.3f} s vs heuristic "
+          f"{res['heuristic']['delta_vs_baseline_s']:+.3f} s ({res['setups'][0]['source']})")
+
+
+def check_route():
+    tmp = tempfile.mkdtemp()
+    seed_path = os.path.join(tmp, "seed.json")
+    with open(seed_path, "w") as f:
+        json.dump({"test_drive": {"td": DEMO_DOC}}, f)
+    os.environ["FIRESTORE_STANDIN"] = seed_path
+    import backend
+    client = backend.app.test_client()
+    q = {"rookie_stability_priority": 0.7, "steering_weight_preference": "light",
+         "throttle_pedal_linearity": 0.6, "brake_pedal_linearity": 0.5}
+    plain = client.post("/dataForConfig", json=q)
+    resp = client.post("/dataForConfig?shortlist=3", json=q)
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    assert resp.headers["ETag"] != plain.headers["ETag"]
+    body = resp.get_json()
+    assert len(body["shortlist"]) == 3 and "predicted_performance" in body
+    assert body["diagnostics"]["laptime"]["candidates"] == laptime.DEFAULT_CANDIDATES
+    assert "shortlist" not in plain.get_json()
+    cached = client.post("/dataForConfig?shortlist=3", json=q)
+    assert cached.get_json() == body
+    for bad in ("0", "x", str(laptime.MAX_SHORTLIST + 1)):
+        resp = client.post(f"/dataForConfig?shortlist={bad}", json=q)
+        assert resp.status_code == 400, (bad, resp.get_json())
+    print("route OK: POST /dataForConfig?shortlist=N (own ETag, cached)")
+
+
+def bench(turn_counts, candidate_counts, seed=0):
+    print(f"{'turns':>7} {'candidates':>11} {'build ms':>9} {'score ms':>9} {'candidates/s':>13}")
+    for n_turns in turn_counts:
+        doc = make_test_drive_doc(n_turns, seed=seed)
+        t0 = time.perf_counter()
+        lm = LapTimeModel(doc)
+        t_build = time.perf_counter() - t0
+        rng = np.random.default_rng(seed)
+        for n in candidate_counts:
+            moves = rng.normal(0, 0.5, (n, len(APPLY_ORDER))) * lm.unit
+            best = float("inf")
+            for _ in range(3):
+                t0 = time.perf_counter()
+                lm.score(moves)
+                best = min(best, time.perf_counter() - t0)
+            print(f"{n_turns:>7} {n:>11} {t_build * 1e3:>9.1f} {best * 1e3:>9.1f} {n / best:>13,.0f}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, nargs="+", default=[6, 60, 600])
+    ap.add_argument("--candidates", type=int, nargs="+", default=[2000, 20000])
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    check_baseline()
+    check_reference(args.seed)
+    check_monotone()
+    check_shortlist(args.seed)
+    check_route()
+    bench(args.turns, args.candidates, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_firestore import FakeFirestore
+from multi_session import SessionWeighting, iter_session_pages, optimise_sessions, prefetch_pages
+from poc import compute_setup_from_doc
+from synth import make_test_drive_doc
+
+# Multi-session optimisation over a Firestore stand-in with per-page latency:
+# paging overlapped with compute (prefetch) vs strictly sequential, peak
+# traced memory vs materialising every session, and single-session parity
+# with compute_setup_from_doc. The prefetch thread exits when the consumer
+# stops early, even with the queue full.
+#   python backend/benchmarks/bench_multi_session.py --sessions 2000 --turns 20
+
+
+def seed(db, n_sessions, n_turns):
+    kinds = ["fp1", "fp2", "fp3", "quali", "race"]
+    for i in range(n_sessions):
+        doc = make_test_drive_doc(n_turns, seed=i)
+        doc["metadata"]["session"] = kinds[i % len(kinds)]
+        doc["metadata"]["recorded_at"] = 1.7e9 + i * 3600
+        if i % 10 == 9:
+            doc["metadata"]["tyre_compound"] = "c4"       # filtered out
+        db.collection("test_drive").document(f"session_{i:06d}").set(doc)
+
+
+def check_prefetch_stops():
+    def producers():
+        return [t for t in threading.enumerate() if t.name == "session-pages"]
+
+    for n_pages in (2, 10):             # blocked on the final "done", blocked on a page
+        pages = prefetch_pages(iter([[i] for i in range(n_pages)]), depth=1)
+        assert next(pages) == [0]
+        time.sleep(0.05)                    # let the producer fill the queue
+        pages.close()
+        deadline = time.monotonic() + 2.0
+        while producers() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not producers(), f"{n_pages} pages: the prefetch thread outlived its consumer"
+    print("prefetch OK: the page thread exits when the consumer stops early")
+
+
+def run(db, base, page_size, prefetch, now):
+    def once():
+        pages = iter_session_pages(db, "austin_cota", "c3", page_size)
+        return optimise_sessions(base, pages, weighting=SessionWeighting(half_life_days=14), now=now, prefetch=prefetch)
+
+    t0 = time.perf_counter()
+    result = once()
+    dt = time.perf_counter() - t0
+    tracemalloc.start()           # separate pass: tracing distorts timings
+    once()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, dt, peak
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sessions", type=int, default=2000)
+    ap.add_argument("--turns", type=int, default=20)
+    ap.add_argument("--page-size", type=int, default=100)
+    ap.add_argument("--page-ms", type=float, default=20.0, help="stand-in latency per page read")
+    args = ap.parse_args()
+
+    check_prefetch_stops()
+    base = make_test_drive_doc(args.turns, seed=10_000)
+    single = optimise_sessions(base, [[base]])
+    ref = compute_setup_from_doc(base)
+    drift = max(abs(single["diagnostics"]["aggregated_move"][k] - v) for k, v in ref["diagnostics"]["aggregated_move"].items())
+    assert list(single["diagnostics"]["aggregated_move"]) == list(ref["diagnostics"]["aggregated_move"])
+    assert drift < 1e-9, drift
+    print(f"single-session parity OK (max |delta move| {drift:.1e})")
+
+    db = FakeFirestore(latency_s=args.page_ms / 1000)
+    seed(db, args.sessions, args.turns)
+    now = 1.7e9 + args.sessions * 3600
+
+    seq, t_seq, mem_seq = run(db, base, args.page_size, 0, now)
+    ovl, t_ovl, mem_ovl = run(db, base, args.page_size, 2, now)
+    assert seq["diagnostics"]["aggregated_move"] == ovl["diagnostics"]["aggregated_move"]
+
+    s = ovl["diagnostics"]["sessions"]
+    print(f"{s['merged']} sessions / {s['turns']} turns in {s['pages']} pages of {args.page_size} "
+          f"({args.page_ms:.0f} ms per page read)")
+    print(f"  sequential          : {t_seq:7.2f} s   peak traced {mem_seq / 2**20:6.1f} MiB")
+    print(f"  overlapped paging   : {t_ovl:7.2f} s   peak traced {mem_ovl / 2**20:6.1f} MiB   x{t_seq / t_ovl:.2f}")
+
+    tracemalloc.start()
+    everything = [snap.to_dict() for snap in db.collection("test_drive").stream()]
+    _, peak_all = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  (materialising all {len(everything)} docs: {peak_all / 2**20:6.1f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
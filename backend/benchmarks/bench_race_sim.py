@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import metrics
+import race_sim
+from poc import DEMO_DOC
+from race_sim import RaceOptions, RaceSim, RaceStream, TooManyStreams, build_track, stream_race
+from schema import SchemaError
+from synth import make_test_drive_doc
+
+# Race simulator: the speed profile respects the turn speeds and the
+# acceleration / braking limits; a lone car without noise laps in the
+# profile's reference time; a full race classifies every car once, with
+# gaps that grow down the order; a seed always gives the same race; memory
+# stays flat as the race gets longer. Served streams are capped and paced
+# playback only times the simulation; through asgi.py, paced viewers wait on
+# the event loop, not in pool threads. Then check the streaming route and
+# time races.
+#   python backend/benchmarks/bench_race_sim.py
+#   python backend/benchmarks/bench_race_sim.py --laps 10 50 100 --cars 20 40
+
+
+def check_track():
+    track = build_track(DEMO_DOC)
+    v, step = track.v_ref, track.step_m
+    assert np.all(v > 0) and v.max() <= race_sim.V_MAX_KMH / 3.6 + 1e-9
+    dv2 = np.diff(np.append(v, v[0]) ** 2) / (2 * step)
+    assert dv2.max() <= race_sim.ACCEL_MS2 + 1e-6 and dv2.min() >= -race_sim.BRAKE_MS2 - 1e-6, (dv2.min(), dv2.max())
+    for t, a, b in zip(DEMO_DOC["turns"], track.turn_start_m, track.turn_end_m):
+        apex = v[int((a // step + b // step) // 2)]
+        assert apex <= t["kinematics"]["v_apex_kmh"] / 3.6 + 1e-9, t["turn_id"]
+
+    doc = copy.deepcopy(DEMO_DOC)
+    doc["metadata"]["lap_length_m"] = 5513.0
+    assert build_track(doc).length_m == 5513.0
+    doc["metadata"]["lap_length_m"] = 1000.0                           # shorter than its turns
+    try:
+        build_track(doc)
+    except SchemaError as exc:
+        assert exc.path == "metadata.lap_length_m", exc.path
+    else:
+        raise AssertionError("a lap shorter than its turns was accepted")
+    print(f"track OK: {track.length_m:.0f} m, reference lap {track.reference_lap_s:.3f} s; "
+          f"turn speeds and accel/brake limits respected")
+
+
+def check_lone_car():
+    track = build_track(DEMO_DOC)
+    saved = race_sim.PACE_SPREAD, race_sim.DEG_PER_LAP, race_sim.LAP_NOISE
+    race_sim.PACE_SPREAD, race_sim.DEG_PER_LAP, race_sim.LAP_NOISE = 0.0, (0.0, 0.0), 0.0
+    try:
+        sim = RaceSim(track, RaceOptions(laps=3, cars=1, dt_s=0.02))
+        for _ in sim.run():
+            pass
+    finally:
+        race_sim.PACE_SPREAD, race_sim.DEG_PER_LAP, race_sim.LAP_NOISE = saved
+    want = 3 * track.reference_lap_s
+    assert abs(sim.finish_s[0] - want) <= 3 * 0.02 + 1e-4 * want, (sim.finish_s[0], want)     # a timestep per lap
+    print(f"lone car OK: 3 laps in {sim.finish_s[0]:.2f} s vs reference {want:.2f} s")
+
+
+def check_race(seed=0):
+    track = build_track(make_test_drive_doc(12, seed=seed))
+    opts = RaceOptions(laps=20, seed=seed, frame_s=2.0)
+    sim = RaceSim(track, opts)
+    frames = list(sim.run())
+    assert sim.finished
+    for f in frames[:: max(1, len(frames) // 50)] + frames[-1:]:
+        assert sorted(f["position"]) == list(range(1, opts.cars + 1))
+        by_pos = sorted(range(opts.cars), key=lambda i: f["position"][i])
+        gaps = [f["gap_s"][i] for i in by_pos if f["gap_s"][i] is not None]
+        assert gaps[0] == 0.0 and all(b >= a - 0.05 for a, b in zip(gaps, gaps[1:])), gaps     # grid resolution
+    last = frames[-1]
+    winner = last["position"].index(1)
+    assert last["lap"][winner] == opts.laps and all(last["finished"])
+    assert all(opts.laps - 1 <= last["lap"][i] + last["laps_down"][i] <= opts.laps for i in range(opts.cars))
+    assert np.all(sim.finish_s >= sim.finish_s[winner])
+    changed = np.argsort(sim.grid).tolist() != sorted(range(opts.cars), key=lambda i: last["position"][i])
+
+    again = RaceSim(track, opts)
+    assert [f for f in again.run()][-1] == last                             # seeded
+    print(f"race OK: {opts.cars} cars x {opts.laps} laps classified in {sim.t:.0f} s race time; "
+          f"consistent positions and gaps; seeded (order changed from the grid: {changed})")
+
+
+def check_memory(cars=20):
+    track = build_track(DEMO_DOC)
+    peaks = []
+    for laps in (5, 50):
+        tracemalloc.start()
+        n = 0
+        for chunk in stream_race(track, RaceOptions(laps=laps, cars=cars)):
+            n += len(chunk)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peaks.append(peak)
+    assert peaks[1] < 2 * peaks[0] + 64 * 1024, peaks
+    print(f"memory OK: peak traced {peaks[0] / 1024:.0f} KiB for 5 laps, {peaks[1] / 1024:.0f} KiB for 50 laps")
+
+
+def check_serving():
+    track = build_track(DEMO_DOC)
+    opts = RaceOptions(laps=1, cars=4, frame_s=5.0, speedup=track.reference_lap_s / 0.5)     # a lap in ~0.5 s
+    held = [RaceStream(track, opts) for _ in range(race_sim.MAX_STREAMS)]
+    try:
+        RaceStream(track, opts)
+    except TooManyStreams:
+        pass
+    else:
+        raise AssertionError(f"stream {race_sim.MAX_STREAMS + 1} was accepted")
+    for s in held:
+        s.close()
+        s.close()                                                   # idempotent
+
+    with metrics.trace() as tr:
+        t0 = time.perf_counter()
+        stream = RaceStream(track, opts)
+        n = sum(1 for _ in stream)
+        wall = time.perf_counter() - t0
+        stream.close()
+    want = stream.sim.t / opts.speedup
+    assert wall >= want - 0.05, (wall, want)                       # paced
+    assert tr.timings_ms["race_sim.step"] < 0.5 * wall * 1e3, tr.timings_ms     # sleeps are not simulation time
+    print(f"serving OK: {race_sim.MAX_STREAMS} streams max; paced playback of {n} events took {wall:.2f} s "
+          f"({want:.2f} s due), {tr.timings_ms['race_sim.step']:.0f} ms of it simulating")
+
+
+def _asgi_get(app, path, query=""):
+    """One GET through an ASGI app: (status, headers, body, seconds)."""
+    async def run():
+        sent = []
+        started = time.perf_counter()
+        closed = asyncio.Event()
+
+        async def receive():
+            if not sent:
+                sent.append(None)
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await closed.wait()
+            return {"type": "http.disconnect"}
+
+        out = {"body": b""}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                out["status"], out["headers"] = message["status"], dict(message["headers"])
+            else:
+                out["body"] += message.get("body", b"")
+                if not message.get("more_body"):
+                    closed.set()
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "headers": [],
+                 "root_path": "", "scheme": "http", "http_version": "1.1"}
+        await app(scope, receive, send)
+        return out["status"], out["headers"], out["body"], time.perf_counter() - started
+    return run()
+
+
+def check_asgi(viewers=6):
+    os.environ["ASGI_THREADS"] = "2"                                # fewer pool threads than viewers
+    import asgi
+    track = build_track(DEMO_DOC)
+    query = f"laps=1&cars=4&frame_s=5&speedup={track.reference_lap_s / 1.0}"      # a lap in ~1 s
+
+    async def run():
+        streams = [asyncio.ensure_future(_asgi_get(asgi.app, "/raceSim/stream", query)) for _ in range(viewers)]
+        await asyncio.sleep(0.2)                                     # every viewer mid-race
+        status, _, _, quick = await _asgi_get(asgi.app, "/cacheStats")
+        assert status == 200
+        return quick, await asyncio.gather(*streams)
+    quick, done = asyncio.run(run())
+    assert all(st == 200 and b"event: finish" in body for st, _, body, _ in done)
+    assert min(t for *_, t in done) >= 0.9, [t for *_, t in done]
+    assert quick < 0.5, quick            # the pool was free: waits happen on the event loop
+    assert race_sim._slots._value == race_sim.MAX_STREAMS              # every slot released
+    print(f"asgi OK: {viewers} paced viewers on {asgi.THREADS} pool threads; /cacheStats answered in "
+          f"{quick * 1e3:.0f} ms mid-race")
+
+
+def _events(body):
+    out = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        out.append((fields["event"], json.loads(fields["data"])))
+    return out
+
+
+def check_route():
+    tmp = tempfile.mkdtemp()
+    seed_path = os.path.join(tmp, "seed.json")
+    with open(seed_path, "w") as f:
+        json.dump({"test_drive": {"td": DEMO_DOC}}, f)
+    os.environ["FIRESTORE_STANDIN"] = seed_path
+    import backend
+    client = backend.app.test_client()
+    resp = client.get("/raceSim/stream?laps=2&ids=alle,verstappen,hamilton&frame_s=5")
+    assert resp.status_code == 200 and resp.mimetype == "text/event-stream"
+    events = _events(resp.get_data(as_text=True))
+    assert events[0][0] == "track" and events[0][1]["cars"] == ["alle", "verstappen", "hamilton"]
+    assert events[-1][0] == "finish" and len(events[-1][1]["classification"]) == 3
+    assert {e for e, _ in events[1:-1]} == {"frame"}
+    for bad in ("laps=0", "cars=100", "dt_s=x", "frame_s=-1"):
+        resp = client.get(f"/raceSim/stream?{bad}")
+        assert resp.status_code == 400, (bad, resp.get_json())
+    held = [RaceStream(build_track(DEMO_DOC)) for _ in range(race_sim.MAX_STREAMS)]
+    resp = client.get("/raceSim/stream?laps=1")
+    assert resp.status_code == 503 and resp.headers["Retry-After"]
+    for s in held:
+        s.close()
+    assert race_sim._slots._value == race_sim.MAX_STREAMS              # route streams released theirs
+    print(f"route OK: GET /raceSim/stream ({len(events) - 2} frames for 2 laps)")
+
+
+def bench(lap_counts, car_counts, seed=0):
+    track = build_track(DEMO_DOC)
+    print(f"{'cars':>5} {'laps':>5} {'race s':>8} {'wall s':>7} {'x real time':>12} {'frames':>7} {'stream KiB':>11}")
+    for cars in car_counts:
+        for laps in lap_counts:
+            opts = RaceOptions(laps=laps, cars=cars, seed=seed)
+            t0 = time.perf_counter()
+            size = frames = 0
+            for chunk in stream_race(track, opts):
+                size += len(chunk)
+                frames += chunk.startswith(b"id:")
+            wall = time.perf_counter() - t0
+            race_s = json.loads(chunk.decode().split("data: ", 1)[1])["t"]
+            print(f"{cars:>5} {laps:>5} {race_s:>8.0f} {wall:>7.2f} {race_s / wall:>12.0f} {frames:>7} {size / 1024:>11.0f}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--laps", type=int, nargs="+", default=[10, 50])
+    ap.add_argument("--cars", type=int, nargs="+", default=[20])
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    check_track()
+    check_lone_car()
+    check_race(args.seed)
+    check_memory()
+    check_serving()
+    check_route()
+    check_asgi()
+    bench(args.laps, args.cars, args.seed)
+
+
+if __name__ == "__main__":
+    main()
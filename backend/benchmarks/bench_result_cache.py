@@ -0,0 +1,83 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poc import build_preferences_from_doc, compute_setup_from_doc
+import result_cache
+import solver
+from result_cache import ResultCache, setup_cache_key
+from synth import make_test_drive_doc
+
+# Memoized /dataForConfig: key (hash) cost, cold compute+serialize, warm memory
+# hit, and a disk-tier hit after a simulated restart. The key changes with the
+# shipped sensitivity model and the engine source, not just the rule table.
+#   python backend/benchmarks/bench_result_cache.py
+
+
+def _ms(fn, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1e3
+
+
+def check_salt():
+    doc = make_test_drive_doc(6, seed=1)
+    prefs = build_preferences_from_doc(doc)
+    key = setup_cache_key(doc, prefs)
+    tmp = tempfile.mkdtemp(prefix="result_cache_")
+    original = solver.DEFAULT_SENSITIVITY_PATH
+    try:
+        with open(original) as f:
+            model = json.load(f)
+        model["move_penalty"] = float(model.get("move_penalty", 0.0)) + 1.0
+        solver.DEFAULT_SENSITIVITY_PATH = os.path.join(tmp, "default_sensitivity.json")
+        with open(solver.DEFAULT_SENSITIVITY_PATH, "w") as f:
+            json.dump(model, f)
+        result_cache._salt.cache_clear()
+        assert setup_cache_key(doc, prefs) != key, "the key ignores default_sensitivity.json"
+    finally:
+        solver.DEFAULT_SENSITIVITY_PATH = original
+        result_cache._salt.cache_clear()
+        shutil.rmtree(tmp, ignore_errors=True)
+    assert setup_cache_key(doc, prefs) == key
+    salt = result_cache._salt()
+    for m in result_cache.ENGINE_MODULES:
+        assert result_cache._file_digest(os.path.join(os.path.dirname(result_cache.__file__), f"{m}.py")) in salt, m
+    print(f"salt OK: the key follows default_rules.json, default_sensitivity.json and {len(result_cache.ENGINE_MODULES)} engine modules")
+
+
+def run(sizes=(6, 120, 600)):
+    disk = tempfile.mkdtemp(prefix="result_cache_")
+    try:
+        for n in sizes:
+            doc = make_test_drive_doc(n, seed=n)
+            prefs = build_preferences_from_doc(doc)
+            key = setup_cache_key(doc, prefs)
+            cache = ResultCache(disk_dir=disk)
+
+            t_key = _ms(lambda: setup_cache_key(doc, prefs))
+            t_cold = _ms(lambda: json.dumps(compute_setup_from_doc(doc, prefs)).encode(), repeat=3)
+            cache.put(key, json.dumps(compute_setup_from_doc(doc, prefs)).encode())
+            t_warm = _ms(lambda: cache.get(key))
+            restarted = ResultCache(disk_dir=disk)
+            t0 = time.perf_counter()
+            assert restarted.get(key) is not None and restarted.disk_hits == 1
+            t_disk = (time.perf_counter() - t0) * 1e3
+            print(f"{n:>5} turns  key {t_key:7.3f} ms  compute {t_cold:8.3f} ms  "
+                  f"hit(mem) {t_warm:7.4f} ms  hit(disk) {t_disk:7.3f} ms  "
+                  f"=> request {t_cold / (t_key + t_warm):6.1f}x faster on repeat")
+    finally:
+        shutil.rmtree(disk)
+
+
+if __name__ == "__main__":
+    check_salt()
+    run()
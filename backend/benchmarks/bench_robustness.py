@@ -0,0 +1,178 @@
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import robustness as rb
+from lap_traces import LapTraces, build_test_drive_doc
+from poc import DEMO_DOC, build_preferences_from_doc, compute_setup_from_doc
+from robustness import NoiseModel, RobustnessOptions, robustness
+from synth import make_lap_traces, make_test_drive_doc, make_track_turns
+from turn_matrix import compile_rules_for_doc
+
+# Monte Carlo robustness: with zero noise every sample is the nominal
+# compute_setup_from_doc move; with noise, the batched samples match feeding
+# the same perturbed turns one doc at a time through compute_setup_from_doc;
+# lap_stats spreads are picked up as the noise scale; a seed always gives the
+# same answer. Then time full sessions.
+#   python backend/benchmarks/bench_robustness.py
+#   python backend/benchmarks/bench_robustness.py --turns 20 50 --samples 1000 5000
+
+
+def _set_path(turn, path, value):
+    *head, last = path.split(".")
+    for k in head:
+        turn = turn[k]
+    turn[last] = value
+
+
+def _get_path(turn, path):
+    for k in path.split("."):
+        turn = turn[k]
+    return turn
+
+
+def check_zero_noise(seed=0):
+    for doc in (DEMO_DOC, make_test_drive_doc(40, seed=seed)):
+        nominal = compute_setup_from_doc(doc, build_preferences_from_doc(doc))["diagnostics"]["aggregated_move"]
+        rules = compile_rules_for_doc(doc)
+        quiet = {f: NoiseModel(sigma=0.0) for f in rb.INPUT_FIELDS + rules.turn_fields}
+        res = robustness(doc, options=RobustnessOptions(samples=300, noise=quiet, quantiles=(0.0, 0.5, 1.0)))
+        assert res["nominal"]["aggregated_move"] == nominal
+        assert list(res["settings"]) == list(nominal)
+        for key, s in res["settings"].items():
+            assert all(v == nominal[key] for v in s["quantiles"].values()), key     # bit for bit
+            assert s["p_moved"] == 1.0 and s["stable"], key
+        for t in res["turns"]:
+            assert all(r["nominal"] and r["p_fire"] == 1.0 for r in t["rules"].values()) and not t["marginal_rules"]
+        assert not res["unstable_settings"] and not res["noise"]
+    print("zero noise OK: every sample reproduces compute_setup_from_doc's aggregated move exactly")
+
+
+def reference(doc, opts):
+    """The same draws, one perturbed doc at a time through compute_setup_from_doc."""
+    prefs = build_preferences_from_doc(doc)
+    rules = compile_rules_for_doc(doc)
+    tm = rb.compile_turns(doc, rules.turn_fields)
+    fields, sigma, models = rb.noise_plan(doc, tm, opts)
+    noisy = [c for c in range(len(fields)) if sigma[:, c].any()]
+    rng = np.random.default_rng(opts.seed)
+    moves = []
+    for lo in range(0, opts.samples, rb.BATCH_SAMPLES):
+        b = min(rb.BATCH_SAMPLES, opts.samples - lo)
+        noise = np.zeros((b, tm.n_turns, len(fields)))
+        for c in noisy:
+            noise[:, :, c] = models[c].draw(rng, (b, tm.n_turns)) * sigma[:, c]
+        for s in range(b):
+            d = copy.deepcopy(doc)
+            for i, t in enumerate(d["turns"]):
+                for c in noisy:
+                    _set_path(t, fields[c], _get_path(t, fields[c]) + noise[s, i, c])
+            moves.append(compute_setup_from_doc(d, prefs)["diagnostics"]["aggregated_move"])
+    return moves
+
+
+def check_reference(seed=0, samples=600):
+    doc = make_test_drive_doc(12, seed=seed)
+    opts = RobustnessOptions(samples=samples, seed=seed, noise_model="student_t",
+                             noise={"balance.mid_oversteer_index": NoiseModel("uniform", 0.05)},
+                             quantiles=(0.0, 0.25, 0.5, 0.75, 1.0))
+    res = robustness(doc, options=opts)
+    moves = reference(doc, opts)
+    for key, s in res["settings"].items():
+        ref = np.array([m.get(key, 0.0) for m in moves])
+        got = np.array(list(s["quantiles"].values()))
+        assert np.allclose(got, np.quantile(ref, opts.quantiles), rtol=0, atol=1e-9), key
+        assert abs(s["mean"] - ref.mean()) < 1e-9, key
+        assert s["p_moved"] == np.mean([key in m for m in moves]), key
+    assert set(res["settings"]) == set().union(*moves)
+    print(f"reference OK: {samples} batched samples match {samples} perturbed docs through compute_setup_from_doc "
+          f"({len(res['settings'])} settings, unstable: {res['unstable_settings']})")
+
+
+def check_lap_stats(seed=0):
+    turns = make_track_turns(10, seed=seed)
+    s, ch, _ = make_lap_traces(turns, 12, seed=seed)
+    doc = build_test_drive_doc(DEMO_DOC, LapTraces(s, ch), turns)
+    res = robustness(doc, options=RobustnessOptions(samples=200, seed=seed))
+    want = [t["lap_stats"]["std"]["balance.mid_oversteer_index"] for t in doc["turns"]]
+    assert res["noise"]["balance.mid_oversteer_index"]["sigma"] == want
+    res = robustness(doc, options=RobustnessOptions(samples=200, seed=seed, lap_stats=False))
+    assert res["noise"]["balance.mid_oversteer_index"]["sigma"] == [rb.DEFAULT_SIGMA["balance.mid_oversteer_index"]] * len(turns)
+    print("lap_stats OK: turns built from lap traces are perturbed by their measured lap-to-lap spread")
+
+
+def check_models(n=200000, seed=0):
+    rng = np.random.default_rng(seed)
+    for model in rb.MODELS:
+        x = NoiseModel(model).draw(rng, (n,))
+        assert abs(x.mean()) < 0.02 and abs(x.std() - 1.0) < 0.03, (model, x.mean(), x.std())
+    doc = make_test_drive_doc(20, seed=seed)
+    a = robustness(doc, options=RobustnessOptions(samples=700, seed=7))
+    b = robustness(doc, options=RobustnessOptions(samples=700, seed=7))
+    c = robustness(doc, options=RobustnessOptions(samples=700, seed=8))
+    assert json.dumps(a) == json.dumps(b) and json.dumps(a) != json.dumps(c)
+    print("models OK: every noise model has unit variance; a seed always gives the same result")
+
+
+def bench(turn_counts, sample_counts, seed=0):
+    print(f"{'turns':>6} {'samples':>8} {'robustness ms':>14} {'per sample us':>14} {'unstable':>9}")
+    for n_turns in turn_counts:
+        doc = make_test_drive_doc(n_turns, seed=seed)
+        for samples in sample_counts:
+            opts = RobustnessOptions(samples=samples, seed=seed)
+            best = float("inf")
+            for _ in range(3):
+                t0 = time.perf_counter()
+                res = robustness(doc, options=opts)
+                best = min(best, time.perf_counter() - t0)
+            print(f"{n_turns:>6} {samples:>8} {best * 1e3:>14.1f} {best * 1e6 / samples:>14.1f} {len(res['unstable_settings']):>9}")
+
+
+def check_route():
+    tmp = tempfile.mkdtemp()
+    seed_path = os.path.join(tmp, "seed.json")
+    with open(seed_path, "w") as f:
+        json.dump({"test_drive": {"td": DEMO_DOC}}, f)
+    os.environ["FIRESTORE_STANDIN"] = seed_path
+    import backend
+    client = backend.app.test_client()
+    q = {"rookie_stability_priority": 0.7, "steering_weight_preference": "light",
+         "throttle_pedal_linearity": 0.6, "brake_pedal_linearity": 0.5}
+    resp = client.post("/dataForConfig/robustness", json=dict(q, samples=500, seed=3, noise={"balance.entry_oversteer_index": 0.05}))
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    body = resp.get_json()
+    plain = client.post("/dataForConfig", json=q).get_json()
+    assert body["nominal"]["aggregated_move"] == plain["diagnostics"]["aggregated_move"]
+    assert body["noise"]["balance.entry_oversteer_index"]["sigma"] == [0.05] * len(DEMO_DOC["turns"])
+    for bad in ({"noise": {"no.such_metric": 0.1}}, {"samples": 0}, {"noise_model": "cauchy"}, {"quantiles": [1.5]}):
+        resp = client.post("/dataForConfig/robustness", json=dict(q, **bad))
+        assert resp.status_code == 400, (bad, resp.get_json())
+    print("route OK: POST /dataForConfig/robustness")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, nargs="+", default=[6, 20, 50])
+    ap.add_argument("--samples", type=int, nargs="+", default=[1000, 2000, 5000])
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    check_zero_noise(args.seed)
+    check_reference(args.seed)
+    check_lap_stats(args.seed)
+    check_models(seed=args.seed)
+    check_route()
+    bench(args.turns, args.samples, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synth import make_race_data, make_test_drive_doc
+
+# Load benchmark: Flask dev server vs the ASGI production mode (serve.py),
+# both backed by the local Firestore stand-in (FIRESTORE_STANDIN) with an
+# artificial round-trip latency. Caches are disabled by default so every
+# request pays the Firestore read and the computation. First, in process:
+# asgi.py refuses an oversized body from its Content-Length before reading
+# it and a body that outgrows the cap mid-read, sends nothing to a client
+# that disconnects mid-body, and streams /feedback/accel past the cap,
+# pulling the body only as the route reads it.
+#   python backend/benchmarks/bench_server.py --concurrency 16 --seconds 5
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEV_SERVER = "import backend; backend.app.run(port={port}, debug=False)"   # app.run minus the reloader
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(port, proc, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/cacheStats")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not come up")
+
+
+def start(kind, port, env, workers):
+    if kind == "dev":
+        cmd = [sys.executable, "-c", DEV_SERVER.format(port=port)]
+    else:
+        cmd = [sys.executable, "serve.py", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _wait_ready(port, proc)
+    return proc
+
+
+def _request(port, route, i):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    if route == "/dataForConfig":
+        body = json.dumps({
+            "rookie_stability_priority": 0.5 + (i % 40) / 100,
+            "steering_weight_preference": "medium",
+            "throttle_pedal_linearity": 0.6,
+            "brake_pedal_linearity": 0.5,
+        })
+        conn.request("POST", route, body=body, headers={"Content-Type": "application/json"})
+    else:
+        conn.request("GET", route)
+    resp = conn.getresponse()
+    resp.read()
+    conn.close()
+    return resp.status
+
+
+def load(port, route, concurrency, seconds):
+    lat, errors = [], [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def client(cid):
+        i = cid
+        mine = []
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            try:
+                ok = _request(port, route, i) == 200
+            except OSError:
+                ok = False
+            mine.append(time.perf_counter() - t0)
+            if not ok:
+                with lock:
+                    errors[0] += 1
+            i += concurrency
+        with lock:
+            lat.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    ms = np.array(lat) * 1e3
+    return {
+        "requests": len(lat),
+        "errors": errors[0],
+        "req_per_s": len(lat) / wall,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def graceful_shutdown(port, proc):
+    """SIGTERM with a live SSE subscriber connected: the stream must end and the worker exit cleanly."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.request("GET", "/feedback/live")
+    resp = conn.getresponse()
+    t0 = time.perf_counter()
+    proc.send_signal(signal.SIGTERM)
+    resp.read()                       # returns once the server ends the stream
+    code = proc.wait(timeout=30)
+    return time.perf_counter() - t0, code
+
+
+def check_body_limits(seed):
+    os.environ["FIRESTORE_STANDIN"] = seed
+    sys.path.insert(0, BACKEND_DIR)
+    import asgi
+
+    def call(headers, messages, path="/dataForConfig"):
+        sent, received = [], []
+
+        async def receive():
+            received.append(None)
+            return next(messages)
+
+        async def send(message):
+            sent.append(message)
+        scope = {"type": "http", "method": "POST", "path": path, "query_string": b"", "headers": headers}
+        asyncio.run(asgi.app(scope, receive, send))
+        return sent, len(received)
+
+    def body(chunks):
+        for i, chunk in enumerate(chunks):
+            yield {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+
+    sent, reads = call([(b"content-length", str(asgi.MAX_BODY_BYTES + 1).encode())], body([b"x"]))
+    assert sent[0]["status"] == 413 and reads == 0, (sent, reads)
+    sent, _ = call([(b"content-type", b"application/json")],
+                   iter([{"type": "http.request", "body": b"{", "more_body": True}, {"type": "http.disconnect"}]))
+    assert sent == [], sent
+
+    cap, asgi.MAX_BODY_BYTES = asgi.MAX_BODY_BYTES, 1 << 20
+    try:
+        sent, reads = call([(b"content-type", b"application/json")], body([b" " * (256 << 10)] * 8))      # no Content-Length
+        assert sent[0]["status"] == 413 and reads == 5, (sent[0], reads)
+        from accel import CHUNK_SAMPLES
+
+        def accel_peak(n_samples):
+            samples = np.zeros((n_samples, 3), dtype="<f4")
+            samples[::1000, 1] = 5.0                    # some vertical load
+            chunks = [c.tobytes() for c in np.array_split(samples, n_samples // 50_000)]     # 600 KB messages
+            tracemalloc.start()
+            sent, reads = call([(b"content-length", str(samples.nbytes).encode())], body(chunks), "/feedback/accel")
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert sent[0]["status"] == 200 and reads == len(chunks), (sent[0], sent[1:2], reads)
+            return samples.nbytes, peak
+
+        accel_peak(CHUNK_SAMPLES)                       # warm up (imports)
+        small, small_peak = accel_peak(2 * CHUNK_SAMPLES)
+        big, big_peak = accel_peak(12 * CHUNK_SAMPLES)
+        assert big_peak < 1.25 * small_peak, f"peak {small_peak} B -> {big_peak} B: the body was buffered"
+    finally:
+        asgi.MAX_BODY_BYTES = cap
+    print(f"body limits OK: 413 from Content-Length before reading and past the cap mid-read; a disconnect "
+          f"mid-body gets no response; /feedback/accel past a 1 MB cap: {small / 1e6:.0f} MB body peaks at "
+          f"{small_peak / 1e6:.0f} MB traced, {big / 1e6:.0f} MB at {big_peak / 1e6:.0f} MB")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--seconds", type=float, default=5.0)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--turns", type=int, default=60)
+    ap.add_argument("--firestore-ms", type=float, default=20.0)
+    ap.add_argument("--cached", action="store_true", help="leave the doc/result caches on")
+    ap.add_argument("--out", help="write results as json")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    seed = os.path.join(tmp, "seed.json")
+    with open(seed, "w") as f:
+        json.dump({"test_drive": [make_test_drive_doc(args.turns)], "race_data": [make_race_data(300)]}, f)
+    check_body_limits(seed)
+
+    env = dict(os.environ, FIRESTORE_STANDIN=seed, FIRESTORE_STANDIN_LATENCY_MS=str(args.firestore_ms))
+    if not args.cached:
+        env.update(DOC_CACHE_SIZE="0", RESULT_CACHE_SIZE="0")
+
+    print(f"concurrency {args.concurrency}, {args.seconds:.0f}s per route, firestore {args.firestore_ms:.0f} ms, "
+          f"caches {'on' if args.cached else 'off'}, asgi workers {args.workers}")
+    results = {}
+    for kind in ("dev", "asgi"):
+        port = _free_port()
+        proc = start(kind, port, env, args.workers)
+        try:
+            for route in ("/dataForConfig", "/feedback"):
+                r = load(port, route, args.concurrency, args.seconds)
+                results[f"{kind} {route}"] = r
+                print(f"  {kind:<4} {route:<15} {r['req_per_s']:8.1f} req/s   p50 {r['p50_ms']:7.1f} ms   "
+                      f"p99 {r['p99_ms']:7.1f} ms   errors {r['errors']}")
+            if kind == "asgi":
+                dt, code = graceful_shutdown(port, proc)
+                results["asgi shutdown"] = {"seconds": dt, "exit_code": code}
+                print(f"  asgi SIGTERM with a live SSE client: exited {code} after {dt:.2f}s")
+        finally:
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
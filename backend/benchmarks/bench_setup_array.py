@@ -0,0 +1,117 @@
+import copy
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poc import DEMO_DOC, _clamp, _safe_get
+from setup_array import APPLY_ORDER, SETTING_PATHS, N_SLOTS, Setup, SetupLimits, apply_many
+
+# Array-backed Setup vs the nested-dict apply it replaced: parity on random
+# moves (limits, missing paths, ERS scaling) and cost per applied move.
+#   python backend/benchmarks/bench_setup_array.py
+
+
+def legacy_apply(setup, move, limits):
+    """apply_moves_in_order_and_clip before Setup (frozen reference)."""
+    s = copy.deepcopy(setup)
+
+    def _get_set(path, delta):
+        d = s
+        for k in path[:-1]:
+            d = d[k]
+        leaf = path[-1]
+        old = float(d.get(leaf, 0.0) or 0.0)
+        new_val = old + float(delta)
+        lim = limits.get(leaf) if isinstance(limits, dict) else None
+        if lim is None:
+            if leaf.startswith("pressures_psi"):
+                lo, hi = limits.get("pressures_psi", [None, None])
+                if lo is not None and hi is not None:
+                    new_val = _clamp(new_val, float(lo), float(hi))
+        else:
+            new_val = _clamp(new_val, float(lim[0]), float(lim[1]))
+        d[leaf] = new_val
+
+    def _ensure_path(s, path):
+        cur = s
+        for k in path[:-1]:
+            if k not in cur or not isinstance(cur[k], dict):
+                cur[k] = {}
+            cur = cur[k]
+
+    for key in APPLY_ORDER:
+        if key in move and key in SETTING_PATHS:
+            _ensure_path(s, SETTING_PATHS[key])
+            _get_set(SETTING_PATHS[key], move[key])
+    ers = [v for k, v in move.items() if k == "ers_exit_scale"]
+    if ers:
+        avg_cut = np.clip(np.mean(ers), -0.4, 0.0)
+        corner_deploy = _safe_get(s, "differential_and_power", "ers_corner_deployment", default={}) or {}
+        for ck in list(corner_deploy.keys()):
+            corner_deploy[ck] = float(corner_deploy[ck]) * (1.0 + avg_cut)
+        s["differential_and_power"]["ers_corner_deployment"] = corner_deploy
+    return s
+
+
+def _random_move(rng):
+    keys = rng.choice(APPLY_ORDER + ["ers_exit_scale", "unknown_key"], size=rng.integers(1, 12), replace=False)
+    return {str(k): float(rng.normal(0, 3)) for k in keys}
+
+
+def check_parity(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    base = DEMO_DOC["initial_setup"]
+    sparse = copy.deepcopy(base)
+    del sparse["alignment"]
+    sparse["brakes"]["brake_migration_map"] = None
+    limits = dict(DEMO_DOC["weights_and_constraints"]["absolute_limits"], rear=[3, 5], high_speed_bump=[1, 6])
+    for setup in (base, sparse):
+        compiled = SetupLimits.from_dict(limits)
+        parsed = Setup.from_json(setup)
+        for _ in range(n):
+            mv = _random_move(rng)
+            want = json.dumps(legacy_apply(setup, mv, limits))
+            got = json.dumps(parsed.apply(mv, compiled).to_json())
+            if want != got:
+                raise AssertionError(f"Setup.apply differs from legacy for {mv}")
+    assert Setup.from_json(base).to_json() == base, "round trip is not lossless"
+    print(f"setup parity OK: {2 * n} random moves")
+
+
+def measure(n=10_000, seed=1):
+    rng = np.random.default_rng(seed)
+    base = DEMO_DOC["initial_setup"]
+    limits = DEMO_DOC["weights_and_constraints"]["absolute_limits"]
+    moves = [{k: float(rng.normal(0, 1)) for k in APPLY_ORDER} for _ in range(n)]
+
+    t0 = time.perf_counter()
+    ref = [legacy_apply(base, m, limits) for m in moves]
+    t_legacy = time.perf_counter() - t0
+
+    parsed, compiled = Setup.from_json(base), SetupLimits.from_dict(limits)
+    t0 = time.perf_counter()
+    for m in moves:
+        parsed.apply(m, compiled)
+    t_setup = time.perf_counter() - t0
+
+    deltas = np.array([[m[k] for k in APPLY_ORDER] for m in moves])
+    t0 = time.perf_counter()
+    vals = apply_many(parsed, deltas, np.ones((n, N_SLOTS), dtype=bool), compiled)
+    t_many = time.perf_counter() - t0
+    assert all(vals[-1][i] == ref[-1][SETTING_PATHS[k][0]].get(SETTING_PATHS[k][-1], None) or len(SETTING_PATHS[k]) == 3
+               for i, k in enumerate(APPLY_ORDER))
+
+    print(f"{n} candidate moves")
+    print(f"  deepcopy + dict walk : {t_legacy / n * 1e6:8.2f} us/move")
+    print(f"  Setup.apply          : {t_setup / n * 1e6:8.2f} us/move")
+    print(f"  apply_many (batched) : {t_many / n * 1e6:8.3f} us/move")
+
+
+if __name__ == "__main__":
+    check_parity()
+    measure()
@@ -0,0 +1,161 @@
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import replace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from batch import apply_questionnaire
+from poc import DEMO_DOC, build_preferences_from_doc, compute_setup_from_doc
+from result_cache import doc_version
+from setup_plan import MAX_MOVE_SETS, PlanCache, SetupPlan
+from synth import make_test_drive_doc
+
+# Per-doc-version setup plans vs recomputing everything per questionnaire:
+# byte parity of the JSON response over random answer sets, the one-off plan
+# build cost, and the per-request saving at the engine and through the route.
+# One plan shared by many threads with more sensitivity vectors than its
+# move LRU holds still answers exactly like compute_setup_from_doc.
+#   python backend/benchmarks/bench_setup_plan.py
+#   python backend/benchmarks/bench_setup_plan.py --turns 6 100 1000 --requests 200
+
+
+def _questionnaires(n, seed):
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(n):
+        q = {
+            "rookie_stability_priority": float(rng.uniform(0.0, 1.0)),
+            "steering_weight_preference": str(rng.choice(["light", "medium", "heavy"])),
+            "throttle_pedal_linearity": float(rng.uniform(0.0, 1.0)),
+            "brake_pedal_linearity": float(rng.uniform(0.0, 1.0)),
+        }
+        if rng.random() < 0.1:
+            q["rookie_stability_priority"] = 0.0        # falsy: the engine falls back to 0.8
+        out.append(q)
+    return out
+
+
+def check_parity(docs, n=300, seed=0):
+    for name, doc in docs:
+        plan = SetupPlan(copy.deepcopy(doc))
+        for q in _questionnaires(n, seed):
+            calc_doc = apply_questionnaire(copy.deepcopy(doc), q)
+            prefs = build_preferences_from_doc(calc_doc)
+            want = json.dumps(compute_setup_from_doc(calc_doc, prefs))
+            got = json.dumps(plan.compute(calc_doc, prefs))
+            if want != got:
+                raise AssertionError(f"{name}: plan result differs for {q}")
+            if doc_version(calc_doc) != doc_version(doc):
+                raise AssertionError(f"{name}: doc_version depends on the answers")
+    print(f"plan parity OK: {len(docs)} docs x {n} questionnaires (byte-identical JSON)")
+
+
+def check_concurrent(doc, n_threads=8, rounds=40):
+    plan = SetupPlan(copy.deepcopy(doc))
+    base = build_preferences_from_doc(doc)
+    variants = [replace(base, wing_sensitivity=0.5 + 0.1 * k, toe_sensitivity=1.5 - 0.05 * k)
+                for k in range(2 * MAX_MOVE_SETS)]
+    want = [json.dumps(compute_setup_from_doc(copy.deepcopy(doc), p)) for p in variants]
+    bad = []
+
+    def run(t):
+        for r in range(rounds):
+            k = (t * 7 + r) % len(variants)
+            if json.dumps(plan.compute(doc, variants[k])) != want[k]:
+                bad.append((t, k))
+    threads = [threading.Thread(target=run, args=(t,)) for t in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not bad, f"{len(bad)} results differ under concurrency"
+    assert len(plan._moves) <= MAX_MOVE_SETS
+    print(f"concurrent plan OK: {n_threads} threads x {rounds} requests over {len(variants)} sensitivity sets")
+
+
+def _per_call_ms(fn, items, rounds=3):
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for it in items:
+            fn(*it)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(items) * 1e3
+
+
+def bench_engine(turns, n_requests, seed):
+    print(f"{'turns':>6} {'full ms':>10} {'plan ms':>10} {'speedup':>8} {'build ms':>10}")
+    for n in turns:
+        doc = make_test_drive_doc(n, seed)
+        items = []
+        for q in _questionnaires(n_requests, seed + 1):
+            calc_doc = apply_questionnaire(copy.deepcopy(doc), q)
+            items.append((calc_doc, build_preferences_from_doc(calc_doc)))
+        plan = SetupPlan(doc)
+        t_full = _per_call_ms(compute_setup_from_doc, items)
+        t_plan = _per_call_ms(plan.compute, items)
+        t_build = _per_call_ms(SetupPlan, [(doc,)] * 5)
+        print(f"{n:>6} {t_full:>10.3f} {t_plan:>10.3f} {t_full / t_plan:>7.1f}x {t_build:>10.3f}")
+
+
+def bench_route(turns, n_requests, seed):
+    tmp = tempfile.mkdtemp()
+    seed_path = os.path.join(tmp, "seed.json")
+    with open(seed_path, "w") as f:
+        json.dump({"test_drive": {"bench": make_test_drive_doc(6)}}, f)
+    os.environ["FIRESTORE_STANDIN"] = seed_path
+    os.environ["RESULT_CACHE_SIZE"] = "0"           # every request computes
+    import backend
+    import setup_plan
+    client = backend.app.test_client()
+
+    def post(q):
+        resp = client.post("/dataForConfig", json=q)
+        assert resp.status_code == 200, resp.status_code
+        return resp.get_json()
+
+    def full(q):
+        from poc import compute_setup_from_doc as _compute
+        calc_doc = apply_questionnaire(backend.docs.first_doc("test_drive"), q)
+        return _compute(calc_doc, build_preferences_from_doc(calc_doc))
+
+    print(f"{'turns':>6} {'route ms':>10} {'engine-only full ms':>20}")
+    for n in turns:
+        backend.db.collection("test_drive").document("bench").set(make_test_drive_doc(n, seed))
+        backend.docs.invalidate()
+        qs = [(q,) for q in _questionnaires(n_requests, seed + 2)]
+        assert post(qs[0][0]) == json.loads(json.dumps(full(qs[0][0])))
+        t_route = _per_call_ms(post, qs)
+        t_full = _per_call_ms(full, qs)
+        print(f"{n:>6} {t_route:>10.3f} {t_full:>20.3f}")
+    print(f"plan cache: {setup_plan.PLANS.stats()}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, nargs="+", default=[6, 100, 1000])
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--skip-route", action="store_true")
+    args = ap.parse_args()
+
+    docs = [("demo", DEMO_DOC)] + [(f"synth{n}", make_test_drive_doc(n, args.seed)) for n in (1, 37, 250)]
+    check_parity(docs)
+    check_concurrent(docs[2][1])
+    assert PlanCache(max_entries=2).get(DEMO_DOC) is not None
+    bench_engine(args.turns, args.requests, args.seed)
+    if not args.skip_route:
+        bench_route(args.turns, args.requests, args.seed)
+
+
+if __name__ == "__main__":
+    main()
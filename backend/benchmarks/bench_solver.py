@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import solver
+from poc import DEMO_DOC, build_cost_weights, build_preferences_from_doc
+from schema import INPUT_FIELDS
+from setup_array import APPLY_ORDER, Setup
+from solver import Objective, SolverOptions, sensitivity_model_for_doc, solve_setup
+from synth import make_test_drive_doc
+from turn_matrix import compile_rules_for_doc, compile_turns, huber_weights
+
+# Closed-loop solver: the sorted-moment objective matches a per-turn
+# evaluation of the CostWeights cost and its gradient matches finite
+# differences; solutions keep the total move within the step caps and
+# absolute limits, never increase the cost and are stationary; a session
+# built from a known setup error is solved down to its noise floor. Then
+# time sessions.
+#   python backend/benchmarks/bench_solver.py
+#   python backend/benchmarks/bench_solver.py --turns 1000 10000 100000
+
+
+def _objective(doc):
+    prefs = build_preferences_from_doc(doc)
+    rules = compile_rules_for_doc(doc)
+    tm = compile_turns(doc, rules.turn_fields)
+    model = sensitivity_model_for_doc(doc)
+    free = np.arange(len(APPLY_ORDER))
+    caps = solver.step_caps(doc["weights_and_constraints"]["per_turn_step_caps"])
+    unit = np.where(np.isfinite(caps), caps, 1.0)
+    return Objective(tm.errors, huber_weights(tm), model, build_cost_weights(prefs), free, unit), model, unit
+
+
+def naive_cost(obj, model, delta):
+    """Turn by turn, metric by metric."""
+    w = obj.weights
+    total = 0.0
+    for t in range(len(w)):
+        for c in range(len(INPUT_FIELDS)):
+            e = obj.errors[t, c] + sum(delta[s] * model.jacobian[s, c] for s in range(len(delta)))
+            r = e / model.scales[c]
+            if solver._ONE_SIDED[c] and r <= 0:
+                continue
+            total += w[t] * obj.term_weight[c] * r * r
+    return total + float(obj.pace @ delta) + float(obj.penalty @ (delta * delta))
+
+
+def check_objective(seed=0):
+    doc = make_test_drive_doc(60, seed=seed)
+    obj, model, unit = _objective(doc)
+    rng = np.random.default_rng(seed)
+    for _ in range(20):
+        delta = rng.normal(0, 0.5, len(APPLY_ORDER)) * unit
+        want = naive_cost(obj, model, delta)
+        cost, grad, _ = obj.linearise(delta)
+        assert abs(cost - want) <= 1e-9 * max(1.0, abs(want)), (cost, want)
+        assert abs(obj.cost(delta) - cost) <= 1e-12 * max(1.0, abs(cost))
+        h = 1e-6 * unit
+        fd = np.array([(obj.cost(delta + h * e) - obj.cost(delta - h * e)) / (2 * h[i])
+                       for i, e in enumerate(np.eye(len(delta)))])
+        assert np.allclose(grad, fd, rtol=1e-4, atol=1e-6), np.abs(grad - fd).max()
+    print("objective OK: sorted-moment cost equals the per-turn cost; gradient matches finite differences")
+
+
+def check_constraints(seed=0):
+    for doc in (DEMO_DOC, make_test_drive_doc(200, seed=seed)):
+        prefs = build_preferences_from_doc(doc)
+        res = solve_setup(doc, prefs, SolverOptions(max_iterations=200))
+        sv = res["diagnostics"]["solver"]
+        costs = [sv["cost"]["initial"]] + [h["cost"] for h in sv["history"]]
+        assert all(b < a for a, b in zip(costs, costs[1:])), costs        # every accepted step descends
+        assert sv["stop_reason"] == "converged", sv["stop_reason"]
+
+        wc = doc["weights_and_constraints"]
+        caps = solver.step_caps(wc["per_turn_step_caps"]) * solver.aggression_scale(prefs)
+        limits = solver.setting_limits(wc["absolute_limits"])
+        values = Setup.from_json(res["optimized_setup"]).values
+        assert np.all(values >= limits.lo) and np.all(values <= limits.hi)
+        assert np.all(limits.clip(values) == values)
+
+        # the caps bound the total move, as per_turn_step_caps does for the heuristic
+        x0 = Setup.from_json(doc["initial_setup"]).values
+        moved = np.nan_to_num(values - x0)
+        assert np.all(np.abs(moved) <= caps + 1e-9), np.max(np.abs(moved) / caps)
+        at_cap = np.abs(moved) >= caps - 1e-9
+
+        # stationary: the gradient vanishes on every setting strictly inside its limits
+        obj, _, unit = _objective(doc)
+        delta = values - x0
+        _, grad, _ = obj.linearise(delta)
+        inside = (values > limits.lo + 1e-9) & (values < limits.hi - 1e-9) & ~at_cap
+        assert np.abs(grad[inside] * unit[inside]).max() < 1e-3, np.abs(grad[inside] * unit[inside]).max()
+    print(f"constraints OK: descending cost, total move within the caps, absolute limits (pressures included), stationary solution "
+          f"({sv['iterations']} iterations, cost {sv['cost']['initial']:.3f} -> {sv['cost']['final']:.3f})")
+
+
+def check_recovery(seed=0, n_turns=400, noise=0.01):
+    """Turns generated from a known setup error: the balance/tyre cost drops to the noise floor."""
+    doc = make_test_drive_doc(n_turns, seed=seed)
+    doc["sensitivity_model"] = {"move_penalty": 0.0, "lap_time_s": {k: 0.0 for k in APPLY_ORDER}}
+    model = sensitivity_model_for_doc(doc)
+    off = np.zeros(len(APPLY_ORDER))
+    for k, v in {"front_wing_flap_deg": 0.3, "rear_wing_main_deg": -0.5, "diff_exit_percent": 4.0,
+                 "pressures_psi_fl": -0.3, "rear_toe_in_deg_total": 0.02}.items():
+        off[APPLY_ORDER.index(k)] = v
+    shift = -(off @ model.jacobian)                                 # what the mis-set car does to each metric
+    tg = doc["targets"]
+    goal = [tg["balance_goal"][f] for f in ("entry_oversteer_index", "mid_oversteer_index", "exit_oversteer_index")]
+    rng = np.random.default_rng(seed)
+    for t in doc["turns"]:
+        for i, f in enumerate(("entry_oversteer_index", "mid_oversteer_index", "exit_oversteer_index")):
+            t["balance"][f] = goal[i] + shift[i] + rng.normal(0, noise)
+        t["braking"]["brake_locking_risk_front"] = 0.0          # one-sided goals comfortably met
+        t["braking"]["brake_locking_risk_rear"] = 0.0
+        t["traction"]["traction_loss_index"] = 0.0
+        t["aero_ride"]["porpoising_amplitude_mm"] = -5.0
+        for j, c in enumerate(("fl", "fr", "rl", "rr")):
+            t["tyre"]["surface_temp_c"][c] = tg["tyre_goal"]["surface_temp_target_c"] + shift[7 + j] + rng.normal(0, 10 * noise)
+    res = solve_setup(doc, options=SolverOptions(max_iterations=200))
+    terms = res["diagnostics"]["solver"]["cost"]["terms"]
+
+    obj, _, _ = _objective(doc)
+    resid = obj.errors - obj.weights @ obj.errors                      # the best any common shift can do
+    floor = obj.term_weight @ (obj.weights @ ((resid / model.scales) ** 2))
+    got = terms["balance"] + terms["tyre"] + terms["stability"] + terms["ride"]
+    assert got <= floor * (1 + 1e-3) + 1e-9, (got, floor)
+    print(f"recovery OK: a {n_turns}-turn session with a known setup error solves to its noise floor "
+          f"(cost {res['diagnostics']['solver']['cost']['initial']:.2f} -> {got:.5f}, floor {floor:.5f})")
+
+
+def bench(turn_counts, seed=0):
+    print(f"{'turns':>7} {'decode ms':>10} {'solve ms':>9} {'iters':>6} {'50 iterations ms':>17}")
+    for n_turns in turn_counts:
+        doc = make_test_drive_doc(n_turns, seed=seed)
+        rules = compile_rules_for_doc(doc)
+        t0 = time.perf_counter()
+        compile_turns(doc, rules.turn_fields)
+        t_decode = time.perf_counter() - t0
+        best = float("inf")
+        for _ in range(3):
+            t0 = time.perf_counter()
+            res = solve_setup(doc)
+            best = min(best, time.perf_counter() - t0)
+        obj, _, _ = _objective(doc)
+        delta = np.zeros(len(APPLY_ORDER))
+        t0 = time.perf_counter()
+        for _ in range(50):                     # one linearisation + one trial cost per iteration
+            obj.linearise(delta)
+            obj.cost(delta)
+        t_iter = time.perf_counter() - t0
+        print(f"{n_turns:>7} {t_decode * 1e3:>10.1f} {best * 1e3:>9.1f} {res['diagnostics']['solver']['iterations']:>6} {t_iter * 1e3:>17.2f}")
+
+
+def check_route():
+    tmp = tempfile.mkdtemp()
+    seed_path = os.path.join(tmp, "seed.json")
+    with open(seed_path, "w") as f:
+        json.dump({"test_drive": {"td": DEMO_DOC}}, f)
+    os.environ["FIRESTORE_STANDIN"] = seed_path
+    import backend
+    client = backend.app.test_client()
+    q = {"rookie_stability_priority": 0.7, "steering_weight_preference": "light",
+         "throttle_pedal_linearity": 0.6, "brake_pedal_linearity": 0.5}
+    resp = client.post("/dataForConfig/solve", json=dict(q, start="heuristic",
+                                                         sensitivity={"settings": {"diff_entry_percent": {"balance.entry_oversteer_index": -0.02}}}))
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    body = resp.get_json()
+    assert body["diagnostics"]["solver"]["start"] == "heuristic"
+    assert body["diagnostics"]["solver"]["cost"]["final"] < body["diagnostics"]["solver"]["cost"]["initial"]
+    for bad in ({"start": "random"}, {"max_iterations": 0},
+                {"sensitivity": {"settings": {"no_such_setting": {}}}},
+                {"sensitivity": {"settings": {"diff_entry_percent": {"balance.nope": 1}}}}):
+        resp = client.post("/dataForConfig/solve", json=dict(q, **bad))
+        assert resp.status_code == 400, (bad, resp.get_json())
+    print("route OK: POST /dataForConfig/solve")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, nargs="+", default=[300, 5000, 50000])
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    check_objective(args.seed)
+    check_constraints(args.seed)
+    check_recovery(args.seed)
+    check_route()
+    bench(args.turns, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synth import make_race_data, make_test_drive_doc
+
+# Cold-start benchmark: spawn a fresh interpreter, import backend, and time
+# the first /healthz, /dataForConfig and /feedback responses through the
+# Flask test client (Firestore replaced by the local stand-in). Times are
+# measured from just before the spawn. --baseline REV runs the same probe
+# against an older revision of backend/ for comparison.
+#   python backend/benchmarks/bench_startup.py --runs 5 --baseline HEAD~1
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, sys, time
+t_spawn = float(sys.argv[1])
+marks = {"interpreter": time.time() - t_spawn}
+import backend
+marks["import_backend"] = time.time() - t_spawn
+client = backend.app.test_client()
+if "/healthz" in [r.rule for r in backend.app.url_map.iter_rules()]:
+    assert client.get("/healthz").status_code == 200
+    marks["first_healthz"] = time.time() - t_spawn
+q = {"rookie_stability_priority": 0.7, "steering_weight_preference": "medium",
+     "throttle_pedal_linearity": 0.6, "brake_pedal_linearity": 0.5}
+assert client.post("/dataForConfig", json=q).status_code == 200
+marks["first_dataForConfig"] = time.time() - t_spawn
+assert client.get("/feedback").status_code == 200
+marks["first_feedback"] = time.time() - t_spawn
+print(json.dumps(marks))
+"""
+
+FIREBASE_IMPORT = "import firebase_admin; from firebase_admin import credentials, firestore"
+
+
+def probe(backend_dir, env):
+    t_spawn = time.time()
+    out = subprocess.run([sys.executable, "-c", PROBE, repr(t_spawn)], cwd=backend_dir, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def firebase_import_s(runs):
+    samples = []
+    for _ in range(runs):
+        t0 = time.time()
+        r = subprocess.run([sys.executable, "-c", FIREBASE_IMPORT], capture_output=True)
+        if r.returncode != 0:
+            return None
+        samples.append(time.time() - t0)
+    t0 = time.time()
+    subprocess.run([sys.executable, "-c", "pass"])
+    bare = time.time() - t0
+    return max(0.0, float(np.median(samples)) - bare)
+
+
+def export_rev(rev):
+    tmp = tempfile.mkdtemp()
+    repo = os.path.dirname(BACKEND_DIR)
+    archive = subprocess.run(["git", "archive", rev, "backend"], cwd=repo, capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", tmp], input=archive, check=True)
+    return os.path.join(tmp, "backend")
+
+
+def summarize(label, runs):
+    keys = list(runs[0])
+    med = {k: float(np.median([r[k] for r in runs])) * 1e3 for k in keys}
+    print(f"{label}:")
+    for k, v in med.items():
+        print(f"  {k:<22} {v:8.1f} ms")
+    return med
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--turns", type=int, default=60)
+    ap.add_argument("--baseline", help="git revision to compare against, e.g. HEAD~1")
+    ap.add_argument("--out", help="write results as json")
+    args = ap.parse_args()
+
+    seed = os.path.join(tempfile.mkdtemp(), "seed.json")
+    with open(seed, "w") as f:
+        json.dump({"test_drive": [make_test_drive_doc(args.turns)], "race_data": [make_race_data(300)]}, f)
+    env = dict(os.environ, FIRESTORE_STANDIN=seed)
+    env.pop("BACKEND_WARMUP", None)
+
+    results = {"current": summarize("current", [probe(BACKEND_DIR, env) for _ in range(args.runs)])}
+    if args.baseline:
+        base_dir = export_rev(args.baseline)
+        results["baseline"] = summarize(f"baseline ({args.baseline})", [probe(base_dir, env) for _ in range(args.runs)])
+
+    fb = firebase_import_s(args.runs)
+    if fb is not None:
+        results["firebase_import_ms"] = fb * 1e3
+        print(f"firebase_admin + firestore import (deferred to first Firestore use): {fb * 1e3:.1f} ms")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
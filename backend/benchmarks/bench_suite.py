@@ -0,0 +1,241 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synth import make_race_data, make_test_drive_doc
+
+# Regression benchmark suite for the hot paths.
+#
+# Times every stage of compute_setup_from_doc on synthetic test_drive docs
+# (N turns), generate_report on synthetic race_data docs (M events), and the
+# Flask routes end to end through the test client with Firestore replaced by
+# the local stand-in. --out writes the results to a JSON file (keep it
+# outside the source tree); --compare flags anything slower than a previous
+# run by more than --tolerance.
+#   python backend/benchmarks/bench_suite.py --out /tmp/bench.json
+#   python backend/benchmarks/bench_suite.py --compare /tmp/bench.json
+
+
+def timed(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1e3)
+    ms = np.array(samples)
+    return {
+        "repeat": repeat,
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.median(ms)),
+        "min_ms": float(ms.min()),
+        "max_ms": float(ms.max()),
+    }
+
+
+def _repeat_for(size, budget):
+    return max(3, min(50, budget // max(size, 1)))
+
+# ---------- Setup pipeline ----------
+
+def bench_setup(n_turns, seed, budget):
+    from poc import (
+        validate_schema, build_preferences_from_doc, rule_table_for_doc,
+        propose_turn_changes, aggregate_moves, apply_moves_in_order_and_clip,
+        compute_setup_from_doc, _safe_get,
+    )
+    from turn_matrix import compile_rules_for_doc, compile_turns, compute_setup_from_doc_vectorized
+    from setup_plan import SetupPlan
+
+    doc = make_test_drive_doc(n_turns, seed)
+    prefs = build_preferences_from_doc(doc)
+    rules = rule_table_for_doc(doc)
+    caps = _safe_get(doc, "weights_and_constraints", "per_turn_step_caps", default={}) or {}
+    limits = _safe_get(doc, "weights_and_constraints", "absolute_limits", default={}) or {}
+    td = validate_schema(doc)
+    errs = [td.error_vector(i) for i in range(td.n_turns)]
+    moves = [propose_turn_changes(t, e, caps, prefs, rules) for t, e in zip(doc["turns"], errs)]
+    weights = [td.corner_weight(i) for i in range(td.n_turns)]
+    agg = aggregate_moves(moves, weights)
+    compiled = compile_rules_for_doc(doc)
+    plan = SetupPlan(doc)
+
+    stages = {
+        "validate_schema": lambda: validate_schema(doc),
+        "build_preferences": lambda: build_preferences_from_doc(doc),
+        "rule_table_for_doc": lambda: rule_table_for_doc(doc),
+        "error_vectors": lambda: [td.error_vector(i) for i in range(td.n_turns)],
+        "corner_weights": lambda: [td.corner_weight(i) for i in range(td.n_turns)],
+        "propose_turn_changes": lambda: [propose_turn_changes(t, e, caps, prefs, rules) for t, e in zip(doc["turns"], errs)],
+        "aggregate_moves": lambda: aggregate_moves(moves, weights),
+        "apply_and_clip": lambda: apply_moves_in_order_and_clip(doc["initial_setup"], agg, limits),
+        "compute_setup_from_doc": lambda: compute_setup_from_doc(doc, prefs),
+        "vectorized.compile_turns": lambda: compile_turns(doc, compiled.turn_fields),
+        "vectorized.compute_setup": lambda: compute_setup_from_doc_vectorized(doc, prefs),
+        "plan.build": lambda: SetupPlan(doc),
+        "plan.compute": lambda: plan.compute(doc, prefs),
+    }
+    repeat = _repeat_for(n_turns, budget)
+    return [dict(name=f"setup.{k}", params={"turns": n_turns}, **timed(fn, repeat)) for k, fn in stages.items()]
+
+# ---------- Health report ----------
+
+def bench_health(n_events, seed, budget):
+    from health import HealthAccumulator, generate_report
+
+    race = make_race_data(n_events, seed)
+    acc = HealthAccumulator(race).extend(race["significant_events"])
+    stages = {
+        "generate_report": lambda: generate_report(race),
+        "accumulate": lambda: HealthAccumulator(race).extend(race["significant_events"]),
+        "snapshot": acc.snapshot,
+    }
+    repeat = _repeat_for(n_events, budget * 20)
+    return [dict(name=f"health.{k}", params={"events": n_events}, **timed(fn, repeat)) for k, fn in stages.items()]
+
+# ---------- Routes ----------
+
+def _load_backend(seed_path):
+    os.environ["FIRESTORE_STANDIN"] = seed_path
+    import backend
+    return backend
+
+
+def bench_routes(n_turns, n_events, seed, repeat):
+    tmp = tempfile.mkdtemp()
+    seed_path = os.path.join(tmp, "seed.json")
+    with open(seed_path, "w") as f:
+        json.dump({"test_drive": {"bench": make_test_drive_doc(6)}, "race_data": {"bench": make_race_data(10)}}, f)
+    backend = _load_backend(seed_path)
+    client = backend.app.test_client()
+    out = []
+
+    counter = [0]
+
+    def questionnaire():
+        counter[0] += 1          # a fresh answer set every call defeats the result cache
+        return {
+            "rookie_stability_priority": 0.5 + (counter[0] % 1000) / 4000,
+            "steering_weight_preference": "medium",
+            "throttle_pedal_linearity": 0.6,
+            "brake_pedal_linearity": 0.5,
+        }
+
+    fixed = questionnaire()
+
+    def post(q, **kw):
+        resp = client.post("/dataForConfig", json=q, **kw)
+        assert resp.status_code in (200, 304), resp.status_code
+        return resp
+
+    def feedback():
+        resp = client.get("/feedback")
+        assert resp.status_code == 200, resp.status_code
+
+    def uncached():
+        backend.docs.invalidate()
+        post(questionnaire())
+
+    for turns in n_turns:
+        backend.db.collection("test_drive").document("bench").set(make_test_drive_doc(turns, seed))
+        etag = post(fixed).headers["ETag"]
+        cases = {
+            "dataForConfig.doc_and_result_miss": uncached,
+            "dataForConfig.result_miss": lambda: post(questionnaire()),
+            "dataForConfig.result_hit": lambda: post(fixed),
+            "dataForConfig.not_modified": lambda: post(fixed, headers={"If-None-Match": etag}),
+        }
+        for k, fn in cases.items():
+            out.append(dict(name=f"route.{k}", params={"turns": turns}, **timed(fn, repeat)))
+
+    for events in n_events:
+        backend.db.collection("race_data").document("bench").set(make_race_data(events, seed))
+        out.append(dict(name="route.feedback", params={"events": events}, **timed(feedback, repeat)))
+        backend.docs.invalidate("race_data")
+        out.append(dict(name="route.feedback.doc_miss", params={"events": events},
+                        **timed(lambda: (backend.docs.invalidate("race_data"), feedback()), repeat)))
+    return out
+
+# ---------- Output ----------
+
+def _meta(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def _key(r):
+    return r["name"], json.dumps(r["params"], sort_keys=True)
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        base = {_key(r): r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        b = base.get(_key(r))
+        if b and b["p50_ms"] > 0 and r["p50_ms"] / b["p50_ms"] > tolerance:
+            regressions.append((r, b))
+    for r, b in regressions:
+        print(f"REGRESSION {r['name']} {r['params']}: p50 {b['p50_ms']:.3f} -> {r['p50_ms']:.3f} ms "
+              f"(x{r['p50_ms'] / b['p50_ms']:.2f})")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, nargs="+", default=[6, 100, 1000])
+    ap.add_argument("--events", type=int, nargs="+", default=[100, 10_000, 100_000])
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--budget", type=int, default=2000, help="turns x repeats per stage (controls repeat counts)")
+    ap.add_argument("--route-repeat", type=int, default=20)
+    ap.add_argument("--skip-routes", action="store_true")
+    ap.add_argument("--out", help="write results as json (nothing is written by default)")
+    ap.add_argument("--compare", help="previous --out file to check for regressions")
+    ap.add_argument("--tolerance", type=float, default=1.25, help="allowed p50 slowdown ratio")
+    args = ap.parse_args()
+
+    results = []
+    for n in args.turns:
+        results += bench_setup(n, args.seed, args.budget)
+    for m in args.events:
+        results += bench_health(m, args.seed, args.budget)
+    if not args.skip_routes:
+        results += bench_routes(args.turns, args.events, args.seed, args.route_repeat)
+
+    for r in results:
+        print(f"{r['name']:<42} {json.dumps(r['params']):<18} p50 {r['p50_ms']:10.3f} ms  mean {r['mean_ms']:10.3f} ms")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"meta": _meta(args), "results": results}, f, indent=2)
+        print(f"wrote {len(results)} results to {args.out}")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
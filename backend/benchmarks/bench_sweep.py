@@ -0,0 +1,77 @@
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import apply_questionnaire
+from poc import compute_setup_from_doc
+from sweep import MAX_GRID_POINTS, sweep_preferences
+from synth import make_test_drive_doc
+
+# One vectorized sweep vs one /dataForConfig-equivalent call per grid point.
+# Oversized grids are refused before any axis is built.
+#   python backend/benchmarks/bench_sweep.py
+
+AXES = {
+    "stability_bias": {"start": 0.4, "stop": 1.0, "num": 13},
+    "throttle_linearity": [0.7, 0.85, 1.0],
+    "brake_pedal_linearity": [0.8, 0.9],
+    "steering_weight_preference": ["light", "medium", "heavy"],
+}
+
+
+def per_point(doc, axes):
+    out = []
+    for s in axes["stability_bias"]:
+        for th in axes["throttle_linearity"]:
+            for br in axes["brake_pedal_linearity"]:
+                for st in axes["steering_weight_preference"]:
+                    q = {"rookie_stability_priority": s, "steering_weight_preference": st,
+                         "throttle_pedal_linearity": th, "brake_pedal_linearity": br}
+                    out.append(compute_setup_from_doc(apply_questionnaire(copy.deepcopy(doc), q)))
+    return out
+
+
+def check_limits():
+    doc = make_test_drive_doc(6, seed=4)
+    for axes in ({"stability_bias": {"start": 0.0, "stop": 1.0, "num": 10 ** 9}},
+                 {"stability_bias": {"start": 0.0, "stop": 1.0, "num": 100}, "aggression": [0.5] * 100}):
+        t0 = time.perf_counter()
+        try:
+            sweep_preferences(doc, axes)
+        except ValueError as exc:
+            assert "points" in str(exc), exc
+        else:
+            raise AssertionError("an oversized grid was accepted")
+        assert time.perf_counter() - t0 < 0.1, "the grid was built before the size check"
+    print(f"limits OK: grids past {MAX_GRID_POINTS} points are refused before any axis is built")
+
+
+def run(n_turns=300):
+    doc = make_test_drive_doc(n_turns, seed=4)
+    t0 = time.perf_counter()
+    res = sweep_preferences(doc, AXES)
+    t_sweep = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ref = per_point(doc, res["axes"])
+    t_ref = time.perf_counter() - t0
+
+    worst = 0.0
+    for p, r in zip(res["points"], ref):
+        want = r["diagnostics"]["aggregated_move"]
+        if list(want) != list(p["aggregated_move"]):
+            raise AssertionError("sweep key order differs from /dataForConfig")
+        worst = max(worst, max(abs(want[k] - p["aggregated_move"][k]) for k in want))
+        if r["optimized_setup"]["controls"] != p["optimized_setup"]["controls"]:
+            raise AssertionError("sweep controls differ from /dataForConfig")
+    print(f"{res['summary']['n_points']} grid points x {n_turns} turns")
+    print(f"  per-point calls: {t_ref * 1e3:8.1f} ms")
+    print(f"  one sweep      : {t_sweep * 1e3:8.1f} ms  x{t_ref / t_sweep:.1f}  (max |delta move| {worst:.2e})")
+
+
+if __name__ == "__main__":
+    check_limits()
+    run()
@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poc import compute_setup_from_doc
+from turn_matrix import compute_setup_from_doc_vectorized
+from synth import make_test_drive_doc
+
+# Scalar vs turn-matrix engine: checks byte-identical output and reports speedup.
+#   python backend/benchmarks/bench_turn_matrix.py
+
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def run(sizes=(10, 1_000, 100_000)):
+    rows = []
+    for n in sizes:
+        doc = make_test_drive_doc(n, seed=n)
+        repeat = 5 if n <= 1_000 else 1
+        t_ref, ref = _best_of(lambda: compute_setup_from_doc(doc), repeat)
+        t_vec, vec = _best_of(lambda: compute_setup_from_doc_vectorized(doc), repeat)
+        if json.dumps(ref) != json.dumps(vec):
+            raise AssertionError(f"turn-matrix output differs from scalar path at n={n}")
+        rows.append({
+            "turns": n,
+            "scalar_s": t_ref,
+            "vectorized_s": t_vec,
+            "speedup": t_ref / t_vec,
+        })
+        print(f"{n:>8} turns  scalar {t_ref * 1e3:10.2f} ms  vectorized {t_vec * 1e3:9.2f} ms  x{t_ref / t_vec:6.1f}")
+    return rows
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,119 @@
+import dataclasses
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poc import (
+    UserPreferences,
+    build_preferences_from_doc,
+    compute_setup_from_doc,
+    propose_turn_changes,
+    validate_schema,
+    _clamp,
+    _dict_scale_inplace,
+)
+from turn_matrix import compute_setup_from_doc_vectorized
+from synth import make_test_drive_doc
+
+# Parity check: default_rules.json (scalar evaluator and compiled kernel)
+# against the hand-written if-chain it replaced.
+#   python backend/benchmarks/check_rule_parity.py
+
+
+def legacy_propose_turn_changes(turn, errs, caps, prefs):
+    """propose_turn_changes as it was before the rule table (frozen reference)."""
+    e = errs
+    move = {}
+
+    if e["d_entry"] > +0.10:
+        move["brake_bias_percent_front"] = move.get("brake_bias_percent_front", 0) + ( +0.4 * prefs.brake_bias_sensitivity )
+        move["diff_entry_percent"]       = move.get("diff_entry_percent", 0)       + ( +3.0 * prefs.diff_sensitivity )
+        move["front_wing_flap_deg"]      = move.get("front_wing_flap_deg", 0)      + ( -0.2 * prefs.wing_sensitivity )
+    if e["d_entry"] < -0.10:
+        move["brake_bias_percent_front"] = move.get("brake_bias_percent_front", 0) + ( -0.3 * prefs.brake_bias_sensitivity )
+        move["diff_entry_percent"]       = move.get("diff_entry_percent", 0)       + ( -2.0 * prefs.diff_sensitivity )
+        move["front_wing_flap_deg"]      = move.get("front_wing_flap_deg", 0)      + ( +0.2 * prefs.wing_sensitivity )
+
+    if e["d_mid"] < -0.08:
+        move["front_wing_flap_deg"]      = move.get("front_wing_flap_deg", 0)      + ( +0.3 * prefs.wing_sensitivity )
+        move["front_toe_out_deg_total"]  = move.get("front_toe_out_deg_total", 0)  + ( +0.01 * prefs.toe_sensitivity )
+        if float(turn["track_env"]["kerb_impact_g"]) > 0.8:
+            move["high_speed_bump"]      = move.get("high_speed_bump", 0)          + ( -1.0 * prefs.damper_sensitivity )
+
+    if e["d_mid"] > +0.08:
+        move["rear_wing_main_deg"]       = move.get("rear_wing_main_deg", 0)       + ( +0.3 * prefs.wing_sensitivity )
+        move["front_wing_flap_deg"]      = move.get("front_wing_flap_deg", 0)      + ( -0.1 * prefs.wing_sensitivity )
+
+    if e["d_exit"] > +0.10 or e["traction_excess"] > 0.10:
+        move["diff_exit_percent"]        = move.get("diff_exit_percent", 0)        + ( -3.0 * prefs.diff_sensitivity )
+        move["rear_arb_steps"]           = move.get("rear_arb_steps", 0)           + ( -1.0 * prefs.arb_sensitivity )
+        move["ers_exit_scale"]           = move.get("ers_exit_scale", 0)           + ( -0.2 )
+
+    if e["d_exit"] < -0.10 and e["traction_excess"] < -0.05:
+        move["diff_exit_percent"]        = move.get("diff_exit_percent", 0)        + ( +2.0 * prefs.diff_sensitivity )
+
+    if e["lock_front_excess"] > 0.05:
+        move["brake_bias_percent_front"] = move.get("brake_bias_percent_front", 0) + ( -0.3 * prefs.brake_bias_sensitivity )
+        move["brake_migration_map"]      = move.get("brake_migration_map", 0)      + ( +1.0 )
+
+    if e["lock_rear_excess"] > 0.05:
+        move["brake_bias_percent_front"] = move.get("brake_bias_percent_front", 0) + ( +0.2 * prefs.brake_bias_sensitivity )
+
+    rr_hot = e.get("surf_rr_excess", 0.0)
+    rl_hot = e.get("surf_rl_excess", 0.0)
+    if rr_hot > 5.0 or rl_hot > 5.0:
+        move["pressures_psi_rr"]         = move.get("pressures_psi_rr", 0)         + ( -0.3 * prefs.pressure_sensitivity )
+        move["pressures_psi_rl"]         = move.get("pressures_psi_rl", 0)         + ( -0.3 * prefs.pressure_sensitivity )
+        move["diff_exit_percent"]        = move.get("diff_exit_percent", 0)        + ( -1.0 * prefs.diff_sensitivity )
+
+    fl_hot = e.get("surf_fl_excess", 0.0)
+    fr_hot = e.get("surf_fr_excess", 0.0)
+    if fl_hot > 5.0 or fr_hot > 5.0:
+        move["pressures_psi_fl"]         = move.get("pressures_psi_fl", 0)         + ( -0.3 * prefs.pressure_sensitivity )
+        move["pressures_psi_fr"]         = move.get("pressures_psi_fr", 0)         + ( -0.3 * prefs.pressure_sensitivity )
+
+    if e["porpoise_excess"] > 0.2 or float(turn["aero_ride"]["bottoming_risk_index"]) > 0.4:
+        move["ride_height_rear_mm"]      = move.get("ride_height_rear_mm", 0)      + ( +2.0 * prefs.ride_height_sensitivity )
+        move["beam_wing_slot_gap_mm"]    = move.get("beam_wing_slot_gap_mm", 0)    + ( +0.5 )
+
+    capped = {}
+    for k, v in move.items():
+        cap = abs(float(caps.get(k, v if v != 0 else 1.0)))
+        capped[k] = _clamp(v, -cap, cap)
+    _dict_scale_inplace(capped, 0.7 + 0.6 * prefs.aggression)
+    return capped
+
+
+def _random_prefs(doc, rng):
+    base = build_preferences_from_doc(doc)
+    sens = {f.name: float(rng.uniform(0.0, 2.0)) for f in dataclasses.fields(UserPreferences) if f.name.endswith("_sensitivity")}
+    return dataclasses.replace(base, aggression=float(rng.uniform(0.0, 1.0)), **sens)
+
+
+def run(n_docs=20, n_turns=300, seed=0):
+    rng = np.random.default_rng(seed)
+    caps = None
+    for i in range(n_docs):
+        doc = make_test_drive_doc(n_turns, seed=seed + i)
+        caps = doc["weights_and_constraints"]["per_turn_step_caps"]
+        prefs = _random_prefs(doc, rng)
+        td = validate_schema(doc)
+        for i, t in enumerate(doc["turns"]):
+            errs = td.error_vector(i)
+            want = legacy_propose_turn_changes(t, errs, caps, prefs)
+            got = propose_turn_changes(t, errs, caps, prefs)
+            if list(want.items()) != list(got.items()):
+                raise AssertionError(f"rule table differs from legacy chain on {t['turn_id']}: {want} != {got}")
+        scalar = compute_setup_from_doc(doc, prefs)
+        vectorized = compute_setup_from_doc_vectorized(doc, prefs)
+        if json.dumps(scalar) != json.dumps(vectorized):
+            raise AssertionError(f"compiled rule kernel differs from scalar path (doc {i})")
+    print(f"rule parity OK: {n_docs} docs x {n_turns} turns")
+
+
+if __name__ == "__main__":
+    run()
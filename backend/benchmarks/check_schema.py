@@ -0,0 +1,156 @@
+import copy
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from health import HealthAccumulator, generate_report
+from poc import DEMO_DOC, compute_corner_weight, error_vector_for_turn
+from schema import SchemaError, decode_race_data, decode_test_drive
+from synth import make_race_data, make_test_drive_doc
+
+# Typed decoding checks: decoded records reproduce the dict-walking readers
+# they replaced, and malformed documents fail with the right path (and the
+# right HTTP status through the routes).
+#   python backend/benchmarks/check_schema.py
+
+
+def legacy_peaks(race_data):
+    """The event fold of generate_report before schema.decode_race_data (frozen reference)."""
+    lat = vert = 0
+    for event in race_data.get("significant_events", []):
+        g = event.get("g_forces", {})
+        if abs(g.get("lateral_peak_g", 0)) > abs(lat):
+            lat = g.get("lateral_peak_g")
+        if abs(g.get("vertical_peak_g", 0)) > abs(vert):
+            vert = g.get("vertical_peak_g")
+    return lat, vert
+
+
+def legacy_error_vector(turn, doc):
+    """poc.error_vector_for_turn before schema.decode_test_drive (frozen reference)."""
+    bg, sg, tg = doc["targets"]["balance_goal"], doc["targets"]["stability_goal"], doc["targets"]["tyre_goal"]
+    e = {f"d_{p}": float(turn["balance"][f"{p}_oversteer_index"]) - float(bg[f"{p}_oversteer_index"])
+         for p in ("entry", "mid", "exit")}
+    for key, (section, name) in {"lock_front_excess": ("braking", "brake_locking_risk_front"),
+                                 "lock_rear_excess": ("braking", "brake_locking_risk_rear"),
+                                 "traction_excess": ("traction", "traction_loss_index"),
+                                 "porpoise_excess": ("aero_ride", "porpoising_amplitude_mm")}.items():
+        e[key] = float(turn[section][name]) - float(sg[name])
+    for ax in ("fl", "fr", "rl", "rr"):
+        e[f"surf_{ax}_excess"] = float(turn["tyre"]["surface_temp_c"][ax]) - float(tg["surface_temp_target_c"])
+    return e
+
+
+def legacy_corner_weight(turn, doc):
+    """poc.compute_corner_weight before schema.decode_test_drive (frozen reference)."""
+    cap = float(doc.get("weights_and_constraints", {}).get("time_loss_weight_cap", 3.0) or 3.0)
+    tlw = float(turn.get("time_loss_weight", 1.0) or 1.0)
+    occ = float(turn.get("occurrence_rate", 1.0) or 1.0)
+    dcw = float(turn.get("driver_confidence_weight", 1.0) or 1.0)
+    rsp = float(doc.get("metadata", {}).get("rookie_stability_priority", 0.8) or 0.8)
+    return min(cap, tlw * occ * dcw * rsp)
+
+
+def check_records(n_docs=20):
+    for seed in range(n_docs):
+        doc = make_test_drive_doc(1 + 37 * seed, seed)
+        td = decode_test_drive(doc)
+        for i, t in enumerate(doc["turns"]):
+            want = legacy_error_vector(t, doc)
+            assert td.error_vector(i) == want and list(td.error_vector(i)) == list(want), (seed, i)     # order too
+            assert td.corner_weight(i) == legacy_corner_weight(t, doc), (seed, i)
+            assert error_vector_for_turn(t, doc) == want and compute_corner_weight(t, doc) == td.corner_weight(i), (seed, i)
+        race = make_race_data(50 * seed, seed)
+        acc = HealthAccumulator.from_record(decode_race_data(race))
+        assert (acc.peak_lateral_g, acc.peak_vertical_g) == legacy_peaks(race), seed
+        assert generate_report(race) == HealthAccumulator(race).extend(race["significant_events"]).snapshot()
+    turn = DEMO_DOC["turns"][0]
+    partial = {"targets": DEMO_DOC["targets"]}          # the per-turn helpers read nothing else
+    assert error_vector_for_turn(turn, partial) == legacy_error_vector(turn, DEMO_DOC)
+    assert compute_corner_weight(turn, {}) == legacy_corner_weight(turn, {})
+    assert error_vector_for_turn(turn, dict(DEMO_DOC, turns=[None])) == legacy_error_vector(turn, DEMO_DOC)
+    print(f"record parity OK: {n_docs} test_drive docs, {n_docs} race_data docs; per-turn helpers accept partial docs")
+
+
+def _broken(doc, edit):
+    doc = copy.deepcopy(doc)
+    edit(doc)
+    return doc
+
+
+BAD_TEST_DRIVES = [
+    (lambda d: d.pop("targets"), "targets"),
+    (lambda d: d.update(turns=[]), "turns"),
+    (lambda d: d["targets"]["balance_goal"].pop("mid_oversteer_index"), "targets.balance_goal.mid_oversteer_index"),
+    (lambda d: d["turns"][3]["braking"].update(brake_locking_risk_front="abc"), "turns[3].braking.brake_locking_risk_front"),
+    (lambda d: d["turns"][2]["tyre"]["surface_temp_c"].pop("rl"), "turns[2].tyre.surface_temp_c.rl"),
+    (lambda d: d["turns"][1].update(balance=[0.1, 0.2]), "turns[1].balance"),
+    (lambda d: d["turns"][0].update(time_loss_weight="heavy"), "turns[0].time_loss_weight"),
+    (lambda d: d["turns"].append(None), "turns[6]"),
+    (lambda d: d["metadata"].update(rookie_stability_priority="high"), "metadata.rookie_stability_priority"),
+    (lambda d: d["weights_and_constraints"]["per_turn_step_caps"].update(rear_arb_steps=None), "weights_and_constraints.per_turn_step_caps.rear_arb_steps"),
+    (lambda d: d["weights_and_constraints"]["absolute_limits"].update(pressures_psi=[20.0]), "weights_and_constraints.absolute_limits.pressures_psi"),
+]
+
+BAD_RACE_DATA = [
+    (lambda r: r.update(significant_events={}), "significant_events"),
+    (lambda r: r["significant_events"].__setitem__(2, "kerb"), "significant_events[2]"),
+    (lambda r: r["significant_events"][4].update(g_forces=None), "significant_events[4].g_forces"),
+    (lambda r: r["significant_events"][1]["g_forces"].update(lateral_peak_g="5g"), "significant_events[1].g_forces.lateral_peak_g"),
+    (lambda r: r.update(hpc_race_summary_estimates={"peak_neck_load_equivalent_kg": "n/a"}), "hpc_race_summary_estimates.peak_neck_load_equivalent_kg"),
+]
+
+
+def check_errors():
+    cases = [(decode_test_drive, _broken(DEMO_DOC, edit), path) for edit, path in BAD_TEST_DRIVES]
+    cases += [(decode_race_data, _broken(make_race_data(10, 0), edit), path) for edit, path in BAD_RACE_DATA]
+    for decode, doc, path in cases:
+        try:
+            decode(doc)
+        except SchemaError as exc:
+            assert exc.path == path, f"expected {path!r}, got {exc.path!r} ({exc})"
+        else:
+            raise AssertionError(f"{path}: accepted a malformed doc")
+    print(f"error paths OK: {len(cases)} malformed docs")
+
+
+def check_routes():
+    tmp = tempfile.mkdtemp()
+    seed_path = os.path.join(tmp, "seed.json")
+    with open(seed_path, "w") as f:
+        json.dump({"test_drive": {"td": DEMO_DOC}, "race_data": {"rd": make_race_data(10)}}, f)
+    os.environ["FIRESTORE_STANDIN"] = seed_path
+    import backend
+    client = backend.app.test_client()
+    q = {"rookie_stability_priority": 0.7, "steering_weight_preference": "light",
+         "throttle_pedal_linearity": 0.6, "brake_pedal_linearity": 0.5}
+
+    def expect(resp, status, path=None):
+        assert resp.status_code == status, (resp.status_code, resp.get_data(as_text=True))
+        if path is not None:
+            assert resp.get_json()["path"] == path, resp.get_json()
+
+    expect(client.post("/dataForConfig", json=dict(q, throttle_pedal_linearity="linear")), 400, "throttle_pedal_linearity")
+    expect(client.post("/dataForConfig", json={k: v for k, v in q.items() if k != "rookie_stability_priority"}), 400, "rookie_stability_priority")
+    expect(client.post("/dataForConfig", json=[q]), 400, "")
+    expect(client.post("/feedback/events", data=b'{"g_forces": {"lateral_peak_g": 3.1}}\n{"g_forces": {"vertical_peak_g": "x"}}\n'),
+           400, "g_forces.vertical_peak_g")
+    expect(client.get("/feedback"), 200)
+    expect(client.post("/dataForConfig/sessions", json=dict(q, half_life_days=-1)), 400)
+    expect(client.post("/dataForConfig/sessions", json=dict(q, page_size="x")), 400)
+
+    backend.db.collection("test_drive").document("td").set(_broken(DEMO_DOC, BAD_TEST_DRIVES[3][0]))
+    backend.docs.invalidate()
+    expect(client.post("/dataForConfig", json=q), 500, "turns[3].braking.brake_locking_risk_front")
+    expect(client.post("/dataForConfig/sessions", json=q), 500, "turns[3].braking.brake_locking_risk_front")
+    print("routes OK: 400 for malformed requests, 500 naming the path for a malformed stored doc")
+
+
+if __name__ == "__main__":
+    check_records()
+    check_errors()
+    check_routes()
@@ -0,0 +1,185 @@
+import copy
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from poc import DEMO_DOC
+
+# Synthetic test_drive docs derived from DEMO_DOC: the six demo turns are
+# cycled and every numeric telemetry field is jittered with a seeded RNG,
+# so a doc with N turns looks like N corner samples from a long session.
+
+_JITTER = {
+    "balance": 0.08,
+    "braking": 0.06,
+    "traction": 0.08,
+    "aero_ride": 0.15,
+    "track_env": 0.25,
+}
+
+
+def _jitter_turn(turn, rng, idx):
+    t = copy.deepcopy(turn)
+    t["turn_id"] = f"{turn['turn_id']}_{idx}"
+    for section, sigma in _JITTER.items():
+        for k, v in t[section].items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                t[section][k] = float(v) + float(rng.normal(0.0, sigma))
+    for ax, v in t["tyre"]["surface_temp_c"].items():
+        t["tyre"]["surface_temp_c"][ax] = float(v) + float(rng.normal(0.0, 4.0))
+    t["driver_confidence_weight"] = float(np.clip(rng.normal(1.1, 0.15), 0.5, 1.5))
+    return t
+
+
+def make_test_drive_doc(n_turns, seed=0):
+    """DEMO_DOC with `n_turns` jittered turns (deterministic for a given seed)."""
+    rng = np.random.default_rng(seed)
+    doc = copy.deepcopy(DEMO_DOC)
+    base = DEMO_DOC["turns"]
+    doc["turns"] = [_jitter_turn(base[i % len(base)], rng, i) for i in range(n_turns)]
+    return doc
+
+
+# Synthetic race_data docs for the health report: `significant_events` with
+# seeded lateral/vertical peaks, a share of SustainedHighG events with
+# durations, and HPC summary estimates.
+
+_EVENT_TYPES = ["SustainedHighG", "KerbStrike", "HeavyBraking", "Lockup"]
+
+
+def make_race_event(rng, idx):
+    kind = _EVENT_TYPES[int(rng.integers(len(_EVENT_TYPES)))]
+    event = {
+        "event_id": idx,
+        "timestamp_ms": idx * 250,
+        "event_type": kind,
+        "g_forces": {
+            "lateral_peak_g": round(float(rng.normal(0.0, 2.5)), 3),
+            "vertical_peak_g": round(float(abs(rng.normal(1.0, 1.8))), 3),
+        },
+    }
+    if kind == "SustainedHighG":
+        event["duration_ms"] = int(rng.integers(200, 4000))
+    return event
+
+
+def iter_race_events(n_events, seed=0):
+    """Deterministic event generator (nothing is materialized)."""
+    rng = np.random.default_rng(seed)
+    for i in range(n_events):
+        yield make_race_event(rng, i)
+
+
+def make_race_data(n_events, seed=0):
+    """A race_data doc with `n_events` significant_events (deterministic for a given seed)."""
+    rng = np.random.default_rng(seed + 1)
+    return {
+        "driver_id": f"driver_{seed}",
+        "track_name": "monza",
+        "cockpit_temp_c": round(float(rng.uniform(35, 55)), 1),
+        "hpc_race_summary_estimates": {
+            "estimated_total_fluid_loss_l": round(float(rng.uniform(1.5, 3.5)), 2),
+            "peak_neck_load_equivalent_kg": round(float(rng.uniform(15, 30)), 1),
+            "cumulative_spinal_compression_events": int(rng.integers(0, 30)),
+        },
+        "significant_events": list(iter_race_events(n_events, seed)),
+    }
+
+
+# Synthetic lap traces for lap_traces.extract_turns: a lap of straights and
+# turns on a distance grid, with a known oversteer index per turn phase and a
+# known locking / traction-loss level per turn (jittered lap to lap), so the
+# extracted turn metrics can be checked against what was put in.
+
+G = 9.81
+
+
+def make_track_turns(n_turns, lap_m=5500.0, seed=0):
+    rng = np.random.default_rng(seed)
+    slot = (lap_m - 200.0) / n_turns
+    turns = []
+    for i in range(n_turns):
+        start = 100.0 + i * slot + float(rng.uniform(0.0, 0.2)) * slot
+        length = float(rng.uniform(0.3, 0.6)) * slot
+        turns.append({
+            "turn_id": f"t{i + 1}", "name": f"turn_{i + 1}", "sector": 1 + 3 * i // n_turns,
+            "start_m": round(start, 1), "end_m": round(start + length, 1),
+            "time_loss_weight": round(float(rng.uniform(0.8, 1.4)), 2),
+        })
+    return turns
+
+
+def make_lap_traces(turns, n_laps, lap_m=5500.0, step_m=2.0, seed=0, lap_noise=0.02):
+    """(distance_m, channels, truth): channels are (n_laps, n_points); truth holds per-turn means put in."""
+    from lap_traces import MID_FRACTION, SLIP_LOCK, SLIP_OK, STEERING_RATIO, WHEELBASE_M
+    rng = np.random.default_rng(seed)
+    s = np.arange(0.0, lap_m, step_m)
+    n_t, p = len(turns), len(s)
+    truth = {
+        "oversteer": rng.uniform(-0.15, 0.2, (n_t, 3)),
+        "lock_front": rng.uniform(0.0, 0.4, n_t),
+        "lock_rear": rng.uniform(0.0, 0.3, n_t),
+        "traction": rng.uniform(0.0, 0.4, n_t),
+        "surface": rng.uniform(95, 112, (n_t, 4)),
+        "v_apex": rng.uniform(70, 220, n_t),
+        "porpoising": rng.uniform(0.0, 3.0, n_t),
+    }
+    start = np.array([t["start_m"] for t in turns])
+    end = np.array([t["end_m"] for t in turns])
+    apex_s = start + (end - start) * rng.uniform(0.4, 0.6, n_t)
+    apex_s = start + np.round((apex_s - start) / step_m) * step_m
+    v_max = 310.0
+
+    # speed: v_max on straights, straight-line drop to the apex and back up
+    knots_s = np.concatenate([[0.0], np.ravel(np.column_stack([start, apex_s, end])), [lap_m]])
+    knots_v = np.concatenate([[v_max], np.ravel(np.column_stack([np.minimum(truth["v_apex"] + 90, v_max), truth["v_apex"], np.minimum(truth["v_apex"] + 60, v_max)])), [v_max]])
+    # where each grid point sits: turn index (-1 outside) and phase 0/1/2 by the extractor's split
+    turn_of = np.full(p, -1)
+    phase = np.zeros(p, dtype=int)
+    curvature = np.zeros(p)
+    for i in range(n_t):
+        inside = (s >= start[i]) & (s <= end[i])
+        turn_of[inside] = i
+        idx = np.flatnonzero(inside)
+        a = int(np.argmin(np.abs(s[idx] - apex_s[i])))
+        half = max(1, int(len(idx) * MID_FRACTION / 2))
+        ph = (np.arange(len(idx)) >= a - half).astype(int) + (np.arange(len(idx)) > a + half)
+        phase[idx] = ph
+        x = (s[idx] - start[i]) / (end[i] - start[i])
+        v_apex_ms = truth["v_apex"][i] / 3.6
+        k_apex = 2.5 * G / v_apex_ms ** 2 * (1 if i % 2 else -1)
+        curvature[idx] = k_apex * (0.3 + 0.7 * np.sin(np.pi * x))
+
+    laps = np.arange(n_laps)[:, None]
+    jit = lambda scale, shape=(n_laps, p): rng.normal(0.0, scale, shape)
+    v = np.interp(s, knots_s, knots_v)[None, :] * (1 + jit(0.003, (n_laps, 1)))
+    in_turn = turn_of >= 0
+    tix = np.maximum(turn_of, 0)
+    k_phase = truth["oversteer"][tix, phase][None, :] + jit(lap_noise, (n_laps, n_t))[:, tix]
+    steer_rad = WHEELBASE_M * curvature
+    ch = {
+        "speed_kmh": v,
+        "steering_deg": np.broadcast_to(np.rad2deg(steer_rad) * STEERING_RATIO, (n_laps, p)).copy(),
+        "yaw_rate_dps": np.rad2deg(v / 3.6 * curvature * (1 + np.where(in_turn, k_phase, 0.0))),
+        "lat_g": (v / 3.6) ** 2 * curvature / G,
+        "long_g": np.gradient((v / 3.6) ** 2 / 2, s, axis=1) / G,
+    }
+    decel = in_turn & (phase == 0)
+    accel = in_turn & (phase == 2)
+    ch["brake"] = np.broadcast_to(np.where(decel, 1.0, 0.0), (n_laps, p)).copy()
+    ch["throttle"] = np.broadcast_to(np.where(accel | ~in_turn, 1.0, 0.3), (n_laps, p)).copy()
+    slip = lambda risk: SLIP_OK + np.clip(risk, 0, 1) * (SLIP_LOCK - SLIP_OK)
+    lf = truth["lock_front"][tix][None, :] + jit(lap_noise, (n_laps, n_t))[:, tix]
+    lr = truth["lock_rear"][tix][None, :] + jit(lap_noise, (n_laps, n_t))[:, tix]
+    tr = truth["traction"][tix][None, :] + jit(lap_noise, (n_laps, n_t))[:, tix]
+    ch["wheel_slip_front"] = np.where(decel, -slip(lf), 0.01)
+    ch["wheel_slip_rear"] = np.where(decel, -slip(lr), np.where(accel, slip(tr), 0.01))
+    for c, corner in enumerate(("fl", "fr", "rl", "rr")):
+        ch[f"tyre_surface_temp_{corner}"] = np.where(in_turn, truth["surface"][tix, c], 98.0)[None, :] + jit(0.5)
+    ch["ride_height_mm"] = 25.0 + np.where(in_turn, truth["porpoising"][tix], 0.0)[None, :] * np.sin(2 * np.pi * s / 14.0) + 0 * laps
+    ch["vert_g"] = 1.0 + jit(0.05)
+    truth["turn_of"] = turn_of
+    return s, ch, truth
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Hashable, List, Tuple
+import os
+import pickle
+import threading
+import time
+
+import metrics
+
+# Read-through cache for Firestore documents used by the Flask routes.
+#
+# Entries are keyed by (collection, query), expire after a TTL, are evicted
+# LRU beyond `max_entries`, and are dropped as soon as a Firestore snapshot
+# listener reports a change to their collection. Values are stored pickled:
+# every caller gets its own copy (the routes mutate the doc) and
+# pickle.loads is several times cheaper than copy.deepcopy. Concurrent misses
+# on one key share a single load: the first caller reads Firestore, the
+# others wait for its result (or raise their own copy of its exception,
+# chained to it). A joiner that has waited `join_timeout_s` stops waiting
+# and reads Firestore itself, so one stuck read can't hold up every request
+# for that key.
+
+class _Load:
+    __slots__ = ("done", "blob", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.blob: bytes | None = None
+        self.error: BaseException | None = None
+
+def _rethrown(exc: BaseException) -> BaseException:
+    """A new exception of exc's type with its args and attributes, for one joiner to raise."""
+    fresh = type(exc).__new__(type(exc), *exc.args)
+    fresh.__dict__.update(exc.__dict__)
+    return fresh
+
+class DocCache:
+    def __init__(
+        self,
+        client: Any,
+        ttl_s: float = 300.0,
+        max_entries: int = 64,
+        join_timeout_s: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.client = client
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.join_timeout_s = join_timeout_s
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, bytes]]" = OrderedDict()
+        self._watches: Dict[str, Any] = {}
+        self._loading: Dict[Tuple[str, Hashable], _Load] = {}     # misses being loaded right now
+        self._generation: Dict[str, int] = {}    # bumped on per-collection invalidation
+        self._epoch = 0                          # bumped on full invalidation
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+        self.join_timeouts = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls, client: Any) -> "DocCache":
+        return cls(
+            client,
+            ttl_s=float(os.environ.get("DOC_CACHE_TTL_S", 300)),
+            max_entries=int(os.environ.get("DOC_CACHE_SIZE", 64)),
+            join_timeout_s=float(os.environ.get("DOC_CACHE_JOIN_TIMEOUT_S", 10)),
+        )
+
+    # ---------- Reads ----------
+
+    def get(self, collection: str, query: Hashable, loader: Callable[[], Any]) -> Any:
+        """Cached result of `loader()` for this collection/query, as a private copy."""
+        key = (collection, query)
+        now = self._clock()
+        gen = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.count("doc_cache_requests_total", collection=collection, result="hit")
+                return pickle.loads(entry[1])
+            if entry is not None:
+                del self._entries[key]     # expired
+            load = self._loading.get(key)
+            if load is None:
+                load = self._loading[key] = _Load()
+                self.misses += 1
+                gen = (self._epoch, self._generation.get(collection, 0))
+            else:
+                self.joined += 1
+
+        if gen is None:
+            metrics.count("doc_cache_requests_total", collection=collection, result="joined")
+            if not load.done.wait(self.join_timeout_s):
+                with self._lock:
+                    self.join_timeouts += 1
+                metrics.count("doc_cache_requests_total", collection=collection, result="join_timeout")
+                with metrics.stage("firestore", collection):
+                    return loader()     # not cached: the stuck load still owns the key
+            if load.error is not None:
+                raise _rethrown(load.error) from load.error
+            return pickle.loads(load.blob)
+
+        metrics.count("doc_cache_requests_total", collection=collection, result="miss")
+        try:
+            with metrics.stage("firestore", collection):
+                value = loader()
+            load.blob = blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except BaseException as exc:
+            load.error = exc
+            raise
+        finally:
+            with self._lock:
+                if self._loading.get(key) is load:
+                    del self._loading[key]
+            load.done.set()
+        with self._lock:
+            if (self._epoch, self._generation.get(collection, 0)) != gen:
+                return pickle.loads(blob)  # invalidated while loading: don't cache a stale read
+            self._entries[key] = (self._clock() + self.ttl_s, blob)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return pickle.loads(blob)
+
+    def first_doc(self, collection: str) -> Dict[str, Any]:
+        """to_dict() of db.collection(collection).limit(1) - the query both routes run."""
+        def _load() -> Dict[str, Any]:
+            results = list(self.client.collection(collection).limit(1).stream())
+            if not results:
+                raise LookupError(f"collection {collection!r} is empty")
+            return results[0].to_dict()
+        return self.get(collection, ("limit", 1), _load)
+
+    # ---------- Invalidation ----------
+
+    def invalidate(self, collection: str | None = None) -> int:
+        with self._lock:
+            keys = [k for k in self._entries if collection is None or k[0] == collection]
+            for k in keys:
+                del self._entries[k]
+            for k in [k for k in self._loading if collection is None or k[0] == collection]:
+                del self._loading[k]       # later misses start a fresh read instead of joining a stale one
+            if collection is None:
+                self._epoch += 1
+            else:
+                self._generation[collection] = self._generation.get(collection, 0) + 1
+            self.invalidations += len(keys)
+        return len(keys)
+
+    def watch(self, collection: str) -> None:
+        """Invalidate `collection` whenever Firestore pushes a snapshot for it."""
+        if collection in self._watches:
+            return
+        first = [True]
+
+        def _on_snapshot(docs: List[Any], changes: List[Any], read_time: Any) -> None:
+            if first[0]:          # initial snapshot: nothing has changed yet
+                first[0] = False
+                return
+            self.invalidate(collection)
+
+        self._watches[collection] = self.client.collection(collection).on_snapshot(_on_snapshot)
+
+    def close(self) -> None:
+        for w in self._watches.values():
+            w.unsubscribe()
+        self._watches.clear()
+
+    # ---------- Introspection ----------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "joined": self.joined,
+                "join_timeouts": self.join_timeouts,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "watched": sorted(self._watches),
+            }
@@ -0,0 +1,353 @@
+from __future__ import annotations
+
+from typing import Dict, Any, Iterable, Iterator, List, Tuple
+import argparse
+import fcntl
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from health import HealthAccumulator
+from schema import SchemaError, decode_race_data, decode_race_meta
+import metrics
+
+# Local columnar store for race_data events.
+#
+# An ingest step (EventStoreWriter, or `python backend/event_store.py ingest
+# DIR`) decodes race_data docs and appends their significant_events to one
+# flat file per column:
+#
+#   timestamp_ms     float64   event timestamp_ms (NaN when absent)
+#   event_type       int32     index into the string dictionary (-1: absent)
+#   lateral_peak_g   float64   g_forces.lateral_peak_g
+#   vertical_peak_g  float64   g_forces.vertical_peak_g
+#   duration_ms      float64   duration_ms (0 when absent, NaN when not a number)
+#
+# plus race_offsets (int64, one more than the number of races) delimiting
+# each race's events. manifest.json holds the column dtypes and lengths, the
+# string dictionary and each race's id and race-level fields (everything but
+# significant_events, as stored). The manifest is replaced atomically after
+# the column files are appended and flushed, so a reader never sees a
+# half-written race and an interrupted ingest is cut back on the next one.
+# A writer holds an exclusive flock on ingest.lock from opening to close(),
+# so concurrent ingests into one directory run one after the other, each
+# starting from the manifest the previous one committed.
+#
+# EventStore.open() memory-maps the columns read-only: slicing a race is a
+# view, and report()/peaks() fold the slices with the same semantics as
+# generate_report, so re-analysis needs neither Firestore nor event dicts.
+
+EVENT_COLUMNS = {
+    "timestamp_ms": "<f8",
+    "event_type": "<i4",
+    "lateral_peak_g": "<f8",
+    "vertical_peak_g": "<f8",
+    "duration_ms": "<f8",
+}
+OFFSETS = "race_offsets"
+MANIFEST = "manifest.json"
+LOCK = "ingest.lock"
+FORMAT_VERSION = 1
+SUSTAINED_HIGH_G = "SustainedHighG"
+
+def _column_path(root: str, name: str) -> str:
+    return os.path.join(root, f"{name}.bin")
+
+def _json_default(value: Any) -> Any:
+    # Firestore timestamps and the like; multi_session.epoch parses ISO strings back
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+def _number_or(value: Any, default: float) -> float:
+    if value is None:
+        return default
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return float("nan")
+
+def _read_manifest(root: str) -> Dict[str, Any] | None:
+    try:
+        with open(os.path.join(root, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(f"{root}: unsupported event store version {manifest.get('version')!r}")
+    return manifest
+
+# ---------- Ingest ----------
+
+class EventStoreWriter:
+    """
+    Appends races to a store directory (created if needed). Races whose id is
+    already stored are skipped, so re-running an ingest only adds new docs.
+    Call commit() (or use as a context manager) to publish what was added.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = open(os.path.join(root, LOCK), "a")
+        fcntl.flock(self._lock, fcntl.LOCK_EX)          # blocks while another writer has the store open
+        manifest = _read_manifest(root) or {
+            "version": FORMAT_VERSION,
+            "columns": dict(EVENT_COLUMNS),
+            "n_events": 0,
+            "strings": [],
+            "races": [],
+        }
+        self.manifest = manifest
+        self.n_events = manifest["n_events"]
+        self.strings: List[str] = list(manifest["strings"])
+        self._codes = {s: i for i, s in enumerate(self.strings)}
+        self._ids = {r["id"] for r in manifest["races"]}
+        self.races: List[Dict[str, Any]] = list(manifest["races"])
+        self.skipped: List[Dict[str, Any]] = []
+        self._files = {}
+        # drop anything an interrupted ingest appended after the last commit
+        lengths = dict.fromkeys(EVENT_COLUMNS, self.n_events)
+        lengths[OFFSETS] = len(self.races) + 1 if self.races else 0
+        for name, n in lengths.items():
+            f = open(_column_path(root, name), "ab+")
+            f.truncate(n * np.dtype(EVENT_COLUMNS.get(name, "<i8")).itemsize)
+            self._files[name] = f
+        if not self.races:
+            self._files[OFFSETS].write(np.zeros(1, dtype="<i8").tobytes())
+
+    def __enter__(self) -> "EventStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.commit()
+        self.close()
+
+    def _code(self, value: Any) -> int:
+        if not isinstance(value, str):
+            return -1
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def add(self, race_id: Any, race_data: Any) -> bool:
+        """Append one race_data doc; a malformed doc is recorded in `skipped` instead."""
+        race_id = str(race_id)
+        if race_id in self._ids:
+            return False
+        try:
+            rec = decode_race_data(race_data)      # validates the events and the fields generate_report reads
+        except SchemaError as exc:
+            self.skipped.append({"id": race_id, "error": str(exc), "path": exc.path})
+            return False
+        events = race_data.get("significant_events", [])
+        n = len(rec.events)
+        cols = {
+            "timestamp_ms": np.fromiter((_number_or(e.get("timestamp_ms"), float("nan")) for e in events), "<f8", n),
+            "event_type": np.fromiter((self._code(e.get("event_type")) for e in events), "<i4", n),
+            "lateral_peak_g": np.frombuffer(rec.events.lateral_peak_g, dtype=float),
+            "vertical_peak_g": np.frombuffer(rec.events.vertical_peak_g, dtype=float),
+            "duration_ms": np.fromiter((_number_or(e.get("duration_ms"), 0.0) for e in events), "<f8", n),
+        }
+        for name, values in cols.items():
+            self._files[name].write(values.astype(EVENT_COLUMNS[name], copy=False).tobytes())
+        self.n_events += n
+        self._files[OFFSETS].write(np.array([self.n_events], dtype="<i8").tobytes())
+        self.races.append({"id": race_id, "fields": json.loads(json.dumps(rec.fields, default=_json_default))})
+        self._ids.add(race_id)
+        return True
+
+    def extend(self, items: Iterable[Any]) -> "EventStoreWriter":
+        """Snapshots (to_dict()/id), or (race_id, race_data) pairs."""
+        for item in items:
+            if hasattr(item, "to_dict"):
+                self.add(item.id, item.to_dict())
+            else:
+                self.add(*item)
+        return self
+
+    def commit(self) -> None:
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        manifest = dict(self.manifest, n_events=self.n_events, strings=self.strings, races=self.races)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.root, MANIFEST))
+        self.manifest = manifest
+
+    def close(self) -> None:
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        if self._lock is not None:
+            self._lock.close()                              # releases the flock
+            self._lock = None
+
+def ingest(root: str, pages: Iterator[List[Any]]) -> Dict[str, Any]:
+    """Append every doc of every page (multi_session.iter_query_pages) to the store at `root`."""
+    with EventStoreWriter(root) as w:
+        before = len(w.races)
+        for page in pages:
+            with metrics.stage("event_store", "ingest_page"):
+                w.extend(page)
+        return {"added": len(w.races) - before, "races": len(w.races), "events": w.n_events, "skipped": w.skipped}
+
+# ---------- Reading ----------
+
+class RaceEvents:
+    """One race's events: zero-copy slices of the store's columns."""
+
+    __slots__ = ("race_id", "fields", "timestamp_ms", "event_type", "lateral_peak_g", "vertical_peak_g", "duration_ms", "_store")
+
+    def __init__(self, store: "EventStore", i: int):
+        a, b = int(store.offsets[i]), int(store.offsets[i + 1])
+        self._store = store
+        self.race_id = store.race_ids[i]
+        self.fields = store.fields[i]
+        for name in EVENT_COLUMNS:
+            setattr(self, name, store.columns[name][a:b])
+
+    def __len__(self) -> int:
+        return len(self.lateral_peak_g)
+
+    @property
+    def event_types(self) -> List[str | None]:
+        strings = self._store.strings
+        return [strings[c] if c >= 0 else None for c in self.event_type.tolist()]
+
+    @property
+    def high_g_duration_ms(self) -> np.ndarray:
+        """duration_ms of SustainedHighG events, 0 elsewhere (what generate_report totals)."""
+        return np.where(self.event_type == self._store.code(SUSTAINED_HIGH_G), self.duration_ms, 0.0)
+
+def _first_peak(values: np.ndarray) -> float | int:
+    """The fold generate_report runs: the first value of largest |value|, if above 0."""
+    if not len(values):
+        return 0
+    i = int(np.argmax(np.abs(values)))        # first occurrence, like max(key=abs)
+    return float(values[i]) if values[i] != 0 else 0
+
+class EventStore:
+    def __init__(self, root: str, manifest: Dict[str, Any]):
+        self.root = root
+        self.n_events = manifest["n_events"]
+        self.strings: List[str] = manifest["strings"]
+        self._codes = {s: i for i, s in enumerate(self.strings)}
+        self.race_ids: List[str] = [r["id"] for r in manifest["races"]]
+        self.fields: List[Dict[str, Any]] = [r["fields"] for r in manifest["races"]]
+        self.index = {rid: i for i, rid in enumerate(self.race_ids)}
+        self.columns = {name: self._map(name, dtype, self.n_events) for name, dtype in manifest["columns"].items()}
+        self.offsets = self._map(OFFSETS, "<i8", len(self.race_ids) + 1)
+
+    @classmethod
+    def open(cls, root: str) -> "EventStore":
+        manifest = _read_manifest(root)
+        if manifest is None:
+            raise FileNotFoundError(f"no event store at {root}")
+        return cls(root, manifest)
+
+    def _map(self, name: str, dtype: str, n: int) -> np.ndarray:
+        if n == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(_column_path(self.root, name), dtype=dtype, mode="r", shape=(n,))
+
+    def __len__(self) -> int:
+        return len(self.race_ids)
+
+    def code(self, s: str) -> int:
+        """Dictionary code of a string (-2 if the store never saw it, so it matches nothing)."""
+        return self._codes.get(s, -2)
+
+    def race(self, race: str | int) -> RaceEvents:
+        """A race by id, or by position in ingest order."""
+        return RaceEvents(self, self.index[race] if isinstance(race, str) else race)
+
+    def accumulator(self, race: str | int) -> HealthAccumulator:
+        r = self.race(race)
+        acc = HealthAccumulator()
+        acc.meta, acc.info = dict(r.fields), decode_race_meta(r.fields)
+        acc.peak_lateral_g = _first_peak(r.lateral_peak_g)
+        acc.peak_vertical_g = _first_peak(r.vertical_peak_g)
+        acc.total_high_g_duration_ms = float(r.high_g_duration_ms.sum())
+        acc.events_seen = len(r)
+        return acc
+
+    def report(self, race: str | int) -> Dict[str, Any]:
+        """generate_report() for a stored race."""
+        with metrics.stage("health", "generate_report"):
+            acc = self.accumulator(race)
+            report = acc.snapshot()
+        metrics.count("health_events_processed_total", acc.events_seen)
+        return report
+
+    def peaks(self) -> Dict[str, np.ndarray]:
+        """
+        Per-race peak lateral / vertical G (signed, first of largest |G|, 0 for
+        no events), SustainedHighG duration total and event count for every
+        race at once, as segmented reductions over the whole columns.
+        """
+        starts, ends = self.offsets[:-1], self.offsets[1:]
+        counts = (ends - starts).astype(float)
+        out = {"events": counts}
+        nonempty = np.flatnonzero(ends > starts)
+        s = np.asarray(starts[nonempty])           # increasing; segment k runs to s[k + 1] (empty races add nothing)
+        seg = np.repeat(np.arange(len(nonempty)), (ends - starts)[nonempty])
+        pos = np.arange(self.n_events)
+        for name in ("lateral_peak_g", "vertical_peak_g"):
+            col = np.asarray(self.columns[name])
+            a = np.abs(col)
+            peak = np.zeros(len(self))
+            if len(nonempty):
+                m = np.maximum.reduceat(a, s)
+                first = np.minimum.reduceat(np.where(a == m[seg], pos, self.n_events), s)
+                peak[nonempty] = np.where(m > 0, col[first], 0.0)
+            out[name] = peak
+        high_g = np.zeros(len(self))
+        if len(nonempty):
+            dur = np.where(np.asarray(self.columns["event_type"]) == self.code(SUSTAINED_HIGH_G), self.columns["duration_ms"], 0.0)
+            high_g[nonempty] = np.add.reduceat(dur, s)
+        out["high_g_duration_ms"] = high_g
+        return out
+
+# Stores opened by the backend, kept mapped between requests
+_open: Dict[str, Tuple[float, EventStore]] = {}
+_open_lock = threading.Lock()
+
+def open_cached(root: str) -> EventStore:
+    """EventStore.open(root), reopened only when an ingest has replaced the manifest."""
+    mtime = os.stat(os.path.join(root, MANIFEST)).st_mtime_ns
+    with _open_lock:
+        hit = _open.get(root)
+        if hit is None or hit[0] != mtime:
+            hit = _open[root] = (mtime, EventStore.open(root))
+        return hit[1]
+
+# ---------- CLI ----------
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Ingest race_data docs into a local columnar event store")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ing = sub.add_parser("ingest", help="append race_data docs from Firestore (or FIRESTORE_STANDIN)")
+    ing.add_argument("root")
+    ing.add_argument("--collection", default="race_data")
+    ing.add_argument("--page-size", type=int, default=200)
+    info = sub.add_parser("info", help="races, events and event types in a store")
+    info.add_argument("root")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "ingest":
+        from firestore_client import get_client
+        from multi_session import iter_query_pages
+        pages = iter_query_pages(get_client().collection(args.collection), args.page_size, pipeline="event_store")
+        print(json.dumps(ingest(args.root, pages), indent=2))
+    else:
+        store = EventStore.open(args.root)
+        print(json.dumps({"races": len(store), "events": store.n_events, "event_types": store.strings}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+from typing import Dict, Any, List, Callable
+import copy
+import itertools
+import json
+import threading
+import time
+
+# Minimal in-process stand-in for the firestore client surface the backend
+# uses: collection(...).where/order_by/start_after/limit(n).stream(),
+# document(id).set/get, add(), and on_snapshot listeners. `latency_s` is
+# slept on every read round-trip so caching and serving modes can be
+# measured offline; backend.py uses it in place of Firestore when
+# FIRESTORE_STANDIN names a seed file.
+
+_OPS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+}
+
+def _field(data: Dict[str, Any] | None, path: str) -> Any:
+    cur: Any = data
+    for k in path.split("."):
+        if not isinstance(cur, dict):
+            return None
+        cur = cur.get(k)
+    return cur
+
+class FakeDocumentSnapshot:
+    def __init__(self, doc_id: str, data: Dict[str, Any] | None, update_time: float | None = None):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+        self.update_time = update_time
+
+    def to_dict(self) -> Dict[str, Any] | None:
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path: str) -> Any:
+        return copy.deepcopy(_field(self._data, field_path))
+
+class FakeWatch:
+    def __init__(self, unsubscribe: Callable[[], None]):
+        self._unsubscribe = unsubscribe
+
+    def unsubscribe(self) -> None:
+        self._unsubscribe()
+
+class FakeQuery:
+    def __init__(
+        self,
+        collection: "FakeCollection",
+        limit: int | None = None,
+        filters: tuple = (),
+        order: str | None = None,
+        after: Any = None,
+    ):
+        self._collection = collection
+        self._limit = limit
+        self._filters = filters
+        self._order = order
+        self._after = after
+
+    def _with(self, **kw) -> "FakeQuery":
+        args = dict(limit=self._limit, filters=self._filters, order=self._order, after=self._after)
+        args.update(kw)
+        return FakeQuery(self._collection, **args)
+
+    def limit(self, n: int) -> "FakeQuery":
+        return self._with(limit=n)
+
+    def where(self, field_path: str | None = None, op_string: str | None = None, value: Any = None, *, filter: Any = None) -> "FakeQuery":
+        """where("a.b", "==", v) or where(filter=FieldFilter("a.b", "==", v))."""
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in _OPS:
+            raise ValueError(f"unsupported operator {op_string!r}")
+        return self._with(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str) -> "FakeQuery":
+        return self._with(order=field_path)
+
+    def start_after(self, snapshot: FakeDocumentSnapshot) -> "FakeQuery":
+        return self._with(after=snapshot)
+
+    def _sort_key(self, snap: FakeDocumentSnapshot) -> Any:
+        return snap.id if self._order in (None, "__name__") else (_field(snap._data, self._order), snap.id)
+
+    def stream(self):
+        self._collection._db._round_trip()
+        docs = [d for d in self._collection._snapshots()
+                if all(_OPS[op](_field(d._data, f), v) for f, op, v in self._filters)]
+        if self._order is not None or self._after is not None:
+            docs.sort(key=self._sort_key)
+        if self._after is not None:
+            after = self._sort_key(self._after)
+            docs = [d for d in docs if self._sort_key(d) > after]
+        return iter(docs if self._limit is None else docs[:self._limit])
+
+    def get(self) -> List[FakeDocumentSnapshot]:
+        return list(self.stream())
+
+    def on_snapshot(self, callback: Callable) -> FakeWatch:
+        return self._collection.on_snapshot(callback)
+
+class FakeDocumentReference:
+    def __init__(self, collection: "FakeCollection", doc_id: str):
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self) -> FakeDocumentSnapshot:
+        self._collection._db._round_trip()
+        with self._collection._db._lock:
+            data = self._collection._docs.get(self.id)
+            updated = self._collection._updated.get(self.id)
+        return FakeDocumentSnapshot(self.id, data, updated)
+
+    def set(self, data: Dict[str, Any]) -> None:
+        self._collection._write(self.id, copy.deepcopy(data))
+
+    def delete(self) -> None:
+        self._collection._write(self.id, None)
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db: "FakeFirestore", name: str):
+        super().__init__(self)
+        self._db = db
+        self.name = name
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._updated: Dict[str, float] = {}
+        self._listeners: Dict[int, Callable] = {}
+
+    def document(self, doc_id: str | None = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self, doc_id or f"doc{next(self._db._ids)}")
+
+    def add(self, data: Dict[str, Any]) -> FakeDocumentReference:
+        ref = self.document()
+        ref.set(data)
+        return ref
+
+    def on_snapshot(self, callback: Callable) -> FakeWatch:
+        """callback(docs, changes, read_time), called once now and after every write."""
+        with self._db._lock:
+            token = next(self._db._ids)
+            self._listeners[token] = callback
+        callback(self._snapshots(), [], time.time())
+        return FakeWatch(lambda: self._listeners.pop(token, None))
+
+    def _snapshots(self) -> List[FakeDocumentSnapshot]:
+        with self._db._lock:
+            return [FakeDocumentSnapshot(k, v, self._updated.get(k)) for k, v in self._docs.items()]
+
+    def _write(self, doc_id: str, data: Dict[str, Any] | None) -> None:
+        with self._db._lock:
+            if data is None:
+                self._docs.pop(doc_id, None)
+                self._updated.pop(doc_id, None)
+            else:
+                self._docs[doc_id] = data
+                self._updated[doc_id] = time.time()
+            listeners = list(self._listeners.values())
+        snaps = self._snapshots()
+        for cb in listeners:
+            cb(snaps, [doc_id], time.time())
+
+class FakeFirestore:
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.reads = 0
+        self._collections: Dict[str, FakeCollection] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    @classmethod
+    def from_json_file(cls, path: str, latency_s: float = 0.0) -> "FakeFirestore":
+        """Seeded from {"collection": [doc, ...] | {"doc_id": doc, ...}, ...}."""
+        with open(path) as f:
+            seed = json.load(f)
+        db = cls(latency_s)
+        for name, docs in seed.items():
+            items = docs.items() if isinstance(docs, dict) else ((None, d) for d in docs)
+            for doc_id, data in items:
+                db.collection(name).document(doc_id).set(data)
+        return db
+
+    def collection(self, name: str) -> FakeCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = FakeCollection(self, name)
+            return self._collections[name]
+
+    def _round_trip(self) -> None:
+        with self._lock:
+            self.reads += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
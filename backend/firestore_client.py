@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+from typing import Any, Callable, List
+import os
+import threading
+
+# Firestore client, created on first use.
+#
+# Importing firebase_admin / google-cloud-firestore and reading the service
+# account key costs a few hundred ms, so backend.py holds a LazyClient and the
+# real client is built the first time a route touches a collection. Callbacks
+# registered with on_ready() (the DocCache snapshot listeners) run once, right
+# after the client exists. FIRESTORE_STANDIN=<seed.json> swaps in the local
+# stand-in from fake_firestore.py.
+
+_lock = threading.RLock()
+_client: Any = None
+_on_ready: List[Callable[[Any], None]] = []
+
+def _create() -> Any:
+    seed = os.environ.get("FIRESTORE_STANDIN")
+    if seed:
+        from fake_firestore import FakeFirestore
+        return FakeFirestore.from_json_file(seed, latency_s=float(os.environ.get("FIRESTORE_STANDIN_LATENCY_MS", 0)) / 1000)
+
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cred = credentials.Certificate(os.environ.get("FIREBASE_CREDENTIALS", os.path.join(basedir, "serviceAccountKey.json")))
+    firebase_admin.initialize_app(cred)
+    return firestore.client()
+
+def get_client() -> Any:
+    global _client
+    if _client is not None:
+        return _client
+    with _lock:
+        if _client is None:
+            client = _create()
+            _client = client
+            for fn in _on_ready:
+                fn(client)
+    return _client
+
+def is_ready() -> bool:
+    return _client is not None
+
+def on_ready(fn: Callable[[Any], None]) -> None:
+    """Run fn(client) once the client exists (immediately if it already does)."""
+    with _lock:
+        _on_ready.append(fn)
+        client = _client
+    if client is not None:
+        fn(client)
+
+class LazyClient:
+    """Stands in for the firestore client; the first .collection() call creates the real one."""
+
+    def collection(self, name: str) -> Any:
+        return get_client().collection(name)
+
+def where_eq(query: Any, path: str, value: Any) -> Any:
+    """query filtered on path == value, with FieldFilter when the real client library is installed."""
+    try:
+        from google.cloud.firestore_v1.base_query import FieldFilter
+    except ImportError:           # local stand-in without google-cloud-firestore installed
+        return query.where(path, "==", value)
+    return query.where(filter=FieldFilter(path, "==", value))
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+from array import array
+from typing import Dict, Any, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from health import (
+    HealthAccumulator,
+    build_report,
+    FLUID_LOSS_HIGH_L,
+    NECK_LOAD_HIGH_KG,
+    SPINAL_PEAK_VERTICAL_G,
+    SPINAL_EVENTS_MODERATE,
+)
+from multi_session import epoch, prefetch_pages
+from schema import RaceMeta, SchemaError, decode_race_data, decode_race_meta
+import metrics
+
+# Fleet-wide health scoring: every race_data doc of a season at once.
+#
+# Docs are decoded one at a time (schema.decode_race_data), their events are
+# folded to per-race peaks with the same fold as generate_report and then
+# dropped, so a FleetTable holds one row of columns per race however many
+# events the season has. Severities are generate_report's thresholds applied
+# column-wise, and per-driver rolling aggregates (neck-load exposure over
+# the last `window` races, ...) are window sums over the races sorted by
+# driver and race time. Per-race reports are rendered from the vectorized
+# severities and equal generate_report() on the same doc.
+
+MAX_WINDOW = 50
+
+_COLUMNS = (
+    "fluid_loss_l",
+    "peak_neck_load_kg",
+    "spinal_compression_events",
+    "peak_lateral_g",
+    "peak_vertical_g",
+    "high_g_duration_ms",
+    "events",
+    "race_time",
+)
+
+# race-level fields that can order a driver's races (else: read order)
+RACE_TIME_FIELDS = ("race_date", "recorded_at", "session_date", "date")
+
+def race_time(race_data: Dict[str, Any], snapshot: Any = None) -> float | None:
+    for key in RACE_TIME_FIELDS:
+        t = epoch(race_data.get(key))
+        if t is not None:
+            return t
+    return epoch(getattr(snapshot, "update_time", None))
+
+class FleetTable:
+    """One row per race; numeric columns are array('d'), the rest are lists."""
+
+    def __init__(self):
+        self.ids: List[Any] = []
+        self.driver_ids: List[Any] = []
+        self.infos: List[RaceMeta] = []
+        self.cols: Dict[str, array] = {k: array("d") for k in _COLUMNS}
+        self.skipped: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, race_id: Any, race_data: Any, snapshot: Any = None) -> bool:
+        """Fold one race doc into a row; a malformed doc is recorded in `skipped` instead."""
+        try:
+            rec = decode_race_data(race_data)
+        except SchemaError as exc:
+            self.skipped.append({"id": race_id, "error": str(exc), "path": exc.path})
+            return False
+        acc = HealthAccumulator.from_record(rec)
+        peaks = (acc.peak_lateral_g, acc.peak_vertical_g, acc.total_high_g_duration_ms, acc.events_seen)
+        self._append(race_id, rec.meta, peaks, race_time(rec.fields, snapshot))
+        return True
+
+    def extend(self, items: Iterable[Any]) -> "FleetTable":
+        """Snapshots (to_dict()/id/update_time), or (race_id, race_data) pairs."""
+        for item in items:
+            if hasattr(item, "to_dict"):
+                self.add(getattr(item, "id", None), item.to_dict(), item)
+            else:
+                self.add(*item)
+        return self
+
+    def extend_pages(self, pages: Iterator[List[Any]], prefetch: int = 2) -> "FleetTable":
+        """Firestore pages (multi_session.iter_query_pages), read ahead on a thread."""
+        for page in prefetch_pages(iter(pages), prefetch):
+            with metrics.stage("fleet_health", "decode_page"):
+                self.extend(page)
+        return self
+
+    def extend_store(self, store: Any, driver: str | None = None) -> "FleetTable":
+        """Every race (or one driver's) of an event_store.EventStore, peaks folded for all races at once."""
+        with metrics.stage("fleet_health", "store_peaks"):
+            peaks = store.peaks()
+        rows = zip(peaks["lateral_peak_g"].tolist(), peaks["vertical_peak_g"].tolist(),
+                   peaks["high_g_duration_ms"].tolist(), peaks["events"].tolist())
+        for race_id, fields, row in zip(store.race_ids, store.fields, rows):
+            try:
+                info = decode_race_meta(fields)
+            except SchemaError as exc:
+                self.skipped.append({"id": race_id, "error": str(exc), "path": exc.path})
+                continue
+            if driver is None or str(info.driver_id) == driver:
+                self._append(race_id, info, row, race_time(fields))
+        return self
+
+    def _append(self, race_id: Any, info: RaceMeta, peaks: Tuple[Any, ...], t: float | None) -> None:
+        row = (info.fluid_loss_l, info.peak_neck_load_kg, info.spinal_compression_events) + peaks + (np.nan if t is None else t,)
+        for k, v in zip(_COLUMNS, row):
+            self.cols[k].append(v)
+        self.ids.append(race_id)
+        self.driver_ids.append(info.driver_id)
+        self.infos.append(info)
+
+    def column(self, name: str) -> np.ndarray:
+        return np.frombuffer(self.cols[name], dtype=float) if len(self) else np.zeros(0)
+
+# ---------- Scoring ----------
+
+# the worst level score() gives each area (Spinal Compression tops out at Moderate)
+TOP_SEVERITY = {"Dehydration": "High", "Neck Strain": "High", "Spinal Compression": "Moderate"}
+
+def score(table: FleetTable) -> Dict[str, np.ndarray]:
+    """generate_report's severities for every race, as string columns."""
+    fluid = table.column("fluid_loss_l")
+    neck = table.column("peak_neck_load_kg")
+    vert = table.column("peak_vertical_g")
+    spinal = table.column("spinal_compression_events")
+    return {
+        "Dehydration": np.where(fluid > FLUID_LOSS_HIGH_L, "High", "Moderate"),
+        "Neck Strain": np.where(neck > NECK_LOAD_HIGH_KG, "High", "Low"),
+        "Spinal Compression": np.where((vert > SPINAL_PEAK_VERTICAL_G) & (spinal > SPINAL_EVENTS_MODERATE), "Moderate", "Low"),
+    }
+
+def _driver_order(table: FleetTable) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """(row order sorted by driver then race time then read order, driver code per sorted row, driver keys)."""
+    keys, codes = np.unique(np.array([str(d) for d in table.driver_ids], dtype=object), return_inverse=True)
+    t = table.column("race_time")
+    order = np.lexsort((np.arange(len(table)), np.where(np.isnan(t), np.inf, t), codes))
+    return order, codes[order], [str(k) for k in keys]
+
+def rolling(values: np.ndarray, group: np.ndarray, window: int, how: str = "sum") -> np.ndarray:
+    """
+    Trailing window aggregate over rows already sorted by group, restarting at
+    each group. Sums add the window oldest-first, like sum() over the slice.
+    """
+    n = len(values)
+    pos = np.arange(n)
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = group[1:] != group[:-1]
+    start = np.maximum.accumulate(np.where(new_group, pos, 0))
+    lo = np.maximum(pos - window + 1, start)
+    out = np.zeros(n) if how in ("sum", "mean") else np.full(n, -np.inf)
+    for k in range(window - 1, -1, -1):       # oldest first
+        idx = pos - k
+        valid = idx >= lo
+        v = values[np.where(valid, idx, pos)]
+        if how == "max":
+            out = np.where(valid, np.maximum(out, v), out)
+        else:
+            out = np.where(valid, out + v, out)
+    if how == "mean":
+        out = out / (pos - lo + 1)
+    return out
+
+def trends(table: FleetTable, severity: Dict[str, np.ndarray], window: int = 5) -> Dict[str, Dict[str, Any]]:
+    """Per-driver series over their races in time order, each a trailing `window`-race aggregate."""
+    if not 1 <= window <= MAX_WINDOW:
+        raise ValueError(f"window must be between 1 and {MAX_WINDOW}")
+    if not len(table):
+        return {}
+    order, group, keys = _driver_order(table)
+    high = sum((s == "High").astype(float) for s in severity.values())
+    series = {
+        "neck_load_kg_sum": rolling(table.column("peak_neck_load_kg")[order], group, window),
+        "fluid_loss_l_mean": rolling(table.column("fluid_loss_l")[order], group, window, "mean"),
+        "spinal_compression_events_sum": rolling(table.column("spinal_compression_events")[order], group, window),
+        "high_g_duration_ms_sum": rolling(table.column("high_g_duration_ms")[order], group, window),
+        "peak_lateral_g_max": rolling(np.abs(table.column("peak_lateral_g"))[order], group, window, "max"),
+        "peak_vertical_g_max": rolling(np.abs(table.column("peak_vertical_g"))[order], group, window, "max"),
+        "high_severity_count": rolling(high[order], group, window),
+    }
+    times = table.column("race_time")[order]
+    bounds = np.flatnonzero(np.r_[True, group[1:] != group[:-1], True])
+    out = {}
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        rows = order[a:b]
+        out[keys[group[a]]] = {
+            "races": [table.ids[r] for r in rows],
+            "race_time": [None if np.isnan(x) else float(x) for x in times[a:b]],
+            "series": {name: s[a:b].tolist() for name, s in series.items()},
+        }
+    return out
+
+# ---------- Public API ----------
+
+def fleet_report(table: FleetTable, window: int = 5, reports: bool = True) -> Dict[str, Any]:
+    """
+    Scores, per-race generate_report-compatible reports (unless reports=False)
+    and per-driver trends for every race in the table.
+    """
+    with metrics.stage("fleet_health", "score"):
+        severity = score(table)
+    with metrics.stage("fleet_health", "trends"):
+        driver_trends = trends(table, severity, window)
+
+    races = []
+    with metrics.stage("fleet_health", "render"):
+        lat = table.column("peak_lateral_g").tolist()
+        vert = table.column("peak_vertical_g").tolist()
+        sev = list(zip(*(s.tolist() for s in severity.values())))
+        for i, race_id in enumerate(table.ids):
+            row = {
+                "id": race_id,
+                "driver_id": table.driver_ids[i],
+                "severity": dict(zip(severity, sev[i])),
+            }
+            if reports:
+                row["report"] = build_report(table.infos[i], lat[i], vert[i], sev[i])
+            races.append(row)
+    metrics.count("health_events_processed_total", int(table.column("events").sum()))
+
+    return {
+        "window": window,
+        "races": races,
+        "trends": driver_trends,
+        "summary": {
+            "races": len(table),
+            "drivers": len(driver_trends),
+            "events": int(table.column("events").sum()),
+            "top_severity": {area: {"level": TOP_SEVERITY[area], "races": int((s == TOP_SEVERITY[area]).sum())}
+                             for area, s in severity.items()},
+            "skipped": table.skipped[:50],
+            "skipped_count": len(table.skipped),
+        },
+    }
@@ -1,41 +1,164 @@
+from itertools import chain
+import json
+
+from schema import EventColumns, RaceDataDoc, SchemaError, decode_event, decode_race_data, decode_race_meta
+import metrics
+
+
+class HealthAccumulator:
+    """
+    Incremental generate_report: feed race events one at a time (or from an
+    NDJSON stream / generator) and call snapshot() whenever you want the
+    current report. Only running peaks and totals are kept, so memory does
+    not grow with the number of events. After the last event, snapshot()
+    equals generate_report() on the full race_data.
+    """
+
+    def __init__(self, race_data: dict | None = None):
+        self.meta = {k: v for k, v in (race_data or {}).items() if k != "significant_events"}
+        self.info = decode_race_meta(self.meta)     # typed view of the fields the report reads
+        self.peak_lateral_g = 0          # g-force metrics
+        self.peak_vertical_g = 0
+        self.total_high_g_duration_ms = 0
+        self.events_seen = 0
+
+    @classmethod
+    def from_record(cls, rec: RaceDataDoc) -> "HealthAccumulator":
+        acc = cls()
+        acc.meta, acc.info = dict(rec.fields), rec.meta
+        return acc.add_columns(rec.events)
+
+    def update_meta(self, fields: dict) -> None:
+        """Merge race_data fields (driver_id, cockpit_temp_c, hpc_race_summary_estimates, ...)."""
+        meta = dict(self.meta)
+        meta.update({k: v for k, v in fields.items() if k != "significant_events"})
+        self.info = decode_race_meta(meta)
+        self.meta = meta
+
+    def add(self, event: dict) -> None:
+        self.add_values(*decode_event(event))
+
+    def add_values(self, lateral_peak_g, vertical_peak_g, high_g_duration_ms) -> None:
+        """One decoded event (schema.decode_event)."""
+        if abs(lateral_peak_g) > abs(self.peak_lateral_g):     # max lateral and vertical
+            self.peak_lateral_g = lateral_peak_g
+
+        if abs(vertical_peak_g) > abs(self.peak_vertical_g):
+            self.peak_vertical_g = vertical_peak_g
+
+        self.total_high_g_duration_ms += high_g_duration_ms       # time sustained (0 unless SustainedHighG)
+        self.events_seen += 1
+
+    def add_columns(self, cols: EventColumns) -> "HealthAccumulator":
+        """
+        Fold decoded event columns in one go. max() keeps the first maximal
+        element and only replaces it on a strictly larger key, which is exactly
+        the event-by-event fold seeded with the current peak.
+        """
+        self.peak_lateral_g = max(chain((self.peak_lateral_g,), cols.lateral_peak_g), key=abs)
+        self.peak_vertical_g = max(chain((self.peak_vertical_g,), cols.vertical_peak_g), key=abs)
+        self.total_high_g_duration_ms += sum(cols.high_g_duration_ms)
+        self.events_seen += len(cols)
+        return self
+
+    def extend(self, events) -> "HealthAccumulator":
+        for event in events:
+            self.add(event)
+        return self
+
+    def feed_ndjson(self, lines) -> "HealthAccumulator":
+        """
+        One JSON object per line. A line is an event, unless it is
+        {"race_data": {...}}, which updates the race-level fields instead.
+        """
+        for n, line in enumerate(lines, 1):
+            item = parse_ndjson_line(line, n)
+            if item is None:
+                continue
+            kind, obj = item
+            if kind == "race_data":
+                self.update_meta(obj)
+            else:
+                self.add_values(*obj)
+        return self
+
+    def snapshot(self) -> dict:
+        """generate_report-compatible report for the events seen so far."""
+        return build_report(self.info, self.peak_lateral_g, self.peak_vertical_g)
+
+
+def parse_ndjson_line(line, lineno: int | None = None) -> tuple | None:
+    """
+    ("event", decoded event) or ("race_data", fields) for one NDJSON line, or
+    None for a blank line. Raises ValueError (SchemaError for a malformed event).
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    line = line.strip()
+    if not line:
+        return None
+    obj = json.loads(line)
+    if not isinstance(obj, dict):
+        raise ValueError(f"expected a JSON object per line, got {type(obj).__name__}")
+    try:
+        if isinstance(obj.get("race_data"), dict):
+            decode_race_meta(obj["race_data"])        # validate before it is merged
+            return "race_data", obj["race_data"]
+        return "event", decode_event(obj)
+    except SchemaError as exc:
+        if lineno is None:
+            raise
+        raise SchemaError(exc.path, f"{exc.problem} (line {lineno})") from None
+
 
 def generate_report(race_data: dict) -> dict:
-   
-    summary_estimates = race_data.get("hpc_race_summary_estimates", {})     # expected that hpc has estimates
-    events = race_data.get("significant_events", [])         # laps brah
-    
+    with metrics.stage("health", "generate_report"):
+        acc = HealthAccumulator.from_record(decode_race_data(race_data))      # laps brah
+        report = acc.snapshot()
+    metrics.count("health_events_processed_total", acc.events_seen)
+    return report
 
-    peak_lateral_g = 0          # g-force metrics
-    peak_vertical_g = 0
-    total_high_g_duration_ms = 0
-    
-    for event in events:
-        g_forces = event.get("g_forces", {})
-        if abs(g_forces.get("lateral_peak_g", 0)) > abs(peak_lateral_g):     # max lateral and vertical
-            peak_lateral_g = g_forces.get("lateral_peak_g")
-            
-        if abs(g_forces.get("vertical_peak_g", 0)) > abs(peak_vertical_g):
-            peak_vertical_g = g_forces.get("vertical_peak_g")
-            
-        if event.get("event_type") == "SustainedHighG":           # time sustained
-            total_high_g_duration_ms += event.get("duration_ms", 0)
+
+# Severity thresholds (fleet_health applies the same ones column-wise)
+FLUID_LOSS_HIGH_L = 2.5
+NECK_LOAD_HIGH_KG = 22
+SPINAL_PEAK_VERTICAL_G = 5.0
+SPINAL_EVENTS_MODERATE = 10
+
+
+def severities(fluid_loss, peak_neck_load, peak_vertical_g, spinal_events) -> tuple:
+    """(dehydration, neck strain, spinal compression) severity for one race."""
+    return (
+        "High" if fluid_loss > FLUID_LOSS_HIGH_L else "Moderate",
+        "High" if peak_neck_load > NECK_LOAD_HIGH_KG else "Low",
+        "Moderate" if peak_vertical_g > SPINAL_PEAK_VERTICAL_G and spinal_events > SPINAL_EVENTS_MODERATE else "Low",
+    )
+
+
+def build_report(info, peak_lateral_g, peak_vertical_g, severity: tuple | None = None) -> dict:
+    """The report for one race; `severity` is severities(...) when the caller already scored it."""
 
     report = {            # actual report
-        "driver_id": race_data.get("driver_id"),
-        "track_name": race_data.get("track_name"),
+        "driver_id": info.driver_id,
+        "track_name": info.track_name,
         "overall_summary": "",
         "key_metrics": [],
         "priority_recovery_plan": []
     }
 
     # basically check cases and have 3 thigns: severity, evidence and recommendations
+    fluid_loss = info.fluid_loss_l
+    peak_neck_load = info.peak_neck_load_kg
+    spinal_events = info.spinal_compression_events
+    if severity is None:
+        severity = severities(fluid_loss, peak_neck_load, peak_vertical_g, spinal_events)
+    dehydration, neck_strain, spinal = severity
 
     # for dehydration
-    fluid_loss = summary_estimates.get("estimated_total_fluid_loss_l", 0)
     dehydration_report = {"focus_area": "Dehydration"}
-    if fluid_loss > 2.5:
+    if dehydration == "High":
         dehydration_report["severity"] = "High"
-        dehydration_report["evidence"] = f"HPC models estimate a significant fluid loss of {fluid_loss}L, based on a cockpit temperature of {race_data.get('cockpit_temp_c')}°C and sustained G-exertion."
+        dehydration_report["evidence"] = f"HPC models estimate a significant fluid loss of {fluid_loss}L, based on a cockpit temperature of {info.cockpit_temp_c}°C and sustained G-exertion."
         dehydration_report["recommendation"] = "Immediate intake of 1.5L of electrolyte solution over the next 60 minutes. Avoid caffeine for the next 4 hours."
     else:
         dehydration_report["severity"] = "Moderate"
@@ -44,9 +167,8 @@ def generate_report(race_data: dict) -> dict:
     report["priority_recovery_plan"].append(dehydration_report)
 
     # Neck strain
-    peak_neck_load = summary_estimates.get("peak_neck_load_equivalent_kg", 0)
     neck_strain_report = {"focus_area": "Neck Strain"}
-    if peak_neck_load > 22:
+    if neck_strain == "High":
         neck_strain_report["severity"] = "High"
         neck_strain_report["evidence"] = f"The vehicle experienced sustained lateral forces up to {abs(peak_lateral_g):.1f}G. Biomechanical models estimate this created a peak equivalent load of {peak_neck_load}kg on neck muscles."
         neck_strain_report["recommendation"] = "Targeted cryotherapy (ice pack) on the affected side of the neck for 15 minutes, followed by gentle stretching exercises."
@@ -58,9 +180,8 @@ def generate_report(race_data: dict) -> dict:
 
     # spinal compression
 
-    spinal_events = summary_estimates.get("cumulative_spinal_compression_events", 0)
     spinal_report = {"focus_area": "Spinal Compression"}
-    if peak_vertical_g > 5.0 and spinal_events > 10:
+    if spinal == "Moderate":
         spinal_report["severity"] = "Moderate"
         spinal_report["evidence"] = f"The chassis accelerometer registered a significant vertical G-force spike of {peak_vertical_g:.1f}G from a kerb strike. The HPC counted {spinal_events} cumulative micro-compression events."
         spinal_report["recommendation"] = "10 minutes of spinal decompression stretches. Prioritize sleeping on a firm surface tonight. Report any lower back pain."
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+from typing import Dict, Any, Iterator, AsyncIterator, Tuple
+import asyncio
+import json
+import os
+import threading
+import time
+
+from health import HealthAccumulator, parse_ndjson_line
+
+# Live health feed: race events are published into one HealthAccumulator and
+# subscribers are pushed the latest report as server-sent events.
+#
+# Nothing is queued per subscriber. The feed keeps a version counter and the
+# serialized state of the newest version only; a subscriber remembers the last
+# version it sent and, when woken, jumps straight to the current one. A burst
+# of events therefore costs a slow client one message, never a backlog, and a
+# subscriber costs a few bytes of state. Async subscribers share one
+# asyncio.Event per event loop, so hundreds of streams run on a single thread;
+# sync subscribers (the Flask route) block on a shared Condition.
+
+class HealthFeed:
+    def __init__(self, race_data: Dict[str, Any] | None = None, min_interval_s: float = 0.1):
+        self.min_interval_s = min_interval_s
+        self._cond = threading.Condition()
+        self._acc = HealthAccumulator(race_data)
+        self._version = 0
+        self._published_at = time.monotonic()
+        self._cached: Tuple[int, Dict[str, Any]] | None = None
+        self._loop_events: Dict[asyncio.AbstractEventLoop, asyncio.Event] = {}
+        self._closed = False
+        self.subscribers = 0
+
+    @classmethod
+    def from_env(cls) -> "HealthFeed":
+        return cls(min_interval_s=float(os.environ.get("HEALTH_FEED_INTERVAL_S", 0.1)))
+
+    # ---------- Publishing ----------
+
+    def publish(self, event: Dict[str, Any]) -> int:
+        return self.publish_many([event])
+
+    def publish_many(self, events) -> int:
+        with self._cond:
+            self._acc.extend(events)
+            return self._bump()
+
+    def publish_ndjson(self, lines, chunk: int = 1024) -> int:
+        """
+        Lines are read and parsed outside the lock (they may come off a slow
+        request body) and applied in chunks, one version per chunk.
+        """
+        pending = []
+        version = self._version
+        for n, line in enumerate(lines, 1):
+            item = parse_ndjson_line(line, n)
+            if item is not None:
+                pending.append(item)
+            if len(pending) >= chunk:
+                version = self._apply(pending)
+                pending = []
+        return self._apply(pending) if pending else version
+
+    def _apply(self, items) -> int:
+        with self._cond:
+            for kind, obj in items:
+                if kind == "race_data":
+                    self._acc.update_meta(obj)
+                else:
+                    self._acc.add_values(*obj)
+            return self._bump()
+
+    def reset(self, race_data: Dict[str, Any] | None = None) -> int:
+        """Start a new race: drop all accumulated events."""
+        with self._cond:
+            self._acc = HealthAccumulator(race_data)
+            return self._bump()
+
+    def _bump(self) -> int:
+        # caller holds the lock
+        self._version += 1
+        self._published_at = time.monotonic()
+        self._cond.notify_all()
+        for loop, ev in list(self._loop_events.items()):
+            try:
+                loop.call_soon_threadsafe(ev.set)
+            except RuntimeError:          # loop closed
+                del self._loop_events[loop]
+        return self._version
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._bump()
+
+    # ---------- State ----------
+
+    def state(self) -> Tuple[int, float, Dict[str, Any]]:
+        """(version, published_at, state); the report is built at most once per version."""
+        with self._cond:
+            if self._cached is None or self._cached[0] != self._version:
+                report = self._acc.snapshot()
+                self._cached = (self._version, {
+                    "version": self._version,
+                    "events_seen": self._acc.events_seen,
+                    "key_metrics": report["key_metrics"],
+                    "severity": {p["focus_area"]: p["severity"] for p in report["priority_recovery_plan"]},
+                    "report": report,
+                })
+            return self._version, self._published_at, self._cached[1]
+
+    @staticmethod
+    def sse_message(state: Dict[str, Any], previous: Dict[str, str] | None) -> bytes:
+        """One SSE `health` event; `changed` lists focus areas whose severity differs from what this client last saw."""
+        changed = [k for k, v in state["severity"].items() if previous is None or previous.get(k) != v]
+        data = json.dumps({**state, "changed": changed}, separators=(",", ":"))
+        return f"id: {state['version']}\nevent: health\ndata: {data}\n\n".encode()
+
+    # ---------- Subscribers ----------
+
+    def stream(self, last_version: int = -1, heartbeat_s: float = 15.0) -> Iterator[bytes]:
+        """Blocking SSE generator for WSGI servers."""
+        with self._cond:
+            self.subscribers += 1
+        try:
+            seen, severity = last_version, None
+            while True:
+                with self._cond:
+                    woke = self._cond.wait_for(lambda: self._version != seen or self._closed, heartbeat_s)
+                    closed = self._closed
+                if closed:
+                    return
+                if not woke:
+                    yield b": keep-alive\n\n"
+                    continue
+                seen, _, state = self.state()
+                yield self.sse_message(state, severity)
+                severity = state["severity"]
+                if self.min_interval_s:
+                    time.sleep(self.min_interval_s)     # coalesce bursts
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    def _loop_event(self) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            ev = self._loop_events.get(loop)
+            if ev is None:
+                ev = self._loop_events[loop] = asyncio.Event()
+            return ev
+
+    async def updates(self, last_version: int = -1) -> AsyncIterator[Tuple[int, float, Dict[str, Any]]]:
+        """Async iterator of (version, published_at, state); skips versions a slow consumer missed."""
+        ev = self._loop_event()
+        with self._cond:
+            self.subscribers += 1
+        try:
+            seen = last_version
+            while not self._closed:
+                if self._version == seen:
+                    await ev.wait()
+                    # every waiter on this loop has been scheduled by now; re-arm for the next publish
+                    ev.clear()
+                    continue
+                version, published_at, state = self.state()
+                seen = version
+                yield version, published_at, state
+                if self.min_interval_s:
+                    await asyncio.sleep(self.min_interval_s)
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    async def astream(self, last_version: int = -1) -> AsyncIterator[bytes]:
+        """Async SSE generator for ASGI servers."""
+        severity = None
+        async for _, _, state in self.updates(last_version):
+            yield self.sse_message(state, severity)
+            severity = state["severity"]
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+from collections import OrderedDict, deque
+from typing import Dict, Any, Callable, Tuple
+import hashlib
+import itertools
+import os
+import pickle
+import threading
+import time
+
+import metrics
+
+# Background jobs for the setup and health-report computations.
+#
+# submit(kind, key, fn) queues fn and returns its Job. While a job with the
+# same key is queued or running, later submits get that job back (single
+# flight): a burst of identical requests costs one computation. Keys are
+# content hashes (result_cache.setup_cache_key for setups, content_key of
+# the race_data doc for reports), so "identical" means the same doc version
+# and answers. A fixed pool of worker threads drains a bounded FIFO; with
+# `max_pending` jobs waiting, submit raises QueueFull and the route answers
+# 503 + Retry-After instead of growing a backlog. Finished jobs stay
+# retrievable by id for `keep_s` (at most `max_finished`, oldest dropped
+# first) and wait() long-polls on a shared Condition. Workers start on the
+# first submit. This queue is in-process, one per server worker; the routes
+# only use submit / get / wait, so a shared broker can sit behind the same
+# surface if several processes ever need one queue.
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+class QueueFull(Exception):
+    pass
+
+def content_key(kind: str, obj: Any) -> str:
+    """Job key for an arbitrary picklable payload (e.g. the race_data doc)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(kind.encode())
+    h.update(pickle.dumps(obj, protocol=5))
+    return h.hexdigest()
+
+class Job:
+    __slots__ = ("id", "kind", "key", "state", "result", "error", "joined",
+                 "submitted_at", "started_at", "finished_at", "_fn")
+
+    def __init__(self, job_id: str, kind: str, key: str, fn: Callable[[], Any], now: float):
+        self.id = job_id
+        self.kind = kind
+        self.key = key
+        self.state = QUEUED
+        self.result: Any = None
+        self.error: str | None = None
+        self.joined = 0                  # later submits collapsed into this job
+        self.submitted_at = now
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self._fn: Callable[[], Any] | None = fn
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (DONE, FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        out = {"job_id": self.id, "kind": self.kind, "state": self.state, "joined": self.joined}
+        if self.started_at is not None:
+            out["queued_s"] = round(self.started_at - self.submitted_at, 6)
+        if self.finished_at is not None:
+            out["run_s"] = round(self.finished_at - self.started_at, 6)
+        if self.error is not None:
+            out["error"] = self.error
+        return out
+
+class JobQueue:
+    def __init__(
+        self,
+        workers: int = 2,
+        max_pending: int = 64,
+        keep_s: float = 300.0,
+        max_finished: int = 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.keep_s = keep_s
+        self.max_finished = max_finished
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._pending: "deque[Job]" = deque()
+        self._inflight: Dict[str, Job] = {}               # key -> queued / running job
+        self._jobs: Dict[str, Job] = {}                   # id -> every job still retrievable
+        self._finished: "OrderedDict[str, float]" = OrderedDict()     # id -> finished_at, oldest first
+        self._threads: list = []
+        self._ids = itertools.count(1)
+        self._prefix = os.urandom(4).hex()                # ids stay unique across restarts
+        self._closed = False
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    @classmethod
+    def from_env(cls) -> "JobQueue":
+        return cls(
+            workers=int(os.environ.get("JOB_WORKERS", 2)),
+            max_pending=int(os.environ.get("JOB_QUEUE_SIZE", 64)),
+            keep_s=float(os.environ.get("JOB_KEEP_S", 300)),
+        )
+
+    # ---------- Submitting ----------
+
+    def submit(self, kind: str, key: str, fn: Callable[[], Any]) -> Tuple[Job, bool]:
+        """(job, deduplicated). Raises QueueFull when max_pending jobs are already waiting."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("job queue is closed")
+            job = self._inflight.get(key)
+            if job is not None:
+                job.joined += 1
+                self.deduplicated += 1
+                metrics.count("job_requests_total", kind=kind, result="deduplicated")
+                return job, True
+            if len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                metrics.count("job_requests_total", kind=kind, result="rejected")
+                raise QueueFull(f"{len(self._pending)} jobs already queued")
+            job = Job(f"{self._prefix}-{next(self._ids)}", kind, key, fn, self._clock())
+            self._inflight[key] = job
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self.submitted += 1
+            self._expire()
+            if len(self._threads) < self.workers:
+                self._start_worker()
+            self._cond.notify()
+        metrics.count("job_requests_total", kind=kind, result="queued")
+        return job, False
+
+    def _start_worker(self) -> None:
+        # caller holds the lock
+        t = threading.Thread(target=self._work, name=f"jobs-{len(self._threads) + 1}", daemon=True)
+        self._threads.append(t)
+        t.start()
+
+    # ---------- Workers ----------
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return                # closed and drained
+                job = self._pending.popleft()
+                job.state = RUNNING
+                job.started_at = self._clock()
+                fn, job._fn = job._fn, None
+            try:
+                with metrics.stage("jobs", job.kind):
+                    result, error, state = fn(), None, DONE
+            except Exception as exc:      # reported through the job, never kills the worker
+                result, error, state = None, f"{type(exc).__name__}: {exc}", FAILED
+            with self._cond:
+                job.result, job.error, job.state = result, error, state
+                job.finished_at = self._clock()
+                del self._inflight[job.key]
+                self._finished[job.id] = job.finished_at
+                if state == DONE:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._expire()
+                self._cond.notify_all()   # long-pollers and idle workers re-check
+            metrics.count("jobs_finished_total", kind=job.kind, state=state)
+
+    def _expire(self) -> None:
+        # caller holds the lock
+        cutoff = self._clock() - self.keep_s
+        while self._finished:
+            job_id, at = next(iter(self._finished.items()))
+            if at > cutoff and len(self._finished) <= self.max_finished:
+                break
+            del self._finished[job_id]
+            del self._jobs[job_id]
+
+    # ---------- Retrieval ----------
+
+    def get(self, job_id: str) -> Job | None:
+        with self._cond:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> Job | None:
+        """The job once finished, or as it stands after `timeout` seconds; None if unknown or expired."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None and timeout > 0:
+                self._cond.wait_for(lambda: job.finished or self._closed, timeout)
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def close(self, wait: bool = True) -> None:
+        """Stop accepting jobs; workers finish what is queued, then exit."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for t in threads:
+                t.join()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "workers": len(self._threads),
+                "max_workers": self.workers,
+                "queued": len(self._pending),
+                "running": len(self._inflight) - len(self._pending),
+                "max_pending": self.max_pending,
+                "retained": len(self._jobs),
+                "submitted": self.submitted,
+                "deduplicated": self.deduplicated,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
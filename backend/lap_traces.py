@@ -0,0 +1,326 @@
+from __future__ import annotations
+
+from typing import Dict, Any, List, Sequence, Tuple
+import copy
+
+import numpy as np
+
+from poc import validate_schema
+from schema import SchemaError, describe, join_path
+import metrics
+
+# Per-turn metrics from distance-indexed lap traces.
+#
+# LapTraces holds every lap on one distance grid: each channel is an
+# (n_laps, n_points) array. extract_turns() cuts the grid into the track's
+# turns (start_m..end_m), finds each lap's apex (minimum speed) in each turn,
+# splits the turn into entry / mid / exit around it, and reduces every channel
+# over (lap, turn) or (lap, turn, phase) groups at once: the turns are
+# gathered into one compressed array so np.ufunc.reduceat runs per turn, and
+# phase groups go through np.bincount. Per-lap values are then averaged over
+# laps, and their lap-to-lap standard deviation is kept in lap_stats.
+#
+# First-order definitions (constants below):
+#   *_oversteer_index       mean (|yaw rate| - |kinematic yaw rate|) /
+#                           (|kinematic yaw rate| + YAW_FLOOR_RAD_S) over the
+#                           phase while steering; kinematic yaw = v * road-wheel
+#                           angle / wheelbase, so > 0 means the car rotates
+#                           more than the steering asks for
+#   brake_locking_risk_*    mean of clip((-slip - SLIP_OK) / (SLIP_LOCK - SLIP_OK))
+#                           over entry points on the brakes
+#   traction_loss_index     the same for rear slip over exit points on throttle
+#   porpoising_amplitude_mm sqrt(2) x ride-height standard deviation (0 without
+#                           a ride_height_mm channel)
+
+REQUIRED_CHANNELS = (
+    "speed_kmh", "throttle", "brake", "steering_deg", "yaw_rate_dps", "lat_g", "long_g",
+    "wheel_slip_front", "wheel_slip_rear",
+    "tyre_surface_temp_fl", "tyre_surface_temp_fr", "tyre_surface_temp_rl", "tyre_surface_temp_rr",
+)
+OPTIONAL_CHANNELS = (
+    "ride_height_mm", "vert_g",
+    "tyre_core_temp_fl", "tyre_core_temp_fr", "tyre_core_temp_rl", "tyre_core_temp_rr",
+    "tyre_pressure_fl", "tyre_pressure_fr", "tyre_pressure_rl", "tyre_pressure_rr",
+)
+CORNERS = ("fl", "fr", "rl", "rr")
+
+WHEELBASE_M = 3.6
+STEERING_RATIO = 12.0
+STEER_MIN_DEG = 3.0
+YAW_FLOOR_RAD_S = 0.02
+MID_FRACTION = 0.2          # share of the turn's points around the apex counted as mid-corner
+BRAKE_ON = 0.1
+THROTTLE_ON = 0.2
+FULL_THROTTLE = 0.9
+HEAVY_BRAKE = 0.8
+SLIP_OK = 0.05
+SLIP_LOCK = 0.15
+BOTTOMING_MM = 2.0
+MIN_TURN_POINTS = 3
+
+def _floats(values: Any, path: str) -> np.ndarray:
+    try:
+        return np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        raise SchemaError(path, "expected numbers (a list, or a list of equal-length lists per lap)") from None
+
+class LapTraces:
+    """Laps resampled onto one distance grid; channels are (n_laps, n_points) float arrays."""
+
+    def __init__(self, distance_m: Sequence[float], channels: Dict[str, Any]):
+        self.distance_m = _floats(distance_m, "distance_m")
+        if self.distance_m.ndim != 1 or len(self.distance_m) < 2 or np.any(np.diff(self.distance_m) <= 0):
+            raise SchemaError("distance_m", "expected an increasing list of at least 2 distances")
+        if not isinstance(channels, dict):
+            raise SchemaError("channels", f"expected an object of channels, {describe(channels)}")
+        missing = [c for c in REQUIRED_CHANNELS if c not in channels]
+        if missing:
+            raise SchemaError(missing[0], "missing channel")
+        self.channels: Dict[str, np.ndarray] = {}
+        for name in REQUIRED_CHANNELS + OPTIONAL_CHANNELS:
+            if name not in channels:
+                continue
+            arr = np.atleast_2d(_floats(channels[name], name))
+            if arr.ndim != 2 or arr.shape[1] != len(self.distance_m):
+                raise SchemaError(name, f"expected (laps, {len(self.distance_m)}) samples, got shape {arr.shape}")
+            self.channels[name] = arr
+        shapes = {a.shape[0] for a in self.channels.values()}
+        if len(shapes) != 1:
+            raise SchemaError("", "every channel needs the same number of laps")
+        self.n_laps = shapes.pop()
+
+    @classmethod
+    def from_laps(cls, laps: Sequence[Dict[str, Any]], step_m: float = 2.0) -> "LapTraces":
+        """
+        Laps given as {"distance_m": [...], <channel>: [...], ...}, each with its
+        own distance samples, linearly resampled onto a common grid spanning the
+        shortest lap.
+        """
+        if not isinstance(laps, list) or not laps:
+            raise SchemaError("laps", f"expected a non-empty list of laps, {describe(laps)}")
+        dists = []
+        for i, lap in enumerate(laps):
+            if not isinstance(lap, dict):
+                raise SchemaError(join_path("laps", i), f"expected a lap object, {describe(lap)}")
+            d = _floats(lap.get("distance_m", ()), join_path(join_path("laps", i), "distance_m"))
+            if d.ndim != 1 or len(d) < 2 or np.any(np.diff(d) <= 0):
+                raise SchemaError(join_path(join_path("laps", i), "distance_m"), "expected an increasing list of at least 2 distances")
+            dists.append(d)
+        grid = np.arange(max(d[0] for d in dists), min(d[-1] for d in dists) + 1e-9, step_m)
+        names = [c for c in REQUIRED_CHANNELS + OPTIONAL_CHANNELS if all(c in lap for lap in laps)]
+        channels = {}
+        for name in names:
+            rows = np.empty((len(laps), len(grid)))
+            for i, (lap, d) in enumerate(zip(laps, dists)):
+                values = _floats(lap[name], join_path(join_path("laps", i), name))
+                if values.shape != d.shape:
+                    raise SchemaError(join_path(join_path("laps", i), name), f"expected {len(d)} samples, got {values.size}")
+                rows[i] = np.interp(grid, d, values)
+            channels[name] = rows
+        return cls(grid, channels)
+
+def _turn_defs(turns: Any) -> List[Dict[str, Any]]:
+    if not isinstance(turns, list) or not turns:
+        raise SchemaError("turns", f"expected a non-empty list of turn definitions, {describe(turns)}")
+    prev_end = -np.inf
+    for i, t in enumerate(turns):
+        where = join_path("turns", i)
+        if not isinstance(t, dict):
+            raise SchemaError(where, f"expected a turn object, {describe(t)}")
+        for k in ("start_m", "end_m"):
+            v = t.get(k)
+            if not isinstance(v, (int, float)) or isinstance(v, bool):
+                raise SchemaError(join_path(where, k), f"expected a number, {describe(v)}")
+        if not prev_end <= t["start_m"] < t["end_m"]:
+            raise SchemaError(where, "turns must be in track order, start_m < end_m, and not overlap")
+        prev_end = t["end_m"]
+    return turns
+
+class _Segments:
+    """The grid points of every turn, gathered so each turn is one contiguous run."""
+
+    def __init__(self, distance_m: np.ndarray, turns: List[Dict[str, Any]]):
+        lo = np.searchsorted(distance_m, [t["start_m"] for t in turns], "left")
+        hi = np.searchsorted(distance_m, [t["end_m"] for t in turns], "right")
+        self.counts = hi - lo
+        short = np.flatnonzero(self.counts < MIN_TURN_POINTS)
+        if len(short):
+            i = int(short[0])
+            raise SchemaError(join_path("turns", i), f"fewer than {MIN_TURN_POINTS} trace points in {turns[i]['start_m']}..{turns[i]['end_m']} m")
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))
+        self.ends = self.starts + self.counts
+        self.index = np.repeat(lo - self.starts, self.counts) + np.arange(self.counts.sum())
+        self.turn = np.repeat(np.arange(len(turns)), self.counts)
+        self.pos = np.arange(len(self.index))
+        self.n_turns = len(turns)
+
+    def take(self, x: np.ndarray) -> np.ndarray:
+        return x[:, self.index]
+
+    def reduce(self, ufunc: np.ufunc, x: np.ndarray) -> np.ndarray:
+        """(laps, turns) reduction of a compressed (laps, points) array."""
+        return ufunc.reduceat(x, self.starts, axis=1)
+
+    def spread(self, per_turn: np.ndarray) -> np.ndarray:
+        """(laps, turns) -> (laps, points)."""
+        return np.repeat(per_turn, self.counts, axis=-1)
+
+    def masked_mean(self, x: np.ndarray, mask: np.ndarray, empty: float = np.nan) -> np.ndarray:
+        n = self.reduce(np.add, mask.astype(float))
+        s = self.reduce(np.add, np.where(mask, x, 0.0))
+        return np.divide(s, n, out=np.full(n.shape, empty), where=n > 0)
+
+def _phase_means(seg: _Segments, phase: np.ndarray, x: np.ndarray, mask: np.ndarray, empty: float = np.nan) -> np.ndarray:
+    """(laps, turns, 3) masked means per entry / mid / exit phase."""
+    n_laps = x.shape[0]
+    groups = seg.n_turns * 3
+    key = (np.arange(n_laps)[:, None] * groups + seg.turn * 3 + phase).ravel()
+    m = mask.ravel().astype(float)
+    s = np.bincount(key, weights=x.ravel() * m, minlength=n_laps * groups)
+    n = np.bincount(key, weights=m, minlength=n_laps * groups)
+    return np.divide(s, n, out=np.full(n.shape, empty), where=n > 0).reshape(n_laps, seg.n_turns, 3)
+
+def _lap_mean(v: np.ndarray, fallback: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+    """Mean and standard deviation over laps (axis 0), ignoring laps without data."""
+    ok = ~np.isnan(v)
+    n = ok.sum(axis=0)
+    mean = np.divide(np.where(ok, v, 0.0).sum(axis=0), n, out=np.full(v.shape[1:], fallback), where=n > 0)
+    dev = np.where(ok, v - mean, 0.0)
+    std = np.sqrt(np.divide((dev * dev).sum(axis=0), n, out=np.zeros(v.shape[1:]), where=n > 0))
+    return mean, std
+
+def _risk(slip: np.ndarray) -> np.ndarray:
+    return np.clip((slip - SLIP_OK) / (SLIP_LOCK - SLIP_OK), 0.0, 1.0)
+
+def lap_metrics(traces: LapTraces, turns: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Every per-turn metric for every lap: name -> (n_laps, n_turns) array (NaN where a lap has no data)."""
+    turns = _turn_defs(turns)
+    seg = _Segments(traces.distance_m, turns)
+    ch = {name: seg.take(arr) for name, arr in traces.channels.items()}
+    v = ch["speed_kmh"]
+
+    # apex: first minimum-speed point of each (lap, turn); phases around it
+    vmin = seg.reduce(np.minimum, v)
+    apex = seg.reduce(np.minimum, np.where(v == seg.spread(vmin), seg.pos, len(seg.pos)))
+    half_mid = seg.spread(np.maximum(1, (seg.counts * MID_FRACTION / 2).astype(int)))
+    apex_pt = seg.spread(apex)
+    phase = (seg.pos >= apex_pt - half_mid).astype(np.int64) + (seg.pos > apex_pt + half_mid)
+    entry, exit_ = phase == 0, phase == 2
+
+    # time along the lap, for the throttle / brake timings
+    ds = np.gradient(traces.distance_m)
+    dt = seg.take(ds / np.maximum(traces.channels["speed_kmh"], 1.0) * 3.6)
+    t = np.cumsum(dt, axis=1)
+
+    r = np.abs(np.deg2rad(ch["yaw_rate_dps"]))
+    r_ref = np.abs(v / 3.6 * np.deg2rad(ch["steering_deg"] / STEERING_RATIO) / WHEELBASE_M)
+    oversteer = (r - r_ref) / (r_ref + YAW_FLOOR_RAD_S)
+    steering = np.abs(ch["steering_deg"]) >= STEER_MIN_DEG
+    balance = _phase_means(seg, phase, oversteer, steering)
+    whole = seg.masked_mean(oversteer, steering, 0.0)[:, :, None]
+    balance = np.where(np.isnan(balance), whole, balance)      # a phase without steering reads as the whole turn
+
+    braking = entry & (ch["brake"] >= BRAKE_ON)
+    on_throttle = exit_ & (ch["throttle"] >= THROTTLE_ON)
+    full_throttle = exit_ & (ch["throttle"] >= FULL_THROTTLE)
+    rows = len(seg.pos)
+    first_full = seg.reduce(np.minimum, np.where((seg.pos >= apex_pt) & (ch["throttle"] >= FULL_THROTTLE), seg.pos, rows))
+    first_full = np.minimum(first_full, seg.ends[None, :] - 1)      # never reached: the end of the turn
+    at = lambda x, i: np.take_along_axis(x, i, axis=1)
+
+    out = {
+        "balance.entry_oversteer_index": balance[:, :, 0],
+        "balance.mid_oversteer_index": balance[:, :, 1],
+        "balance.exit_oversteer_index": balance[:, :, 2],
+        "braking.brake_locking_risk_front": seg.masked_mean(_risk(-ch["wheel_slip_front"]), braking, 0.0),
+        "braking.brake_locking_risk_rear": seg.masked_mean(_risk(-ch["wheel_slip_rear"]), braking, 0.0),
+        "braking.min_long_g_brake": seg.reduce(np.minimum, ch["long_g"]),
+        "traction.traction_loss_index": seg.masked_mean(_risk(ch["wheel_slip_rear"]), on_throttle, 0.0),
+        "traction.deployment_wheelspin_risk": seg.masked_mean((ch["wheel_slip_rear"] > SLIP_LOCK).astype(float), full_throttle, 0.0),
+        "traction.max_long_g_exit": seg.reduce(np.maximum, np.where(exit_, ch["long_g"], -np.inf)),
+        "kinematics.v_entry_kmh": v[:, seg.starts],
+        "kinematics.v_apex_kmh": vmin,
+        "kinematics.v_exit_kmh": v[:, seg.ends - 1],
+        "kinematics.lat_g_apex": np.abs(at(ch["lat_g"], apex)),
+        "kinematics.throttle_time_90pct_ms": (at(t, first_full) - at(t, apex)) * 1000.0,
+        "kinematics.brake_time_80pct_ms": seg.reduce(np.add, np.where(ch["brake"] >= HEAVY_BRAKE, dt, 0.0)) * 1000.0,
+        "track_env.kerb_impact_g": seg.reduce(np.maximum, np.abs(ch["vert_g"] - 1.0)) if "vert_g" in ch else np.zeros_like(vmin),
+    }
+    out["traction.max_long_g_exit"] = np.where(np.isinf(out["traction.max_long_g_exit"]), np.nan, out["traction.max_long_g_exit"])
+    for c in CORNERS:
+        out[f"tyre.surface_temp_c.{c}"] = seg.reduce(np.add, ch[f"tyre_surface_temp_{c}"]) / seg.counts
+        if f"tyre_core_temp_{c}" in ch:
+            out[f"tyre.core_temp_c.{c}"] = seg.reduce(np.add, ch[f"tyre_core_temp_{c}"]) / seg.counts
+        if f"tyre_pressure_{c}" in ch:
+            out[f"tyre.pressures_psi.{c}"] = seg.reduce(np.add, ch[f"tyre_pressure_{c}"]) / seg.counts
+    if "ride_height_mm" in ch:
+        rh = ch["ride_height_mm"]
+        mean = seg.reduce(np.add, rh) / seg.counts
+        var = np.maximum(seg.reduce(np.add, rh * rh) / seg.counts - mean * mean, 0.0)
+        out["aero_ride.porpoising_amplitude_mm"] = np.sqrt(2.0 * var)
+        out["aero_ride.bottoming_risk_index"] = seg.reduce(np.add, (rh < BOTTOMING_MM).astype(float)) / seg.counts
+        out["aero_ride.ride_height_margin_min_mm"] = seg.reduce(np.minimum, rh)
+        out["track_env.bump_rms_mm"] = np.sqrt(var)
+    else:
+        out["aero_ride.porpoising_amplitude_mm"] = np.zeros_like(vmin)
+        out["aero_ride.bottoming_risk_index"] = np.zeros_like(vmin)
+    return out
+
+# fields whose lap-to-lap spread is reported (what the setup rules threshold on)
+SPREAD_FIELDS = (
+    "balance.entry_oversteer_index", "balance.mid_oversteer_index", "balance.exit_oversteer_index",
+    "braking.brake_locking_risk_front", "braking.brake_locking_risk_rear",
+    "traction.traction_loss_index", "aero_ride.porpoising_amplitude_mm",
+    "tyre.surface_temp_c.fl", "tyre.surface_temp_c.fr", "tyre.surface_temp_c.rl", "tyre.surface_temp_c.rr",
+)
+
+def _set(d: Dict[str, Any], path: str, value: Any) -> None:
+    *head, last = path.split(".")
+    for k in head:
+        d = d.setdefault(k, {})
+    d[last] = value
+
+def extract_turns(traces: LapTraces, turns: List[Dict[str, Any]], decimals: int = 4) -> List[Dict[str, Any]]:
+    """test_drive `turns` entries for the track's turn definitions, averaged over every lap."""
+    with metrics.stage("lap_traces", "metrics"):
+        per_lap = lap_metrics(traces, turns)
+    with metrics.stage("lap_traces", "aggregate"):
+        stats = {name: _lap_mean(v) for name, v in per_lap.items()}
+        out = []
+        for i, t in enumerate(turns):
+            turn = {
+                "turn_id": t.get("turn_id", f"t{i + 1}"),
+                "name": t.get("name", t.get("turn_id", f"t{i + 1}")),
+                "sector": t.get("sector", 1),
+                "length_m": round(t["end_m"] - t["start_m"], 3),
+                "time_loss_weight": t.get("time_loss_weight", 1.0),
+                "occurrence_rate": t.get("occurrence_rate", 1.0),
+                "driver_confidence_weight": t.get("driver_confidence_weight", 1.0),
+            }
+            for name, (mean, _) in stats.items():
+                _set(turn, name, round(float(mean[i]), decimals))
+            turn["lap_stats"] = {
+                "laps": traces.n_laps,
+                "std": {name: round(float(stats[name][1][i]), decimals) for name in SPREAD_FIELDS},
+            }
+            out.append(turn)
+    metrics.count("lap_trace_turns_total", len(out) * traces.n_laps)
+    return out
+
+def build_test_drive_doc(base_doc: Dict[str, Any], traces: LapTraces, turns: List[Dict[str, Any]] | None = None) -> Dict[str, Any]:
+    """
+    `base_doc` (targets, constraints, initial setup) with its turns replaced by
+    the ones extracted from `traces`. Turn definitions default to the base
+    doc's `track_turns`. The result is validated like any stored test_drive doc.
+    Raises SchemaError; a bad default definition is reported under `track_turns`.
+    """
+    if turns is None:
+        try:
+            turns = _turn_defs(base_doc.get("track_turns"))
+        except SchemaError as exc:
+            raise SchemaError("track_turns" + exc.path[len("turns"):], exc.problem) from None
+    doc = {k: copy.deepcopy(v) for k, v in base_doc.items() if k != "turns"}
+    doc["turns"] = extract_turns(traces, turns)
+    doc.setdefault("metadata", {})["telemetry_source"] = {"kind": "lap_traces", "laps": traces.n_laps}
+    validate_schema(doc)
+    return doc
@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+from typing import Dict, Any, List, Tuple
+
+import numpy as np
+
+from poc import UserPreferences, build_cost_weights, build_preferences_from_doc, _safe_get
+from schema import INPUT_FIELDS, SchemaError, join_path, read_num, read_num_or, read_obj
+from setup_array import APPLY_ORDER, N_SLOTS, Setup
+from solver import project_move, sensitivity_model_for_doc, setting_limits, solve_setup, step_caps
+from turn_matrix import aggression_scale, compile_rules_for_doc, compile_turns, compute_setup_from_matrix, huber_weights
+import metrics
+
+# Lap-time surrogate for ranking candidate setups.
+#
+# Each turn is two constant-acceleration halves, entry -> apex and apex ->
+# exit, over its length_m at the measured kinematics speeds; with the doc's
+# metadata.lap_length_m the rest of the lap is split into straights that
+# accelerate from one turn's exit speed to the next turn's entry speed.
+# A candidate setup changes the times through grip:
+#
+#   - the solver's turn-response model (solver.sensitivity_model_for_doc)
+#     predicts every turn's balance, locking, traction, porpoising and tyre
+#     temperatures under the candidate; squared deviations from the goals
+#     cost grip per phase (constants below)
+#   - the model's aero_grip terms change downforce, which counts for the
+#     share of the apex grip above MECH_GRIP_G (from lat_g_apex)
+#   - the model's lap_time_s terms add straight-line drag
+#
+# Apex speed scales with sqrt(mid-phase grip ratio), braking time with the
+# entry ratio and the exit speed gain with the exit ratio. A zero move
+# reproduces the measured speeds, so deltas are relative to the session as
+# driven. Candidates are scored in batches of BATCH_CANDIDATES as
+# (candidates, turns, metrics) arrays; confidence_for_rookie falls with the
+# predicted stability and ride cost (CostWeights-weighted, as in the solver).
+# Every candidate is first projected like the solver's iterates: each
+# setting's move within per_turn_step_caps x aggression scale, then the
+# absolute limits. The surrogate is linear in the move, so unbounded
+# candidates would always win by going further than the caps allow.
+
+MECH_GRIP_G = 1.6               # lateral G without downforce; the rest of lat_g_apex is aero
+BALANCE_GRIP_LOSS = 0.02        # grip lost per (phase balance error / scale)^2
+TYRE_GRIP_LOSS = 0.01           # per mean (surface temp error / scale)^2, every phase
+LOCKING_GRIP_LOSS = 0.03        # entry, per (locking excess / scale)^2, front and rear
+TRACTION_GRIP_LOSS = 0.03       # exit, per (traction excess / scale)^2
+PORPOISING_AERO_LOSS = 0.02     # downforce lost per (porpoising excess / scale)^2
+MAX_GRIP_LOSS = 0.5
+
+BATCH_CANDIDATES = 256
+DEFAULT_CANDIDATES = 2000
+MAX_CANDIDATES = 50000
+SHORTLIST = 5
+MAX_SHORTLIST = 20
+HEURISTIC_SCALES = (0.25, 0.5, 0.75, 1.0, 1.25)
+RANDOM_SPREAD = 0.5             # random candidates: normal noise x step cap around the heuristic / solver moves
+
+_COL = {f: i for i, f in enumerate(INPUT_FIELDS)}
+_ENTRY, _MID, _EXIT = _COL["balance.entry_oversteer_index"], _COL["balance.mid_oversteer_index"], _COL["balance.exit_oversteer_index"]
+_LOCK = slice(_COL["braking.brake_locking_risk_front"], _COL["braking.brake_locking_risk_rear"] + 1)
+_TRACTION = _COL["traction.traction_loss_index"]
+_PORPOISE = _COL["aero_ride.porpoising_amplitude_mm"]
+_TYRE = slice(_COL["tyre.surface_temp_c.fl"], _COL["tyre.surface_temp_c.rr"] + 1)
+
+def _kinematics(doc: Dict[str, Any]) -> np.ndarray:
+    """(6, N): length_m, entry / apex / exit speed (m/s), lat_g_apex, occurrence_rate."""
+    out = []
+    for i, t in enumerate(doc["turns"]):
+        path = join_path("turns", i)
+        k = read_obj(t, "kinematics", path)
+        kp = join_path(path, "kinematics")
+        row = []
+        for parent, where, f in ((t, path, "length_m"), (k, kp, "v_entry_kmh"), (k, kp, "v_apex_kmh"),
+                                 (k, kp, "v_exit_kmh"), (k, kp, "lat_g_apex")):
+            v = read_num(parent, f, where)
+            if not v > 0:
+                raise SchemaError(join_path(where, f), f"expected a positive number, got {v!r}")
+            row.append(v)
+        row.append(read_num_or(t, "occurrence_rate", 1.0, path))
+        out.append(row)
+    out = np.array(out).T
+    out[1:4] /= 3.6
+    return out
+
+class LapTimeModel:
+    """One session's turns and setup, compiled for scoring (C, N_SLOTS) setting moves."""
+
+    def __init__(self, doc: Dict[str, Any], prefs: UserPreferences | None = None, sensitivity: Dict[str, Any] | None = None):
+        rules = compile_rules_for_doc(doc)
+        tm = compile_turns(doc, rules.turn_fields)      # validates the doc
+        self.prefs = prefs if prefs is not None else build_preferences_from_doc(doc)
+        self.model = model = sensitivity_model_for_doc(doc, sensitivity)
+        self.setup = Setup.from_json(doc["initial_setup"])
+        self.limits = setting_limits(_safe_get(doc, "weights_and_constraints", "absolute_limits", default={}) or {})
+        caps = step_caps(_safe_get(doc, "weights_and_constraints", "per_turn_step_caps", default={}) or {})
+        self.unit = np.where(np.isfinite(caps), caps, 1.0)
+        self.caps = caps * aggression_scale(self.prefs)      # the solver's bound on each setting's total move
+        modelled = np.any(model.jacobian != 0, axis=1) | (model.lap_time != 0) | (model.aero_grip != 0)
+        self.modelled = modelled & np.isfinite(self.setup.values)
+
+        self.length, self.v_entry, self.v_apex, self.v_exit, lat_g, self.occurrence = _kinematics(doc)
+        self.aero_share = np.clip(1.0 - MECH_GRIP_G / lat_g, 0.0, 1.0)
+        lap_length = _safe_get(doc, "metadata", "lap_length_m")
+        rest = float(lap_length) - float(self.length.sum()) if isinstance(lap_length, (int, float)) else 0.0
+        self.turns_only = not rest > 0
+        self.straight = max(rest, 0.0) / len(self.length)
+        self.v_next_entry = np.roll(self.v_entry, -1)
+
+        self.inv_scale = 1.0 / model.scales
+        self.errors = np.where(np.isnan(tm.errors), 0.0, tm.errors) * self.inv_scale      # (N, M) scaled
+        self.jac = model.jacobian * self.inv_scale
+        w = huber_weights(tm)
+        self.weights = w / w.sum() if w.sum() > 0 else np.full(len(w), 1.0 / len(w))
+        cw = build_cost_weights(self.prefs)
+        self.risk_weight = np.zeros(len(INPUT_FIELDS))
+        self.risk_weight[_LOCK] = cw.w_stab
+        self.risk_weight[_TRACTION] = cw.w_stab
+        self.risk_weight[_PORPOISE] = cw.w_ride
+
+        self._base_grip = self._grip(self.errors[None], np.zeros(1))     # grip ratios are exactly 1 at a zero move
+        self.baseline_s = float(self._times(np.zeros((1, N_SLOTS)))[0][0])
+        ref = _safe_get(doc, "metadata", "reference_lap_time_s")
+        self.reference_s = float(ref) if isinstance(ref, (int, float)) and ref > 0 else self.baseline_s
+
+    def _grip(self, r: np.ndarray, aero_gain: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Entry, mid and exit grip (B, N) for scaled predicted errors (B, N, M)."""
+        ex = np.maximum(r, 0.0)
+        tyre = TYRE_GRIP_LOSS * (r[..., _TYRE] ** 2).mean(axis=-1)
+        entry = BALANCE_GRIP_LOSS * r[..., _ENTRY] ** 2 + LOCKING_GRIP_LOSS * (ex[..., _LOCK] ** 2).sum(axis=-1) + tyre
+        mid = BALANCE_GRIP_LOSS * r[..., _MID] ** 2 + tyre
+        exit_ = BALANCE_GRIP_LOSS * r[..., _EXIT] ** 2 + TRACTION_GRIP_LOSS * ex[..., _TRACTION] ** 2 + tyre
+        porpoise = np.minimum(PORPOISING_AERO_LOSS * ex[..., _PORPOISE] ** 2, MAX_GRIP_LOSS)
+        aero = 1.0 + self.aero_share * (aero_gain[:, None] - porpoise)
+        return tuple(aero * (1.0 - np.minimum(loss, MAX_GRIP_LOSS)) for loss in (entry, mid, exit_))
+
+    def _times(self, moves: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(lap time (B,), rookie confidence (B,)) for a batch of effective moves."""
+        r = self.errors[None] + (moves @ self.jac)[:, None, :]
+        g_entry, g_mid, g_exit = self._grip(r, moves @ self.model.aero_grip)
+        ratio = tuple(g / b for g, b in zip((g_entry, g_mid, g_exit), self._base_grip))
+        v_apex = self.v_apex * np.sqrt(ratio[1])
+        v_exit = v_apex + (self.v_exit - self.v_apex) * ratio[2]
+        t = self.length / (self.v_entry + v_apex) / np.sqrt(ratio[0]) + self.length / (v_apex + v_exit)
+        if self.straight:
+            t = t + 2.0 * self.straight / (v_exit + self.v_next_entry)
+        lap = t @ self.occurrence + moves @ self.model.lap_time
+        risk = (self.weights @ np.maximum(r, 0.0) ** 2) @ self.risk_weight if r.shape[0] else np.zeros(0)
+        return lap, 1.0 / (1.0 + risk)
+
+    def effective(self, moves: np.ndarray) -> np.ndarray:
+        """
+        The moves as they land: clipped to the step caps x aggression scale and
+        the absolute limits (solver.project_move), zero on unmodelled settings.
+        """
+        eff = project_move(self.setup.values, np.where(self.modelled, moves, 0.0), self.caps, self.limits)
+        return np.where(self.modelled, eff, 0.0)
+
+    def score(self, moves: np.ndarray) -> Dict[str, np.ndarray]:
+        """Predicted lap time, delta vs the session as driven, and rookie confidence for (C, N_SLOTS) moves."""
+        moves = self.effective(np.atleast_2d(np.asarray(moves, dtype=float)))
+        lap = np.empty(len(moves))
+        conf = np.empty(len(moves))
+        with metrics.stage("laptime", "score"):
+            for lo in range(0, len(moves), BATCH_CANDIDATES):
+                lap[lo:lo + BATCH_CANDIDATES], conf[lo:lo + BATCH_CANDIDATES] = self._times(moves[lo:lo + BATCH_CANDIDATES])
+        metrics.count("laptime_candidates_scored_total", len(moves))
+        delta = lap - self.baseline_s
+        return {"moves": moves, "lap_time_s": self.reference_s + delta, "delta_s": delta, "confidence": conf}
+
+    def move_vector(self, move: Dict[str, float]) -> np.ndarray:
+        delta, _ = Setup.move_vector(move)
+        return delta
+
+    def candidates(self, anchors: List[Tuple[str, np.ndarray]], n: int, seed: int = 0) -> Tuple[np.ndarray, List[str]]:
+        """
+        The unchanged setup, each anchor move as given, the anchors at the
+        other HEURISTIC_SCALES, and random moves around the anchors (seeded) up
+        to `n` candidates in total; never fewer than the baseline and the anchors.
+        """
+        rows = [np.zeros(N_SLOTS)] + [move for _, move in anchors]
+        sources = ["baseline"] + [name for name, _ in anchors]
+        for name, move in anchors:
+            for s in HEURISTIC_SCALES:
+                if s != 1.0:
+                    rows.append(move * s)
+                    sources.append(f"{name} x{s:g}")
+        rng = np.random.default_rng(seed)
+        n_random = max(0, n - len(rows))
+        if n_random and anchors:
+            pick = rng.integers(0, len(anchors), n_random)
+            noise = rng.standard_normal((n_random, N_SLOTS)) * (RANDOM_SPREAD * self.unit)
+            rows.extend(np.stack([m for _, m in anchors])[pick] + noise)
+            sources.extend(f"{anchors[i][0]} + noise" for i in pick.tolist())
+        keep = max(n, 1 + len(anchors))
+        return np.array(rows[:keep]), sources[:keep]
+
+    def performance(self, lap_time_s: float, delta_s: float, confidence: float) -> Dict[str, Any]:
+        """predicted_performance, as in sample_data.json."""
+        return {
+            "ideal_lap_time_s": round(float(lap_time_s), 3),
+            "delta_vs_baseline_s": round(float(delta_s), 3),
+            "confidence_for_rookie": round(float(confidence), 3),
+        }
+
+def shortlist_size(arg: Any) -> int:
+    """The /dataForConfig ?shortlist=N query value."""
+    try:
+        n = int(arg)
+    except (TypeError, ValueError):
+        raise ValueError(f"shortlist must be an integer, got {arg!r}") from None
+    if not 1 <= n <= MAX_SHORTLIST:
+        raise ValueError(f"shortlist must be between 1 and {MAX_SHORTLIST}")
+    return n
+
+def shortlist(
+    doc: Dict[str, Any],
+    prefs: UserPreferences | None = None,
+    n: int = SHORTLIST,
+    candidates: int = DEFAULT_CANDIDATES,
+    seed: int = 0,
+    heuristic: Dict[str, float] | None = None,
+    sensitivity: Dict[str, Any] | None = None,
+) -> Dict[str, Any]:
+    """
+    Score the heuristic move, the solver's move, scaled copies and random
+    neighbours of both, and return the `n` fastest distinct setups with
+    their predicted_performance. `heuristic` is compute_setup_from_doc's
+    aggregated_move if the caller already has it.
+    """
+    if not 1 <= candidates <= MAX_CANDIDATES:
+        raise ValueError(f"candidates must be between 1 and {MAX_CANDIDATES}")
+    if not 1 <= n <= MAX_SHORTLIST:
+        raise ValueError(f"shortlist must be between 1 and {MAX_SHORTLIST}")
+    lm = LapTimeModel(doc, prefs, sensitivity)
+    if heuristic is None:
+        rules = compile_rules_for_doc(doc)
+        heuristic = compute_setup_from_matrix(doc, compile_turns(doc, rules.turn_fields), lm.prefs, rules)["diagnostics"]["aggregated_move"]
+    with metrics.stage("laptime", "solve"):
+        solved = solve_setup(doc, lm.prefs, sensitivity=sensitivity)["diagnostics"]["aggregated_move"]
+    anchors = [("heuristic", lm.move_vector(heuristic)), ("solver", lm.move_vector(solved))]
+    moves, sources = lm.candidates(anchors, candidates, seed)
+    scored = lm.score(moves)
+
+    order = np.lexsort((-scored["confidence"], scored["delta_s"]))
+    picked: List[int] = []
+    seen = set()
+    for i in order.tolist():
+        key = np.round(scored["moves"][i], 9).tobytes()
+        if key not in seen:
+            seen.add(key)
+            picked.append(i)
+            if len(picked) == n:
+                break
+
+    out = []
+    for rank, i in enumerate(picked, 1):
+        eff = scored["moves"][i]
+        moved = eff != 0
+        out.append({
+            "rank": rank,
+            "source": sources[i],
+            "aggregated_move": {APPLY_ORDER[s]: float(eff[s]) for s in np.flatnonzero(moved)},
+            "optimized_setup": lm.setup.apply_vector(eff, moved, lm.limits).to_json(),
+            "predicted_performance": lm.performance(scored["lap_time_s"][i], scored["delta_s"][i], scored["confidence"][i]),
+        })
+    heuristic_at = sources.index("heuristic")
+    return {
+        "candidates": len(moves),
+        "baseline": lm.performance(lm.reference_s, 0.0, scored["confidence"][0]),
+        "heuristic": lm.performance(scored["lap_time_s"][heuristic_at], scored["delta_s"][heuristic_at], scored["confidence"][heuristic_at]),
+        "turns_only": lm.turns_only,
+        "setups": out,
+    }
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Dict, Any, List, Tuple
+import os
+import threading
+import time
+
+# Stage timers and counters for the setup / health pipelines.
+#
+# Two sinks, both optional:
+#   - the process-wide registry, exported in Prometheus text format by
+#     /metrics (off with METRICS_ENABLED=0);
+#   - a per-request Trace, activated with `with trace():`, whose timings and
+#     counters the route attaches to `diagnostics`.
+# With neither active, stage() returns a shared no-op context manager and
+# count() returns immediately, so instrumented code pays one contextvar
+# lookup per call site.
+
+Labels = Tuple[Tuple[str, str], ...]
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_HELP = {
+    "pipeline_stage_seconds": ("histogram", "Time spent in each pipeline stage"),
+    "setup_turns_processed_total": ("counter", "Turns evaluated by compute_setup_from_doc"),
+    "setup_rule_moves_total": ("counter", "Per-turn moves proposed by the rule table, by setting"),
+    "health_events_processed_total": ("counter", "Race events folded into health reports"),
+    "doc_cache_requests_total": ("counter", "DocCache lookups by result"),
+    "result_cache_requests_total": ("counter", "ResultCache lookups by result"),
+    "setup_plan_requests_total": ("counter", "SetupPlan lookups by result"),
+    "lap_trace_turns_total": ("counter", "Turn x lap segments extracted from lap traces"),
+    "robustness_samples_total": ("counter", "Perturbed turn matrices evaluated by the robustness mode"),
+    "laptime_candidates_scored_total": ("counter", "Candidate setups scored by the lap-time surrogate"),
+    "race_sim_steps_total": ("counter", "Fixed timesteps advanced by the race simulator"),
+    "job_requests_total": ("counter", "Job submissions by result (queued, deduplicated, rejected)"),
+    "jobs_finished_total": ("counter", "Background jobs finished by state"),
+}
+
+class Registry:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}   # bucket counts..., count, sum
+
+    def inc(self, name: str, labels: Labels, n: float = 1) -> None:
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def observe(self, name: str, labels: Labels, seconds: float) -> None:
+        key = (name, labels)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(BUCKETS) + 2) + [0.0]
+            h[bisect_left(BUCKETS, seconds)] += 1      # index len(BUCKETS) is +Inf only
+            h[-2] += 1
+            h[-1] += seconds
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        lines: List[str] = []
+        seen = set()
+
+        def _header(name: str) -> None:
+            if name not in seen:
+                seen.add(name)
+                kind, help_text = _HELP.get(name, ("untyped", name))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            _header(name)
+            lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+        for (name, labels), h in histograms:
+            _header(name)
+            cumulative = 0
+            for bound, n in zip(BUCKETS, h):
+                cumulative += n
+                lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels + (('le', '+Inf'),))} {h[-2]}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {h[-2]}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(h[-1])}")
+        return "\n".join(lines) + "\n"
+
+def _fmt_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+    return "{" + body + "}"
+
+def _fmt_value(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+REGISTRY = Registry(enabled=os.environ.get("METRICS_ENABLED", "1") != "0")
+
+# ---------- Per-request trace ----------
+
+class Trace:
+    __slots__ = ("timings_ms", "counters")
+
+    def __init__(self):
+        self.timings_ms: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"timings_ms": dict(self.timings_ms), "counters": dict(self.counters)}
+
+_TRACE: ContextVar[Trace | None] = ContextVar("metrics_trace", default=None)
+
+class trace:
+    """`with trace() as tr:` collects stage timings and counters for the current request."""
+    __slots__ = ("tr", "_token")
+
+    def __enter__(self) -> Trace:
+        self.tr = Trace()
+        self._token = _TRACE.set(self.tr)
+        return self.tr
+
+    def __exit__(self, *exc) -> None:
+        _TRACE.reset(self._token)
+
+def active() -> bool:
+    return REGISTRY.enabled or _TRACE.get() is not None
+
+# ---------- Instrumentation ----------
+
+_NOOP = nullcontext()
+
+class _Stage:
+    __slots__ = ("pipeline", "name", "tr", "t0")
+
+    def __init__(self, pipeline: str, name: str, tr: Trace | None):
+        self.pipeline, self.name, self.tr = pipeline, name, tr
+
+    def __enter__(self) -> "_Stage":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        dt = time.perf_counter() - self.t0
+        if self.tr is not None:
+            key = f"{self.pipeline}.{self.name}"
+            self.tr.timings_ms[key] = self.tr.timings_ms.get(key, 0.0) + dt * 1e3
+        if REGISTRY.enabled:
+            REGISTRY.observe("pipeline_stage_seconds", (("pipeline", self.pipeline), ("stage", self.name)), dt)
+
+def stage(pipeline: str, name: str):
+    """Context manager timing one stage; a shared no-op when nothing is collecting."""
+    tr = _TRACE.get()
+    if tr is None and not REGISTRY.enabled:
+        return _NOOP
+    return _Stage(pipeline, name, tr)
+
+def count(name: str, n: float = 1, **labels: str) -> None:
+    tr = _TRACE.get()
+    if tr is None and not REGISTRY.enabled:
+        return
+    key = tuple(sorted(labels.items()))
+    if tr is not None:
+        tkey = name + _fmt_labels(key)
+        tr.counters[tkey] = tr.counters.get(tkey, 0) + n
+    if REGISTRY.enabled:
+        REGISTRY.inc(name, key, n)
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Any, Iterator, List, Tuple
+import queue
+import threading
+import time
+
+import numpy as np
+
+from poc import (
+    UserPreferences,
+    build_preferences_from_doc,
+    validate_schema,
+    apply_moves_in_order_and_clip,
+    _safe_get,
+)
+from turn_matrix import (
+    compile_rules_for_doc,
+    compile_turns,
+    huber_weights,
+    cap_and_scale,
+    move_key_order,
+)
+from firestore_client import where_eq
+import metrics
+
+# Multi-session optimisation: one setup from every test_drive doc recorded
+# for a track / tyre compound.
+#
+# Session docs are read in pages (order_by document id + start_after) on a
+# producer thread that stays at most `prefetch` pages ahead, so Firestore
+# paging overlaps the computation and at most a few pages are held in memory.
+# Each session's turns are scored against the base doc (targets, constraints,
+# initial setup, questionnaire), exactly like /dataForConfig does for its one
+# doc. Per-turn weights are multiplied by a session weight (session type x
+# recency half-life), and the usual weighted sum is normalised by the total
+# session weight, so a single session reproduces /dataForConfig (up to float
+# rounding).
+
+SESSION_TYPE_WEIGHTS = {
+    "race": 1.0,
+    "sprint": 1.0,
+    "quali": 0.9,
+    "q": 0.9,
+    "fp3": 0.8,
+    "fp2": 0.7,
+    "fp1": 0.6,
+}
+
+@dataclass
+class SessionWeighting:
+    half_life_days: float | None = 30.0
+    session_types: Dict[str, float] = field(default_factory=lambda: dict(SESSION_TYPE_WEIGHTS))
+    default_type_weight: float = 0.5
+
+    def type_weight(self, session: Any) -> float:
+        return float(self.session_types.get(str(session or "").lower(), self.default_type_weight))
+
+    def recency_weight(self, recorded_at: float | None, now: float) -> float:
+        if not self.half_life_days or recorded_at is None:
+            return 1.0
+        age_days = max(0.0, now - recorded_at) / 86400.0
+        return 0.5 ** (age_days / self.half_life_days)
+
+    def weight(self, doc: Dict[str, Any], recorded_at: float | None, now: float) -> float:
+        return self.type_weight(_safe_get(doc, "metadata", "session")) * self.recency_weight(recorded_at, now)
+
+def epoch(value: Any) -> float | None:
+    """Seconds since the epoch from a number, an ISO-8601 string or a datetime."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if hasattr(value, "timestamp"):
+        if getattr(value, "tzinfo", None) is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return float(value.timestamp())
+    return None
+
+def recorded_at(doc: Dict[str, Any], snapshot: Any = None) -> float | None:
+    """metadata.recorded_at / session_date if present, else the document's last write time."""
+    meta = doc.get("metadata") or {}
+    for key in ("recorded_at", "session_date"):
+        t = epoch(meta.get(key))
+        if t is not None:
+            return t
+    return epoch(getattr(snapshot, "update_time", None))
+
+# ---------- Paged reads ----------
+
+def iter_session_pages(
+    client: Any,
+    track: str | None,
+    compound: str | None,
+    page_size: int = 100,
+    collection: str = "test_drive",
+) -> Iterator[List[Any]]:
+    """Pages of document snapshots matching metadata.track / metadata.tyre_compound."""
+    query = client.collection(collection)
+    for path, value in (("metadata.track", track), ("metadata.tyre_compound", compound)):
+        if value is not None:
+            query = where_eq(query, path, value)
+    return iter_query_pages(query, page_size)
+
+def iter_query_pages(query: Any, page_size: int = 100, pipeline: str = "multi_session") -> Iterator[List[Any]]:
+    """Pages of a query's snapshots in document id order (order_by __name__ + start_after)."""
+    query = query.order_by("__name__")
+    last = None
+    while True:
+        page_query = query.limit(page_size) if last is None else query.start_after(last).limit(page_size)
+        with metrics.stage(pipeline, "firestore_page"):
+            page = list(page_query.stream())
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        last = page[-1]
+
+def prefetch_pages(pages: Iterator[List[Any]], depth: int) -> Iterator[List[Any]]:
+    """Run the page iterator on a thread, at most `depth` pages ahead of the consumer (0: no thread)."""
+    if depth <= 0:
+        yield from pages
+        return
+    q: "queue.Queue[Tuple[str, Any]]" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _put(item: Tuple[str, Any]) -> bool:
+        # gives up once the consumer has stopped, so a full queue never strands the thread
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce() -> None:
+        try:
+            for page in pages:
+                if not _put(("page", page)):
+                    return
+            _put(("done", None))
+        except BaseException as exc:        # surfaced on the consumer side
+            _put(("error", exc))
+
+    t = threading.Thread(target=_produce, name="session-pages", daemon=True)
+    t.start()
+    try:
+        while True:
+            kind, item = q.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+# ---------- Optimisation ----------
+
+class _Aggregate:
+    """Running weighted move sum, keys in first-seen order."""
+
+    def __init__(self):
+        self.totals: Dict[str, float] = {}
+
+    def add(self, keys: List[str], vals: np.ndarray, present: np.ndarray, rank: np.ndarray, weights: np.ndarray) -> None:
+        if not keys or not len(weights):
+            return
+        contrib = np.where(present, weights[:, None] * vals, 0.0)
+        sums = np.cumsum(contrib, axis=0)[-1]
+        for c in move_key_order(present, rank):
+            self.totals[keys[c]] = self.totals.get(keys[c], 0.0) + float(sums[c])
+
+def optimise_sessions(
+    base_doc: Dict[str, Any],
+    pages: Iterator[List[Any]],
+    prefs: UserPreferences | None = None,
+    weighting: SessionWeighting | None = None,
+    now: float | None = None,
+    prefetch: int = 2,
+) -> Dict[str, Any]:
+    """
+    One setup from every session in `pages` (iterables of snapshots or plain
+    docs). Returns /dataForConfig's shape; diagnostics.sessions summarises
+    what was merged.
+    """
+    validate_schema(base_doc)
+    if prefs is None:
+        prefs = build_preferences_from_doc(base_doc)
+    weighting = weighting or SessionWeighting()
+    now = time.time() if now is None else now
+    caps = _safe_get(base_doc, "weights_and_constraints", "per_turn_step_caps", default={}) or {}
+    abs_limits = _safe_get(base_doc, "weights_and_constraints", "absolute_limits", default={}) or {}
+    rules = compile_rules_for_doc(base_doc)
+
+    agg = _Aggregate()
+    weight_total = 0.0
+    n_sessions = n_turns = n_pages = 0
+    skipped: List[Dict[str, Any]] = []
+    newest = oldest = None
+
+    for page in prefetch_pages(iter(pages), prefetch):
+        n_pages += 1
+        sessions: List[Tuple[Any, List[Dict[str, Any]], float, float | None]] = []
+        with metrics.stage("multi_session", "collect_page"):
+            for item in page:
+                doc = item.to_dict() if hasattr(item, "to_dict") else item
+                doc_id = getattr(item, "id", None)
+                session_turns = doc.get("turns") if isinstance(doc, dict) else None
+                if not isinstance(session_turns, list) or not session_turns:
+                    skipped.append({"id": doc_id, "reason": "no turns"})
+                    continue
+                t = recorded_at(doc, item)
+                sw = weighting.weight(doc, t, now)
+                if sw <= 0.0:
+                    skipped.append({"id": doc_id, "reason": "zero weight"})
+                    continue
+                sessions.append((doc_id, session_turns, sw, t))
+        if not sessions:
+            continue
+
+        with metrics.stage("multi_session", "compute_page"):
+            try:
+                tm = compile_turns(dict(base_doc, turns=[t for s in sessions for t in s[1]]), rules.turn_fields)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                # a malformed session: find it (rare path), drop it, and compile the rest
+                good = []
+                for s in sessions:
+                    try:
+                        compile_turns(dict(base_doc, turns=s[1]), rules.turn_fields)
+                        good.append(s)
+                    except (KeyError, TypeError, ValueError, AttributeError) as exc:
+                        skipped.append({"id": s[0], "reason": f"malformed turns: {exc!r}"})
+                sessions = good
+                if not sessions:
+                    continue
+                tm = compile_turns(dict(base_doc, turns=[t for s in sessions for t in s[1]]), rules.turn_fields)
+
+            turn_sw = np.concatenate([np.full(len(s[1]), s[2]) for s in sessions])
+            mm = rules.run(tm.features, prefs)
+            vals = cap_and_scale(mm.keys, mm.values, caps, prefs)
+            agg.add(mm.keys, vals, mm.present, mm.rank, huber_weights(tm) * turn_sw)
+
+        for _, session_turns, sw, t in sessions:
+            weight_total += sw
+            n_sessions += 1
+            n_turns += len(session_turns)
+            if t is not None:
+                newest = t if newest is None else max(newest, t)
+                oldest = t if oldest is None else min(oldest, t)
+        metrics.count("setup_turns_processed_total", tm.n_turns)
+
+    if n_sessions == 0:
+        raise LookupError("no test_drive sessions with turns matched")
+
+    agg_move = {k: v / weight_total + 0.0 for k, v in agg.totals.items()}
+    new_setup = apply_moves_in_order_and_clip(base_doc["initial_setup"], agg_move, abs_limits)
+    diags = {
+        "aggregated_move": agg_move,
+        "preferences": prefs.__dict__,
+        "sessions": {
+            "merged": n_sessions,
+            "turns": n_turns,
+            "pages": n_pages,
+            "weight_total": weight_total,
+            "newest_recorded_at": newest,
+            "oldest_recorded_at": oldest,
+            "skipped": skipped[:50],
+            "skipped_count": len(skipped),
+        },
+    }
+    return {"optimized_setup": new_setup, "diagnostics": diags}
@@ -1,13 +1,17 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Sequence, Tuple
 import numpy as np
 import json
 import math
-import copy
 import pprint
 
+from rules import RuleTable, default_rule_table, parse_rule_table, evaluate_rules_for_turn
+from schema import TestDriveDoc, decode_test_drive, turn_corner_weight, turn_error_vector
+from setup_array import APPLY_ORDER, Setup, SetupLimits      # noqa: F401  (APPLY_ORDER: re-exported, it lived here)
+import metrics
+
 # ---------- Utilities ----------
 
 def _huber(x: float, delta: float = 1.0) -> float:
@@ -70,17 +74,12 @@ def build_preferences_from_doc(doc: Dict[str, Any]) -> UserPreferences:
 
 # ---------- Validation ----------
 
-def validate_schema(doc: Dict[str, Any]) -> None:
-    required = ["metadata", "targets", "turns", "initial_setup"]
-    for r in required:
-        if r not in doc:
-            raise ValueError(f"Missing top-level key: {r}")
-    if not isinstance(doc["turns"], list) or len(doc["turns"]) == 0:
-        raise ValueError("turns must be a non-empty list")
-    # Spot-check presence of key sections inside targets
-    _ = doc["targets"]["balance_goal"]
-    _ = doc["targets"]["stability_goal"]
-    _ = doc["targets"]["tyre_goal"]
+def validate_schema(doc: Dict[str, Any], turn_fields: Sequence[str] = ()) -> TestDriveDoc:
+    """
+    Full one-pass validation (schema.decode_test_drive). Raises SchemaError
+    (a ValueError naming the offending path); returns the decoded record.
+    """
+    return decode_test_drive(doc, turn_fields)
 
 # ---------- Cost Model ----------
 
@@ -104,117 +103,44 @@ def build_cost_weights(prefs: UserPreferences) -> CostWeights:
     )
 
 def compute_corner_weight(turn: Dict[str, Any], doc: Dict[str, Any]) -> float:
-    cap = float(_safe_get(doc, "weights_and_constraints", "time_loss_weight_cap", default=3.0) or 3.0)
-    tlw = float(turn.get("time_loss_weight", 1.0) or 1.0)
-    occ = float(turn.get("occurrence_rate", 1.0) or 1.0)
-    dcw = float(turn.get("driver_confidence_weight", 1.0) or 1.0)
-    rsp = float(_safe_get(doc, "metadata", "rookie_stability_priority", default=0.8) or 0.8)
-    return min(cap, tlw * occ * dcw * rsp)
+    """One turn's corner weight (schema.turn_corner_weight, the TestDriveDoc.corner_weight arithmetic)."""
+    return turn_corner_weight(turn, doc)
 
 def _phase_targets(doc: Dict[str, Any]) -> Tuple[float, float, float]:
     bg = doc["targets"]["balance_goal"]
     return float(bg["entry_oversteer_index"]), float(bg["mid_oversteer_index"]), float(bg["exit_oversteer_index"])
 
 def error_vector_for_turn(turn: Dict[str, Any], doc: Dict[str, Any]) -> Dict[str, float]:
-    t_entry, t_mid, t_exit = _phase_targets(doc)
-    b = turn["balance"]
-    # Oversteer index error (positive => too oversteery vs target; negative => too understeery)
-    e = {
-        "d_entry": float(b["entry_oversteer_index"]) - t_entry,
-        "d_mid":   float(b["mid_oversteer_index"])   - t_mid,
-        "d_exit":  float(b["exit_oversteer_index"])  - t_exit,
-    }
-    # Stability risks vs goals
-    sg = doc["targets"]["stability_goal"]
-    br = turn["braking"]
-    tr = turn["traction"]
-    ar = turn["aero_ride"]
-    e.update({
-        "lock_front_excess": float(br["brake_locking_risk_front"]) - float(sg["brake_locking_risk_front"]),
-        "lock_rear_excess":  float(br["brake_locking_risk_rear"])  - float(sg["brake_locking_risk_rear"]),
-        "traction_excess":   float(tr["traction_loss_index"])      - float(sg["traction_loss_index"]),
-        "porpoise_excess":   float(ar["porpoising_amplitude_mm"])  - float(sg["porpoising_amplitude_mm"]),
-    })
-    # Thermal deltas (surface temps vs target)
-    tg = doc["targets"]["tyre_goal"]
-    surf = turn["tyre"]["surface_temp_c"]
-    for ax in ["fl","fr","rl","rr"]:
-        e[f"surf_{ax}_excess"] = float(surf[ax]) - float(tg["surface_temp_target_c"])
-    return e
+    """One turn's errors against the doc's targets, keyed in schema.ERR_KEYS order (schema.turn_error_vector)."""
+    return turn_error_vector(turn, doc)
 
 # ---------- Rules Engine (domain heuristics) ----------
 
+def rule_table_for_doc(doc: Dict[str, Any]) -> RuleTable:
+    """
+    Rule table for this doc: an inline `rule_table` (per-track tuning stored
+    with the doc) or the shipped default_rules.json.
+    """
+    raw = doc.get("rule_table")
+    table = default_rule_table() if raw is None else parse_rule_table(raw)
+    unknown = [s for s in table.scales if s not in UserPreferences.__dataclass_fields__]
+    if unknown:
+        raise ValueError(f"rule table references unknown sensitivities: {unknown}")
+    return table
+
 def propose_turn_changes(
     turn: Dict[str, Any],
     errs: Dict[str, float],
     caps: Dict[str, float],
     prefs: UserPreferences,
+    rules: RuleTable | None = None,
 ) -> Dict[str, float]:
     """
     Propose per-turn changes based on error signals.
-    Returns deltas keyed by setting names, before weighting and capping.
+    Fires the rule table (default_rules.json unless given), then clips to
+    per-turn step caps and applies aggression scaling.
     """
-    e = errs
-    move: Dict[str, float] = {}
-
-    # --- Entry balance ---
-    if e["d_entry"] > +0.10:  # too lively (oversteer) on entry
-        move["brake_bias_percent_front"] = move.get("brake_bias_percent_front", 0) + ( +0.4 * prefs.brake_bias_sensitivity )
-        move["diff_entry_percent"]       = move.get("diff_entry_percent", 0)       + ( +3.0 * prefs.diff_sensitivity )
-        move["front_wing_flap_deg"]      = move.get("front_wing_flap_deg", 0)      + ( -0.2 * prefs.wing_sensitivity )
-    if e["d_entry"] < -0.10:  # entry push (understeer)
-        move["brake_bias_percent_front"] = move.get("brake_bias_percent_front", 0) + ( -0.3 * prefs.brake_bias_sensitivity )
-        move["diff_entry_percent"]       = move.get("diff_entry_percent", 0)       + ( -2.0 * prefs.diff_sensitivity )
-        move["front_wing_flap_deg"]      = move.get("front_wing_flap_deg", 0)      + ( +0.2 * prefs.wing_sensitivity )
-
-    # --- Mid balance ---
-    if e["d_mid"] < -0.08:    # mid understeer (needs front bite)
-        move["front_wing_flap_deg"]      = move.get("front_wing_flap_deg", 0)      + ( +0.3 * prefs.wing_sensitivity )
-        move["front_toe_out_deg_total"]  = move.get("front_toe_out_deg_total", 0)  + ( +0.01 * prefs.toe_sensitivity )
-        # Kerb impact => back off HS bump
-        if float(turn["track_env"]["kerb_impact_g"]) > 0.8:
-            move["high_speed_bump"]      = move.get("high_speed_bump", 0)          + ( -1.0 * prefs.damper_sensitivity )
-
-    if e["d_mid"] > +0.08:    # mid oversteer (front too strong / rear too weak aero platform)
-        move["rear_wing_main_deg"]       = move.get("rear_wing_main_deg", 0)       + ( +0.3 * prefs.wing_sensitivity )
-        move["front_wing_flap_deg"]      = move.get("front_wing_flap_deg", 0)      + ( -0.1 * prefs.wing_sensitivity )
-
-    # --- Exit balance / traction ---
-    if e["d_exit"] > +0.10 or e["traction_excess"] > 0.10:
-        move["diff_exit_percent"]        = move.get("diff_exit_percent", 0)        + ( -3.0 * prefs.diff_sensitivity )
-        move["rear_arb_steps"]           = move.get("rear_arb_steps", 0)           + ( -1.0 * prefs.arb_sensitivity )
-        move["ers_exit_scale"]           = move.get("ers_exit_scale", 0)           + ( -0.2 )  # scale factor to apply on exits at this corner
-
-    if e["d_exit"] < -0.10 and e["traction_excess"] < -0.05: # exit understeer + good traction -> can free diff a bit
-        move["diff_exit_percent"]        = move.get("diff_exit_percent", 0)        + ( +2.0 * prefs.diff_sensitivity )
-
-    # --- Braking stability ---
-    if e["lock_front_excess"] > 0.05:
-        move["brake_bias_percent_front"] = move.get("brake_bias_percent_front", 0) + ( -0.3 * prefs.brake_bias_sensitivity )
-        move["brake_migration_map"]      = move.get("brake_migration_map", 0)      + ( +1.0 )
-
-    if e["lock_rear_excess"] > 0.05:
-        move["brake_bias_percent_front"] = move.get("brake_bias_percent_front", 0) + ( +0.2 * prefs.brake_bias_sensitivity )
-
-    # --- Thermal trims ---
-    rr_hot = e.get("surf_rr_excess", 0.0)
-    rl_hot = e.get("surf_rl_excess", 0.0)
-    if rr_hot > 5.0 or rl_hot > 5.0:
-        move["pressures_psi_rr"]         = move.get("pressures_psi_rr", 0)         + ( -0.3 * prefs.pressure_sensitivity )
-        move["pressures_psi_rl"]         = move.get("pressures_psi_rl", 0)         + ( -0.3 * prefs.pressure_sensitivity )
-        move["diff_exit_percent"]        = move.get("diff_exit_percent", 0)        + ( -1.0 * prefs.diff_sensitivity )
-
-    fl_hot = e.get("surf_fl_excess", 0.0)
-    fr_hot = e.get("surf_fr_excess", 0.0)
-    if fl_hot > 5.0 or fr_hot > 5.0:
-        move["pressures_psi_fl"]         = move.get("pressures_psi_fl", 0)         + ( -0.3 * prefs.pressure_sensitivity )
-        move["pressures_psi_fr"]         = move.get("pressures_psi_fr", 0)         + ( -0.3 * prefs.pressure_sensitivity )
-        # If mid understeer present, prefer wing change over pressure to keep front alive
-
-    # --- Ride & floor ---
-    if e["porpoise_excess"] > 0.2 or float(turn["aero_ride"]["bottoming_risk_index"]) > 0.4:
-        move["ride_height_rear_mm"]      = move.get("ride_height_rear_mm", 0)      + ( +2.0 * prefs.ride_height_sensitivity )
-        move["beam_wing_slot_gap_mm"]    = move.get("beam_wing_slot_gap_mm", 0)    + ( +0.5 )
+    move = evaluate_rules_for_turn(rules if rules is not None else default_rule_table(), turn, errs, prefs)
 
     # Clip per-turn step caps
     capped = {}
@@ -228,23 +154,6 @@ def propose_turn_changes(
 
 # ---------- Aggregation & Application ----------
 
-APPLY_ORDER = [
-    # pressures first (thermal stability)
-    "pressures_psi_fl", "pressures_psi_fr", "pressures_psi_rl", "pressures_psi_rr",
-    # brakes
-    "brake_bias_percent_front", "brake_migration_map",
-    # diff
-    "diff_entry_percent", "diff_mid_percent", "diff_exit_percent",
-    # aero balance (front/rear wing & beam)
-    "front_wing_flap_deg", "rear_wing_main_deg", "beam_wing_slot_gap_mm",
-    # chassis
-    "rear_arb_steps", "high_speed_bump",
-    # alignment
-    "front_toe_out_deg_total", "rear_toe_in_deg_total",
-    # ride heights last
-    "ride_height_front_mm", "ride_height_rear_mm"
-]
-
 def aggregate_moves(
     per_turn_moves: List[Dict[str, float]],
     per_turn_weights: List[float],
@@ -262,80 +171,7 @@ def apply_moves_in_order_and_clip(
     limits: Dict[str, Any],
 ) -> Dict[str, Any]:
     """Apply aggregated move in a safe order and clip to absolute limits."""
-    s = copy.deepcopy(setup)
-
-    # Helper to get & set nested fields
-    def _get_set(path: List[str], delta: float) -> None:
-        nonlocal s
-        # navigate
-        d = s
-        for k in path[:-1]:
-            d = d[k]
-        leaf = path[-1]
-        old = float(d.get(leaf, 0.0) or 0.0)
-        new_val = old + float(delta)
-
-        # Clip by absolute limits if available
-        lim = limits.get(leaf) if isinstance(limits, dict) else None
-        if lim is None:
-            # try namespaced (e.g., pressures)
-            if leaf.startswith("pressures_psi"):
-                lo, hi = limits.get("pressures_psi", [None, None])
-                if lo is not None and hi is not None:
-                    new_val = _clamp(new_val, float(lo), float(hi))
-        else:
-            lo, hi = float(lim[0]), float(lim[1])
-            new_val = _clamp(new_val, lo, hi)
-
-        d[leaf] = new_val
-
-    # Map setting keys to their JSON paths
-    PATHS = {
-        "pressures_psi_fl": ["tyres", "pressures_psi", "fl"],
-        "pressures_psi_fr": ["tyres", "pressures_psi", "fr"],
-        "pressures_psi_rl": ["tyres", "pressures_psi", "rl"],
-        "pressures_psi_rr": ["tyres", "pressures_psi", "rr"],
-        "brake_bias_percent_front": ["brakes", "brake_bias_percent_front"],
-        "brake_migration_map": ["brakes", "brake_migration_map"],
-        "diff_entry_percent": ["differential_and_power", "diff_entry_percent"],
-        "diff_mid_percent": ["differential_and_power", "diff_mid_percent"],
-        "diff_exit_percent": ["differential_and_power", "diff_exit_percent"],
-        "front_wing_flap_deg": ["aero", "front_wing_flap_deg"],
-        "rear_wing_main_deg": ["aero", "rear_wing_main_deg"],
-        "beam_wing_slot_gap_mm": ["aero", "beam_wing_slot_gap_mm"],
-        "rear_arb_steps": ["ride_and_suspension", "antiroll_bar_scale_0_10", "rear"],
-        "high_speed_bump": ["ride_and_suspension", "dampers_clicks", "high_speed_bump"],
-        "front_toe_out_deg_total": ["alignment", "front_toe_out_deg_total"],
-        "rear_toe_in_deg_total": ["alignment", "rear_toe_in_deg_total"],
-        "ride_height_front_mm": ["ride_and_suspension", "ride_height_front_mm"],
-        "ride_height_rear_mm": ["ride_and_suspension", "ride_height_rear_mm"],
-    }
-
-    # Ensure all paths exist
-    def _ensure_path(s: Dict[str, Any], path: List[str]) -> None:
-        cur = s
-        for k in path[:-1]:
-            if k not in cur or not isinstance(cur[k], dict):
-                cur[k] = {}
-            cur = cur[k]
-
-    for key in APPLY_ORDER:
-        if key in move and key in PATHS:
-            _ensure_path(s, PATHS[key])
-            _get_set(PATHS[key], move[key])
-
-    # Handle ERS exit scaling per-corner by converting to a global heuristic:
-    # If many corners requested ERS cuts on exit, reduce default per-corner ERS by avg scale
-    ers_scale_requests = [v for k, v in move.items() if k == "ers_exit_scale"]
-    if ers_scale_requests:
-        avg_cut = np.clip(np.mean(ers_scale_requests), -0.4, 0.0)
-        # Apply a default policy: reduce all exits by avg_cut proportionally
-        corner_deploy = _safe_get(s, "differential_and_power", "ers_corner_deployment", default={}) or {}
-        for ck in list(corner_deploy.keys()):
-            corner_deploy[ck] = float(corner_deploy[ck]) * (1.0 + avg_cut)
-        s["differential_and_power"]["ers_corner_deployment"] = corner_deploy
-
-    return s
+    return Setup.from_json(setup).apply(move, SetupLimits.from_dict(limits)).to_json()
 
 # ---------- Public API ----------
 
@@ -347,41 +183,55 @@ def compute_setup_from_doc(
     Main entry: produce an optimized setup from the full JSON doc.
     Respects user preferences (stability bias, control linearities, etc.).
     """
-    validate_schema(doc)
+    with metrics.stage("setup", "validate_schema"):
+        td = validate_schema(doc)      # every numeric input decoded once
     if user_prefs is None:
         user_prefs = build_preferences_from_doc(doc)
     prefs = user_prefs
 
-    weights_conf = _safe_get(doc, "weights_and_constraints", "per_turn_step_caps", default={}) or {}
-    abs_limits = _safe_get(doc, "weights_and_constraints", "absolute_limits", default={}) or {}
+    weights_conf = td.step_caps
+    abs_limits = td.absolute_limits
     turns = doc["turns"]
+    with metrics.stage("setup", "rule_table"):
+        rules = rule_table_for_doc(doc)
 
     per_turn_moves = []
     per_turn_weights = []
 
     # Robust pre-weighting by leverage: scale by Huber on errors to downweight outliers
-    for t in turns:
-        errs = error_vector_for_turn(t, doc)
-
-        # Compute a scalar "error magnitude" for robust weighting (Huber downweight big outliers)
-        err_vals = np.array(list(_nan_to_num_dict(errs).values()), dtype=float)
-        err_mag = float(np.mean([_huber(x, delta=0.8) for x in err_vals]))
-        base_w = compute_corner_weight(t, doc)
-
-        # Downweight high-error outliers slightly to avoid overfitting a single awkward corner
-        outlier_scale = 1.0 / (1.0 + 0.6 * err_mag)
-        w = base_w * outlier_scale
-
-        mv = propose_turn_changes(t, errs, weights_conf, prefs)
-        per_turn_moves.append(mv)
-        per_turn_weights.append(w)
+    with metrics.stage("setup", "per_turn_loop"):
+        for i, t in enumerate(turns):
+            errs = td.error_vector(i)
+
+            # Compute a scalar "error magnitude" for robust weighting (Huber downweight big outliers)
+            err_vals = np.array(list(_nan_to_num_dict(errs).values()), dtype=float)
+            err_mag = float(np.mean([_huber(x, delta=0.8) for x in err_vals]))
+            base_w = td.corner_weight(i)
+
+            # Downweight high-error outliers slightly to avoid overfitting a single awkward corner
+            outlier_scale = 1.0 / (1.0 + 0.6 * err_mag)
+            w = base_w * outlier_scale
+
+            mv = propose_turn_changes(t, errs, weights_conf, prefs, rules)
+            per_turn_moves.append(mv)
+            per_turn_weights.append(w)
+
+    if metrics.active():
+        metrics.count("setup_turns_processed_total", len(turns))
+        fired: Dict[str, int] = {}
+        for mv in per_turn_moves:
+            for k in mv:
+                fired[k] = fired.get(k, 0) + 1
+        for k, n in fired.items():
+            metrics.count("setup_rule_moves_total", n, setting=k)
 
     # Aggregate across corners
-    agg_move = aggregate_moves(per_turn_moves, per_turn_weights)
+    with metrics.stage("setup", "aggregate_moves"):
+        agg_move = aggregate_moves(per_turn_moves, per_turn_weights)
 
-    # Apply in safe order and clip to absolute limits
-    initial_setup = copy.deepcopy(doc["initial_setup"])
-    new_setup = apply_moves_in_order_and_clip(initial_setup, agg_move, abs_limits)
+    # Apply in safe order and clip to absolute limits (returns a fresh dict; the doc is untouched)
+    with metrics.stage("setup", "apply_and_clip"):
+        new_setup = apply_moves_in_order_and_clip(doc["initial_setup"], agg_move, abs_limits)
 
     # Return both the new setup and some diagnostics
     diags = {
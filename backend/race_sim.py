@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, Any, Iterator, List
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from schema import SchemaError, join_path, read_num, read_obj
+import metrics
+
+# Race simulation for the track view.
+#
+# The track is a reference speed profile on a STEP_M distance grid, built
+# from the test_drive turns: each turn's measured entry / apex / exit speeds
+# cap the speed at its start, middle and end, everything else is capped at
+# V_MAX_KMH, and a forward (traction) and backward (braking) pass limit
+# acceleration between the caps. Turns are laid out in doc order with equal
+# straights between them (metadata.lap_length_m, else DEFAULT_STRAIGHT_M
+# each) unless they carry start_m / end_m.
+#
+# All cars start from a seeded grid and advance together at a fixed
+# timestep as arrays of distance, lap and pace: a car's speed is its pace
+# times the reference speed at its position, with per-car tyre degradation
+# and per-lap noise. A car within
+# FOLLOW_M of the car ahead in race order is held to that car's speed
+# outside the overtaking zones (where the reference speed is above
+# OVERTAKE_FRACTION of V_MAX_KMH). Gaps are exact at grid resolution: the
+# time the leader passed each grid point of the last lap is kept in a
+# one-lap ring. Nothing grows with race length: frames are yielded every
+# frame_s of race time and never stored.
+#
+# A served race is a RaceStream, which holds one of MAX_STREAMS slots until
+# it is closed. With speedup > 0 a frame is due once the wall clock catches
+# up with its race time; delay() says how long that is, so asgi.py can await
+# it instead of parking a thread for the length of the race (plain WSGI
+# iteration sleeps it).
+
+STEP_M = 5.0
+V_MAX_KMH = 330.0
+ACCEL_MS2 = 12.0          # at low speed; falls to zero at V_MAX_KMH (drag)
+BRAKE_MS2 = 40.0
+DEFAULT_STRAIGHT_M = 400.0
+FOLLOW_M = 20.0
+OVERTAKE_FRACTION = 0.85
+
+DEFAULT_CARS = 20
+MAX_CARS = 40
+DEFAULT_LAPS = 50
+MAX_LAPS = 100
+DT_S = 0.1
+FRAME_S = 1.0
+PACE_SPREAD = 0.015       # slowest car is this much slower than the fastest
+DEG_PER_LAP = (0.0003, 0.0008)
+LAP_NOISE = 0.002
+MAX_STREAMS = int(os.environ.get("RACE_SIM_MAX_STREAMS", 8))
+
+@dataclass
+class Track:
+    length_m: float
+    step_m: float
+    v_ref: np.ndarray           # (P,) m/s at each grid point
+    turn_ids: List[str]
+    turn_start_m: np.ndarray
+    turn_end_m: np.ndarray
+
+    @property
+    def reference_lap_s(self) -> float:
+        return float(np.sum(self.step_m / self.v_ref))
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "length_m": round(self.length_m, 1),
+            "reference_lap_s": round(self.reference_lap_s, 3),
+            "turns": [{"turn_id": t, "start_m": round(float(a), 1), "end_m": round(float(b), 1)}
+                      for t, a, b in zip(self.turn_ids, self.turn_start_m, self.turn_end_m)],
+        }
+
+def _speed_profile(v_cap: np.ndarray, step_m: float) -> np.ndarray:
+    """Forward (traction) and backward (braking) passes over a closed lap, starting from the slowest cap."""
+    v_max = V_MAX_KMH / 3.6
+    n = len(v_cap)
+    start = int(np.argmin(v_cap))
+    v = np.roll(v_cap, -start).tolist()
+    for i in range(1, n):
+        a = ACCEL_MS2 * max(0.0, 1.0 - (v[i - 1] / v_max) ** 2)
+        v[i] = min(v[i], math.sqrt(v[i - 1] ** 2 + 2.0 * a * step_m))
+    for i in range(n - 2, -1, -1):
+        v[i] = min(v[i], math.sqrt(v[i + 1] ** 2 + 2.0 * BRAKE_MS2 * step_m))
+    v[-1] = min(v[-1], math.sqrt(v[0] ** 2 + 2.0 * BRAKE_MS2 * step_m))     # braking into the slowest point
+    return np.roll(np.array(v), start)
+
+def build_track(doc: Dict[str, Any], step_m: float = STEP_M) -> Track:
+    """Track model from a test_drive doc's turns (length_m + kinematics, or start_m / end_m)."""
+    turns = doc.get("turns")
+    if not isinstance(turns, list) or not turns:
+        raise SchemaError("turns", "expected a non-empty list")
+    ids, start, end, speeds = [], [], [], []
+    for i, t in enumerate(turns):
+        path = join_path("turns", i)
+        if not isinstance(t, dict):
+            raise SchemaError(path, "expected an object")
+        k = read_obj(t, "kinematics", path)
+        v = [read_num(k, f, join_path(path, "kinematics")) / 3.6 for f in ("v_entry_kmh", "v_apex_kmh", "v_exit_kmh")]
+        if min(v) <= 0:
+            raise SchemaError(join_path(path, "kinematics"), "speeds must be positive")
+        if "start_m" in t:
+            a, b = read_num(t, "start_m", path), read_num(t, "end_m", path)
+        else:
+            a, b = None, read_num(t, "length_m", path)
+        ids.append(str(t.get("turn_id", i)))
+        start.append(a)
+        end.append(b)
+        speeds.append(v)
+
+    if all(a is None for a in start):
+        lengths = np.array(end)
+        lap = (doc.get("metadata") or {}).get("lap_length_m")
+        straight = (float(lap) - lengths.sum()) / len(turns) if isinstance(lap, (int, float)) else DEFAULT_STRAIGHT_M
+        if straight <= 0:
+            raise SchemaError("metadata.lap_length_m", "shorter than the turns it contains")
+        start_m = np.concatenate([[0.0], np.cumsum(lengths + straight)[:-1]]) + straight / 2
+        end_m = start_m + lengths
+        length_m = float(lengths.sum() + straight * len(turns))
+    elif any(a is None for a in start):
+        raise SchemaError(join_path("turns", start.index(None)), "start_m missing (other turns have it)")
+    else:
+        start_m, end_m = np.array(start), np.array(end)
+        lap = (doc.get("metadata") or {}).get("lap_length_m")
+        length_m = float(lap) if isinstance(lap, (int, float)) else float(end_m.max() + DEFAULT_STRAIGHT_M)
+
+    n = int(math.ceil(length_m / step_m))
+    v_cap = np.full(n, V_MAX_KMH / 3.6)
+    for a, b, (ve, va, vx) in zip(start_m, end_m, speeds):
+        i0, i1 = int(a // step_m), int(b // step_m)
+        mid = (i0 + i1) // 2
+        idx = np.arange(i0, i1 + 1)
+        v_cap[idx % n] = np.minimum(v_cap[idx % n], np.interp(idx, [i0, mid, i1], [ve, va, vx]))
+    return Track(length_m, step_m, _speed_profile(v_cap, step_m), ids, start_m, end_m)
+
+@dataclass
+class RaceOptions:
+    laps: int = DEFAULT_LAPS
+    cars: int = DEFAULT_CARS
+    seed: int = 0
+    dt_s: float = DT_S
+    frame_s: float = FRAME_S
+    speedup: float = 0.0      # 0: as fast as it computes; x: x times real time
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "RaceOptions":
+        """From query args or a JSON body; ValueError names the bad field."""
+        out = cls()
+        for name, conv, lo, hi in (("laps", int, 1, MAX_LAPS), ("cars", int, 1, MAX_CARS), ("seed", int, 0, 2 ** 32 - 1),
+                                   ("dt_s", float, 0.01, 1.0), ("frame_s", float, 0.0, 60.0), ("speedup", float, 0.0, 1000.0)):
+            if payload.get(name) is None:
+                continue
+            try:
+                v = conv(payload[name])
+            except (TypeError, ValueError):
+                raise ValueError(f"{name} must be a number, got {payload[name]!r}") from None
+            if not lo <= v <= hi:
+                raise ValueError(f"{name} must be between {lo} and {hi}")
+            setattr(out, name, v)
+        return out
+
+class RaceSim:
+    """All cars as arrays; step() advances them together, frame() is the current snapshot."""
+
+    def __init__(self, track: Track, options: RaceOptions | None = None, car_ids: List[str] | None = None):
+        self.track = track
+        self.options = opts = options or RaceOptions()
+        n = opts.cars
+        self.ids = list(car_ids) if car_ids else [f"car_{i + 1}" for i in range(n)]
+        if len(self.ids) != n:
+            raise ValueError(f"{len(self.ids)} car ids for {n} cars")
+        rng = self.rng = np.random.default_rng(opts.seed)
+        self.pace = 1.0 - np.sort(rng.uniform(0.0, PACE_SPREAD, n))
+        self.deg = rng.uniform(*DEG_PER_LAP, n)
+        self.lap_factor = 1.0 + rng.normal(0.0, LAP_NOISE, n)
+        self.grid = rng.permutation(n)                         # starting slot per car (not in pace order)
+        self.dist = -FOLLOW_M * self.grid.astype(float)       # grid slots behind the line
+        self.lap = np.zeros(n, dtype=int)                     # completed laps
+        self.finish_s = np.full(n, np.inf)
+        self.race_m = opts.laps * track.length_m
+        self.steps = 0
+        self._scale = self.pace * self.lap_factor              # pace x lap noise x degradation, updated at the line
+        self.speed = self._scale * track.v_ref[self._grid(self.dist)]     # rolling start
+        self._ring = np.full(len(track.v_ref), np.nan)       # when the leader last passed each grid point
+        self._lead = 0.0
+        self._overtake = track.v_ref > OVERTAKE_FRACTION * V_MAX_KMH / 3.6
+
+    @property
+    def t(self) -> float:
+        return self.steps * self.options.dt_s
+
+    def _grid(self, dist: np.ndarray) -> np.ndarray:
+        return (np.mod(dist, self.track.length_m) * (1.0 / self.track.step_m)).astype(int)
+
+    @property
+    def finished(self) -> bool:
+        return bool(np.all(np.isfinite(self.finish_s)))
+
+    def step(self, n: int = 1) -> None:
+        v_ref, overtake, dt, length = self.track.v_ref, self._overtake, self.options.dt_s, self.track.length_m
+        running = ~np.isfinite(self.finish_s)
+        cars = np.arange(len(running))
+        ahead = np.empty_like(cars)
+        steps = self.steps
+        for _ in range(n):
+            idx = self._grid(self.dist)
+            v = self._scale * v_ref[idx]
+            order = np.argsort(-self.dist)
+            ahead[order[1:]] = order[:-1]
+            ahead[order[0]] = order[0]
+            close = (self.dist[ahead] - self.dist < FOLLOW_M) & (ahead != cars) & running[ahead] & ~overtake[idx]
+            if close.any():
+                v = np.where(close, np.minimum(v, self.speed[ahead]), v)
+            v *= running
+            self.speed = v
+            new = self.dist + v * dt
+
+            self.steps += 1
+            self._mark_leader(float(new.max()), dt)
+            crossed = np.floor_divide(new, length) > np.floor_divide(self.dist, length)
+            self.dist = new
+            if crossed.any():
+                self._line(crossed, running)
+                running = ~np.isfinite(self.finish_s)
+                if not running.any():
+                    break
+        metrics.count("race_sim_steps_total", self.steps - steps)
+
+    def _line(self, crossed: np.ndarray, running: np.ndarray) -> None:
+        """Cars crossing the line: new lap noise and degradation; the leader takes the flag at race distance, everyone else at their next crossing."""
+        length = self.track.length_m
+        self.lap = np.maximum(np.floor_divide(self.dist, length).astype(int), 0)
+        self.lap_factor[crossed] = 1.0 + self.rng.normal(0.0, LAP_NOISE, int(crossed.sum()))
+        self._scale = self.pace * self.lap_factor * (1.0 - self.deg * self.lap)
+        flag = crossed & (self.dist >= self.race_m)
+        done = crossed & running & (flag.any() or np.isfinite(self.finish_s).any())
+        if done.any():
+            self.finish_s[done] = self.t
+            self.dist[done] = np.floor_divide(self.dist[done], length) * length
+
+    def _mark_leader(self, lead: float, dt: float) -> None:
+        """Stamp the grid points the leader passed this step with interpolated times."""
+        if lead <= self._lead:
+            return
+        step_m, n_grid = self.track.step_m, len(self._ring)
+        first = math.floor(self._lead / step_m) + 1
+        last = math.floor(lead / step_m)
+        t0 = self.t - dt
+        for k in range(first, last + 1):
+            self._ring[k % n_grid] = t0 + (k * step_m - self._lead) / (lead - self._lead) * dt
+        self._lead = lead
+
+    def frame(self) -> Dict[str, Any]:
+        """
+        Columns per car, in car order (ids in the `track` event): race
+        position, completed laps, lap progress 0..1, speed, gap to the leader
+        (null when lapped), laps down, finished.
+        """
+        track = self.track
+        order = np.lexsort((self.finish_s, -self.dist))
+        leader = order[0]
+        position = np.empty_like(order)
+        position[order] = np.arange(1, len(order) + 1)
+        done = np.isfinite(self.finish_s)
+        laps_down = np.where(done, self.lap[leader] - self.lap, np.floor_divide(self._lead - self.dist, track.length_m))
+        laps_down = np.maximum(laps_down, 0).astype(int)
+        passed = self._ring[self._grid(np.maximum(self.dist, 0.0))]
+        with np.errstate(invalid="ignore"):
+            gap = np.where(done, self.finish_s - self.finish_s[leader], self.t - passed)
+        gap[leader] = 0.0
+        gap = np.where((laps_down == 0) & np.isfinite(gap), np.round(gap, 3), np.nan)
+        return {
+            "t": round(self.t, 3),
+            "leader_lap": min(int(self.lap[leader]) + 1, self.options.laps),
+            "position": position.tolist(),
+            "lap": self.lap.tolist(),
+            "progress": np.round(np.mod(self.dist, track.length_m) / track.length_m, 4).tolist(),
+            "speed_kmh": np.round(self.speed * 3.6, 1).tolist(),
+            "gap_s": [None if g != g else g for g in gap.tolist()],
+            "laps_down": laps_down.tolist(),
+            "finished": done.tolist(),
+        }
+
+    def classification(self) -> List[Dict[str, Any]]:
+        f = self.frame()
+        rows = [{"id": car, "position": f["position"][i], "laps": f["lap"][i], "gap_s": f["gap_s"][i],
+                 "laps_down": f["laps_down"][i], "finished": f["finished"][i]} for i, car in enumerate(self.ids)]
+        return sorted(rows, key=lambda r: r["position"])
+
+    def run(self) -> Iterator[Dict[str, Any]]:
+        """Frames every frame_s of race time (every step if 0), the last one at the finish."""
+        every = max(1, int(round(self.options.frame_s / self.options.dt_s)))
+        while not self.finished:
+            with metrics.stage("race_sim", "step"):
+                self.step(every)
+            yield self.frame()
+
+def _sse(event: str, data: Dict[str, Any], event_id: int | None = None) -> bytes:
+    head = "" if event_id is None else f"id: {event_id}\n"
+    return f"{head}event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+def _race_events(sim: RaceSim) -> Iterator[bytes]:
+    yield _sse("track", dict(sim.track.describe(), cars=sim.ids, laps=sim.options.laps))
+    for n, frame in enumerate(sim.run()):
+        yield _sse("frame", frame, n)
+    yield _sse("finish", {"t": round(sim.t, 3), "steps": sim.steps, "classification": sim.classification()})
+
+def stream_race(track: Track, options: RaceOptions | None = None, car_ids: List[str] | None = None) -> Iterator[bytes]:
+    """SSE: a `track` event (layout + car ids), one `frame` event per frame, and a `finish` event with the classification."""
+    return _race_events(RaceSim(track, options, car_ids))
+
+# ---------- Serving ----------
+
+class TooManyStreams(Exception):
+    pass
+
+_slots = threading.BoundedSemaphore(MAX_STREAMS)
+_closing = threading.Event()
+
+class RaceStream:
+    """stream_race's events, paced to options.speedup, holding a stream slot until close()."""
+
+    def __init__(self, track: Track, options: RaceOptions | None = None, car_ids: List[str] | None = None):
+        self.sim = RaceSim(track, options, car_ids)
+        if not _slots.acquire(blocking=False):
+            raise TooManyStreams(f"{MAX_STREAMS} race streams already open")
+        self._events = _race_events(self.sim)
+        self._started = time.monotonic()
+        self._open = True
+        self._lock = threading.Lock()         # next_chunk and close may run on different pool threads
+
+    def next_chunk(self) -> bytes | None:
+        """The next event, computed now; None at the end of the race (or on shutdown)."""
+        with self._lock:
+            if not self._open:
+                return None
+            chunk = None if _closing.is_set() else next(self._events, None)
+            if chunk is None:               # the race is over: free the slot without waiting for close()
+                self._close()
+            return chunk
+
+    def delay(self) -> float:
+        """Seconds until the last computed event is due (0 when unpaced)."""
+        speedup = self.sim.options.speedup
+        if not speedup:
+            return 0.0
+        return max(0.0, self.sim.t / speedup - (time.monotonic() - self._started))
+
+    def __iter__(self) -> "RaceStream":
+        return self
+
+    def __next__(self) -> bytes:
+        chunk = self.next_chunk()
+        if chunk is None:
+            raise StopIteration
+        wait = self.delay()
+        if wait:
+            time.sleep(wait)
+        return chunk
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        # caller holds the lock
+        if self._open:
+            self._open = False
+            self._events.close()
+            _slots.release()
+
+def close_streams() -> None:
+    """End every open RaceStream at its next event (server shutdown)."""
+    _closing.set()
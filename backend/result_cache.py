@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import asdict
+from functools import lru_cache
+from typing import Dict, Any, Tuple, TYPE_CHECKING
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+
+import metrics
+
+if TYPE_CHECKING:
+    from poc import UserPreferences
+
+# Memoized /dataForConfig results.
+#
+# The key is a content hash of the (questionnaire-mutated) doc and the
+# UserPreferences, salted with everything else that shapes the body: the
+# shipped rule table and sensitivity model, the source of the engine modules
+# (ENGINE_MODULES) and ENGINE_VERSION (bump it when the route changes the
+# body's shape), so it doubles as a strong ETag and a deploy never serves a
+# stale body from the disk tier. It is built in two parts: doc_version()
+# hashes everything the questionnaire does not write (setup_plan keys its
+# precomputed plans on it), then the answers and preferences are mixed in. The doc is hashed through pickle rather than
+# sorted JSON (float repr makes that ~10x slower): equal bytes imply equal
+# content, and a differing key order can only cost a miss, never a wrong hit.
+# Values are the serialized JSON response bodies: a hit skips both the
+# computation and re-serialization. Memory is a bounded LRU; an optional
+# directory tier (RESULT_CACHE_DIR) survives restarts.
+
+ENGINE_VERSION = "setup-engine/2"
+# modules whose code produces /dataForConfig bodies (setup, ?shortlist)
+ENGINE_MODULES = ("batch", "laptime", "poc", "rules", "schema", "setup_array", "setup_plan", "solver", "turn_matrix")
+
+def _file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+@lru_cache(maxsize=1)
+def _salt() -> str:
+    from rules import DEFAULT_RULES_PATH      # deferred: rules and solver pull in numpy
+    from solver import DEFAULT_SENSITIVITY_PATH
+    here = os.path.dirname(os.path.abspath(__file__))
+    paths = [DEFAULT_RULES_PATH, DEFAULT_SENSITIVITY_PATH] + [os.path.join(here, f"{m}.py") for m in ENGINE_MODULES]
+    return ":".join([ENGINE_VERSION] + [_file_digest(p) for p in paths])
+
+def _canonical_json(obj: Any) -> str:
+    """Key-sorted, whitespace-free JSON; non-JSON values (e.g. Firestore timestamps) via str()."""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+
+def split_questionnaire(doc: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    (doc without the fields batch.apply_questionnaire writes, those fields).
+    Shallow: only the top level, metadata and initial_setup are copied.
+    """
+    meta = dict(doc.get("metadata") or {})
+    setup = dict(doc.get("initial_setup") or {})
+    answers = {}
+    if "rookie_stability_priority" in meta:       # absent and None must not collide
+        answers["rookie_stability_priority"] = meta.pop("rookie_stability_priority")
+    if "controls" in setup:
+        answers["controls"] = setup.pop("controls")
+    return dict(doc, metadata=meta, initial_setup=setup), answers
+
+def doc_version(doc: Dict[str, Any]) -> str:
+    """Content hash of the preference-independent part of the doc."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(_salt().encode())
+    h.update(pickle.dumps(split_questionnaire(doc)[0], protocol=5))
+    return h.hexdigest()
+
+def setup_cache_key(doc: Dict[str, Any], prefs: UserPreferences, version: str | None = None) -> str:
+    """`version` is doc_version(doc), if the caller already has it."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update((version or doc_version(doc)).encode())
+    h.update(pickle.dumps(split_questionnaire(doc)[1], protocol=5))
+    h.update(_canonical_json(asdict(prefs)).encode())
+    return h.hexdigest()
+
+class ResultCache:
+    def __init__(self, max_entries: int = 256, disk_dir: str | None = None, max_disk_entries: int = 4096):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, bytes]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        return cls(
+            max_entries=int(os.environ.get("RESULT_CACHE_SIZE", 256)),
+            disk_dir=os.environ.get("RESULT_CACHE_DIR") or None,
+        )
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _remember(self, key: str, body: bytes) -> None:
+        # caller holds the lock
+        self._mem[key] = body
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            body = self._mem.get(key)
+            if body is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                metrics.count("result_cache_requests_total", result="hit")
+                return body
+        if self.disk_dir:
+            try:
+                with open(self._path(key), "rb") as f:
+                    body = f.read()
+            except FileNotFoundError:
+                body = None
+            if body is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, body)
+                metrics.count("result_cache_requests_total", result="disk_hit")
+                return body
+        with self._lock:
+            self.misses += 1
+        metrics.count("result_cache_requests_total", result="miss")
+        return None
+
+    def put(self, key: str, body: bytes) -> None:
+        with self._lock:
+            self._remember(key, body)
+        if self.disk_dir:
+            # atomic publish so a concurrent reader never sees a partial file
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp, self._path(key))
+            self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        names = [n for n in os.listdir(self.disk_dir) if n.endswith(".json")]
+        if len(names) <= self.max_disk_entries:
+            return
+        paths = sorted((os.path.join(self.disk_dir, n) for n in names), key=os.path.getmtime)
+        for p in paths[:len(paths) - self.max_disk_entries]:
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._mem),
+                "max_entries": self.max_entries,
+                "disk_dir": self.disk_dir,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Tuple
+import math
+
+import numpy as np
+
+from poc import UserPreferences, build_preferences_from_doc, _safe_get
+from rules import CompiledRules
+from schema import ERR_KEYS, INPUT_FIELDS
+from turn_matrix import (
+    TurnMatrix,
+    compile_rules_for_doc,
+    compile_turns,
+    compute_setup_from_matrix,
+    huber_scale,
+    cap_and_scale,
+)
+import metrics
+
+# Robustness mode: how much of the aggregated move survives telemetry noise.
+#
+# The per-turn metrics are lap averages, and a rule that thresholds at 0.10
+# fires on 0.101 but not on 0.099. Here the turn matrix is perturbed with a
+# noise model per metric and thousands of perturbed copies go through the
+# whole vectorized pipeline (Huber weighting, rule firing, caps, aggression
+# scaling, weighted aggregation) in batches of BATCH_SAMPLES, drawn from a
+# seeded generator so a given seed always returns the same answer.
+#
+# Every model is parameterised by its standard deviation. The scale of a
+# metric comes, in order, from the request, the turn's lap_stats.std (docs
+# built from lap traces carry the measured lap-to-lap spread), or
+# DEFAULT_SIGMA. With zero noise every sample is the nominal
+# compute_setup_from_doc move, bit for bit.
+#
+# Per setting the result gives the nominal delta, the sample mean, std and
+# quantiles, how often any turn moved it, and how often the sampled delta
+# has the nominal's sign; a setting is unstable when that agreement is below
+# stable_probability. Per turn it gives each rule's firing probability and
+# flags the rules whose nominal outcome is that fragile.
+
+MODELS = ("normal", "uniform", "student_t")
+DEFAULT_SAMPLES = 2000
+MAX_SAMPLES = 20000
+BATCH_SAMPLES = 500
+DEFAULT_QUANTILES = (0.05, 0.5, 0.95)
+STABLE_PROBABILITY = 0.9
+
+# lap-to-lap standard deviation assumed when neither the request nor lap_stats gives one
+DEFAULT_SIGMA = {
+    "balance.entry_oversteer_index": 0.03,
+    "balance.mid_oversteer_index": 0.03,
+    "balance.exit_oversteer_index": 0.03,
+    "braking.brake_locking_risk_front": 0.02,
+    "braking.brake_locking_risk_rear": 0.02,
+    "traction.traction_loss_index": 0.02,
+    "aero_ride.porpoising_amplitude_mm": 0.5,
+    "tyre.surface_temp_c.fl": 2.0,
+    "tyre.surface_temp_c.fr": 2.0,
+    "tyre.surface_temp_c.rl": 2.0,
+    "tyre.surface_temp_c.rr": 2.0,
+    "track_env.kerb_impact_g": 0.05,
+    "aero_ride.bottoming_risk_index": 0.03,
+}
+
+# ---------- Options ----------
+
+@dataclass(frozen=True)
+class NoiseModel:
+    model: str = "normal"
+    sigma: float | None = None    # None: the turn's lap_stats std, else DEFAULT_SIGMA
+    df: float = 5.0               # student_t degrees of freedom (> 2)
+
+    def draw(self, rng: np.random.Generator, size: Tuple[int, ...]) -> np.ndarray:
+        """Zero-mean, unit-variance draws of this model's shape."""
+        if self.model == "normal":
+            return rng.standard_normal(size)
+        if self.model == "uniform":
+            return rng.uniform(-math.sqrt(3.0), math.sqrt(3.0), size)
+        return rng.standard_t(self.df, size) * math.sqrt((self.df - 2.0) / self.df)
+
+def _noise_model(name: str, spec: Any, default: str) -> NoiseModel:
+    """A number is a standard deviation; an object is {"model", "sigma", "df"}."""
+    if isinstance(spec, (int, float)) and not isinstance(spec, bool):
+        spec = {"sigma": spec}
+    if not isinstance(spec, dict):
+        raise ValueError(f"noise.{name}: expected a standard deviation or an object")
+    model = spec.get("model", default)
+    if model not in MODELS:
+        raise ValueError(f"noise.{name}: unknown model {model!r} (expected one of {list(MODELS)})")
+    try:
+        sigma = None if spec.get("sigma") is None else float(spec["sigma"])
+        df = float(spec.get("df", 5.0))
+    except (TypeError, ValueError):
+        raise ValueError(f"noise.{name}: 'sigma' and 'df' must be numbers")
+    if sigma is not None and not sigma >= 0:
+        raise ValueError(f"noise.{name}: 'sigma' must be >= 0")
+    if not df > 2:
+        raise ValueError(f"noise.{name}: 'df' must be > 2")
+    return NoiseModel(model, sigma, df)
+
+@dataclass(frozen=True)
+class RobustnessOptions:
+    samples: int = DEFAULT_SAMPLES
+    seed: int = 0
+    noise_model: str = "normal"                   # shape for metrics without their own entry
+    noise: Dict[str, NoiseModel] = field(default_factory=dict)
+    quantiles: Tuple[float, ...] = DEFAULT_QUANTILES
+    stable_probability: float = STABLE_PROBABILITY
+    lap_stats: bool = True                        # use turns' measured lap_stats.std as sigma
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "RobustnessOptions":
+        """Request options; questionnaire answers and other keys are ignored."""
+        try:
+            samples = int(payload.get("samples", DEFAULT_SAMPLES))
+            seed = int(payload.get("seed", 0))
+            quantiles = tuple(float(q) for q in payload.get("quantiles", DEFAULT_QUANTILES))
+            stable = float(payload.get("stable_probability", STABLE_PROBABILITY))
+        except (TypeError, ValueError):
+            raise ValueError("'samples', 'seed', 'quantiles' and 'stable_probability' must be numbers")
+        if not 1 <= samples <= MAX_SAMPLES:
+            raise ValueError(f"'samples' must be between 1 and {MAX_SAMPLES}")
+        if not quantiles or not all(0.0 <= q <= 1.0 for q in quantiles):
+            raise ValueError("'quantiles' must be a non-empty list of values in [0, 1]")
+        if not 0.5 < stable <= 1.0:
+            raise ValueError("'stable_probability' must be in (0.5, 1]")
+        default = payload.get("noise_model", "normal")
+        if default not in MODELS:
+            raise ValueError(f"unknown noise_model {default!r} (expected one of {list(MODELS)})")
+        spec = payload.get("noise") or {}
+        if not isinstance(spec, dict):
+            raise ValueError("'noise' must be an object of per-metric noise models")
+        return cls(
+            samples=samples,
+            seed=seed,
+            noise_model=default,
+            noise={name: _noise_model(name, s, default) for name, s in spec.items()},
+            quantiles=quantiles,
+            stable_probability=stable,
+            lap_stats=bool(payload.get("lap_stats", True)),
+        )
+
+# ---------- Noise plan ----------
+
+def noise_plan(doc: Dict[str, Any], tm: TurnMatrix, opts: RobustnessOptions) -> Tuple[List[str], np.ndarray, List[NoiseModel]]:
+    """
+    (fields, sigma, models): the dotted turn metric of every feature column,
+    the (N, F) per-turn standard deviations, and each column's noise model.
+    """
+    fields = INPUT_FIELDS + tm.turn_fields
+    unknown = [f for f in opts.noise if f not in fields]
+    if unknown:
+        raise ValueError(f"noise for unknown metrics {unknown} (perturbable: {fields})")
+    turns = doc["turns"]
+    sigma = np.zeros((tm.n_turns, len(fields)))
+    models = []
+    for c, f in enumerate(fields):
+        nm = opts.noise.get(f) or NoiseModel(opts.noise_model)
+        models.append(nm)
+        if nm.sigma is not None:
+            sigma[:, c] = nm.sigma
+            continue
+        sigma[:, c] = DEFAULT_SIGMA.get(f, 0.0)
+        if opts.lap_stats:
+            for i, t in enumerate(turns):
+                std = _safe_get(t, "lap_stats", "std", f)
+                if isinstance(std, (int, float)) and not isinstance(std, bool) and std >= 0:
+                    sigma[i, c] = float(std)
+    return fields, sigma, models
+
+# ---------- Batched pipeline ----------
+
+def sample_moves(
+    tm: TurnMatrix,
+    rules: CompiledRules,
+    prefs: UserPreferences,
+    caps: Dict[str, float],
+    features: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    compute_setup_from_matrix's aggregated move for a (B, N, F) stack of
+    feature matrices: (B, K) totals over rules.keys, (B, K) whether any turn
+    moved the key, and the (B, N, R) fired rules.
+    """
+    b, n, f = features.shape
+    weights = tm.corner_weights() * huber_scale(features[:, :, :len(ERR_KEYS)])    # (B, N)
+    fired = rules.fired(features.reshape(b * n, f))
+    mm = rules.moves(fired, prefs)
+    vals = cap_and_scale(mm.keys, mm.values, caps, prefs).reshape(b, n, -1)
+    present = mm.present.reshape(b, n, -1)
+    totals = np.zeros((b, vals.shape[2]))
+    for i in range(n):      # turn by turn, the order aggregate_moves sums in
+        totals += np.where(present[:, i], weights[:, i, None] * vals[:, i], 0.0)
+    return totals + 0.0, present.any(axis=1), fired.reshape(b, n, -1)
+
+# ---------- Public API ----------
+
+def robustness(
+    doc: Dict[str, Any],
+    prefs: UserPreferences | None = None,
+    options: RobustnessOptions | None = None,
+) -> Dict[str, Any]:
+    """
+    Monte Carlo spread of compute_setup_from_doc's aggregated move under
+    noisy turn metrics: per-setting delta statistics, per-turn rule firing
+    probabilities, and the settings whose direction is not stable.
+    """
+    opts = options or RobustnessOptions()
+    rules = compile_rules_for_doc(doc)
+    tm = compile_turns(doc, rules.turn_fields)      # validates the doc
+    if prefs is None:
+        prefs = build_preferences_from_doc(doc)
+    caps = _safe_get(doc, "weights_and_constraints", "per_turn_step_caps", default={}) or {}
+    nominal = compute_setup_from_matrix(doc, tm, prefs, rules)["diagnostics"]["aggregated_move"]
+    fields, sigma, models = noise_plan(doc, tm, opts)
+    noisy = [c for c in range(len(fields)) if sigma[:, c].any()]
+
+    s, n, k, r = opts.samples, tm.n_turns, len(rules.keys), len(rules.table.rules)
+    totals = np.empty((s, k))
+    moved = np.empty((s, k), dtype=bool)
+    fire_counts = np.zeros((n, r))
+    rng = np.random.default_rng(opts.seed)
+    with metrics.stage("robustness", "sample"):
+        for lo in range(0, s, BATCH_SAMPLES):
+            b = min(BATCH_SAMPLES, s - lo)
+            features = np.repeat(tm.features[None], b, axis=0)
+            for c in noisy:
+                features[:, :, c] += models[c].draw(rng, (b, n)) * sigma[:, c]
+            totals[lo:lo + b], moved[lo:lo + b], fired = sample_moves(tm, rules, prefs, caps, features)
+            fire_counts += fired.sum(axis=0)
+    metrics.count("robustness_samples_total", s)
+
+    with metrics.stage("robustness", "summarize"):
+        col = {key: c for c, key in enumerate(rules.keys)}
+        keys = list(nominal) + [key for key in rules.keys if key not in nominal and moved[:, col[key]].any()]
+        cols = [col[key] for key in keys]
+        nominal_row = np.array([nominal.get(key, 0.0) for key in keys])
+        sampled = totals[:, cols]
+        qs = np.quantile(sampled, opts.quantiles, axis=0) if keys else np.zeros((len(opts.quantiles), 0))
+        agree = (np.sign(sampled) == np.sign(nominal_row)).mean(axis=0)
+        settings = {}
+        for j, key in enumerate(keys):
+            settings[key] = {
+                "nominal": float(nominal_row[j]),
+                "mean": float(sampled[:, j].mean()),
+                "std": float(sampled[:, j].std()),
+                "quantiles": {f"{q:g}": float(qs[i, j]) for i, q in enumerate(opts.quantiles)},
+                "p_moved": float(moved[:, cols[j]].mean()),
+                "sign_agreement": float(agree[j]),
+                "stable": bool(agree[j] >= opts.stable_probability),
+            }
+
+        p_fire = fire_counts / s
+        nominal_fired = rules.fired(tm.features)
+        names = [rule.name for rule in rules.table.rules]
+        turns = []
+        for i, t in enumerate(doc["turns"]):
+            entry = {"turn_id": t.get("turn_id", i), "rules": {}, "marginal_rules": []}
+            for ri in np.flatnonzero(nominal_fired[i] | (p_fire[i] > 0)):
+                nom = bool(nominal_fired[i, ri])
+                entry["rules"][names[ri]] = {"nominal": nom, "p_fire": float(p_fire[i, ri])}
+                if (p_fire[i, ri] if nom else 1.0 - p_fire[i, ri]) < opts.stable_probability:
+                    entry["marginal_rules"].append(names[ri])
+            turns.append(entry)
+
+    return {
+        "samples": s,
+        "seed": opts.seed,
+        "noise": {
+            fields[c]: {"model": models[c].model, "sigma": sigma[:, c].tolist()} for c in noisy
+        },
+        "nominal": {"aggregated_move": nominal},
+        "settings": settings,
+        "turns": turns,
+        "unstable_settings": [key for key, v in settings.items() if not v["stable"]],
+    }
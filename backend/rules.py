@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple, Sequence
+import numpy as np
+import json
+import operator
+import os
+
+# Declarative setup rules.
+#
+# A rule table is JSON:
+#
+#   {"version": 1, "rules": [
+#     {"name": "entry_oversteer",
+#      "when": {"all": [{"field": "err.d_entry", "op": ">", "value": 0.10}]},
+#      "then": [{"setting": "brake_bias_percent_front", "delta": 0.4,
+#                "scale": "brake_bias_sensitivity"}]}
+#   ]}
+#
+# `field` is either "err.<error key>" (schema.ERR_KEYS) or
+# "turn.<dotted path>" into the raw turn dict. `when` combines its clauses
+# with "all" or "any". Each fired action adds `delta` (times the named
+# UserPreferences sensitivity, if `scale` is set) to `setting`.
+# Rules fire in table order; per-turn caps and aggression scaling are applied
+# afterwards by the caller, exactly as for the old hand-written if-chain.
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_rules.json")
+
+_OPS = {">": operator.gt, "<": operator.lt, ">=": operator.ge, "<=": operator.le}
+_NP_OPS = {">": np.greater, "<": np.less, ">=": np.greater_equal, "<=": np.less_equal}
+_FIELD_PREFIXES = ("err.", "turn.")
+
+# ---------- Table model ----------
+
+@dataclass(frozen=True)
+class Clause:
+    field: str
+    op: str
+    value: float
+
+@dataclass(frozen=True)
+class Action:
+    setting: str
+    delta: float
+    scale: str | None = None
+
+@dataclass(frozen=True)
+class Rule:
+    name: str
+    mode: str                     # "all" | "any"
+    clauses: Tuple[Clause, ...]
+    actions: Tuple[Action, ...]
+
+@dataclass(frozen=True)
+class RuleTable:
+    rules: Tuple[Rule, ...]
+
+    @property
+    def turn_fields(self) -> List[str]:
+        """Dotted turn paths referenced by any clause, in first-use order."""
+        out: List[str] = []
+        for r in self.rules:
+            for c in r.clauses:
+                if c.field.startswith("turn.") and c.field[5:] not in out:
+                    out.append(c.field[5:])
+        return out
+
+    @property
+    def scales(self) -> List[str]:
+        return sorted({a.scale for r in self.rules for a in r.actions if a.scale is not None})
+
+# ---------- Parsing ----------
+
+def _num(v: Any, where: str) -> float:
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        raise ValueError(f"{where}: expected a number, got {v!r}")
+    return float(v)
+
+def _parse_clause(c: Any, where: str) -> Clause:
+    if not isinstance(c, dict):
+        raise ValueError(f"{where}: clause must be an object")
+    field = c.get("field")
+    if not isinstance(field, str) or not field.startswith(_FIELD_PREFIXES) or field in _FIELD_PREFIXES:
+        raise ValueError(f"{where}.field: must be 'err.<key>' or 'turn.<path>', got {field!r}")
+    op = c.get("op")
+    if op not in _OPS:
+        raise ValueError(f"{where}.op: unknown operator {op!r} (expected one of {sorted(_OPS)})")
+    return Clause(field=field, op=op, value=_num(c.get("value"), f"{where}.value"))
+
+def _parse_action(a: Any, where: str) -> Action:
+    if not isinstance(a, dict):
+        raise ValueError(f"{where}: action must be an object")
+    setting = a.get("setting")
+    if not isinstance(setting, str) or not setting:
+        raise ValueError(f"{where}.setting: must be a non-empty string")
+    scale = a.get("scale")
+    if scale is not None and not isinstance(scale, str):
+        raise ValueError(f"{where}.scale: must be a preference name or null")
+    return Action(setting=setting, delta=_num(a.get("delta"), f"{where}.delta"), scale=scale)
+
+def parse_rule_table(obj: Dict[str, Any]) -> RuleTable:
+    """Validate a JSON-shaped rule table; raises ValueError naming the offending path."""
+    if not isinstance(obj, dict) or not isinstance(obj.get("rules"), list):
+        raise ValueError("rule table must be an object with a 'rules' list")
+    rules = []
+    for i, r in enumerate(obj["rules"]):
+        where = f"rules[{i}]"
+        if not isinstance(r, dict):
+            raise ValueError(f"{where}: rule must be an object")
+        when = r.get("when")
+        if not isinstance(when, dict) or len(when) != 1 or next(iter(when)) not in ("all", "any"):
+            raise ValueError(f"{where}.when: must be {{'all': [...]}} or {{'any': [...]}}")
+        mode, clauses = next(iter(when.items()))
+        if not isinstance(clauses, list) or not clauses:
+            raise ValueError(f"{where}.when.{mode}: must be a non-empty list")
+        actions = r.get("then")
+        if not isinstance(actions, list) or not actions:
+            raise ValueError(f"{where}.then: must be a non-empty list")
+        rules.append(Rule(
+            name=str(r.get("name", f"rule_{i}")),
+            mode=mode,
+            clauses=tuple(_parse_clause(c, f"{where}.when.{mode}[{j}]") for j, c in enumerate(clauses)),
+            actions=tuple(_parse_action(a, f"{where}.then[{j}]") for j, a in enumerate(actions)),
+        ))
+    return RuleTable(rules=tuple(rules))
+
+def load_rule_table(path: str) -> RuleTable:
+    with open(path) as f:
+        return parse_rule_table(json.load(f))
+
+@lru_cache(maxsize=1)
+def default_rule_table() -> RuleTable:
+    return load_rule_table(DEFAULT_RULES_PATH)
+
+# ---------- Scalar evaluation (one turn) ----------
+
+def _turn_value(turn: Dict[str, Any], path: str) -> float:
+    cur: Any = turn
+    for k in path.split("."):
+        cur = cur[k]
+    return float(cur)
+
+def _clause_holds(c: Clause, turn: Dict[str, Any], errs: Dict[str, float]) -> bool:
+    if c.field.startswith("err."):
+        x = errs[c.field[4:]]
+    else:
+        x = _turn_value(turn, c.field[5:])
+    return _OPS[c.op](x, c.value)
+
+def evaluate_rules_for_turn(
+    table: RuleTable,
+    turn: Dict[str, Any],
+    errs: Dict[str, float],
+    prefs: Any,
+) -> Dict[str, float]:
+    """Raw (uncapped, unscaled) deltas for one turn, keyed by setting name."""
+    move: Dict[str, float] = {}
+    for r in table.rules:
+        hit = all if r.mode == "all" else any
+        if not hit(_clause_holds(c, turn, errs) for c in r.clauses):
+            continue
+        for a in r.actions:
+            d = a.delta if a.scale is None else a.delta * getattr(prefs, a.scale)
+            move[a.setting] = move.get(a.setting, 0) + d
+    return move
+
+# ---------- Compiled evaluation (all turns) ----------
+
+_NOT_WRITTEN = np.iinfo(np.int64).max
+
+@dataclass
+class MoveMatrix:
+    """Per-turn moves as columns: values, which turns wrote each key, and first-write rank."""
+    keys: List[str]
+    values: np.ndarray    # (N, K)
+    present: np.ndarray   # (N, K) bool
+    rank: np.ndarray      # (N, K) index of first action that wrote the key in that turn
+
+class CompiledRules:
+    """
+    A rule table lowered to array ops over a turn x feature matrix.
+    All clauses are evaluated with one comparison per operator, rules are
+    resolved with a single clause->rule membership product, and actions are
+    applied in table order so per-turn sums match the scalar evaluator bit-for-bit.
+    """
+
+    def __init__(self, table: RuleTable, err_keys: Sequence[str]):
+        self.table = table
+        self.err_keys = list(err_keys)
+        self.turn_fields = table.turn_fields
+        col = {f"err.{k}": i for i, k in enumerate(self.err_keys)}
+        col.update({f"turn.{p}": len(self.err_keys) + i for i, p in enumerate(self.turn_fields)})
+
+        clauses = [(ri, c) for ri, r in enumerate(table.rules) for c in r.clauses]
+        for _, c in clauses:
+            if c.field not in col:
+                raise ValueError(f"unknown rule field {c.field!r}")
+        self.n_clauses = len(clauses)
+        # op -> (clause positions, feature columns, thresholds)
+        self._groups: List[Tuple[str, np.ndarray, np.ndarray, np.ndarray]] = []
+        for op in _OPS:
+            pos = [i for i, (_, c) in enumerate(clauses) if c.op == op]
+            if pos:
+                self._groups.append((
+                    op,
+                    np.array(pos, dtype=np.intp),
+                    np.array([col[clauses[i][1].field] for i in pos], dtype=np.intp),
+                    np.array([clauses[i][1].value for i in pos], dtype=float),
+                ))
+        n_rules = len(table.rules)
+        self._membership = np.zeros((self.n_clauses, n_rules), dtype=float)
+        for i, (ri, _) in enumerate(clauses):
+            self._membership[i, ri] = 1.0
+        self._is_all = np.array([r.mode == "all" for r in table.rules], dtype=bool)
+        self._need = np.array([len(r.clauses) for r in table.rules], dtype=float)
+
+        self.keys: List[str] = []
+        self._actions: List[Tuple[int, int, float, str | None]] = []
+        for ri, r in enumerate(table.rules):
+            for a in r.actions:
+                if a.setting not in self.keys:
+                    self.keys.append(a.setting)
+                self._actions.append((ri, self.keys.index(a.setting), a.delta, a.scale))
+
+    def fired(self, features: np.ndarray) -> np.ndarray:
+        """(N, R) bool: which rules fire for each turn."""
+        n = features.shape[0]
+        hits = np.empty((n, self.n_clauses), dtype=bool)
+        for op, pos, cols, thr in self._groups:
+            hits[:, pos] = _NP_OPS[op](features[:, cols], thr)
+        counts = hits.astype(float) @ self._membership
+        return np.where(self._is_all, counts == self._need, counts > 0)
+
+    def run(self, features: np.ndarray, prefs: Any) -> MoveMatrix:
+        """Evaluate the table on a (N, len(err_keys) + len(turn_fields)) feature matrix."""
+        return self.moves(self.fired(features), prefs)
+
+    def moves(self, fired: np.ndarray, prefs: Any) -> MoveMatrix:
+        """Actions of the fired rules, sensitivity-scaled by prefs; `fired` from fired()."""
+        n, k = fired.shape[0], len(self.keys)
+        vals = np.zeros((k, n), dtype=float)
+        rank = np.full((k, n), _NOT_WRITTEN, dtype=np.int64)
+        for ai, (ri, kc, delta, scale) in enumerate(self._actions):
+            d = delta if scale is None else delta * getattr(prefs, scale)
+            m = fired[:, ri]
+            vals[kc] = np.where(m, vals[kc] + d, vals[kc])
+            rank[kc] = np.where(m & (rank[kc] == _NOT_WRITTEN), ai, rank[kc])
+        return MoveMatrix(keys=list(self.keys), values=vals.T, present=rank.T != _NOT_WRITTEN, rank=rank.T)
+
+@lru_cache(maxsize=32)
+def compile_rule_table(table: RuleTable, err_keys: Tuple[str, ...]) -> CompiledRules:
+    return CompiledRules(table, err_keys)
@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+from array import array
+from typing import Dict, Any, List, Sequence, Tuple
+
+# Typed decoding of test_drive / race_data documents and questionnaires.
+#
+# Each decode_* function validates its input in one pass and returns a compact
+# __slots__ record; numeric per-turn / per-event data is packed into flat
+# array('d') buffers (turn_matrix wraps them with np.frombuffer, no copy), so
+# the engines never walk the nested dicts again. Anything malformed raises
+# SchemaError, a ValueError whose `path` points at the offending value
+# (e.g. "turns[3].braking.brake_locking_risk_front"), which the routes turn
+# into 400 responses. Numbers follow float() semantics, exactly like the
+# casts the engines used to do, so decoding never changes a result.
+#
+# This module is stdlib-only: backend.py imports it (through health.py) at
+# startup.
+
+class SchemaError(ValueError):
+    def __init__(self, path: str, problem: str):
+        self.path = path
+        self.problem = problem
+        super().__init__(f"{path}: {problem}" if path else problem)
+
+    def within(self, prefix: str) -> "SchemaError":
+        """The same error, located inside `prefix`."""
+        return SchemaError(join_path(prefix, self.path) if self.path else prefix, self.problem)
+
+# join_path, describe and the read_* readers are public: the modules that decode
+# their own inputs (laptime, race_sim, lap_traces) report errors the same way.
+
+def join_path(path: str, key: Any) -> str:
+    if isinstance(key, int):
+        return f"{path}[{key}]"
+    return f"{path}.{key}" if path else str(key)
+
+def describe(v: Any) -> str:
+    r = repr(v)
+    return f"got {type(v).__name__} {r if len(r) <= 40 else r[:37] + '...'}"
+
+# ---------- Field readers (path-tracking, used on the slow path) ----------
+
+def read_obj(parent: Dict[str, Any], key: str, path: str) -> Dict[str, Any]:
+    if key not in parent:
+        raise SchemaError(join_path(path, key), "missing")
+    v = parent[key]
+    if not isinstance(v, dict):
+        raise SchemaError(join_path(path, key), f"expected an object, {describe(v)}")
+    return v
+
+def _opt_obj(parent: Dict[str, Any], key: str, path: str) -> Dict[str, Any]:
+    v = parent.get(key)
+    if v is None:
+        return {}
+    if not isinstance(v, dict):
+        raise SchemaError(join_path(path, key), f"expected an object, {describe(v)}")
+    return v
+
+def _float(v: Any, path: str) -> float:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        raise SchemaError(path, f"expected a number, {describe(v)}") from None
+
+def read_num(parent: Dict[str, Any], key: str, path: str) -> float:
+    if key not in parent:
+        raise SchemaError(join_path(path, key), "missing")
+    return _float(parent[key], join_path(path, key))
+
+def read_num_or(parent: Dict[str, Any], key: str, default: float, path: str) -> float:
+    """float(parent.get(key, default) or default): absent, null and 0 all mean the default."""
+    return _float(parent.get(key, default) or default, join_path(path, key))
+
+def _is_number(v: Any) -> bool:
+    return isinstance(v, (int, float))
+
+# ---------- test_drive ----------
+
+# Column order of the per-turn error block, and the key order of
+# TestDriveDoc.error_vector (the Huber mean is order-sensitive).
+ERR_KEYS = [
+    "d_entry", "d_mid", "d_exit",
+    "lock_front_excess", "lock_rear_excess", "traction_excess", "porpoise_excess",
+    "surf_fl_excess", "surf_fr_excess", "surf_rl_excess", "surf_rr_excess",
+]
+N_ERR = len(ERR_KEYS)
+
+# (section, field) of each error column's raw turn value
+_TURN_INPUTS = [
+    ("balance", "entry_oversteer_index"), ("balance", "mid_oversteer_index"), ("balance", "exit_oversteer_index"),
+    ("braking", "brake_locking_risk_front"), ("braking", "brake_locking_risk_rear"),
+    ("traction", "traction_loss_index"), ("aero_ride", "porpoising_amplitude_mm"),
+    ("tyre.surface_temp_c", "fl"), ("tyre.surface_temp_c", "fr"), ("tyre.surface_temp_c", "rl"), ("tyre.surface_temp_c", "rr"),
+]
+# the same inputs as dotted turn paths (lap_traces.SPREAD_FIELDS names)
+INPUT_FIELDS = [f"{section}.{name}" for section, name in _TURN_INPUTS]
+CORNER_FIELDS = ("time_loss_weight", "occurrence_rate", "driver_confidence_weight")
+
+class TestDriveDoc:
+    """A validated test_drive doc: doc-level scalars plus packed per-turn columns."""
+    __slots__ = (
+        "metadata", "stability_priority", "weight_cap", "step_caps", "absolute_limits",
+        "targets", "turn_fields", "width", "n_turns", "turn_values", "corner_factors", "initial_setup",
+    )
+
+    def __init__(self, **fields: Any):
+        for k, v in fields.items():
+            setattr(self, k, v)
+
+    def error_vector(self, i: int) -> Dict[str, float]:
+        """Turn i's measured values minus the targets, keyed in ERR_KEYS order."""
+        return _errors(self.turn_values[i * self.width:i * self.width + N_ERR], self.targets)
+
+    def corner_weight(self, i: int) -> float:
+        """Turn i's time-loss x occurrence x confidence weight, scaled by the stability priority and capped."""
+        return _corner(self.corner_factors[3 * i:3 * i + 3], self.stability_priority, self.weight_cap)
+
+def _errors(row: Sequence[float], targets: Sequence[float]) -> Dict[str, float]:
+    return {k: row[c] - targets[c] for c, k in enumerate(ERR_KEYS)}
+
+def _corner(factors: Sequence[float], stability_priority: float, weight_cap: float) -> float:
+    tlw, occ, dcw = factors
+    return min(weight_cap, tlw * occ * dcw * stability_priority)
+
+# One turn on its own, for callers that have a single turn dict: only the
+# turn and the doc fields it is measured against are read, so partial docs
+# work and nothing else in the doc is validated.
+
+def turn_error_vector(turn: Any, doc: Dict[str, Any]) -> Dict[str, float]:
+    """TestDriveDoc.error_vector for one turn against doc["targets"]."""
+    targets = _targets(doc)
+    try:
+        row = _turn_row(turn, ())
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+        _check_turn(turn, "", ())
+        raise SchemaError("", "malformed turn") from None
+    return _errors(row, targets)
+
+def turn_corner_weight(turn: Any, doc: Dict[str, Any]) -> float:
+    """TestDriveDoc.corner_weight for one turn; metadata and weights_and_constraints may be absent."""
+    if not isinstance(turn, dict):
+        raise SchemaError("", f"expected a turn object, {describe(turn)}")
+    meta = _opt_obj(doc, "metadata", "")
+    wc = _opt_obj(doc, "weights_and_constraints", "")
+    return _corner([read_num_or(turn, k, 1.0, "") for k in CORNER_FIELDS],
+                   read_num_or(meta, "rookie_stability_priority", 0.8, "metadata"),
+                   read_num_or(wc, "time_loss_weight_cap", 3.0, "weights_and_constraints"))
+
+def _targets(doc: Dict[str, Any]) -> List[float]:
+    tg = read_obj(doc, "targets", "")
+    bg = read_obj(tg, "balance_goal", "targets")
+    sg = read_obj(tg, "stability_goal", "targets")
+    ty = read_obj(tg, "tyre_goal", "targets")
+    surf = read_num(ty, "surface_temp_target_c", "targets.tyre_goal")
+    return [
+        read_num(bg, "entry_oversteer_index", "targets.balance_goal"),
+        read_num(bg, "mid_oversteer_index", "targets.balance_goal"),
+        read_num(bg, "exit_oversteer_index", "targets.balance_goal"),
+        read_num(sg, "brake_locking_risk_front", "targets.stability_goal"),
+        read_num(sg, "brake_locking_risk_rear", "targets.stability_goal"),
+        read_num(sg, "traction_loss_index", "targets.stability_goal"),
+        read_num(sg, "porpoising_amplitude_mm", "targets.stability_goal"),
+        surf, surf, surf, surf,
+    ]
+
+def _turn_row(t: Dict[str, Any], paths: Sequence[List[str]]) -> Tuple[float, ...]:
+    # fast path: no path bookkeeping; _check_turn explains any failure
+    b = t["balance"]
+    br = t["braking"]
+    surf = t["tyre"]["surface_temp_c"]
+    row = [
+        float(b["entry_oversteer_index"]), float(b["mid_oversteer_index"]), float(b["exit_oversteer_index"]),
+        float(br["brake_locking_risk_front"]), float(br["brake_locking_risk_rear"]),
+        float(t["traction"]["traction_loss_index"]), float(t["aero_ride"]["porpoising_amplitude_mm"]),
+        float(surf["fl"]), float(surf["fr"]), float(surf["rl"]), float(surf["rr"]),
+    ]
+    for p in paths:
+        cur: Any = t
+        for k in p:
+            cur = cur[k]
+        row.append(float(cur))
+    return tuple(row)
+
+def _check_turn(t: Any, path: str, paths: Sequence[List[str]]) -> None:
+    """Re-read the turn at `path` with path tracking; raises the SchemaError _turn_row's failure corresponds to."""
+    if not isinstance(t, dict):
+        raise SchemaError(path, f"expected an object, {describe(t)}")
+    for section, field in _TURN_INPUTS:
+        cur, where = t, path
+        for k in section.split("."):
+            cur, where = read_obj(cur, k, where), join_path(where, k)
+        read_num(cur, field, where)
+    for k in CORNER_FIELDS:
+        read_num_or(t, k, 1.0, path)
+    for p in paths:
+        cur, where = t, path
+        for k in p[:-1]:
+            cur, where = read_obj(cur, k, where), join_path(where, k)
+        read_num(cur, p[-1], where)
+
+def _check_limits(limits: Dict[str, Any], path: str) -> None:
+    for k, v in limits.items():
+        where = join_path(path, k)
+        if not isinstance(v, (list, tuple)) or len(v) != 2:
+            raise SchemaError(where, f"expected a [lo, hi] pair, {describe(v)}")
+        _float(v[0], join_path(where, 0))
+        _float(v[1], join_path(where, 1))
+
+def decode_test_drive(doc: Any, turn_fields: Sequence[str] = ()) -> TestDriveDoc:
+    """
+    Validate a test_drive doc and pack it. `turn_fields` are the extra dotted
+    turn paths the rule table reads (CompiledRules.turn_fields); they become
+    columns after the error block.
+    """
+    if not isinstance(doc, dict):
+        raise SchemaError("", f"expected a test_drive object, {describe(doc)}")
+    for key in ("metadata", "targets", "turns", "initial_setup"):
+        if key not in doc:
+            raise SchemaError(key, "missing")
+    meta = read_obj(doc, "metadata", "")
+    initial_setup = read_obj(doc, "initial_setup", "")
+    turns = doc["turns"]
+    if not isinstance(turns, list) or not turns:
+        raise SchemaError("turns", "expected a non-empty list")
+    targets = _targets(doc)
+
+    wc = _opt_obj(doc, "weights_and_constraints", "")
+    caps = _opt_obj(wc, "per_turn_step_caps", "weights_and_constraints")
+    for k, v in caps.items():
+        _float(v, join_path("weights_and_constraints.per_turn_step_caps", k))
+    limits = _opt_obj(wc, "absolute_limits", "weights_and_constraints")
+    _check_limits(limits, "weights_and_constraints.absolute_limits")
+
+    paths = [p.split(".") for p in turn_fields]
+    values = array("d")
+    factors = array("d")
+    i = 0
+    try:
+        for i, t in enumerate(turns):
+            values.extend(_turn_row(t, paths))
+            factors.append(float(t.get("time_loss_weight", 1.0) or 1.0))
+            factors.append(float(t.get("occurrence_rate", 1.0) or 1.0))
+            factors.append(float(t.get("driver_confidence_weight", 1.0) or 1.0))
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+        _check_turn(turns[i], join_path("turns", i), paths)
+        raise SchemaError(join_path("turns", i), "malformed turn") from None
+
+    return TestDriveDoc(
+        metadata=meta,
+        stability_priority=read_num_or(meta, "rookie_stability_priority", 0.8, "metadata"),
+        weight_cap=read_num_or(wc, "time_loss_weight_cap", 3.0, "weights_and_constraints"),
+        step_caps=caps,
+        absolute_limits=limits,
+        targets=targets,
+        turn_fields=list(turn_fields),
+        width=N_ERR + len(paths),
+        n_turns=len(turns),
+        turn_values=values,
+        corner_factors=factors,
+        initial_setup=initial_setup,
+    )
+
+# ---------- Questionnaire ----------
+
+class Questionnaire:
+    """The four /dataForConfig answers, as apply_questionnaire writes them into the doc."""
+    __slots__ = ("rookie_stability_priority", "steering_weight_preference", "throttle_pedal_linearity", "brake_pedal_linearity")
+
+    def __init__(self, rsp: float, steering: Any, throttle: float, brake: float):
+        self.rookie_stability_priority = rsp
+        self.steering_weight_preference = steering
+        self.throttle_pedal_linearity = throttle
+        self.brake_pedal_linearity = brake
+
+def decode_questionnaire(q: Any) -> Questionnaire:
+    if not isinstance(q, dict):
+        raise SchemaError("", f"expected a questionnaire object, {describe(q)}")
+    return Questionnaire(
+        read_num(q, "rookie_stability_priority", ""),
+        q.get("steering_weight_preference"),
+        read_num(q, "throttle_pedal_linearity", ""),
+        read_num(q, "brake_pedal_linearity", ""),
+    )
+
+# ---------- race_data ----------
+
+class RaceMeta:
+    """The race-level fields the health report reads (numbers are kept as given: the report prints them)."""
+    __slots__ = ("driver_id", "track_name", "cockpit_temp_c", "fluid_loss_l", "peak_neck_load_kg", "spinal_compression_events")
+
+    def __init__(self, driver_id: Any, track_name: Any, cockpit_temp_c: Any,
+                 fluid_loss_l: float, peak_neck_load_kg: float, spinal_compression_events: float):
+        self.driver_id = driver_id
+        self.track_name = track_name
+        self.cockpit_temp_c = cockpit_temp_c
+        self.fluid_loss_l = fluid_loss_l
+        self.peak_neck_load_kg = peak_neck_load_kg
+        self.spinal_compression_events = spinal_compression_events
+
+def decode_race_meta(fields: Dict[str, Any]) -> RaceMeta:
+    est = _opt_obj(fields, "hpc_race_summary_estimates", "")
+    values = []
+    for k in ("estimated_total_fluid_loss_l", "peak_neck_load_equivalent_kg", "cumulative_spinal_compression_events"):
+        v = est.get(k, 0)
+        if not _is_number(v):
+            raise SchemaError(join_path("hpc_race_summary_estimates", k), f"expected a number, {describe(v)}")
+        values.append(v)
+    return RaceMeta(fields.get("driver_id"), fields.get("track_name"), fields.get("cockpit_temp_c"), *values)
+
+def decode_event(event: Any) -> Tuple[float, float, float]:
+    """(lateral_peak_g, vertical_peak_g, sustained high-g duration_ms) of one significant event."""
+    if not isinstance(event, dict):
+        raise SchemaError("", f"expected an event object, {describe(event)}")
+    g = event.get("g_forces", {})
+    if not isinstance(g, dict):
+        raise SchemaError("g_forces", f"expected an object, {describe(g)}")
+    lat = g.get("lateral_peak_g", 0)
+    vert = g.get("vertical_peak_g", 0)
+    if not _is_number(lat):
+        raise SchemaError("g_forces.lateral_peak_g", f"expected a number, {describe(lat)}")
+    if not _is_number(vert):
+        raise SchemaError("g_forces.vertical_peak_g", f"expected a number, {describe(vert)}")
+    high_g = 0
+    if event.get("event_type") == "SustainedHighG":
+        high_g = event.get("duration_ms", 0)
+        if not _is_number(high_g):
+            raise SchemaError("duration_ms", f"expected a number, {describe(high_g)}")
+    return lat, vert, high_g
+
+class EventColumns:
+    """Significant events as three parallel array('d') columns."""
+    __slots__ = ("lateral_peak_g", "vertical_peak_g", "high_g_duration_ms")
+
+    def __init__(self):
+        self.lateral_peak_g = array("d")
+        self.vertical_peak_g = array("d")
+        self.high_g_duration_ms = array("d")
+
+    def __len__(self) -> int:
+        return len(self.lateral_peak_g)
+
+_NO_G_FORCES: Dict[str, Any] = {}
+
+def decode_events(events: Sequence[Any], path: str = "significant_events") -> EventColumns:
+    cols = EventColumns()
+    lat, vert, dur = cols.lateral_peak_g.append, cols.vertical_peak_g.append, cols.high_g_duration_ms.append
+    try:
+        # fast path: array('d').append rejects non-numbers itself
+        for ev in events:
+            g = ev.get("g_forces", _NO_G_FORCES)
+            lat(g.get("lateral_peak_g", 0))
+            vert(g.get("vertical_peak_g", 0))
+            dur(ev.get("duration_ms", 0) if ev.get("event_type") == "SustainedHighG" else 0)
+    except (AttributeError, TypeError):
+        for i, ev in enumerate(events):
+            try:
+                decode_event(ev)
+            except SchemaError as exc:
+                raise exc.within(join_path(path, i)) from None
+        raise SchemaError(path, "malformed event") from None
+    return cols
+
+class RaceDataDoc:
+    """A validated race_data doc: race-level fields and the events as columns."""
+    __slots__ = ("fields", "meta", "events")
+
+    def __init__(self, fields: Dict[str, Any], meta: RaceMeta, events: EventColumns):
+        self.fields = fields      # every race-level field, as given (merged by HealthAccumulator.update_meta)
+        self.meta = meta
+        self.events = events
+
+def decode_race_data(race_data: Any) -> RaceDataDoc:
+    if not isinstance(race_data, dict):
+        raise SchemaError("", f"expected a race_data object, {describe(race_data)}")
+    fields = {k: v for k, v in race_data.items() if k != "significant_events"}
+    events = race_data.get("significant_events", [])
+    if not isinstance(events, list):
+        raise SchemaError("significant_events", f"expected a list, {describe(events)}")
+    return RaceDataDoc(fields, decode_race_meta(fields), decode_events(events))
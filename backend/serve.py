@@ -0,0 +1,41 @@
+import argparse
+import os
+import sys
+
+# Production server: `python backend/serve.py [--workers N] [--port 5000]`.
+#
+# Runs asgi:app under uvicorn (pip install uvicorn). Each worker is a separate
+# process with its own caches and live feed. On SIGTERM/SIGINT a worker stops
+# accepting connections, ends live streams, and lets in-flight requests finish
+# for up to --graceful-timeout seconds before shutting down its pools.
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Serve the backend over ASGI (uvicorn)")
+    ap.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 1)))
+    ap.add_argument("--graceful-timeout", type=float, default=float(os.environ.get("GRACEFUL_TIMEOUT_S", 20)))
+    ap.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "info"))
+    args = ap.parse_args(argv)
+
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("serve.py needs uvicorn: pip install uvicorn")
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    uvicorn.run(
+        "asgi:app",
+        app_dir=here,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        lifespan="on",
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level=args.log_level,
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
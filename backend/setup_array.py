@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+from typing import Dict, Any, Tuple
+import numpy as np
+
+# Array-backed car setup.
+#
+# The 18 adjustable settings live in a flat float64 vector indexed by
+# APPLY_ORDER; absolute limits compile to parallel lo/hi arrays, so applying
+# and clipping a move is a couple of vector ops. Everything else in the
+# nested setup JSON (throttle_map, ers_corner_deployment, springs, ...) is
+# kept by reference and treated as read-only, so copying a Setup only copies
+# two small arrays. to_json() materializes a fresh nested dict once, at the end.
+
+APPLY_ORDER = [
+    # pressures first (thermal stability)
+    "pressures_psi_fl", "pressures_psi_fr", "pressures_psi_rl", "pressures_psi_rr",
+    # brakes
+    "brake_bias_percent_front", "brake_migration_map",
+    # diff
+    "diff_entry_percent", "diff_mid_percent", "diff_exit_percent",
+    # aero balance (front/rear wing & beam)
+    "front_wing_flap_deg", "rear_wing_main_deg", "beam_wing_slot_gap_mm",
+    # chassis
+    "rear_arb_steps", "high_speed_bump",
+    # alignment
+    "front_toe_out_deg_total", "rear_toe_in_deg_total",
+    # ride heights last
+    "ride_height_front_mm", "ride_height_rear_mm"
+]
+
+# Map setting keys to their JSON paths
+SETTING_PATHS = {
+    "pressures_psi_fl": ["tyres", "pressures_psi", "fl"],
+    "pressures_psi_fr": ["tyres", "pressures_psi", "fr"],
+    "pressures_psi_rl": ["tyres", "pressures_psi", "rl"],
+    "pressures_psi_rr": ["tyres", "pressures_psi", "rr"],
+    "brake_bias_percent_front": ["brakes", "brake_bias_percent_front"],
+    "brake_migration_map": ["brakes", "brake_migration_map"],
+    "diff_entry_percent": ["differential_and_power", "diff_entry_percent"],
+    "diff_mid_percent": ["differential_and_power", "diff_mid_percent"],
+    "diff_exit_percent": ["differential_and_power", "diff_exit_percent"],
+    "front_wing_flap_deg": ["aero", "front_wing_flap_deg"],
+    "rear_wing_main_deg": ["aero", "rear_wing_main_deg"],
+    "beam_wing_slot_gap_mm": ["aero", "beam_wing_slot_gap_mm"],
+    "rear_arb_steps": ["ride_and_suspension", "antiroll_bar_scale_0_10", "rear"],
+    "high_speed_bump": ["ride_and_suspension", "dampers_clicks", "high_speed_bump"],
+    "front_toe_out_deg_total": ["alignment", "front_toe_out_deg_total"],
+    "rear_toe_in_deg_total": ["alignment", "rear_toe_in_deg_total"],
+    "ride_height_front_mm": ["ride_and_suspension", "ride_height_front_mm"],
+    "ride_height_rear_mm": ["ride_and_suspension", "ride_height_rear_mm"],
+}
+
+N_SLOTS = len(APPLY_ORDER)
+SLOT = {k: i for i, k in enumerate(APPLY_ORDER)}
+_PATHS = [SETTING_PATHS[k] for k in APPLY_ORDER]
+
+def _copy_json(o: Any) -> Any:
+    """Structural copy of JSON-shaped data (much cheaper than copy.deepcopy)."""
+    if isinstance(o, dict):
+        return {k: _copy_json(v) for k, v in o.items()}
+    if isinstance(o, list):
+        return [_copy_json(v) for v in o]
+    return o
+
+# ---------- Limits ----------
+
+class SetupLimits:
+    """absolute_limits compiled to per-slot lo/hi arrays (looked up by path leaf, as before)."""
+    __slots__ = ("lo", "hi", "has")
+
+    def __init__(self, lo: np.ndarray, hi: np.ndarray, has: np.ndarray):
+        self.lo, self.hi, self.has = lo, hi, has
+
+    @classmethod
+    def from_dict(cls, limits: Dict[str, Any]) -> "SetupLimits":
+        lo = np.full(N_SLOTS, -np.inf)
+        hi = np.full(N_SLOTS, np.inf)
+        has = np.zeros(N_SLOTS, dtype=bool)
+        for i, path in enumerate(_PATHS):
+            leaf = path[-1]
+            lim = limits.get(leaf) if isinstance(limits, dict) else None
+            if lim is None:
+                # try namespaced (e.g., pressures)
+                if leaf.startswith("pressures_psi"):
+                    l, h = limits.get("pressures_psi", [None, None])
+                    if l is not None and h is not None:
+                        lo[i], hi[i], has[i] = float(l), float(h), True
+            else:
+                lo[i], hi[i], has[i] = float(lim[0]), float(lim[1]), True
+        return cls(lo, hi, has)
+
+    def clip(self, values: np.ndarray) -> np.ndarray:
+        """_clamp(x, lo, hi) == max(lo, min(hi, x)) on limited slots; works on (..., N_SLOTS)."""
+        v = np.where(values < self.hi, values, self.hi)
+        v = np.where(v > self.lo, v, self.lo)
+        return np.where(self.has, v, values)
+
+# ---------- Setup ----------
+
+class Setup:
+    __slots__ = ("values", "dirty", "_base", "_invalid", "_ers_factors")
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        dirty: np.ndarray,
+        base: Dict[str, Any],
+        invalid: Dict[int, Any],
+        ers_factors: Tuple[Any, ...] = (),
+    ):
+        self.values = values            # (N_SLOTS,) current setting values
+        self.dirty = dirty              # (N_SLOTS,) slots written since from_json
+        self._base = base               # original nested JSON, shared and never mutated
+        self._invalid = invalid         # slot -> raw value that is not a number
+        self._ers_factors = ers_factors # pending ers_corner_deployment scalings
+
+    @classmethod
+    def from_json(cls, setup: Dict[str, Any]) -> "Setup":
+        values = np.zeros(N_SLOTS)
+        invalid: Dict[int, Any] = {}
+        for i, path in enumerate(_PATHS):
+            d: Any = setup
+            for k in path[:-1]:
+                d = d.get(k) if isinstance(d, dict) else None
+            raw = d.get(path[-1], 0.0) if isinstance(d, dict) else 0.0
+            try:
+                values[i] = float(raw or 0.0)
+            except (TypeError, ValueError):
+                values[i] = np.nan
+                invalid[i] = raw
+        return cls(values, np.zeros(N_SLOTS, dtype=bool), setup, invalid)
+
+    def copy(self) -> "Setup":
+        return Setup(self.values.copy(), self.dirty.copy(), self._base, self._invalid, self._ers_factors)
+
+    def rebase(self, setup: Dict[str, Any]) -> "Setup":
+        """
+        The same setting values over another nested JSON, which must only differ
+        from this one outside the slots (e.g. the questionnaire's controls).
+        """
+        return Setup(self.values, self.dirty, setup, self._invalid, self._ers_factors)
+
+    def __getitem__(self, key: str) -> float:
+        return float(self.values[SLOT[key]])
+
+    @staticmethod
+    def move_vector(move: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """(delta, moved) slot arrays for a move dict; unknown keys are ignored."""
+        delta = np.zeros(N_SLOTS)
+        moved = np.zeros(N_SLOTS, dtype=bool)
+        for k, v in move.items():
+            i = SLOT.get(k)
+            if i is not None:
+                delta[i] = float(v)
+                moved[i] = True
+        return delta, moved
+
+    def apply(self, move: Dict[str, float], limits: SetupLimits) -> "Setup":
+        """New Setup with the aggregated move applied, clipped, and ERS exit scaling recorded."""
+        delta, moved = self.move_vector(move)
+        out = self.apply_vector(delta, moved, limits)
+        if "ers_exit_scale" in move:
+            # If many corners requested ERS cuts on exit, reduce default per-corner ERS by avg scale
+            avg_cut = np.clip(np.mean([move["ers_exit_scale"]]), -0.4, 0.0)
+            out._ers_factors = out._ers_factors + (1.0 + avg_cut,)
+        return out
+
+    def apply_vector(self, delta: np.ndarray, moved: np.ndarray, limits: SetupLimits) -> "Setup":
+        for i in self._invalid:
+            if moved[i]:
+                float(self._invalid[i])   # same error the dict path raised
+        new = limits.clip(self.values + delta)
+        return Setup(
+            np.where(moved, new, self.values),
+            self.dirty | moved,
+            self._base,
+            self._invalid,
+            self._ers_factors,
+        )
+
+    def to_json(self) -> Dict[str, Any]:
+        s = _copy_json(self._base)
+        for i in np.flatnonzero(self.dirty):
+            cur = s
+            path = _PATHS[i]
+            for k in path[:-1]:
+                if k not in cur or not isinstance(cur[k], dict):
+                    cur[k] = {}
+                cur = cur[k]
+            cur[path[-1]] = float(self.values[i])
+        for factor in self._ers_factors:
+            dp = s.get("differential_and_power")
+            corner_deploy = (dp.get("ers_corner_deployment") if isinstance(dp, dict) else None) or {}
+            for ck in list(corner_deploy.keys()):
+                corner_deploy[ck] = float(corner_deploy[ck]) * factor
+            s["differential_and_power"]["ers_corner_deployment"] = corner_deploy
+        return s
+
+def apply_many(base: Setup, deltas: np.ndarray, moved: np.ndarray, limits: SetupLimits) -> np.ndarray:
+    """Setting values for M candidate moves at once: (M, N_SLOTS) deltas/masks -> (M, N_SLOTS) values."""
+    return np.where(moved, limits.clip(base.values + deltas), base.values)
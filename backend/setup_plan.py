@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Dict, Any, Tuple
+import os
+import threading
+
+import numpy as np
+
+from poc import UserPreferences, validate_schema, _safe_get
+from result_cache import doc_version
+from rules import MoveMatrix
+from setup_array import Setup, SetupLimits
+from turn_matrix import (
+    compile_rules_for_doc,
+    matrix_from_record,
+    outlier_scale,
+    cap_moves,
+    aggression_scale,
+    aggregate_moves_matrix,
+)
+import metrics
+
+# Precomputed setup plans for /dataForConfig.
+#
+# Every questionnaire request runs against the same test_drive doc, and most
+# of compute_setup_from_doc does not depend on the answers: error vectors,
+# rule firing, the Huber outlier factor, the time_loss x occurrence x
+# confidence corner products, per-turn caps, the parsed initial setup and the
+# absolute limits. A SetupPlan holds all of that for one doc version
+# (result_cache.doc_version: a hash of the doc minus the questionnaire fields).
+# Per request only the rookie_stability_priority corner factor, sensitivity
+# scaling, aggression scaling, aggregation and application run, with the same
+# float64 ops in the same order, so responses are identical to
+# compute_setup_from_doc.
+
+MAX_MOVE_SETS = 8     # capped move matrices kept per plan
+
+_SENSITIVITIES = tuple(k for k in UserPreferences.__dataclass_fields__ if k.endswith("_sensitivity"))
+
+class SetupPlan:
+    def __init__(self, doc: Dict[str, Any]):
+        self.rules = compile_rules_for_doc(doc)
+        td = validate_schema(doc, self.rules.turn_fields)
+        self.turns = matrix_from_record(td)
+        self.outlier = outlier_scale(self.turns)
+        self.fired = self.rules.fired(self.turns.features)
+        self.caps = td.step_caps
+        self.limits = SetupLimits.from_dict(td.absolute_limits)
+        self.setup = Setup.from_json(doc["initial_setup"])
+        # capped moves per sensitivity vector (the questionnaire never sets them, so usually one
+        # entry), a small LRU shared by every request thread using this plan
+        self._lock = threading.Lock()
+        self._moves: "OrderedDict[Tuple[float, ...], Tuple[MoveMatrix, np.ndarray]]" = OrderedDict()
+        # per-setting count of turns proposing a move, for setup_rule_moves_total
+        self._fired_counts = None
+
+    def _capped(self, prefs: UserPreferences) -> Tuple[MoveMatrix, np.ndarray]:
+        key = tuple(getattr(prefs, s) for s in _SENSITIVITIES)
+        with self._lock:
+            hit = self._moves.get(key)
+            if hit is not None:
+                self._moves.move_to_end(key)
+                return hit
+        mm = self.rules.moves(self.fired, prefs)
+        hit = (mm, cap_moves(mm.keys, mm.values, self.caps))     # outside the lock, like PlanCache.get
+        with self._lock:
+            self._moves[key] = hit
+            self._moves.move_to_end(key)
+            while len(self._moves) > MAX_MOVE_SETS:
+                self._moves.popitem(last=False)
+        return hit
+
+    def compute(self, doc: Dict[str, Any], prefs: UserPreferences) -> Dict[str, Any]:
+        """
+        compute_setup_from_doc(doc, prefs) for a doc of this plan's version
+        (i.e. this plan's doc with any questionnaire answers applied).
+        """
+        rsp = float(_safe_get(doc, "metadata", "rookie_stability_priority", default=0.8) or 0.8)
+
+        with metrics.stage("setup", "plan_rules"):
+            mm, capped = self._capped(prefs)
+            vals = capped * aggression_scale(prefs)
+        weights = self.turns.corner_weights(rsp) * self.outlier
+
+        if metrics.active():
+            metrics.count("setup_turns_processed_total", self.turns.n_turns)
+            if self._fired_counts is None:
+                self._fired_counts = mm.present.sum(axis=0)
+            for c in np.flatnonzero(self._fired_counts):
+                metrics.count("setup_rule_moves_total", int(self._fired_counts[c]), setting=mm.keys[c])
+
+        with metrics.stage("setup", "aggregate_moves"):
+            agg_move = aggregate_moves_matrix(mm.keys, vals, mm.present, mm.rank, weights)
+
+        with metrics.stage("setup", "apply_and_clip"):
+            new_setup = self.setup.rebase(doc["initial_setup"]).apply(agg_move, self.limits).to_json()
+
+        diags = {
+            "per_turn_weights": weights.tolist(),
+            "aggregated_move": agg_move,
+            "preferences": prefs.__dict__,
+        }
+        return {"optimized_setup": new_setup, "diagnostics": diags}
+
+# ---------- Plan cache ----------
+
+class PlanCache:
+    """Bounded LRU of SetupPlans keyed by doc version; stale versions just age out."""
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._plans: "OrderedDict[str, SetupPlan]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "PlanCache":
+        return cls(max_entries=int(os.environ.get("SETUP_PLAN_CACHE_SIZE", 16)))
+
+    def get(self, doc: Dict[str, Any], version: str | None = None) -> SetupPlan:
+        """Plan for this doc's version, built on a miss. `version` is doc_version(doc) if known."""
+        version = version or doc_version(doc)
+        with self._lock:
+            plan = self._plans.get(version)
+            if plan is not None:
+                self._plans.move_to_end(version)
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.count("setup_plan_requests_total", result="hit" if plan is not None else "miss")
+        if plan is not None:
+            return plan
+
+        with metrics.stage("setup", "plan_build"):
+            plan = SetupPlan(doc)      # outside the lock; a concurrent duplicate build is harmless
+        with self._lock:
+            self._plans[version] = plan
+            self._plans.move_to_end(version)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+        return plan
+
+    def compute(self, doc: Dict[str, Any], prefs: UserPreferences, version: str | None = None) -> Dict[str, Any]:
+        return self.get(doc, version).compute(doc, prefs)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._plans.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._plans),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+PLANS = PlanCache.from_env()
@@ -0,0 +1,402 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple
+import json
+import os
+import re
+
+import numpy as np
+
+from poc import (
+    CostWeights,
+    UserPreferences,
+    build_cost_weights,
+    build_preferences_from_doc,
+    _safe_get,
+)
+from schema import INPUT_FIELDS
+from setup_array import APPLY_ORDER, N_SLOTS, SETTING_PATHS, Setup, SetupLimits
+from turn_matrix import (
+    aggression_scale,
+    compile_rules_for_doc,
+    compile_turns,
+    compute_setup_from_matrix,
+    huber_weights,
+)
+import metrics
+
+# Closed-loop setup solver.
+#
+# compute_setup_from_doc takes one rule-based step and never asks whether
+# the turns would then meet their targets. Here a linearised turn-response
+# model (metric change per unit setting change, default_sensitivity.json)
+# predicts every turn's metrics under a candidate setup, and the setup is
+# iterated to minimise the CostWeights objective over the session:
+#
+#   balance   w_bal  x  ((oversteer index - balance_goal) / scale)^2
+#   stability w_stab x  (max(0, risk - stability_goal) / scale)^2
+#   ride      w_ride x  (max(0, porpoising - goal) / scale)^2
+#   tyre      w_tyre x  ((surface temp - tyre_goal) / scale)^2
+#
+# each averaged over turns with the heuristic's Huber x corner weights, plus
+# w_pace x the model's lap-time change and a small move_penalty x (move /
+# step cap)^2 that keeps settings the objective does not care about still.
+#
+# The model is the same for every turn, so an iteration is a handful of
+# (N, M) array ops for N turns and M metrics, then an S x S Levenberg-
+# Marquardt solve over the S modelled settings. The total move is capped by
+# per_turn_step_caps (times the aggression scale), as the heuristic's is,
+# and each iterate is projected onto the caps and absolute_limits; the loop
+# stops when the cost or the setup stops moving, or when no step inside the
+# caps and limits lowers the cost ("no_descent").
+#
+# Caps and limits are looked up by setting key, then path leaf, then
+# corner-less namespace, so "pressures_psi" and "ride_height_mm" apply to
+# each corner's / axle's setting.
+
+DEFAULT_SENSITIVITY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_sensitivity.json")
+
+MAX_ITERATIONS = 50
+FTOL = 1e-9             # stop when the cost improves by less than this (relative)
+XTOL = 1e-6             # ... or no setting moves by more than this x its step unit
+MAX_BACKTRACK = 8       # damping increases per iteration before giving up
+
+N_METRICS = len(INPUT_FIELDS)
+_METRIC_COL = {f: i for i, f in enumerate(INPUT_FIELDS)}
+_SLOT = {k: i for i, k in enumerate(APPLY_ORDER)}
+
+# cost term of each metric column, and whether only the excess over the goal costs
+TERMS = ("balance", "stability", "ride", "tyre")
+_TERM_OF = np.array([0, 0, 0, 1, 1, 1, 2, 3, 3, 3, 3])
+_ONE_SIDED = np.array([False, False, False, True, True, True, True, False, False, False, False])
+
+# ---------- Sensitivity model ----------
+
+@dataclass(frozen=True)
+class SensitivityModel:
+    jacobian: np.ndarray    # (N_SLOTS, N_METRICS) metric change per unit setting change
+    scales: np.ndarray      # (N_METRICS,) metric deviation that costs 1
+    lap_time: np.ndarray    # (N_SLOTS,) lap time change (s) per unit setting change
+    move_penalty: float
+    aero_grip: np.ndarray   # (N_SLOTS,) fractional downforce change per unit setting change (laptime.py)
+
+def _num(v: Any, where: str) -> float:
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        raise ValueError(f"{where}: expected a number, got {v!r}")
+    return float(v)
+
+def _obj(parent: Dict[str, Any], key: str, where: str) -> Dict[str, Any]:
+    v = parent.get(key) or {}
+    if not isinstance(v, dict):
+        raise ValueError(f"{where}.{key}: must be an object")
+    return v
+
+def parse_sensitivity_model(obj: Any, base: SensitivityModel | None = None) -> SensitivityModel:
+    """
+    Validate a JSON-shaped sensitivity model; entries override `base`
+    coefficient by coefficient. Raises ValueError naming the offending path.
+    """
+    if not isinstance(obj, dict):
+        raise ValueError("sensitivity model must be an object")
+    jac = np.zeros((N_SLOTS, N_METRICS)) if base is None else base.jacobian.copy()
+    scales = np.ones(N_METRICS) if base is None else base.scales.copy()
+    lap_time = np.zeros(N_SLOTS) if base is None else base.lap_time.copy()
+    aero_grip = np.zeros(N_SLOTS) if base is None else base.aero_grip.copy()
+
+    def slot(key: str, where: str) -> int:
+        if key not in _SLOT:
+            raise ValueError(f"{where}: unknown setting {key!r}")
+        return _SLOT[key]
+
+    def metric(name: str, where: str) -> int:
+        if name not in _METRIC_COL:
+            raise ValueError(f"{where}: unknown turn metric {name!r} (expected one of {INPUT_FIELDS})")
+        return _METRIC_COL[name]
+
+    for name, v in _obj(obj, "scales", "sensitivity").items():
+        scales[metric(name, "sensitivity.scales")] = _num(v, f"sensitivity.scales.{name}")
+    if not np.all(scales > 0):
+        raise ValueError("sensitivity.scales: every scale must be > 0")
+    for key, row in _obj(obj, "settings", "sensitivity").items():
+        s = slot(key, "sensitivity.settings")
+        if not isinstance(row, dict):
+            raise ValueError(f"sensitivity.settings.{key}: must be an object of turn metric -> change per unit")
+        for name, v in row.items():
+            jac[s, metric(name, f"sensitivity.settings.{key}")] = _num(v, f"sensitivity.settings.{key}.{name}")
+    for key, v in _obj(obj, "lap_time_s", "sensitivity").items():
+        lap_time[slot(key, "sensitivity.lap_time_s")] = _num(v, f"sensitivity.lap_time_s.{key}")
+    for key, v in _obj(obj, "aero_grip", "sensitivity").items():
+        aero_grip[slot(key, "sensitivity.aero_grip")] = _num(v, f"sensitivity.aero_grip.{key}")
+    penalty = base.move_penalty if base is not None else 0.0
+    if "move_penalty" in obj:
+        penalty = _num(obj["move_penalty"], "sensitivity.move_penalty")
+        if penalty < 0:
+            raise ValueError("sensitivity.move_penalty: must be >= 0")
+    return SensitivityModel(jac, scales, lap_time, penalty, aero_grip)
+
+@lru_cache(maxsize=1)
+def default_sensitivity_model() -> SensitivityModel:
+    with open(DEFAULT_SENSITIVITY_PATH) as f:
+        return parse_sensitivity_model(json.load(f))
+
+def sensitivity_model_for_doc(doc: Dict[str, Any], override: Dict[str, Any] | None = None) -> SensitivityModel:
+    """default_sensitivity.json, then an inline `sensitivity_model` stored with the doc, then `override`."""
+    model = default_sensitivity_model()
+    for layer in (doc.get("sensitivity_model"), override):
+        if layer is not None:
+            model = parse_sensitivity_model(layer, model)
+    return model
+
+# ---------- Caps & limits ----------
+
+_CORNER = re.compile(r"_(front|rear|fl|fr|rl|rr)(?=_|$)")
+
+def _lookup(table: Dict[str, Any], key: str) -> Any:
+    """table entry for a setting: its own key, its path leaf, or its corner-less namespace."""
+    for k in (key, SETTING_PATHS[key][-1], _CORNER.sub("", key)):
+        if k in table:
+            return table[k]
+    return None
+
+def step_caps(caps: Dict[str, Any]) -> np.ndarray:
+    """(N_SLOTS,) caps on each setting's total move; inf where none applies."""
+    out = np.full(N_SLOTS, np.inf)
+    for i, key in enumerate(APPLY_ORDER):
+        cap = _lookup(caps, key)
+        if cap is not None:
+            out[i] = abs(float(cap))
+    return out
+
+def project_move(x0: np.ndarray, move: np.ndarray, cap: np.ndarray, limits: SetupLimits) -> np.ndarray:
+    """The move clipped to +-cap (the total move per setting), then to the absolute limits; works on (..., N)."""
+    return limits.clip(x0 + np.clip(move, -cap, cap)) - x0
+
+def setting_limits(limits: Dict[str, Any]) -> SetupLimits:
+    lo = np.full(N_SLOTS, -np.inf)
+    hi = np.full(N_SLOTS, np.inf)
+    has = np.zeros(N_SLOTS, dtype=bool)
+    for i, key in enumerate(APPLY_ORDER):
+        lim = _lookup(limits, key)
+        if lim is not None:
+            lo[i], hi[i], has[i] = float(lim[0]), float(lim[1]), True
+    return SetupLimits(lo, hi, has)
+
+# ---------- Options ----------
+
+@dataclass(frozen=True)
+class SolverOptions:
+    max_iterations: int = MAX_ITERATIONS
+    ftol: float = FTOL
+    xtol: float = XTOL
+    start: str = "initial"       # "initial" setup, or the "heuristic" compute_setup_from_doc move
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "SolverOptions":
+        try:
+            opts = cls(
+                max_iterations=int(payload.get("max_iterations", MAX_ITERATIONS)),
+                ftol=float(payload.get("ftol", FTOL)),
+                xtol=float(payload.get("xtol", XTOL)),
+                start=str(payload.get("start", "initial")),
+            )
+        except (TypeError, ValueError):
+            raise ValueError("'max_iterations', 'ftol' and 'xtol' must be numbers")
+        if not 1 <= opts.max_iterations <= 1000:
+            raise ValueError("'max_iterations' must be between 1 and 1000")
+        if not (opts.ftol >= 0 and opts.xtol >= 0):
+            raise ValueError("'ftol' and 'xtol' must be >= 0")
+        if opts.start not in ("initial", "heuristic"):
+            raise ValueError("'start' must be 'initial' or 'heuristic'")
+        return opts
+
+# ---------- Objective ----------
+
+class Objective:
+    """
+    The session cost of a setup move over the modelled settings, with its
+    gradient and Gauss-Newton Hessian. The model shifts every turn's scaled
+    error for a metric by the same amount, so each metric's cost is a
+    quadratic in that shift over the turns that cost; with the errors sorted
+    once, those turns are a suffix found by binary search and an evaluation
+    is O(M log N) however long the session.
+    """
+
+    def __init__(self, errors: np.ndarray, weights: np.ndarray, model: SensitivityModel,
+                 cost: CostWeights, free: np.ndarray, unit: np.ndarray):
+        self.errors = np.where(np.isnan(errors), 0.0, errors)        # (N, M); a missing metric is on target
+        total = float(weights.sum())
+        self.weights = weights / total if total > 0 else np.full(len(weights), 1.0 / len(weights))
+        self.jac = model.jacobian[free]                              # (S, M)
+        self.inv_scale = 1.0 / model.scales
+        self.term_weight = np.array([cost.w_bal, cost.w_stab, cost.w_ride, cost.w_tyre])[_TERM_OF]
+        self.pace = cost.w_pace * model.lap_time[free]
+        self.penalty = model.move_penalty / (unit * unit)
+
+        scaled = self.errors * self.inv_scale
+        order = np.argsort(scaled, axis=0, kind="stable")
+        self._sorted = np.take_along_axis(scaled, order, axis=0)    # ascending per metric
+        ws = self.weights[order]
+        zero = np.zeros((1, N_METRICS))
+        # prefix sums of w, w x r, w x r^2 down each sorted column
+        self._moments = [np.concatenate((zero, np.cumsum(ws * self._sorted ** p, axis=0))) for p in (0, 1, 2)]
+        self._cols = np.arange(N_METRICS)
+
+    def _shifted(self, delta: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(shift, W0, W1, W2): scaled error shift and the moments of the costing turns, per metric."""
+        shift = (delta @ self.jac) * self.inv_scale
+        first = np.zeros(N_METRICS, dtype=np.intp)
+        for c in np.flatnonzero(_ONE_SIDED):
+            first[c] = np.searchsorted(self._sorted[:, c], -shift[c], side="right")     # r + shift > 0
+        w0, w1, w2 = (m[-1] - m[first, self._cols] for m in self._moments)
+        return shift, w0, w1, w2
+
+    def _metric_costs(self, delta: np.ndarray) -> np.ndarray:
+        shift, w0, w1, w2 = self._shifted(delta)
+        return self.term_weight * (w2 + 2.0 * shift * w1 + shift * shift * w0)
+
+    def residuals(self, delta: np.ndarray) -> np.ndarray:
+        """Per-turn scaled predicted errors (N, M), zero where a one-sided goal is met."""
+        r = (self.errors + delta @ self.jac) * self.inv_scale
+        return np.where(~_ONE_SIDED | (r > 0), r, 0.0)
+
+    def terms(self, delta: np.ndarray) -> Dict[str, float]:
+        per_metric = self._metric_costs(delta)
+        out = {t: float(per_metric[_TERM_OF == i].sum()) for i, t in enumerate(TERMS)}
+        out["pace"] = float(self.pace @ delta)
+        out["move"] = float(self.penalty @ (delta * delta))
+        return out
+
+    def cost(self, delta: np.ndarray) -> float:
+        return float(self._metric_costs(delta).sum() + self.pace @ delta + self.penalty @ (delta * delta))
+
+    def linearise(self, delta: np.ndarray) -> Tuple[float, np.ndarray, np.ndarray]:
+        """(cost, gradient, Gauss-Newton Hessian) at `delta`."""
+        shift, w0, w1, w2 = self._shifted(delta)
+        cost = float((self.term_weight * (w2 + 2.0 * shift * w1 + shift * shift * w0)).sum()
+                     + self.pace @ delta + self.penalty @ (delta * delta))
+        grad = 2.0 * self.jac @ (self.term_weight * (w1 + shift * w0) * self.inv_scale) + self.pace + 2.0 * self.penalty * delta
+        d = self.term_weight * w0 * self.inv_scale * self.inv_scale
+        hess = 2.0 * (self.jac * d) @ self.jac.T + np.diag(2.0 * self.penalty)
+        return cost, grad, hess
+
+# ---------- Solver ----------
+
+def _solve_loop(obj: Objective, x0: np.ndarray, start: np.ndarray, cap: np.ndarray, limits: SetupLimits,
+                opts: SolverOptions, unit: np.ndarray) -> Tuple[np.ndarray, List[Dict[str, float]], str]:
+    """Levenberg-Marquardt projected onto the step caps and limits; returns (move, history, stop reason)."""
+    def project(d):
+        return project_move(x0, d, cap, limits)
+
+    lo, hi = project(np.full(len(x0), -np.inf)), project(np.full(len(x0), np.inf))
+    delta = project(start)
+    lam = 1e-3
+    history = []
+    reason = "max_iterations"
+    for it in range(opts.max_iterations):
+        cost, grad, hess = obj.linearise(delta)
+        # settings on a bound that the gradient pushes outward stay put; the rest take the LM step
+        held = ((delta <= lo) & (grad > 0)) | ((delta >= hi) & (grad < 0))
+        idx = np.flatnonzero(~held)
+        if not len(idx):
+            reason = "no_descent"
+            break
+        h, g = hess[np.ix_(idx, idx)], grad[idx]
+        damp = np.diag(h).copy()
+        damp[damp <= 0] = 1.0
+        for _ in range(MAX_BACKTRACK):
+            step = np.zeros(len(delta))
+            step[idx] = np.linalg.solve(h + lam * np.diag(damp), -g)
+            new = project(delta + step)
+            new_cost = obj.cost(new)
+            if new_cost < cost:
+                lam = max(lam * 0.1, 1e-9)
+                break
+            lam *= 10.0
+        else:
+            reason = "no_descent"      # no step inside the caps and limits lowers the cost
+            break
+        moved = float(np.max(np.abs(new - delta) / unit)) if len(new) else 0.0
+        delta = new
+        history.append({"iteration": it + 1, "cost": new_cost, "max_step": moved})
+        if cost - new_cost <= opts.ftol * max(abs(cost), 1e-12) or moved <= opts.xtol:
+            reason = "converged"
+            break
+    return delta, history, reason
+
+def solve_setup(
+    doc: Dict[str, Any],
+    user_prefs: UserPreferences | None = None,
+    options: SolverOptions | None = None,
+    sensitivity: Dict[str, Any] | None = None,
+) -> Dict[str, Any]:
+    """
+    Iterate the setup against the turn-response model. Returns optimized_setup
+    and diagnostics like compute_setup_from_doc, plus the solver's cost
+    breakdown, iteration history and predicted per-metric errors.
+    """
+    opts = options or SolverOptions()
+    rules = compile_rules_for_doc(doc)
+    tm = compile_turns(doc, rules.turn_fields)      # validates the doc
+    prefs = user_prefs if user_prefs is not None else build_preferences_from_doc(doc)
+    model = sensitivity_model_for_doc(doc, sensitivity)
+    cw = build_cost_weights(prefs)
+    caps = _safe_get(doc, "weights_and_constraints", "per_turn_step_caps", default={}) or {}
+    abs_limits = _safe_get(doc, "weights_and_constraints", "absolute_limits", default={}) or {}
+
+    with metrics.stage("solver", "prepare"):
+        setup = Setup.from_json(doc["initial_setup"])
+        modelled = np.any(model.jacobian != 0, axis=1) | (model.lap_time != 0)
+        free = np.flatnonzero(modelled & np.isfinite(setup.values))      # a non-numeric setting stays as it is
+        all_caps = step_caps(caps)
+        all_limits = setting_limits(abs_limits)
+        cap = all_caps[free] * aggression_scale(prefs)
+        unit = np.where(np.isfinite(all_caps[free]), all_caps[free], 1.0)
+        limits = SetupLimits(all_limits.lo[free], all_limits.hi[free], all_limits.has[free])
+        x0 = setup.values[free]
+        weights = huber_weights(tm)
+        obj = Objective(tm.errors, weights, model, cw, free, unit)
+
+        start = np.zeros(len(free))
+        if opts.start == "heuristic":
+            move = compute_setup_from_matrix(doc, tm, prefs, rules)["diagnostics"]["aggregated_move"]
+            start = np.array([move.get(APPLY_ORDER[i], 0.0) for i in free])
+
+    with metrics.stage("solver", "iterate"):
+        initial_terms = obj.terms(np.zeros(len(free)))
+        delta, history, reason = _solve_loop(obj, x0, start, cap, limits, opts, unit)
+
+    full = np.zeros(N_SLOTS)
+    full[free] = delta
+    moved = np.zeros(N_SLOTS, dtype=bool)
+    moved[free] = delta != 0
+    new_setup = setup.apply_vector(full, moved, setting_limits(abs_limits)).to_json()
+
+    before = obj.residuals(np.zeros(len(free)))
+    after = obj.residuals(delta)
+    final_terms = obj.terms(delta)
+    diags = {
+        "per_turn_weights": weights.tolist(),
+        "aggregated_move": {APPLY_ORDER[i]: float(full[i]) for i in range(N_SLOTS) if moved[i]},
+        "preferences": prefs.__dict__,
+        "cost_weights": cw.__dict__,
+        "solver": {
+            "iterations": len(history),
+            "stop_reason": reason,
+            "start": opts.start,
+            "cost": {
+                "initial": sum(initial_terms.values()),
+                "final": sum(final_terms.values()),
+                "terms": final_terms,
+                "initial_terms": initial_terms,
+            },
+            "history": history,
+            # weighted mean |predicted error| / scale per turn metric (excess only for one-sided goals)
+            "predicted_error": {
+                f: {"before": float(obj.weights @ np.abs(before[:, c])), "after": float(obj.weights @ np.abs(after[:, c]))}
+                for c, f in enumerate(INPUT_FIELDS)
+            },
+        },
+    }
+    return {"optimized_setup": new_setup, "diagnostics": diags}
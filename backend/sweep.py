@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+from dataclasses import replace
+from itertools import product
+from typing import Dict, Any, List, Tuple
+import numpy as np
+
+from poc import (
+    UserPreferences,
+    build_preferences_from_doc,
+    validate_schema,
+    _safe_get,
+)
+from setup_array import SETTING_PATHS, Setup, SetupLimits
+from turn_matrix import (
+    compile_rules_for_doc,
+    compile_turns,
+    outlier_scale,
+    cap_moves,
+    aggression_scale,
+    move_key_order,
+)
+
+# Preference sweep: evaluate a grid of questionnaire answers in one pass.
+#
+# Error vectors, rule firing, per-turn caps and the Huber outlier factor do
+# not depend on the questionnaire, so they are computed once. Per grid point
+# only the stability-priority corner weight and the aggression scale vary,
+# and the weighted aggregation for all points is a single (G, N) x (N, K)
+# product. Values match /dataForConfig up to float rounding.
+
+# Sweep axes, in grid order. Only the first two change the moves; the
+# control linearities and steering preference are carried into the setup.
+AXES = [
+    "stability_bias",
+    "aggression",
+    "throttle_linearity",
+    "brake_pedal_linearity",
+    "steering_weight_preference",
+]
+MAX_GRID_POINTS = 2000
+
+# ---------- Axis parsing ----------
+
+def _axis_values(name: str, spec: Any, others: int = 1) -> List[Any]:
+    """
+    A list of values, or {"start", "stop", "num"} for an evenly spaced range.
+    `others` is the product of the axes already parsed: the grid size is
+    checked against MAX_GRID_POINTS before this axis is built.
+    """
+    if isinstance(spec, dict):
+        try:
+            start, stop, num = float(spec["start"]), float(spec["stop"]), int(spec.get("num", 5))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise ValueError(f"{name}: range needs numeric 'start', 'stop' and optional 'num'")
+        if num < 1:
+            raise ValueError(f"{name}: 'num' must be >= 1")
+        _check_grid(others * num)
+        return [float(x) for x in np.linspace(start, stop, num)]
+    if not isinstance(spec, list) or not spec:
+        raise ValueError(f"{name}: expected a non-empty list or a range object")
+    _check_grid(others * len(spec))
+    if name == "steering_weight_preference":
+        return [str(v) for v in spec]
+    try:
+        return [float(v) for v in spec]
+    except (TypeError, ValueError):
+        raise ValueError(f"{name}: values must be numbers")
+
+def _check_grid(n_points: int) -> None:
+    if n_points > MAX_GRID_POINTS:
+        raise ValueError(f"sweep grid has {n_points} points (max {MAX_GRID_POINTS})")
+
+def parse_axes(payload: Dict[str, Any], defaults: UserPreferences) -> Dict[str, List[Any]]:
+    """
+    Missing axes are pinned to the doc's current preference. A missing
+    `aggression` axis means "derived from stability", as build_preferences_from_doc does.
+    """
+    unknown = [k for k in payload if k not in AXES]
+    if unknown:
+        raise ValueError(f"unknown sweep axes: {unknown} (expected {AXES})")
+    axes = {}
+    n_points = 1
+    for name in AXES:
+        if name in payload:
+            axes[name] = _axis_values(name, payload[name], n_points)
+        elif name == "aggression":
+            axes[name] = [None]
+        else:
+            axes[name] = [getattr(defaults, name)]
+        n_points *= len(axes[name])
+    return axes
+
+# ---------- Sweep ----------
+
+def _prefs_for(stability: float, aggression: float | None, throttle: float, brake: float, steering: str) -> UserPreferences:
+    # Go through build_preferences_from_doc so clamping/defaults match the route exactly
+    prefs = build_preferences_from_doc({
+        "metadata": {"rookie_stability_priority": stability},
+        "initial_setup": {"controls": {
+            "steering_weight_preference": steering,
+            "throttle_pedal_linearity": throttle,
+            "brake_pedal_linearity": brake,
+        }},
+    })
+    return prefs if aggression is None else replace(prefs, aggression=aggression)
+
+def _setting_value(setup: Dict[str, Any], key: str) -> float | None:
+    v = _safe_get(setup, *SETTING_PATHS[key])
+    return float(v) if isinstance(v, (int, float)) else None
+
+def sweep_preferences(doc: Dict[str, Any], payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Evaluate every combination of the requested axes. Returns the grid axes,
+    one entry per point (preferences, aggregated_move, optimized_setup) in
+    row-major AXES order, and a per-setting summary across the grid.
+    """
+    validate_schema(doc)
+    axes = parse_axes(payload, build_preferences_from_doc(doc))
+    caps = _safe_get(doc, "weights_and_constraints", "per_turn_step_caps", default={}) or {}
+    abs_limits = _safe_get(doc, "weights_and_constraints", "absolute_limits", default={}) or {}
+
+    # Preference-independent stage (once)
+    rules = compile_rules_for_doc(doc)
+    tm = compile_turns(doc, rules.turn_fields)
+    scale = outlier_scale(tm)
+    mm = rules.run(tm.features, UserPreferences())   # sensitivities are not swept
+    capped = np.where(mm.present, cap_moves(mm.keys, mm.values, caps), 0.0)
+    order = move_key_order(mm.present, mm.rank)
+    keys = [mm.keys[c] for c in order]
+
+    # Preference-dependent stage, vectorized over distinct (stability, aggression) pairs
+    grid = list(product(*(axes[a] for a in AXES)))
+    point_prefs = [_prefs_for(*p) for p in grid]
+    pairs: Dict[Tuple[float, float], int] = {}
+    rsp_w, aggr = [], []
+    pair_of_point = []
+    for p, prefs in zip(grid, point_prefs):
+        # corner weights use the raw rookie_stability_priority (falsy -> 0.8), not the clamped bias
+        rsp = float(p[0] or 0.8)
+        key = (rsp, prefs.aggression)
+        if key not in pairs:
+            pairs[key] = len(pairs)
+            rsp_w.append(rsp)
+            aggr.append(aggression_scale(prefs))
+        pair_of_point.append(pairs[key])
+    weights = tm.corner_weights(np.array(rsp_w)[:, None]) * scale        # (P, N)
+    agg = (weights @ capped[:, order]) * np.array(aggr)[:, None]         # (P, K)
+
+    base_setup = doc["initial_setup"]
+    parsed, limits = Setup.from_json(base_setup), SetupLimits.from_dict(abs_limits)
+    pair_setups = []
+    pair_moves = []
+    for row in agg:
+        move = {k: float(v) + 0.0 for k, v in zip(keys, row)}
+        pair_moves.append(move)
+        pair_setups.append(parsed.apply(move, limits).to_json())
+
+    points = []
+    for prefs, pi in zip(point_prefs, pair_of_point):
+        setup = dict(pair_setups[pi])
+        setup["controls"] = {
+            **(base_setup.get("controls") or {}),
+            "steering_weight_preference": prefs.steering_weight_preference,
+            "throttle_pedal_linearity": prefs.throttle_linearity,
+            "brake_pedal_linearity": prefs.brake_pedal_linearity,
+        }
+        points.append({
+            "preferences": prefs.__dict__,
+            "aggregated_move": pair_moves[pi],
+            "optimized_setup": setup,
+        })
+
+    settings = {}
+    for key in SETTING_PATHS:
+        if key not in keys:
+            continue
+        per_pair = [_setting_value(s, key) for s in pair_setups]
+        values = [per_pair[pi] for pi in pair_of_point]
+        present = [v for v in values if v is not None]     # None: the setting is missing from that setup
+        settings[key] = {
+            "baseline": _setting_value(base_setup, key),
+            "min": min(present) if present else None,
+            "max": max(present) if present else None,
+            "values": values,
+        }
+
+    return {
+        "axes": {a: [v for v in axes[a]] for a in AXES},
+        "shape": [len(axes[a]) for a in AXES],
+        "points": points,
+        "summary": {
+            "n_points": len(points),
+            "distinct_move_sets": len(pairs),
+            "settings": settings,
+        },
+    }
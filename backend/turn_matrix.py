@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, Any, List, Sequence
+import numpy as np
+
+from poc import (
+    UserPreferences,
+    build_preferences_from_doc,
+    apply_moves_in_order_and_clip,
+    rule_table_for_doc,
+    _safe_get,
+)
+from rules import CompiledRules, compile_rule_table
+from schema import ERR_KEYS, TestDriveDoc, decode_test_drive
+
+# Vectorized twin of poc.compute_setup_from_doc.
+#
+# The per-turn dict walk is replaced by a turn x feature matrix that is
+# compiled once per doc; error vectors, Huber weighting, corner weights,
+# rule firing (rules.CompiledRules), per-turn caps and weighted aggregation
+# then run as masked array operations. Every step mirrors the scalar path operation-for-operation
+# (same float64 ops in the same order), so the result is bit-identical.
+
+_ERR_COL = {k: i for i, k in enumerate(ERR_KEYS)}
+
+# ---------- Compilation ----------
+
+@dataclass
+class TurnMatrix:
+    """Doc turns compiled into column arrays (one row per turn)."""
+    features: np.ndarray      # (N, len(ERR_KEYS) + len(turn_fields)) error vectors, then raw turn fields
+    turn_fields: List[str]    # dotted turn paths referenced by the rule table
+    corner_product: np.ndarray  # (N,) time_loss_weight * occurrence_rate * driver_confidence_weight
+    weight_cap: float         # weights_and_constraints.time_loss_weight_cap
+    stability_priority: float # metadata.rookie_stability_priority (corner-weight factor)
+
+    @property
+    def n_turns(self) -> int:
+        return int(self.features.shape[0])
+
+    @property
+    def errors(self) -> np.ndarray:
+        return self.features[:, :len(ERR_KEYS)]
+
+    def err(self, key: str) -> np.ndarray:
+        return self.errors[:, _ERR_COL[key]]
+
+    def corner_weights(self, rsp: float | np.ndarray | None = None) -> np.ndarray:
+        """
+        TestDriveDoc.corner_weight for every turn. `rsp` overrides the doc's
+        stability priority; an array of shape (G, 1) yields one weight row per
+        value.
+        """
+        prod = self.corner_product * (self.stability_priority if rsp is None else rsp)
+        # min(cap, x) keeps cap unless x < cap (also for NaN)
+        return np.where(prod < self.weight_cap, prod, self.weight_cap)
+
+def compile_turns(doc: Dict[str, Any], turn_fields: Sequence[str] = ()) -> TurnMatrix:
+    """
+    Validate the doc and extract every per-turn input the engine needs in a single pass.
+    `turn_fields` are the dotted turn paths the rule table reads (CompiledRules.turn_fields).
+    """
+    return matrix_from_record(decode_test_drive(doc, turn_fields))
+
+def matrix_from_record(td: TestDriveDoc) -> TurnMatrix:
+    raw = np.frombuffer(td.turn_values, dtype=float).reshape(td.n_turns, td.width)
+    cols = np.frombuffer(td.corner_factors, dtype=float).reshape(td.n_turns, 3).T
+    targets = np.array(td.targets + [0.0] * len(td.turn_fields), dtype=float)
+    return TurnMatrix(
+        features=raw - targets,
+        turn_fields=list(td.turn_fields),
+        corner_product=cols[0] * cols[1] * cols[2],
+        weight_cap=td.weight_cap,
+        stability_priority=td.stability_priority,
+    )
+
+# ---------- Robust weighting ----------
+
+def outlier_scale(tm: TurnMatrix) -> np.ndarray:
+    """Huber downweighting of high-error turns; depends on the doc only."""
+    return huber_scale(tm.errors)
+
+def huber_scale(errors: np.ndarray) -> np.ndarray:
+    """outlier_scale over the last axis of any (..., len(ERR_KEYS)) error array."""
+    e = np.where(np.isnan(errors), 0.0, errors)
+    ax = np.abs(e)
+    delta = 0.8
+    h = np.where(ax <= delta, 0.5 * ax * ax, delta * (ax - 0.5 * delta))
+    err_mag = h.mean(axis=-1)
+    return 1.0 / (1.0 + 0.6 * err_mag)
+
+def huber_weights(tm: TurnMatrix) -> np.ndarray:
+    """Per-turn weights: corner weight scaled by the Huber outlier factor."""
+    return tm.corner_weights() * outlier_scale(tm)
+
+# ---------- Caps & aggregation ----------
+
+def aggression_scale(prefs: UserPreferences) -> float:
+    return 0.7 + 0.6 * prefs.aggression  # 0.7..1.3x
+
+def cap_moves(keys: List[str], vals: np.ndarray, caps: Dict[str, float]) -> np.ndarray:
+    """Per-turn step caps, column by column."""
+    out = vals.copy()
+    for c, k in enumerate(keys):
+        if k not in caps:
+            continue  # cap defaults to |v| => identity
+        cap = abs(float(caps[k]))
+        v = out[:, c]
+        v = np.where(v < cap, v, cap)      # min(cap, v)
+        out[:, c] = np.where(v > -cap, v, -cap)  # max(-cap, .)
+    return out
+
+def cap_and_scale(
+    keys: List[str],
+    vals: np.ndarray,
+    caps: Dict[str, float],
+    prefs: UserPreferences,
+) -> np.ndarray:
+    """Per-turn step caps then aggression scaling (the tail of propose_turn_changes)."""
+    return cap_moves(keys, vals, caps) * aggression_scale(prefs)
+
+def aggregate_moves_matrix(
+    keys: List[str],
+    vals: np.ndarray,
+    present: np.ndarray,
+    rank: np.ndarray,
+    weights: np.ndarray,
+) -> Dict[str, float]:
+    """Weighted sum over turns, with aggregate_moves' summation and key order."""
+    if not keys:
+        return {}
+    contrib = np.where(present, weights[:, None] * vals, 0.0)
+    # Sequential (not pairwise) sum, same as the dict loop; +0.0 folds -0.0
+    totals = np.cumsum(contrib, axis=0)[-1] + 0.0
+
+    return {keys[c]: float(totals[c]) for c in move_key_order(present, rank)}
+
+def move_key_order(present: np.ndarray, rank: np.ndarray) -> List[int]:
+    """Columns that appear in any turn, in aggregate_moves' dict insertion order."""
+    any_present = present.any(axis=0)
+    first_turn = np.argmax(present, axis=0)
+    first_rank = rank[first_turn, np.arange(present.shape[1])]
+    return sorted(
+        (c for c in range(present.shape[1]) if any_present[c]),
+        key=lambda c: (int(first_turn[c]), int(first_rank[c])),
+    )
+
+# ---------- Public API ----------
+
+def compile_rules_for_doc(doc: Dict[str, Any]) -> CompiledRules:
+    return compile_rule_table(rule_table_for_doc(doc), tuple(ERR_KEYS))
+
+def compute_setup_from_matrix(
+    doc: Dict[str, Any],
+    tm: TurnMatrix,
+    prefs: UserPreferences,
+    rules: CompiledRules,
+) -> Dict[str, Any]:
+    if tm.turn_fields != rules.turn_fields:
+        raise ValueError("turn matrix was compiled for a different rule table")
+    caps = _safe_get(doc, "weights_and_constraints", "per_turn_step_caps", default={}) or {}
+    abs_limits = _safe_get(doc, "weights_and_constraints", "absolute_limits", default={}) or {}
+
+    weights = huber_weights(tm)
+    mm = rules.run(tm.features, prefs)
+    vals = cap_and_scale(mm.keys, mm.values, caps, prefs)
+    agg_move = aggregate_moves_matrix(mm.keys, vals, mm.present, mm.rank, weights)
+
+    new_setup = apply_moves_in_order_and_clip(doc["initial_setup"], agg_move, abs_limits)
+    diags = {
+        "per_turn_weights": weights.tolist(),
+        "aggregated_move": agg_move,
+        "preferences": prefs.__dict__,
+    }
+    return {"optimized_setup": new_setup, "diagnostics": diags}
+
+def compute_setup_from_doc_vectorized(
+    doc: Dict[str, Any],
+    user_prefs: UserPreferences | None = None,
+) -> Dict[str, Any]:
+    """
+    Drop-in replacement for poc.compute_setup_from_doc.
+    Returns the same optimized_setup/diagnostics, computed on a compiled turn matrix.
+    """
+    rules = compile_rules_for_doc(doc)
+    tm = compile_turns(doc, rules.turn_fields)      # validates the doc
+    if user_prefs is None:
+        user_prefs = build_preferences_from_doc(doc)
+    return compute_setup_from_matrix(doc, tm, user_prefs, rules)